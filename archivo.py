@@ -0,0 +1,468 @@
+"""Archivo frío: ejercicios cerrados en una base SQLite por año.
+
+Después de la declaración anual lo que se consulta a diario es el ejercicio en curso y
+el anterior; los demás solo agrandan la base activa (índices, caché de páginas, WAL).
+``python archivo.py archivar 2022`` mueve los CFDI emitidos ese año (facturas con sus
+conceptos, impuestos, pagos, DoctoRelacionado, CfdiRelacionado y complementos) y las
+retenciones del ejercicio a ``data/archivo/2022.sqlite``:
+
+- Mismo esquema e índices que la base activa; ``xml_text`` va comprimido con zlib
+  (BLOB), que es casi todo el tamaño de un CFDI.
+- Los ids se guardan negados: no chocan con los de la base activa (SQLite puede volver
+  a usar los números al borrar las filas) ni con los de otro año.
+- Se queda en la base activa todo lo que se enlaza por UUID con otro ejercicio:
+  facturas PPD con saldo pendiente o pagadas con complementos que no se archivan, y los
+  complementos que pagan facturas que se quedan; igual con CfdiRelacionado (sustituciones,
+  notas de crédito) en ambos sentidos. Así un periodo activo nunca necesita el archivo,
+  y un periodo archivado solo necesita su año.
+- ``uuids_archivados`` guarda los UUID para que reimportar un XML archivado siga contando
+  como duplicado, y ``periodos_archivados`` los meses para los selectores de periodo.
+
+La copia se hace primero (la base activa solo se lee) y después, en una transacción
+corta, se borran las filas y se registra el año en ``archivos_frios``; un archivo sin
+registro (copia interrumpida) se ignora y se reemplaza al volver a archivar.
+
+Lectura (``sesion_lectura``): si una vista pide un año archivado, su sesión usa una
+conexión que adjunta solo esos años (``ATTACH ... mode=ro``) y crea vistas ``TEMP`` con
+el nombre de cada tabla (``main.t UNION ALL frio_<año>.t``). SQLite busca primero en
+``temp``, así que las consultas de queries.py leen ambas bases sin cambios; en los
+joins reparte la unión entre las partes y cada una usa sus índices. Los periodos
+activos siguen con la sesión de siempre, sin adjuntar nada.
+
+Uso:
+    python archivo.py archivar 2022 [--vacuum]
+    python archivo.py listar
+"""
+
+from __future__ import annotations
+
+import argparse
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from datetime import date, datetime
+from functools import partial
+from pathlib import Path
+from typing import Container, Iterable, Optional
+
+from sqlalchemy import Connection, Engine, Table, create_engine, event, select, text
+from sqlalchemy.orm import Session
+
+import complementos  # noqa: F401  registra Nómina, Comercio Exterior, ...
+from db import DATA_DIR, DB_PATH, ReadSessionLocal, crear_engine_lectura, sync_schema, write_session
+from estado import bump_data_version
+from models import ArchivoFrio, Base
+from parser_xml import tablas_complemento
+
+
+ARCHIVO_DIR = DATA_DIR / "archivo"
+
+ANIOS_ACTIVOS = 2  # el ejercicio en curso y el anterior no se archivan (salvo --forzar)
+MAX_ADJUNTOS = 10  # SQLITE_MAX_ATTACHED de las compilaciones comunes
+ENGINES_MAX = 4  # combinaciones de años adjuntos con conexiones abiertas
+
+# Padres antes que hijos; el borrado va en orden inverso
+TABLAS = [
+    "facturas",
+    "conceptos",
+    "impuestos_concepto",
+    "impuestos_comprobante",
+    "pagos",
+    "pago_documento",
+    "cfdi_relacionados",
+    "retenciones_plataforma",
+    *tablas_complemento("cfdi"),
+    *tablas_complemento("retenciones"),
+]
+
+# Columnas agregadas después de archivar un año que se derivan de las que ese archivo sí
+# tiene: (expresión, columnas que usa). Los importes en MXN de un archivo anterior a
+# tipos_cambio.py son los del CFDI tal cual, como se sumaban cuando se archivó.
+_DERIVADAS = {
+    ("facturas", "base_mxn"): ("coalesce(subtotal, 0) - coalesce(descuento, 0)", "subtotal", "descuento"),
+    ("facturas", "total_mxn"): ("total", "total"),
+    ("facturas", "trasladados_mxn"): ("total_trasladados", "total_trasladados"),
+    ("facturas", "retenidos_mxn"): ("total_retenidos", "total_retenidos"),
+    ("impuestos_comprobante", "base_mxn"): ("base", "base"),
+    ("impuestos_comprobante", "importe_mxn"): ("importe", "importe"),
+    ("pagos", "monto_mxn"): ("monto", "monto"),
+    ("pago_documento", "iva_mxn"): ("iva_dr", "iva_dr"),
+}
+
+_engines: "OrderedDict[tuple[int, ...], Engine]" = OrderedDict()
+_engines_lock = threading.Lock()
+
+
+class ArchivoError(Exception):
+    """El año no se puede archivar (ya archivado, ejercicio activo, la base cambió)."""
+
+
+def ruta(year: int) -> Path:
+    return ARCHIVO_DIR / f"{year}.sqlite"
+
+
+def comprimir(texto: Optional[str]) -> Optional[bytes]:
+    return zlib.compress(texto.encode("utf-8"), 6) if texto is not None else None
+
+
+def descomprimir(valor) -> Optional[str]:
+    """``xml_text`` de un archivo frío (BLOB zlib); el texto de la base activa pasa igual."""
+    if isinstance(valor, bytes):
+        return zlib.decompress(valor).decode("utf-8")
+    return valor
+
+
+def _tabla(nombre: str) -> Table:
+    return Base.metadata.tables[nombre]
+
+
+def _negadas(tabla: Table) -> set[str]:
+    """Llave primaria y llaves foráneas hacia tablas que también se archivan."""
+    columnas = {c.name for c in tabla.primary_key.columns}
+    columnas |= {fk.parent.name for fk in tabla.foreign_keys if fk.column.table.name in TABLAS}
+    return columnas
+
+
+# ---------------------------------------------------------------------------
+# Lectura
+# ---------------------------------------------------------------------------
+
+
+def _columnas(cur, esquema: str, tabla: str) -> set[str]:
+    return {fila[1] for fila in cur.execute(f'PRAGMA "{esquema}".table_info("{tabla}")')}
+
+
+def _adjuntar(anios: tuple[int, ...], dbapi_conn, _record) -> None:
+    """Adjunta los años (solo lectura) y crea las vistas ``TEMP`` que unen cada tabla."""
+    dbapi_conn.create_function("descomprimir", 1, descomprimir, deterministic=True)
+    cur = dbapi_conn.cursor()
+    try:
+        for y in anios:
+            cur.execute(f'ATTACH DATABASE ? AS "frio_{y}"', (f"file:{ruta(y).as_posix()}?mode=ro",))
+        for nombre in TABLAS:
+            columnas = [c.name for c in _tabla(nombre).columns]
+            partes = [f'SELECT {", ".join(columnas)} FROM main."{nombre}"']
+            for y in anios:
+                presentes = _columnas(cur, f"frio_{y}", nombre)
+                if not presentes:
+                    continue  # tabla creada después de archivar ese año
+                exprs = []
+                for c in columnas:
+                    derivada = _DERIVADAS.get((nombre, c))
+                    if c not in presentes and derivada and presentes.issuperset(derivada[1:]):
+                        exprs.append(f"{derivada[0]} AS {c}")
+                    elif c not in presentes:
+                        exprs.append(f"NULL AS {c}")  # columna agregada después de archivar
+                    elif c == "xml_text":
+                        exprs.append("descomprimir(xml_text) AS xml_text")
+                    else:
+                        exprs.append(c)
+                partes.append(f'SELECT {", ".join(exprs)} FROM "frio_{y}"."{nombre}"')
+            cur.execute(f'CREATE TEMP VIEW "{nombre}" AS ' + " UNION ALL ".join(partes))
+    finally:
+        cur.close()
+
+
+def _engine_historico(anios: tuple[int, ...]) -> Engine:
+    with _engines_lock:
+        eng = _engines.get(anios)
+        if eng is not None:
+            _engines.move_to_end(anios)
+            return eng
+        eng = crear_engine_lectura(DB_PATH, query_only=False)
+        event.listen(eng, "connect", partial(_adjuntar, anios))
+        _engines[anios] = eng
+        while len(_engines) > ENGINES_MAX:
+            _, viejo = _engines.popitem(last=False)
+            viejo.dispose()
+        return eng
+
+
+def anios_archivados(db: Session) -> list[int]:
+    return list(db.scalars(select(ArchivoFrio.year).order_by(ArchivoFrio.year)))
+
+
+def sesion_lectura(anios: Optional[Container[int]] = None) -> Session:
+    """Sesión de solo lectura que también ve los años archivados de ``anios``.
+
+    ``None`` = todos los años archivados (p.ej. el detalle de un id negativo). Si ninguno
+    está archivado regresa la sesión de lectura normal.
+    """
+    db = ReadSessionLocal()
+    try:
+        archivados = anios_archivados(db)
+    except BaseException:
+        db.close()
+        raise
+    necesarios = tuple(y for y in archivados if anios is None or y in anios)
+    if not necesarios:
+        return db
+    db.close()
+    if len(necesarios) > MAX_ADJUNTOS:
+        raise ValueError(f"La consulta abarca {len(necesarios)} ejercicios archivados; el máximo es {MAX_ADJUNTOS}")
+    return Session(bind=_engine_historico(necesarios), autoflush=False)
+
+
+# ---------------------------------------------------------------------------
+# Archivar
+# ---------------------------------------------------------------------------
+
+
+def _seleccionar(conn: Connection, year: int, tabla: str) -> int:
+    """Ids de facturas del año que se pueden archivar, en ``temp.<tabla>``. Regresa cuántas.
+
+    Quita las PPD con saldo y, hasta que no cambie nada, las facturas pagadas por un
+    complemento que se queda, los complementos que pagan una factura que se queda y los
+    CFDI relacionados (CfdiRelacionado, en cualquier sentido) con uno que se queda.
+    """
+    conn.exec_driver_sql(f"DROP TABLE IF EXISTS temp.{tabla}")
+    conn.exec_driver_sql(f"CREATE TEMP TABLE {tabla} (id INTEGER PRIMARY KEY)")
+    conn.execute(
+        text(
+            f"""INSERT INTO temp.{tabla}
+            SELECT id FROM main.facturas
+            WHERE year_emision = :year
+              AND (coalesce(metodo_pago, '') != 'PPD' OR coalesce(saldo_pendiente, total, 0) <= 0.005)"""
+        ),
+        {"year": year},
+    )
+    while True:
+        pagadas = conn.exec_driver_sql(
+            f"""DELETE FROM temp.{tabla} WHERE id IN (
+                SELECT f.id FROM temp.{tabla} a
+                JOIN main.facturas f ON f.id = a.id
+                JOIN main.pago_documento pd ON pd.titular_rfc = f.titular_rfc AND pd.id_documento = f.uuid
+                WHERE pd.factura_id NOT IN (SELECT id FROM temp.{tabla}))"""
+        ).rowcount
+        complementos = conn.exec_driver_sql(
+            f"""DELETE FROM temp.{tabla} WHERE id IN (
+                SELECT pd.factura_id FROM temp.{tabla} a
+                JOIN main.pago_documento pd ON pd.factura_id = a.id
+                JOIN main.facturas f ON f.titular_rfc = pd.titular_rfc AND f.uuid = pd.id_documento
+                WHERE f.id NOT IN (SELECT id FROM temp.{tabla}))"""
+        ).rowcount
+        relacionados = conn.exec_driver_sql(
+            f"""DELETE FROM temp.{tabla} WHERE id IN (
+                SELECT f.id FROM temp.{tabla} a
+                JOIN main.facturas f ON f.id = a.id
+                JOIN main.cfdi_relacionados r ON r.titular_rfc = f.titular_rfc AND r.uuid_relacionado = f.uuid
+                WHERE r.factura_id NOT IN (SELECT id FROM temp.{tabla}))"""
+        ).rowcount
+        declarantes = conn.exec_driver_sql(
+            f"""DELETE FROM temp.{tabla} WHERE id IN (
+                SELECT r.factura_id FROM temp.{tabla} a
+                JOIN main.cfdi_relacionados r ON r.factura_id = a.id
+                JOIN main.facturas f ON f.titular_rfc = r.titular_rfc AND f.uuid = r.uuid_relacionado
+                WHERE f.id NOT IN (SELECT id FROM temp.{tabla}))"""
+        ).rowcount
+        if not pagadas and not complementos and not relacionados and not declarantes:
+            break
+    return conn.exec_driver_sql(f"SELECT count(*) FROM temp.{tabla}").scalar_one()
+
+
+def _filtro(nombre: str) -> str:
+    if nombre == "facturas":
+        return "id IN (SELECT id FROM temp.archivo_facturas)"
+    if nombre == "retenciones_plataforma":
+        return "ejercicio = :year"
+    if "retencion_id" in _tabla(nombre).c:
+        return "retencion_id IN (SELECT id FROM main.retenciones_plataforma WHERE ejercicio = :year)"
+    return "factura_id IN (SELECT id FROM temp.archivo_facturas)"
+
+
+def _copiar(conn: Connection, nombre: str, year: int) -> int:
+    tabla = _tabla(nombre)
+    negadas = _negadas(tabla)
+    columnas = [c.name for c in tabla.columns]
+    exprs = [f"-{c}" if c in negadas else "comprimir(xml_text)" if c == "xml_text" else c for c in columnas]
+    return conn.execute(
+        text(
+            f'INSERT INTO frio."{nombre}" ({", ".join(columnas)}) '
+            f'SELECT {", ".join(exprs)} FROM main."{nombre}" WHERE {_filtro(nombre)}'
+        ),
+        {"year": year},
+    ).rowcount
+
+
+def _crear_esquema(path: Path) -> None:
+    eng = create_engine(f"sqlite:///{path.as_posix()}")
+    try:
+        Base.metadata.create_all(bind=eng, tables=[_tabla(t) for t in TABLAS])
+    finally:
+        eng.dispose()
+
+
+def archivar(year: int, forzar: bool = False) -> dict:
+    """Mueve el ejercicio ``year`` a ``data/archivo/<year>.sqlite``. Regresa conteos."""
+    actual = date.today().year
+    if year > actual - ANIOS_ACTIVOS and not (forzar and year < actual):
+        raise ArchivoError(f"{year} es un ejercicio activo; se archivan hasta {actual - ANIOS_ACTIVOS}")
+    db = ReadSessionLocal()
+    try:
+        if db.get(ArchivoFrio, year) is not None:
+            raise ArchivoError(f"{year} ya está archivado")
+    finally:
+        db.close()
+
+    ARCHIVO_DIR.mkdir(parents=True, exist_ok=True)
+    tmp = ARCHIVO_DIR / f".{year}.sqlite.tmp"
+    tmp.unlink(missing_ok=True)
+    _crear_esquema(tmp)
+    destino = ruta(year)
+    stats = {"year": year}
+    registrado = False
+
+    with write_session(bulk=True) as db:
+        conn = db.connection()
+        conn.connection.dbapi_connection.create_function("comprimir", 1, comprimir, deterministic=True)
+        try:
+            # 1) Copia: en la base activa solo se lee
+            conn.exec_driver_sql("ATTACH DATABASE ? AS frio", (str(tmp),))
+            stats["facturas"] = _seleccionar(conn, year, "archivo_facturas")
+            stats["conservadas"] = conn.execute(
+                text("SELECT count(*) FROM main.facturas WHERE year_emision = :year"), {"year": year}
+            ).scalar_one() - stats["facturas"]
+            for nombre in TABLAS:
+                stats[nombre] = _copiar(conn, nombre, year)
+            db.commit()
+            conn.exec_driver_sql("DETACH DATABASE frio")
+            conn.commit()
+            os.replace(tmp, destino)
+
+            # 2) Borrado y registro en una transacción; si la base cambió mientras se copiaba, no se toca.
+            # ``db.connection()`` de nuevo para que el commit de la sesión sea el de esta transacción.
+            conn = db.connection()
+            conn.exec_driver_sql("ATTACH DATABASE ? AS frio", (str(destino),))
+            _seleccionar(conn, year, "archivo_verificacion")
+            distintas = conn.exec_driver_sql(
+                "SELECT count(*) FROM (SELECT id FROM temp.archivo_facturas "
+                "EXCEPT SELECT id FROM temp.archivo_verificacion)"
+            ).scalar_one()
+            retenciones = conn.execute(
+                text("SELECT count(*) FROM main.retenciones_plataforma WHERE ejercicio = :year"), {"year": year}
+            ).scalar_one()
+            if distintas or stats["retenciones_plataforma"] != retenciones:
+                raise ArchivoError("La base cambió mientras se copiaba; vuelve a intentar")
+
+            for nombre in reversed(TABLAS):
+                conn.execute(text(f'DELETE FROM main."{nombre}" WHERE {_filtro(nombre)}'), {"year": year})
+            conn.exec_driver_sql(
+                """INSERT OR IGNORE INTO main.uuids_archivados (titular_rfc, tabla, uuid)
+                SELECT titular_rfc, 'facturas', uuid FROM frio.facturas
+                WHERE titular_rfc IS NOT NULL AND uuid IS NOT NULL
+                UNION ALL
+                SELECT titular_rfc, 'retenciones_plataforma', uuid FROM frio.retenciones_plataforma
+                WHERE titular_rfc IS NOT NULL AND uuid IS NOT NULL"""
+            )
+            conn.exec_driver_sql(
+                """INSERT OR IGNORE INTO main.periodos_archivados (titular_rfc, tabla, year, month)
+                SELECT DISTINCT titular_rfc, 'facturas', year_emision, month_emision FROM frio.facturas
+                WHERE titular_rfc IS NOT NULL AND year_emision IS NOT NULL AND month_emision IS NOT NULL
+                UNION
+                SELECT DISTINCT titular_rfc, 'retenciones_plataforma', ejercicio, mes_fin FROM frio.retenciones_plataforma
+                WHERE titular_rfc IS NOT NULL AND ejercicio IS NOT NULL AND mes_fin IS NOT NULL"""
+            )
+            stats["bytes"] = destino.stat().st_size
+            db.add(
+                ArchivoFrio(
+                    year=year,
+                    facturas=stats["facturas"],
+                    retenciones=stats["retenciones_plataforma"],
+                    bytes=stats["bytes"],
+                    created_at=datetime.utcnow(),
+                )
+            )
+            bump_data_version(db)
+            db.commit()
+            registrado = True
+        except BaseException:
+            db.rollback()
+            raise
+        finally:
+            for t in ("archivo_facturas", "archivo_verificacion"):
+                conn.exec_driver_sql(f"DROP TABLE IF EXISTS temp.{t}")
+            conn.commit()
+            if "frio" in {fila[1] for fila in conn.exec_driver_sql("PRAGMA database_list")}:
+                conn.exec_driver_sql("DETACH DATABASE frio")
+            conn.commit()
+            tmp.unlink(missing_ok=True)
+            if not registrado:
+                destino.unlink(missing_ok=True)
+    return stats
+
+
+def mover_titular(anios: Iterable[int], anterior: str, nuevo: str) -> int:
+    """Pasa las filas de ``anterior`` a ``nuevo`` en los archivos fríos de ``anios``.
+
+    Acompaña a ``titulares.sincronizar_titular_default``: sin esto un año archivado seguiría
+    con el RFC anterior y sus CfdiRelacionado no cruzarían con las facturas (``sustituido``).
+    Cada archivo se actualiza en su propia transacción (no se puede adjuntar dentro de la de
+    la base activa); repetirlo no cambia nada. Regresa cuántas filas cambiaron.
+    """
+    cambios = 0
+    for y in anios:
+        con = sqlite3.connect(ruta(y))
+        try:
+            with con:
+                for nombre in TABLAS:
+                    if "titular_rfc" in _columnas(con, "main", nombre):
+                        cambios += con.execute(
+                            f'UPDATE "{nombre}" SET titular_rfc = ? WHERE titular_rfc = ?', (nuevo, anterior)
+                        ).rowcount
+        finally:
+            con.close()
+    # las conexiones con años adjuntos ya no reflejan el archivo
+    with _engines_lock:
+        while _engines:
+            _, eng = _engines.popitem()
+            eng.dispose()
+    return cambios
+
+
+def vacuum() -> None:
+    """Compacta la base activa (devuelve al sistema las páginas de lo archivado)."""
+    with write_session() as db:
+        db.connection().exec_driver_sql("VACUUM")
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="Archivo frío de ejercicios cerrados.")
+    sub = ap.add_subparsers(dest="comando", required=True)
+    p = sub.add_parser("archivar", help="Mueve un ejercicio cerrado a data/archivo/<año>.sqlite")
+    p.add_argument("year", type=int)
+    p.add_argument("--forzar", action="store_true", help="Permite archivar el ejercicio anterior")
+    p.add_argument("--vacuum", action="store_true", help="Compacta la base activa al terminar")
+    sub.add_parser("listar", help="Ejercicios archivados")
+    args = ap.parse_args()
+
+    sync_schema(Base.metadata)
+    if args.comando == "listar":
+        db = ReadSessionLocal()
+        try:
+            for a in db.scalars(select(ArchivoFrio).order_by(ArchivoFrio.year)):
+                print(f"{a.year}: {a.facturas} CFDI, {a.retenciones} retenciones, {a.bytes / 1048576:.1f} MiB ({ruta(a.year)})")
+        finally:
+            db.close()
+        return
+
+    antes = DB_PATH.stat().st_size
+    t0 = time.perf_counter()
+    try:
+        stats = archivar(args.year, forzar=args.forzar)
+    except ArchivoError as e:
+        raise SystemExit(f"error: {e}")
+    print(
+        f"{args.year}: {stats['facturas']} CFDI y {stats['retenciones_plataforma']} retenciones a {ruta(args.year)} "
+        f"({stats['bytes'] / 1048576:.1f} MiB); {stats['conservadas']} CFDI enlazados con otros ejercicios "
+        f"se quedan en la base activa ({time.perf_counter() - t0:.1f} s)"
+    )
+    if args.vacuum:
+        vacuum()
+        print(f"base activa: {antes / 1048576:.1f} MiB -> {DB_PATH.stat().st_size / 1048576:.1f} MiB")
+
+
+if __name__ == "__main__":
+    main()
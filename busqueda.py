@@ -0,0 +1,116 @@
+"""Búsqueda de texto completo (SQLite FTS5).
+
+Tres índices FTS5 de contenido externo (el texto vive en la tabla original, el índice
+solo guarda los términos):
+
+- ``conceptos_fts``: ``conceptos.descripcion`` y ``clave_prod_serv``.
+- ``contribuyentes_fts``: ``contribuyentes.nombre`` y ``rfc`` (contrapartes).
+- ``declaraciones_fts``: ``declaraciones_pdf.text_excerpt`` (texto de los acuses).
+
+Los triggers los mantienen al día con cualquier escritura (``BulkWriter``, ``rederive.py``,
+importación de PDF), así que no hay que llamarlos desde el importador. La primera vez
+que se crean se indexan las filas existentes (``rebuild``). Los índices de
+``OBSOLETOS`` (de esquemas anteriores) se eliminan junto con sus triggers.
+
+Las consultas (``queries.buscar_*``) ordenan por ``rank`` (bm25), que FTS5 entrega ya
+ordenado: el costo depende de cuántos documentos contienen los términos, no del
+tamaño de la tabla. Para términos muy comunes el ranking se acota a las
+``VENTANA_RANKING`` coincidencias más recientes.
+"""
+
+from __future__ import annotations
+
+import re
+from typing import Optional
+
+from markupsafe import Markup, escape
+from sqlalchemy import Engine, column, table, text
+
+
+TOKENIZADOR = "unicode61 remove_diacritics 2"  # "facturacion" encuentra "facturación"
+MAX_TERMINOS = 8
+
+# Marcadores de los fragmentos (snippet/highlight); se convierten a <mark> al mostrarlos
+INICIO_MARCA = "\x02"
+FIN_MARCA = "\x03"
+
+# (tabla fts, tabla de contenido, columnas indexadas)
+INDICES = [
+    ("conceptos_fts", "conceptos", ("descripcion", "clave_prod_serv")),
+    ("contribuyentes_fts", "contribuyentes", ("nombre", "rfc")),
+    ("declaraciones_fts", "declaraciones_pdf", ("text_excerpt",)),
+]
+
+# Índices de versiones anteriores; facturas_fts indexaba columnas que ahora viven en contribuyentes
+OBSOLETOS = ["facturas_fts"]
+
+# Tablas ligeras para armar las consultas con SQLAlchemy; la columna con el nombre de la
+# tabla es la columna oculta de FTS5 que recibe el MATCH.
+conceptos_fts = table("conceptos_fts", column("rowid"), column("rank"), column("conceptos_fts"))
+contribuyentes_fts = table("contribuyentes_fts", column("rowid"), column("rank"), column("contribuyentes_fts"))
+declaraciones_fts = table("declaraciones_fts", column("rowid"), column("rank"), column("declaraciones_fts"))
+TABLAS_FTS = {"conceptos": conceptos_fts, "contrapartes": contribuyentes_fts, "acuses": declaraciones_fts}
+
+# bm25 se calcula para cada coincidencia antes de ordenar: un término presente en
+# cientos de miles de conceptos tarda cientos de ms. Con más coincidencias que esto,
+# el ranking se hace solo entre las VENTANA_RANKING más recientes.
+VENTANA_RANKING = 10_000
+
+
+def _ddl(fts: str, contenido: str, columnas: tuple[str, ...]) -> list[str]:
+    cols = ", ".join(columnas)
+    nuevos = ", ".join(f"new.{c}" for c in columnas)
+    viejos = ", ".join(f"old.{c}" for c in columnas)
+    borrar = f"INSERT INTO {fts}({fts}, rowid, {cols}) VALUES ('delete', old.id, {viejos});"
+    insertar = f"INSERT INTO {fts}(rowid, {cols}) VALUES (new.id, {nuevos});"
+    return [
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5("
+        f"{cols}, content='{contenido}', content_rowid='id', tokenize='{TOKENIZADOR}', prefix='2 3')",
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_ai AFTER INSERT ON {contenido} BEGIN {insertar} END",
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_ad AFTER DELETE ON {contenido} BEGIN {borrar} END",
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_au AFTER UPDATE OF {cols} ON {contenido} BEGIN {borrar} {insertar} END",
+    ]
+
+
+def crear_indices_fts(engine: Engine) -> list[str]:
+    """Crea los índices FTS5 y sus triggers si faltan. Regresa los índices creados.
+
+    Llamar después de ``sync_schema`` (las tablas de contenido deben existir).
+    """
+    creados = []
+    with engine.begin() as conn:
+        existentes = set(conn.execute(text("SELECT name FROM sqlite_master WHERE type = 'table'")).scalars())
+        for fts in OBSOLETOS:
+            for sufijo in ("ai", "ad", "au"):
+                conn.execute(text(f"DROP TRIGGER IF EXISTS {fts}_{sufijo}"))
+            conn.execute(text(f"DROP TABLE IF EXISTS {fts}"))
+        for fts, contenido, columnas in INDICES:
+            for sentencia in _ddl(fts, contenido, columnas):
+                conn.execute(text(sentencia))
+            if fts not in existentes:
+                conn.execute(text(f"INSERT INTO {fts}({fts}) VALUES ('rebuild')"))
+                creados.append(fts)
+    return creados
+
+
+_PALABRA = re.compile(r"\w+", re.UNICODE)
+
+
+def consulta_fts(texto: Optional[str]) -> Optional[str]:
+    """Convierte lo que escribe el usuario en una consulta FTS5 segura.
+
+    Cada palabra se busca como prefijo (``"ube"*`` encuentra "Uber") y todas deben
+    aparecer. Los operadores de FTS5 no se interpretan, así que una comilla o un
+    paréntesis no producen errores de sintaxis. Regresa None si no hay palabras.
+    """
+    palabras = _PALABRA.findall(texto or "")[:MAX_TERMINOS]
+    if not palabras:
+        return None
+    # Un prefijo de una letra recorrería casi todo el vocabulario
+    return " ".join(f'"{p}"*' if len(p) > 1 else f'"{p}"' for p in palabras)
+
+
+def fragmento_html(fragmento: Optional[str]) -> Markup:
+    """Escapa el fragmento y convierte los marcadores de coincidencia en ``<mark>``."""
+    s = str(escape(fragmento or ""))
+    return Markup(s.replace(INICIO_MARCA, "<mark>").replace(FIN_MARCA, "</mark>"))
@@ -0,0 +1,156 @@
+"""Parsers de complementos además de Timbre, Pagos y Plataformas Tecnológicas.
+
+Cada función se registra con ``parser_xml.registrar_complemento`` por el tag completo
+(``{namespace}Nodo``) del hijo de ``Complemento`` que procesa y por la tabla donde van
+sus filas. ``parse_cfdi_40``/``parse_retenciones_plataforma`` recorren ``Complemento``
+una sola vez y llaman al manejador de cada nodo (búsqueda en un dict); el importador
+(``BulkWriter``) inserta las filas de cada tabla por lotes con ``executemany``, ligadas
+por ``factura_id`` o ``retencion_id``.
+
+Para agregar un complemento: su modelo en models.py (con ``factura_id`` o
+``retencion_id``), una función aquí que regrese la fila o filas, y subir
+``parser_xml.PARSER_VERSION`` para que ``rederive.py`` lo llene en lo ya importado.
+
+Los manejadores se registran al importar este módulo; lo importan los que parsean o
+recorren las tablas de complementos (main.py, importer.py, archivo.py, rederive.py).
+parser_xml.py no lo importa: aquí se usan sus funciones.
+"""
+
+from __future__ import annotations
+
+import xml.etree.ElementTree as ET
+
+from parser_xml import _parse_dt, _to_decimal, _to_int, registrar_complemento
+
+
+NOMINA12_NS = "http://www.sat.gob.mx/nomina12"
+CCE11_NS = "http://www.sat.gob.mx/ComercioExterior11"
+CCE20_NS = "http://www.sat.gob.mx/ComercioExterior20"
+IMPLOCAL_NS = "http://www.sat.gob.mx/implocal"
+DIVIDENDOS_NS = "http://www.sat.gob.mx/esquemas/retencionpago/1/dividendos"
+ENAJENACION_NS = "http://www.sat.gob.mx/esquemas/retencionpago/1/enajenaciondeacciones"
+
+
+@registrar_complemento(NOMINA12_NS, "Nomina", tabla="nominas")
+def nomina(nodo: ET.Element, data: dict) -> dict:
+    a = nodo.attrib
+    fila = {
+        "version": a.get("Version"),
+        "tipo_nomina": a.get("TipoNomina"),
+        "fecha_pago": _parse_dt(a.get("FechaPago")),
+        "fecha_inicial_pago": _parse_dt(a.get("FechaInicialPago")),
+        "fecha_final_pago": _parse_dt(a.get("FechaFinalPago")),
+        "num_dias_pagados": _to_decimal(a.get("NumDiasPagados")),
+        "curp": None,
+        "num_empleado": None,
+        "total_percepciones": _to_decimal(a.get("TotalPercepciones")),
+        "total_deducciones": _to_decimal(a.get("TotalDeducciones")),
+        "total_otros_pagos": _to_decimal(a.get("TotalOtrosPagos")),
+        "total_sueldos": None,
+        "total_gravado": None,
+        "total_exento": None,
+        "total_impuestos_retenidos": None,
+        "total_otras_deducciones": None,
+    }
+    # Hijos directos; el detalle por percepción/deducción no se guarda
+    for hijo in nodo:
+        h = hijo.attrib
+        local = hijo.tag.rpartition("}")[2]
+        if local == "Receptor":
+            fila["curp"] = h.get("Curp")
+            fila["num_empleado"] = h.get("NumEmpleado")
+        elif local == "Percepciones":
+            fila["total_sueldos"] = _to_decimal(h.get("TotalSueldos"))
+            fila["total_gravado"] = _to_decimal(h.get("TotalGravado"))
+            fila["total_exento"] = _to_decimal(h.get("TotalExento"))
+        elif local == "Deducciones":
+            fila["total_impuestos_retenidos"] = _to_decimal(h.get("TotalImpuestosRetenidos"))
+            fila["total_otras_deducciones"] = _to_decimal(h.get("TotalOtrasDeducciones"))
+    return fila
+
+
+@registrar_complemento(CCE11_NS, "ComercioExterior", tabla="comercio_exterior")
+@registrar_complemento(CCE20_NS, "ComercioExterior", tabla="comercio_exterior")
+def comercio_exterior(nodo: ET.Element, data: dict) -> dict:
+    a = nodo.attrib
+    return {
+        "version": a.get("Version"),
+        "clave_de_pedimento": a.get("ClaveDePedimento"),
+        "certificado_origen": _to_int(a.get("CertificadoOrigen")),
+        "incoterm": a.get("Incoterm"),
+        "tipo_cambio_usd": _to_decimal(a.get("TipoCambioUSD")),
+        "total_usd": _to_decimal(a.get("TotalUSD")),
+    }
+
+
+@registrar_complemento(IMPLOCAL_NS, "ImpuestosLocales", tabla="impuestos_locales")
+def impuestos_locales(nodo: ET.Element, data: dict) -> list[dict]:
+    filas = []
+    for hijo in nodo:
+        h = hijo.attrib
+        local = hijo.tag.rpartition("}")[2]
+        if local == "TrasladosLocales":
+            filas.append(
+                {
+                    "tipo": "traslado",
+                    "impuesto": h.get("ImpLocTrasladado"),
+                    "tasa": _to_decimal(h.get("TasadeTraslado")),
+                    "importe": _to_decimal(h.get("Importe")),
+                }
+            )
+        elif local == "RetencionesLocales":
+            filas.append(
+                {
+                    "tipo": "retencion",
+                    "impuesto": h.get("ImpLocRetenido"),
+                    "tasa": _to_decimal(h.get("TasadeRetencion")),
+                    "importe": _to_decimal(h.get("Importe")),
+                }
+            )
+    return filas
+
+
+@registrar_complemento(DIVIDENDOS_NS, "Dividendos", documentos=("retenciones",), tabla="dividendos")
+def dividendos(nodo: ET.Element, data: dict) -> dict:
+    fila: dict = dict.fromkeys(
+        (
+            "cve_tip_div_o_util",
+            "tipo_soc_distr_div",
+            "mont_isr_acred_ret_mexico",
+            "mont_isr_acred_ret_extranjero",
+            "mont_ret_ext_div_ext",
+            "mont_isr_acred_nal",
+            "mont_div_acum_nal",
+            "mont_div_acum_ext",
+            "proporcion_rem",
+        )
+    )
+    for hijo in nodo:
+        h = hijo.attrib
+        local = hijo.tag.rpartition("}")[2]
+        if local == "DividOUtil":
+            fila.update(
+                {
+                    "cve_tip_div_o_util": h.get("CveTipDivOUtil"),
+                    "tipo_soc_distr_div": h.get("TipoSocDistrDiv"),
+                    "mont_isr_acred_ret_mexico": _to_decimal(h.get("MontISRAcredRetMexico")),
+                    "mont_isr_acred_ret_extranjero": _to_decimal(h.get("MontISRAcredRetExtranjero")),
+                    "mont_ret_ext_div_ext": _to_decimal(h.get("MontRetExtDivExt")),
+                    "mont_isr_acred_nal": _to_decimal(h.get("MontISRAcredNal")),
+                    "mont_div_acum_nal": _to_decimal(h.get("MontDivAcumNal")),
+                    "mont_div_acum_ext": _to_decimal(h.get("MontDivAcumExt")),
+                }
+            )
+        elif local == "Remanente":
+            fila["proporcion_rem"] = _to_decimal(h.get("ProporcionRem"))
+    return fila
+
+
+@registrar_complemento(ENAJENACION_NS, "EnajenaciondeAcciones", documentos=("retenciones",), tabla="enajenaciones_acciones")
+def enajenacion_acciones(nodo: ET.Element, data: dict) -> dict:
+    a = nodo.attrib
+    return {
+        "contrato_intermediacion": a.get("ContratoIntermediacion"),
+        "ganancia": _to_decimal(a.get("Ganancia")),
+        "perdida": _to_decimal(a.get("Perdida")),
+    }
@@ -0,0 +1,378 @@
+"""Contabilidad electrónica (Anexo 24): catálogo de cuentas y balanza de comprobación 1.3.
+
+No hay pólizas capturadas: los movimientos se derivan de lo ya clasificado con un
+catálogo fijo (``CUENTAS``) y asientos tipo por documento:
+
+- Ingreso PUE: cargo a bancos y a impuestos retenidos a favor, abono a ventas e IVA
+  trasladado cobrado. Con PPD el cargo es a clientes y el IVA queda como no cobrado.
+- Cobro (complemento P emitido): bancos contra clientes; el IVA del documento pasa de
+  no cobrado a cobrado.
+- Gasto PUE: cargo a gastos e IVA acreditable pagado, abono a bancos e impuestos
+  retenidos por pagar. Con PPD el abono es a proveedores y el IVA queda pendiente.
+- Pago (complemento P recibido): proveedores contra bancos; el IVA pasa a acreditable.
+- Retención de plataforma (en su ``mes_fin``): bancos e impuestos retenidos a favor
+  contra ingresos por plataformas e IVA trasladado cobrado.
+
+Los importes de cada mes salen de consultas agrupadas por (año, mes) (``queries``), así
+que la memoria depende del número de meses y cuentas, no del número de CFDI. Los XML
+se escriben por flujo con ``XMLGenerator``; ``balanzas_zip`` arma las doce balanzas de
+un año en un ZIP que también se envía por flujo.
+"""
+
+from __future__ import annotations
+
+import io
+import zipfile
+from collections import defaultdict
+from dataclasses import dataclass
+from decimal import Decimal
+from typing import Iterator, Optional
+from xml.sax.saxutils import XMLGenerator
+
+from sqlalchemy.orm import Session
+
+import archivo
+import queries
+
+
+VERSION = "1.3"
+NS_CATALOGO = "http://www.sat.gob.mx/esquemas/ContabilidadE/1_3/CatalogoCuentas"
+NS_BALANZA = "http://www.sat.gob.mx/esquemas/ContabilidadE/1_3/BalanzaComprobacion"
+NS_XSI = "http://www.w3.org/2001/XMLSchema-instance"
+
+# Qué ingresos se contabilizan: CFDI emitidos, retenciones de plataformas o ambos
+# (igual que en /declaracion, "ambos" solo si no son las mismas ventas)
+FUENTES_INGRESOS = ("ambos", "cfdi", "plataforma")
+TIPOS_ENVIO = ("N", "C")  # normal / complementaria
+
+CUENTAS_POR_BLOQUE = 200  # elementos <Ctas> por bloque enviado
+
+
+@dataclass(frozen=True)
+class Cuenta:
+    num: str
+    cod_agrup: str  # código agrupador del SAT
+    desc: str
+    natur: str  # D deudora / A acreedora
+    sub_cta_de: Optional[str] = None
+
+    @property
+    def nivel(self) -> int:
+        return 1 if self.sub_cta_de is None else 2
+
+    @property
+    def de_resultados(self) -> bool:
+        """Ingresos, costos y gastos: su saldo vuelve a cero al iniciar cada ejercicio."""
+        return self.num[0] in "4567"
+
+
+BANCOS = "102.01"
+CLIENTES = "105.01"
+RETENIDOS_A_FAVOR = "113.01"
+IVA_ACREDITABLE_PAGADO = "118.01"
+IVA_PENDIENTE_PAGO = "119.01"
+PROVEEDORES = "201.01"
+IVA_TRASLADADO_COBRADO = "208.01"
+IVA_TRASLADADO_NO_COBRADO = "209.01"
+RETENIDOS_POR_PAGAR = "216.01"
+VENTAS = "401.01"
+INGRESOS_PLATAFORMAS = "401.02"
+GASTOS = "601.84"
+
+CUENTAS = [
+    Cuenta("102", "102", "Bancos", "D"),
+    Cuenta(BANCOS, "102.01", "Bancos nacionales", "D", "102"),
+    Cuenta("105", "105", "Clientes", "D"),
+    Cuenta(CLIENTES, "105.01", "Clientes nacionales", "D", "105"),
+    Cuenta("113", "113", "Impuestos a favor", "D"),
+    Cuenta(RETENIDOS_A_FAVOR, "113", "ISR e IVA retenidos por clientes y plataformas", "D", "113"),
+    Cuenta("118", "118", "Impuestos acreditables pagados", "D"),
+    Cuenta(IVA_ACREDITABLE_PAGADO, "118.01", "IVA acreditable pagado", "D", "118"),
+    Cuenta("119", "119", "Impuestos acreditables por pagar", "D"),
+    Cuenta(IVA_PENDIENTE_PAGO, "119.01", "IVA pendiente de pago", "D", "119"),
+    Cuenta("201", "201", "Proveedores", "A"),
+    Cuenta(PROVEEDORES, "201.01", "Proveedores nacionales", "A", "201"),
+    Cuenta("208", "208", "Impuestos trasladados cobrados", "A"),
+    Cuenta(IVA_TRASLADADO_COBRADO, "208.01", "IVA trasladado cobrado", "A", "208"),
+    Cuenta("209", "209", "Impuestos trasladados no cobrados", "A"),
+    Cuenta(IVA_TRASLADADO_NO_COBRADO, "209.01", "IVA trasladado no cobrado", "A", "209"),
+    Cuenta("216", "216", "Impuestos retenidos", "A"),
+    Cuenta(RETENIDOS_POR_PAGAR, "216", "ISR e IVA retenidos a proveedores", "A", "216"),
+    Cuenta("401", "401", "Ingresos", "A"),
+    Cuenta(VENTAS, "401.01", "Ventas y/o servicios gravados a la tasa general", "A", "401"),
+    Cuenta(INGRESOS_PLATAFORMAS, "401", "Ingresos por plataformas tecnológicas", "A", "401"),
+    Cuenta("601", "601", "Gastos generales", "D"),
+    Cuenta(GASTOS, "601.84", "Otros gastos generales", "D", "601"),
+]
+_POR_NUM = {c.num: c for c in CUENTAS}
+
+Periodo = tuple[int, int]
+# (año, mes) -> cuenta -> [debe, haber]
+Movimientos = dict[Periodo, dict[str, list[Decimal]]]
+
+
+def _dec(v) -> Decimal:
+    return v if isinstance(v, Decimal) else Decimal(str(v or 0))
+
+
+class _Poliza:
+    """Acumula cargos y abonos por periodo; un importe negativo (notas de crédito) cambia de lado."""
+
+    def __init__(self) -> None:
+        self.movs: Movimientos = defaultdict(lambda: defaultdict(lambda: [Decimal(0), Decimal(0)]))
+
+    def cargo(self, periodo: Periodo, cuenta: str, importe) -> None:
+        self._asentar(periodo, cuenta, _dec(importe), 0)
+
+    def abono(self, periodo: Periodo, cuenta: str, importe) -> None:
+        self._asentar(periodo, cuenta, _dec(importe), 1)
+
+    def _asentar(self, periodo: Periodo, cuenta: str, importe: Decimal, lado: int) -> None:
+        if importe < 0:
+            importe, lado = -importe, 1 - lado
+        if importe:
+            self.movs[periodo][cuenta][lado] += importe
+
+
+def movimientos(db: Session, rfc: str, hasta: Periodo, ingresos: str = "ambos") -> Movimientos:
+    """Cargos y abonos por mes y cuenta desde el primer documento hasta ``hasta`` (inclusive)."""
+    desde = (1, 1)
+    p = _Poliza()
+    con_cfdi = ingresos in ("ambos", "cfdi")
+    con_plataforma = ingresos in ("ambos", "plataforma")
+
+    for y, m, naturaleza, es_ppd, base, trasl, ret in db.execute(queries.facturas_por_mes_metodo(rfc, desde, hasta)):
+        per = (int(y), int(m))
+        neto = _dec(base) + _dec(trasl) - _dec(ret)
+        if naturaleza == "ingreso":
+            if not con_cfdi:
+                continue
+            p.cargo(per, CLIENTES if es_ppd else BANCOS, neto)
+            p.cargo(per, RETENIDOS_A_FAVOR, ret)
+            p.abono(per, VENTAS, base)
+            p.abono(per, IVA_TRASLADADO_NO_COBRADO if es_ppd else IVA_TRASLADADO_COBRADO, trasl)
+        else:
+            p.cargo(per, GASTOS, base)
+            p.cargo(per, IVA_PENDIENTE_PAGO if es_ppd else IVA_ACREDITABLE_PAGADO, trasl)
+            p.abono(per, PROVEEDORES if es_ppd else BANCOS, neto)
+            p.abono(per, RETENIDOS_POR_PAGAR, ret)
+
+    for y, m, cash_in, cash_out, _ in db.execute(queries.pagos_por_mes(rfc, desde, hasta)):
+        per = (int(y), int(m))
+        if con_cfdi:
+            p.cargo(per, BANCOS, cash_in)
+            p.abono(per, CLIENTES, cash_in)
+        p.cargo(per, PROVEEDORES, cash_out)
+        p.abono(per, BANCOS, cash_out)
+
+    for y, m, iva_cobrado, iva_pagado in db.execute(queries.iva_flujo_por_mes(rfc, desde, hasta)):
+        per = (int(y), int(m))
+        if con_cfdi:
+            p.cargo(per, IVA_TRASLADADO_NO_COBRADO, iva_cobrado)
+            p.abono(per, IVA_TRASLADADO_COBRADO, iva_cobrado)
+        p.cargo(per, IVA_ACREDITABLE_PAGADO, iva_pagado)
+        p.abono(per, IVA_PENDIENTE_PAGO, iva_pagado)
+
+    if con_plataforma:
+        for r in db.execute(queries.retenciones_por_rango(rfc, desde[0], hasta[0])).mappings():
+            if r["ejercicio"] is None or r["mes_fin"] is None:
+                continue
+            per = (int(r["ejercicio"]), int(r["mes_fin"]))
+            if per > hasta:
+                continue
+            siva, iva, iva_ret, isr_ret = (
+                _dec(r[k]) for k in ("plat_ing_siva", "plat_iva_tras", "plat_iva_ret", "plat_isr_ret")
+            )
+            p.cargo(per, BANCOS, siva + iva - iva_ret - isr_ret)
+            p.cargo(per, RETENIDOS_A_FAVOR, iva_ret + isr_ret)
+            p.abono(per, INGRESOS_PLATAFORMAS, siva)
+            p.abono(per, IVA_TRASLADADO_COBRADO, iva)
+
+    return p.movs
+
+
+@dataclass
+class RenglonBalanza:
+    cuenta: Cuenta
+    saldo_ini: Decimal
+    debe: Decimal
+    haber: Decimal
+
+    @property
+    def saldo_fin(self) -> Decimal:
+        if self.cuenta.natur == "D":
+            return self.saldo_ini + self.debe - self.haber
+        return self.saldo_ini + self.haber - self.debe
+
+
+def balanza(movs: Movimientos, year: int, month: int) -> list[RenglonBalanza]:
+    """Renglones de la balanza del mes (todas las cuentas del catálogo, con las de nivel 1 sumadas).
+
+    El saldo inicial acumula los meses anteriores; en las cuentas de resultados solo los
+    del mismo ejercicio.
+    """
+    periodo = (year, month)
+    hojas: dict[str, RenglonBalanza] = {
+        c.num: RenglonBalanza(c, Decimal(0), Decimal(0), Decimal(0)) for c in CUENTAS if c.sub_cta_de
+    }
+    for per, cuentas in movs.items():
+        if per > periodo:
+            continue
+        for num, (debe, haber) in cuentas.items():
+            r = hojas[num]
+            if per == periodo:
+                r.debe += debe
+                r.haber += haber
+            elif not r.cuenta.de_resultados or per[0] == year:
+                r.saldo_ini += debe - haber if r.cuenta.natur == "D" else haber - debe
+
+    renglones = []
+    for c in CUENTAS:
+        if c.sub_cta_de:
+            renglones.append(hojas[c.num])
+        else:
+            hijas = [h for h in hojas.values() if h.cuenta.sub_cta_de == c.num]
+            renglones.append(
+                RenglonBalanza(
+                    c,
+                    sum((h.saldo_ini for h in hijas), Decimal(0)),
+                    sum((h.debe for h in hijas), Decimal(0)),
+                    sum((h.haber for h in hijas), Decimal(0)),
+                )
+            )
+    return renglones
+
+
+# ---------------------------------------------------------------------------
+# XML por flujo
+
+
+def _importe(v: Decimal) -> str:
+    return f"{v:.2f}"
+
+
+class _EscritorXML:
+    """``XMLGenerator`` sobre un búfer que se vacía en cada ``bloque()``."""
+
+    def __init__(self) -> None:
+        self.buf = io.StringIO()
+        self.xml = XMLGenerator(self.buf, encoding="UTF-8", short_empty_elements=True)
+        self.xml.startDocument()
+
+    def bloque(self) -> bytes:
+        data = self.buf.getvalue().encode("utf-8")
+        self.buf.seek(0)
+        self.buf.truncate()
+        return data
+
+
+def _raiz(prefijo: str, ns: str, xsd: str, attrs: dict[str, str]) -> dict[str, str]:
+    return {
+        f"xmlns:{prefijo}": ns,
+        "xmlns:xsi": NS_XSI,
+        "xsi:schemaLocation": f"{ns} {ns}/{xsd}",
+        "Version": VERSION,
+        **attrs,
+    }
+
+
+def catalogo_xml(rfc: str, year: int, month: int) -> Iterator[bytes]:
+    """Catálogo de cuentas (``CatalogoCuentas_1_3``) del periodo."""
+    w = _EscritorXML()
+    w.xml.startElement(
+        "catalogocuentas:Catalogo",
+        _raiz("catalogocuentas", NS_CATALOGO, "CatalogoCuentas_1_3.xsd",
+              {"RFC": rfc, "Mes": f"{month:02d}", "Anio": str(year)}),
+    )
+    for c in CUENTAS:
+        attrs = {"CodAgrup": c.cod_agrup, "NumCta": c.num, "Desc": c.desc}
+        if c.sub_cta_de:
+            attrs["SubCtaDe"] = c.sub_cta_de
+        attrs.update({"Nivel": str(c.nivel), "Natur": c.natur})
+        w.xml.startElement("catalogocuentas:Ctas", attrs)
+        w.xml.endElement("catalogocuentas:Ctas")
+    w.xml.endElement("catalogocuentas:Catalogo")
+    w.xml.endDocument()
+    yield w.bloque()
+
+
+def _balanza_xml(rfc: str, year: int, month: int, renglones: list[RenglonBalanza], tipo_envio: str) -> Iterator[bytes]:
+    w = _EscritorXML()
+    w.xml.startElement(
+        "BCE:Balanza",
+        _raiz("BCE", NS_BALANZA, "BalanzaComprobacion_1_3.xsd",
+              {"RFC": rfc, "Mes": f"{month:02d}", "Anio": str(year), "TipoEnvio": tipo_envio}),
+    )
+    for n, r in enumerate(renglones, start=1):
+        w.xml.startElement(
+            "BCE:Ctas",
+            {
+                "NumCta": r.cuenta.num,
+                "SaldoIni": _importe(r.saldo_ini),
+                "Debe": _importe(r.debe),
+                "Haber": _importe(r.haber),
+                "SaldoFin": _importe(r.saldo_fin),
+            },
+        )
+        w.xml.endElement("BCE:Ctas")
+        if n % CUENTAS_POR_BLOQUE == 0:
+            yield w.bloque()
+    w.xml.endElement("BCE:Balanza")
+    w.xml.endDocument()
+    yield w.bloque()
+
+
+def balanza_xml(rfc: str, year: int, month: int, ingresos: str = "ambos", tipo_envio: str = "N") -> Iterator[bytes]:
+    """Balanza de comprobación (``BalanzaComprobacion_1_3``) del mes."""
+    db = archivo.sesion_lectura(range(year + 1))  # los saldos acumulan desde el primer año
+    try:
+        movs = movimientos(db, rfc, (year, month), ingresos)
+    finally:
+        db.close()
+    yield from _balanza_xml(rfc, year, month, balanza(movs, year, month), tipo_envio)
+
+
+def nombre_archivo(rfc: str, year: int, month: int, tipo: str) -> str:
+    """Nombre que pide el SAT: RFC + año + mes + tipo (CT catálogo, BN/BC balanza)."""
+    return f"{rfc}{year}{month:02d}{tipo}.xml"
+
+
+class _SalidaZip(io.RawIOBase):
+    """Destino de ``ZipFile`` sin ``seek``: acumula lo escrito hasta que se lee con ``vaciar``."""
+
+    def __init__(self) -> None:
+        self._partes: list[bytes] = []
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, b) -> int:
+        self._partes.append(bytes(b))
+        return len(b)
+
+    def vaciar(self) -> bytes:
+        data, self._partes = b"".join(self._partes), []
+        return data
+
+
+def balanzas_zip(rfc: str, year: int, ingresos: str = "ambos", tipo_envio: str = "N") -> Iterator[bytes]:
+    """Las doce balanzas del ejercicio en un ZIP, generado y enviado por flujo.
+
+    Los movimientos del año se consultan una sola vez; cada XML se comprime conforme se
+    escribe, así que en memoria solo hay un bloque a la vez.
+    """
+    db = archivo.sesion_lectura(range(year + 1))
+    try:
+        movs = movimientos(db, rfc, (year, 12), ingresos)
+    finally:
+        db.close()
+
+    salida = _SalidaZip()
+    with zipfile.ZipFile(salida, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+        for month in range(1, 13):
+            nombre = nombre_archivo(rfc, year, month, "BN" if tipo_envio == "N" else "BC")
+            with zf.open(nombre, "w") as f:
+                for bloque in _balanza_xml(rfc, year, month, balanza(movs, year, month), tipo_envio):
+                    f.write(bloque)
+            yield salida.vaciar()
+    yield salida.vaciar()
@@ -0,0 +1,184 @@
+"""Dimensión de contribuyentes (emisores y receptores).
+
+Facturas y retenciones guardan ``emisor_id``/``receptor_id`` hacia ``contribuyentes``
+(RFC y último nombre visto) en lugar de repetir nombres de hasta 300 caracteres en cada
+fila. Los RFC se quedan en la fila porque la clasificación (naturaleza) y los filtros
+los usan directamente.
+
+Al importar, ``cache.resolver`` traduce RFC a id con un diccionario en memoria y solo
+va a la base por los RFC nuevos (o cuyo nombre cambió). Lo que se inserta dentro de
+una transacción se agrega a la caché hasta que el llamador confirma (``recordar``),
+para que un rollback no deje ids inexistentes en memoria.
+"""
+
+from __future__ import annotations
+
+import threading
+from datetime import datetime
+from typing import Iterable, Optional
+
+from sqlalchemy import Engine, bindparam, inspect, select, text, update
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session
+
+from models import Contribuyente, Parametro
+
+
+CACHE_MAX = 200_000  # RFC en memoria; al pasarlo se vacía y se vuelve a llenar desde la base
+
+# rfc -> (id, nombre)
+Resueltos = dict[str, tuple[int, Optional[str]]]
+
+
+class ContribuyenteCache:
+    def __init__(self) -> None:
+        self._items: Resueltos = {}
+        self._lock = threading.Lock()
+
+    def resolver(self, db: Session, pares: Iterable[tuple[Optional[str], Optional[str]]]) -> Resueltos:
+        """Ids para los ``(rfc, nombre)`` dados, dentro de la transacción de ``db``.
+
+        Inserta los RFC que faltan y actualiza el nombre cuando llega uno distinto (el
+        último importado gana). Regresa ``{rfc: (id, nombre)}``; el llamador lo pasa a
+        ``recordar`` después de su commit.
+        """
+        nombres: dict[str, Optional[str]] = {}
+        for rfc, nombre in pares:
+            if rfc:
+                nombres[rfc] = nombre or nombres.get(rfc)
+        if not nombres:
+            return {}
+
+        with self._lock:
+            conocidos = {rfc: self._items.get(rfc) for rfc in nombres}
+
+        resueltos: Resueltos = {}
+        cambios: list[dict] = []
+        faltan = [rfc for rfc, v in conocidos.items() if v is None]
+        if faltan:
+            ahora = datetime.utcnow()
+            db.execute(
+                sqlite_insert(Contribuyente)
+                .values([{"rfc": rfc, "nombre": nombres[rfc], "updated_at": ahora} for rfc in faltan])
+                .on_conflict_do_nothing(index_elements=["rfc"])
+            )
+            for cid, rfc, nombre in db.execute(
+                select(Contribuyente.id, Contribuyente.rfc, Contribuyente.nombre).where(Contribuyente.rfc.in_(faltan))
+            ):
+                conocidos[rfc] = (cid, nombre)
+
+        for rfc, (cid, nombre) in conocidos.items():
+            nuevo = nombres[rfc]
+            if nuevo and nuevo != nombre:
+                cambios.append({"_id": cid, "_nombre": nuevo})
+                nombre = nuevo
+            resueltos[rfc] = (cid, nombre)
+
+        if cambios:
+            tabla = Contribuyente.__table__
+            db.execute(
+                update(tabla)
+                .where(tabla.c.id == bindparam("_id"))
+                .values(nombre=bindparam("_nombre"), updated_at=datetime.utcnow()),
+                cambios,
+            )
+        return resueltos
+
+    def recordar(self, resueltos: Resueltos) -> None:
+        """Agrega a la caché lo resuelto en una transacción ya confirmada."""
+        with self._lock:
+            if len(self._items) + len(resueltos) > CACHE_MAX:
+                self._items.clear()
+            self._items.update(resueltos)
+
+    def limpiar(self) -> None:
+        with self._lock:
+            self._items.clear()
+
+
+cache = ContribuyenteCache()
+
+
+def asignar_ids(db: Session, parsed_list: list[dict]) -> Resueltos:
+    """Llena ``emisor_id``/``receptor_id`` de los documentos parseados. Regresa lo resuelto."""
+    resueltos = cache.resolver(
+        db,
+        [(p.get("emisor_rfc"), p.get("emisor_nombre")) for p in parsed_list]
+        + [(p.get("receptor_rfc"), p.get("receptor_nombre")) for p in parsed_list],
+    )
+    for p in parsed_list:
+        p["emisor_id"] = resueltos[p["emisor_rfc"]][0] if p.get("emisor_rfc") else None
+        p["receptor_id"] = resueltos[p["receptor_rfc"]][0] if p.get("receptor_rfc") else None
+    return resueltos
+
+
+# ---------------------------------------------------------------------------
+# Migración de bases con nombres en cada fila
+
+# Tabla con columnas viejas -> fecha del documento (la más reciente da el nombre)
+_TABLAS = {"facturas": "fecha_emision", "retenciones_plataforma": "fecha_exp"}
+# En ``parametros``: con SQLite < 3.35 las columnas viejas se quedan (en NULL) tras migrar
+MIGRADO_KEY = "contribuyentes_migrados"
+
+
+def migrar(engine: Engine) -> bool:
+    """Pasa ``emisor_nombre``/``receptor_nombre`` de facturas y retenciones a ``contribuyentes``.
+
+    Solo actúa si las columnas viejas siguen en la base y no se ha migrado antes
+    (``MIGRADO_KEY``): llena la dimensión (nombre del documento más reciente por RFC según
+    su fecha, en facturas o retenciones), asigna ``emisor_id``/``receptor_id`` y elimina
+    las columnas. Llamar después de ``sync_schema`` y de ``busqueda.crear_indices_fts``
+    (que quita el índice FTS viejo que dependía de esas columnas). Regresa True si migró.
+    """
+    insp = inspect(engine)
+    pendientes = [t for t in _TABLAS if "emisor_nombre" in {c["name"] for c in insp.get_columns(t)}]
+    if not pendientes:
+        return False
+
+    with engine.begin() as conn:
+        if conn.scalar(select(Parametro.valor).where(Parametro.clave == MIGRADO_KEY)):
+            return False
+        union = " UNION ALL ".join(
+            f"SELECT {lado}_rfc AS rfc, {lado}_nombre AS nombre, {_TABLAS[t]} AS fecha, id "
+            f"FROM {t} WHERE {lado}_rfc IS NOT NULL"
+            for t in pendientes
+            for lado in ("emisor", "receptor")
+        )
+        # El nombre del documento más reciente con nombre, en ambas tablas (sin fecha al final)
+        conn.execute(
+            text(
+                f"INSERT INTO contribuyentes (rfc, nombre, updated_at) "
+                f"SELECT rfc, nombre, datetime('now') FROM ("
+                f"  SELECT rfc, nombre, row_number() OVER (PARTITION BY rfc ORDER BY fecha DESC, id DESC) AS n"
+                f"  FROM ({union}) WHERE nombre IS NOT NULL AND nombre <> ''"
+                f") WHERE n = 1 ON CONFLICT (rfc) DO UPDATE SET nombre = excluded.nombre"
+            )
+        )
+        conn.execute(
+            text(
+                f"INSERT INTO contribuyentes (rfc, nombre, updated_at) "
+                f"SELECT DISTINCT rfc, NULL, datetime('now') FROM ({union}) WHERE true ON CONFLICT (rfc) DO NOTHING"
+            )
+        )
+        for t in pendientes:
+            conn.execute(
+                text(
+                    f"UPDATE {t} SET "
+                    f"emisor_id = (SELECT id FROM contribuyentes c WHERE c.rfc = {t}.emisor_rfc), "
+                    f"receptor_id = (SELECT id FROM contribuyentes c WHERE c.rfc = {t}.receptor_rfc)"
+                )
+            )
+            for col in ("emisor_nombre", "receptor_nombre"):
+                try:
+                    conn.execute(text(f'ALTER TABLE "{t}" DROP COLUMN "{col}"'))
+                except OperationalError:
+                    # SQLite < 3.35 no tiene DROP COLUMN: al menos se libera el contenido
+                    conn.execute(text(f'UPDATE "{t}" SET "{col}" = NULL'))
+        conn.execute(
+            sqlite_insert(Parametro)
+            .values(clave=MIGRADO_KEY, valor="1")
+            .on_conflict_do_update(index_elements=["clave"], set_={"valor": "1"})
+        )
+    cache.limpiar()
+    return True
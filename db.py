@@ -1,12 +1,18 @@
 from __future__ import annotations
 
+import os
+import threading
+from contextlib import contextmanager
 from pathlib import Path
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker, DeclarativeBase
+from typing import Iterator
+
+from sqlalchemy import Engine, create_engine, event, inspect, text
+from sqlalchemy.orm import Session, sessionmaker, DeclarativeBase
 
 BASE_DIR = Path(__file__).resolve().parent
-DATA_DIR = BASE_DIR / "data"
-DATA_DIR.mkdir(exist_ok=True)
+# CFDI_DATA_DIR permite apuntar a otra carpeta de datos (p.ej. scripts de prueba con una base temporal)
+DATA_DIR = Path(os.environ.get("CFDI_DATA_DIR") or BASE_DIR / "data")
+DATA_DIR.mkdir(parents=True, exist_ok=True)
 
 PDF_DIR = DATA_DIR / "pdfs"
 PDF_DIR.mkdir(exist_ok=True)
@@ -14,13 +20,146 @@ PDF_DIR.mkdir(exist_ok=True)
 DB_PATH = DATA_DIR / "contabilidad.sqlite"
 DATABASE_URL = f"sqlite:///{DB_PATH.as_posix()}"
 
-engine = create_engine(
-    DATABASE_URL,
-    connect_args={"check_same_thread": False},  # requerido para SQLite en FastAPI
-)
+# Perfil de almacenamiento. En modo WAL los lectores leen la última versión confirmada
+# mientras un importador escribe, en lugar de esperar al candado del rollback journal.
+BUSY_TIMEOUT_MS = 10_000
+_PRAGMAS_COMUNES = {
+    "busy_timeout": BUSY_TIMEOUT_MS,
+    "cache_size": -65536,  # 64 MiB por conexión
+    "mmap_size": 268435456,  # 256 MiB
+    "temp_store": "MEMORY",
+}
+
+
+def _aplicar_pragmas(dbapi_conn, pragmas: dict) -> None:
+    cur = dbapi_conn.cursor()
+    for clave, valor in pragmas.items():
+        cur.execute(f"PRAGMA {clave}={valor}")
+    cur.close()
+
+
+def crear_engine_escritura(path: Path) -> Engine:
+    """Engine de escritura: WAL, ``synchronous=FULL`` salvo dentro de ``write_session(bulk=True)``."""
+    eng = create_engine(
+        f"sqlite:///{path.as_posix()}",
+        connect_args={"check_same_thread": False, "timeout": BUSY_TIMEOUT_MS / 1000},  # requerido para SQLite en FastAPI
+    )
+
+    @event.listens_for(eng, "connect")
+    def _on_connect(dbapi_conn, _record) -> None:
+        _aplicar_pragmas(dbapi_conn, {"journal_mode": "WAL", "synchronous": "FULL", **_PRAGMAS_COMUNES})
+
+    return eng
+
+
+def crear_engine_lectura(path: Path, query_only: bool = True) -> Engine:
+    """Engine de solo lectura (``mode=ro``) para las vistas; nunca toma el candado de escritura.
+
+    ``query_only=False`` solo sirve para crear objetos ``TEMP`` (las vistas del archivo
+    frío, ver archivo.py); la base sigue abierta en ``mode=ro``.
+    """
+    eng = create_engine(
+        f"sqlite:///file:{path.as_posix()}?mode=ro&uri=true",
+        connect_args={"check_same_thread": False, "timeout": BUSY_TIMEOUT_MS / 1000},
+    )
+
+    @event.listens_for(eng, "connect")
+    def _on_connect(dbapi_conn, _record) -> None:
+        _aplicar_pragmas(dbapi_conn, {"query_only": 1, **_PRAGMAS_COMUNES} if query_only else _PRAGMAS_COMUNES)
+
+    return eng
+
+
+engine = crear_engine_escritura(DB_PATH)
+read_engine = crear_engine_lectura(DB_PATH)
 
 SessionLocal = sessionmaker(bind=engine, autoflush=False, autocommit=False)
+ReadSessionLocal = sessionmaker(bind=read_engine, autoflush=False, autocommit=False)
+
+# Un solo escritor por proceso: SQLite admite un escritor a la vez y así las
+# importaciones concurrentes esperan aquí y no en un SQLITE_BUSY a media transacción.
+_WRITE_LOCK = threading.Lock()
+
+
+@contextmanager
+def write_session(bulk: bool = False, bind: Engine | None = None) -> Iterator[Session]:
+    """Sesión de escritura serializada.
+
+    Con ``bulk=True`` la conexión usa ``synchronous=NORMAL`` mientras dura (en WAL solo
+    se sincroniza al hacer checkpoint); al salir se restaura ``FULL`` en esa misma conexión.
+    """
+    with _WRITE_LOCK, (bind or engine).connect() as conn:
+        if bulk:
+            conn.exec_driver_sql("PRAGMA synchronous=NORMAL")
+            conn.commit()  # cierra el autobegin para que la sesión controle sus propias transacciones
+        db = SessionLocal(bind=conn)
+        try:
+            yield db
+        finally:
+            db.close()
+            conn.rollback()
+            if bulk:
+                conn.exec_driver_sql("PRAGMA synchronous=FULL")
+                conn.commit()
 
 
 class Base(DeclarativeBase):
     pass
+
+
+# Índices que reemplazaron los compuestos por consulta de ruta (ver models.py): se borran
+# por nombre; cualquier otro índice que no declare el modelo (agregado a mano o por una
+# versión más nueva que comparte la base) se respeta.
+INDICES_REEMPLAZADOS = (
+    "ix_facturas_tipo_comprobante",
+    "ix_facturas_fecha_emision",
+    "ix_facturas_year_emision",
+    "ix_facturas_month_emision",
+    "ix_facturas_naturaleza",
+    "ix_facturas_titular_periodo",
+    "ix_facturas_titular_ppd_saldo",
+    "ix_pagos_fecha_pago",
+    "ix_pagos_year_pago",
+    "ix_pagos_month_pago",
+    "ix_pagos_titular_periodo",
+    "ix_pago_doc_titular_documento",
+    "ix_retenciones_plataforma_fecha_exp",
+    "ix_retenciones_plataforma_ejercicio",
+    "ix_retenciones_plataforma_mes_ini",
+    "ix_retenciones_plataforma_mes_fin",
+    "ix_ret_plat_titular_periodo",
+    "ix_declaraciones_pdf_year",
+    "ix_declaraciones_pdf_month",
+    "ix_decl_pdf_titular_periodo",
+)
+
+
+def sync_schema(metadata) -> None:
+    """Crea tablas faltantes y agrega columnas/índices nuevos a tablas existentes.
+
+    ``create_all`` no altera tablas que ya existen; aquí se emite ``ALTER TABLE ADD COLUMN``
+    para columnas nuevas (siempre nullable) y ``CREATE INDEX`` para índices faltantes.
+    Los índices de ``INDICES_REEMPLAZADOS`` se eliminan (quedan reemplazados por los
+    compuestos y solo encarecen las escrituras).
+    """
+    metadata.create_all(bind=engine)
+
+    insp = inspect(engine)
+    with engine.begin() as conn:
+        for table in metadata.sorted_tables:
+            if not insp.has_table(table.name):
+                continue
+            existing_cols = {c["name"] for c in insp.get_columns(table.name)}
+            for col in table.columns:
+                if col.name in existing_cols:
+                    continue
+                col_type = col.type.compile(dialect=engine.dialect)
+                conn.execute(text(f'ALTER TABLE "{table.name}" ADD COLUMN "{col.name}" {col_type}'))
+
+            existing_idx = {i["name"] for i in insp.get_indexes(table.name)}
+            declared_idx = {idx.name for idx in table.indexes}
+            for name in sorted((existing_idx - declared_idx).intersection(INDICES_REEMPLAZADOS)):
+                conn.execute(text(f'DROP INDEX IF EXISTS "{name}"'))
+            for idx in table.indexes:
+                if idx.name not in existing_idx:
+                    idx.create(bind=conn)
@@ -0,0 +1,263 @@
+"""Categorías de deducción de cada concepto según ClaveProdServ, UsoCFDI y FormaPago.
+
+Las reglas se evalúan en orden y gana la primera que aplica. Cada regla puede pedir
+prefijos de ``ClaveProdServ`` (segmento, familia, clase o producto del catálogo del
+SAT), usos de CFDI y formas de pago; lo que no pide no lo revisa:
+
+- ``IndiceReglas`` las compila una vez en un trie de prefijos de ClaveProdServ. Cada
+  nodo guarda, ya en orden, sus reglas y las de sus ancestros, así que clasificar es
+  bajar a lo más 8 dígitos y tomar la primera regla del nodo cuyo uso y forma de pago
+  coinciden. El resultado por (clave, uso, forma) se guarda en memoria: un periodo
+  tiene pocas combinaciones distintas aunque tenga miles de conceptos.
+- Al importar, cada concepto guarda su categoría (``Concepto.categoria_deduccion``).
+- ``reclasificar`` (tras cambiar las reglas) clasifica en Python solo las combinaciones
+  distintas y aplica el resultado con un ``UPDATE ... FROM`` sobre una tabla ``TEMP``.
+  Al arrancar la app, ``clasificar_pendientes`` hace lo mismo con los conceptos que
+  nunca se clasificaron (índice parcial ``ix_conceptos_sin_categoria``).
+
+La forma de pago es la del comprobante: en un PPD es ``99`` y la regla de combustible en
+efectivo no la detecta. Las reglas de ``DATA_DIR/reglas_deduccion.csv`` (columnas
+``categoria,clave_prod_serv,uso_cfdi,forma_pago``; varios valores separados por espacio)
+van antes de las de ``REGLAS``.
+
+Uso:
+    python deducciones.py reclasificar
+    python deducciones.py reglas
+"""
+
+from __future__ import annotations
+
+import argparse
+import csv
+import time
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Iterable, Optional
+
+from db import DATA_DIR, sync_schema, write_session
+from estado import bump_data_version
+from models import Base
+
+
+REGLAS_ARCHIVO = DATA_DIR / "reglas_deduccion.csv"
+SIN_CLASIFICAR = "sin_clasificar"
+
+# categoría -> (etiqueta, tratamiento); el tratamiento agrupa el desglose del resumen
+CATEGORIAS = {
+    "mercancias": ("Mercancías", "deducible"),
+    "devoluciones": ("Devoluciones, descuentos o bonificaciones", "deducible"),
+    "combustible": ("Combustibles", "deducible"),
+    "honorarios": ("Servicios profesionales", "deducible"),
+    "arrendamiento": ("Arrendamiento", "deducible"),
+    "telecomunicaciones": ("Telefonía e internet", "deducible"),
+    "viaticos": ("Viáticos y transporte", "deducible"),
+    "gastos_generales": ("Gastos en general", "deducible"),
+    "alimentos": ("Consumos en restaurantes", "parcial"),
+    "inversion": ("Inversiones (depreciación)", "inversion"),
+    "personal": ("Deducciones personales (anual)", "personal"),
+    "combustible_efectivo": ("Combustible pagado en efectivo", "no_deducible"),
+    "no_deducible": ("Sin efectos fiscales", "no_deducible"),
+    SIN_CLASIFICAR: ("Sin clasificar", None),
+}
+
+_USOS_INVERSION = ("I01", "I02", "I03", "I04", "I05", "I06", "I07", "I08")
+_USOS_PERSONALES = ("D01", "D02", "D03", "D04", "D05", "D06", "D07", "D08", "D09", "D10")
+
+
+class ReglasInvalidas(Exception):
+    """El archivo de reglas no tiene el encabezado o los valores esperados."""
+
+
+@dataclass(frozen=True)
+class Regla:
+    categoria: str
+    claves: tuple[str, ...] = ()  # prefijos de ClaveProdServ; vacío = cualquiera
+    usos: frozenset[str] = frozenset()  # UsoCFDI; vacío = cualquiera
+    formas: frozenset[str] = frozenset()  # FormaPago; vacío = cualquiera
+
+    def aplica(self, uso: str, forma: str) -> bool:
+        return (not self.usos or uso in self.usos) and (not self.formas or forma in self.formas)
+
+
+def _regla(categoria: str, claves: Iterable[str] = (), usos: Iterable[str] = (), formas: Iterable[str] = ()) -> Regla:
+    return Regla(categoria, tuple(claves), frozenset(u.upper() for u in usos), frozenset(formas))
+
+
+# Primera que aplica. El uso declara la intención del receptor, así que los usos sin
+# efectos, personales y de mercancía van antes que las claves de producto.
+REGLAS = (
+    _regla("no_deducible", usos=("S01", "CP01", "CN01")),
+    _regla("personal", usos=_USOS_PERSONALES),
+    _regla("devoluciones", usos=("G02",)),
+    _regla("mercancias", usos=("G01",)),
+    _regla("combustible_efectivo", claves=("151015",), formas=("01",)),  # LISR 27-III: solo medios electrónicos
+    _regla("combustible", claves=("151015",)),
+    _regla("inversion", usos=_USOS_INVERSION),
+    _regla("inversion", claves=("2510", "4320", "4321", "4322", "5610", "5611", "5612")),
+    _regla("telecomunicaciones", claves=("8311", "811121")),  # 811121: internet, antes que 8111
+    _regla("honorarios", claves=("8010", "8011", "8012", "8016", "8411", "8111")),
+    _regla("arrendamiento", claves=("8013",)),
+    _regla("viaticos", claves=("7811", "7812", "9011", "9012")),
+    _regla("alimentos", claves=("9010",)),
+    _regla("gastos_generales", usos=("G03",)),
+)
+
+
+class _Nodo:
+    __slots__ = ("hijos", "reglas")
+
+    def __init__(self) -> None:
+        self.hijos: dict[str, _Nodo] = {}
+        self.reglas: list[tuple[int, Regla]] = []
+
+
+class IndiceReglas:
+    """Reglas compiladas en un trie de prefijos de ClaveProdServ (ver el docstring del módulo)."""
+
+    def __init__(self, reglas: Iterable[Regla]):
+        self.reglas = list(reglas)
+        self._raiz = _Nodo()
+        for orden, regla in enumerate(self.reglas):
+            for prefijo in regla.claves or ("",):
+                nodo = self._raiz
+                for digito in prefijo:
+                    nodo = nodo.hijos.setdefault(digito, _Nodo())
+                nodo.reglas.append((orden, regla))
+        self._heredar(self._raiz, [])
+        self._cache: dict[tuple[str, str, str], str] = {}
+
+    def _heredar(self, nodo: _Nodo, heredadas: list[tuple[int, Regla]]) -> None:
+        nodo.reglas = sorted(heredadas + nodo.reglas, key=lambda x: x[0])
+        for hijo in nodo.hijos.values():
+            self._heredar(hijo, nodo.reglas)
+
+    def categoria(self, clave: Optional[str], uso: Optional[str], forma: Optional[str]) -> str:
+        llave = (clave or "", uso or "", forma or "")
+        cat = self._cache.get(llave)
+        if cat is None:
+            nodo = self._raiz
+            for digito in llave[0].strip():
+                siguiente = nodo.hijos.get(digito)
+                if siguiente is None:
+                    break
+                nodo = siguiente
+            uso_, forma_ = llave[1].strip().upper(), llave[2].strip()
+            cat = next((r.categoria for _, r in nodo.reglas if r.aplica(uso_, forma_)), SIN_CLASIFICAR)
+            self._cache[llave] = cat
+        return cat
+
+
+def leer_reglas(ruta=REGLAS_ARCHIVO) -> list[Regla]:
+    """Reglas del CSV de ``DATA_DIR`` (vacío si no existe)."""
+    if not ruta.exists():
+        return []
+    reglas = []
+    with open(ruta, encoding="utf-8-sig", newline="") as f:
+        lector = csv.DictReader(f)
+        faltan = {"categoria", "clave_prod_serv", "uso_cfdi", "forma_pago"} - set(lector.fieldnames or ())
+        if faltan:
+            raise ReglasInvalidas(f"{ruta.name}: faltan las columnas {', '.join(sorted(faltan))}")
+        for n, fila in enumerate(lector, start=2):
+            categoria = (fila["categoria"] or "").strip()
+            if not categoria or len(categoria) > 30:
+                raise ReglasInvalidas(f"{ruta.name}: renglón {n}: categoría vacía o de más de 30 caracteres")
+            reglas.append(
+                _regla(
+                    categoria,
+                    (fila["clave_prod_serv"] or "").split(),
+                    (fila["uso_cfdi"] or "").split(),
+                    (fila["forma_pago"] or "").split(),
+                )
+            )
+    return reglas
+
+
+@lru_cache(maxsize=1)
+def indice() -> IndiceReglas:
+    """Índice de las reglas vigentes, compilado la primera vez que se usa."""
+    return IndiceReglas([*leer_reglas(), *REGLAS])
+
+
+def clasificar(clave: Optional[str], uso: Optional[str], forma: Optional[str]) -> str:
+    return indice().categoria(clave, uso, forma)
+
+
+def etiqueta(categoria: Optional[str]) -> tuple[str, Optional[str]]:
+    """(etiqueta, tratamiento) de la categoría; las del archivo de reglas se muestran tal cual."""
+    return CATEGORIAS.get(categoria or SIN_CLASIFICAR, (categoria, None))
+
+
+# ---------------------------------------------------------------------------
+# Reclasificación
+# ---------------------------------------------------------------------------
+
+
+def reclasificar(todos: bool = True) -> tuple[int, int]:
+    """Clasifica los conceptos (todos o los que nunca se clasificaron) con las reglas vigentes.
+
+    Regresa (conceptos que cambiaron, combinaciones distintas clasificadas).
+    """
+    idx = indice()
+    pendiente = "" if todos else "conceptos.categoria_deduccion IS NULL"
+    with write_session(bulk=True) as db:
+        conn = db.connection()
+        combinaciones = conn.exec_driver_sql(
+            "SELECT DISTINCT coalesce(conceptos.clave_prod_serv, ''), coalesce(f.uso_cfdi, ''), "
+            "coalesce(f.forma_pago, '') FROM conceptos JOIN facturas f ON f.id = conceptos.factura_id "
+            + (f" WHERE {pendiente}" if pendiente else "")
+        ).all()
+        if not combinaciones:
+            return 0, 0
+        conn.exec_driver_sql("DROP TABLE IF EXISTS temp.categorias_deduccion")
+        conn.exec_driver_sql(
+            "CREATE TEMP TABLE categorias_deduccion (clave TEXT, uso TEXT, forma TEXT, categoria TEXT, "
+            "PRIMARY KEY (clave, uso, forma)) WITHOUT ROWID"
+        )
+        conn.exec_driver_sql(
+            "INSERT INTO temp.categorias_deduccion VALUES (?, ?, ?, ?)",
+            [(clave, uso, forma, idx.categoria(clave, uso, forma)) for clave, uso, forma in combinaciones],
+        )
+        cambiados = conn.exec_driver_sql(
+            "UPDATE conceptos SET categoria_deduccion = m.categoria "
+            "FROM facturas f, temp.categorias_deduccion m "
+            "WHERE f.id = conceptos.factura_id AND m.clave = coalesce(conceptos.clave_prod_serv, '') "
+            "AND m.uso = coalesce(f.uso_cfdi, '') AND m.forma = coalesce(f.forma_pago, '') "
+            "AND conceptos.categoria_deduccion IS NOT m.categoria" + (f" AND {pendiente}" if pendiente else "")
+        ).rowcount
+        conn.exec_driver_sql("DROP TABLE temp.categorias_deduccion")
+        if cambiados:
+            bump_data_version(db)
+        db.commit()
+    return cambiados, len(combinaciones)
+
+
+def clasificar_pendientes() -> int:
+    """Clasifica los conceptos sin categoría (base anterior a las reglas). Regresa cuántos."""
+    return reclasificar(todos=False)[0]
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="Categorías de deducción por ClaveProdServ, UsoCFDI y FormaPago.")
+    sub = ap.add_subparsers(dest="comando", required=True)
+    sub.add_parser("reclasificar", help="Vuelve a clasificar todos los conceptos con las reglas vigentes")
+    sub.add_parser("reglas", help="Muestra las reglas vigentes en orden de evaluación")
+    args = ap.parse_args()
+
+    if args.comando == "reglas":
+        for n, r in enumerate(indice().reglas, start=1):
+            condiciones = [
+                f"{nombre} {' '.join(sorted(valores))}"
+                for nombre, valores in (("clave", r.claves), ("uso", r.usos), ("forma", r.formas))
+                if valores
+            ]
+            print(f"{n:3d}. {r.categoria:<22} {'; '.join(condiciones) or '(todas)'}")
+        return
+
+    sync_schema(Base.metadata)
+    t0 = time.perf_counter()
+    cambiados, combinaciones = reclasificar()
+    print(f"{cambiados} conceptos reclasificados ({combinaciones} combinaciones) en {time.perf_counter() - t0:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""DIOT (Declaración Informativa de Operaciones con Terceros) en formato de carga masiva.
+
+``queries.diot_por_proveedor`` agrega en SQL los actos pagados a cada proveedor en el
+mes (gastos PUE por emisión y PPD por complemento de pago, notas de crédito restando);
+aquí solo se acomoda cada fila al layout de 24 campos separados por ``|`` y se envía
+por flujo con ``exportar.filas_csv``.
+
+Los importes van en pesos sin decimales (redondeados en la consulta). Un neto negativo
+(más notas de crédito que compras con un proveedor) se escribe tal cual para que se
+revise antes de presentar.
+"""
+
+from __future__ import annotations
+
+from typing import Optional
+
+from fastapi.responses import StreamingResponse
+from sqlalchemy import Row
+
+import exportar
+import queries
+
+
+# Layout de carga masiva (un renglón por tercero, sin encabezado)
+CAMPOS = [
+    "tipo_tercero",
+    "tipo_operacion",
+    "rfc",
+    "id_fiscal",
+    "nombre_extranjero",
+    "pais_residencia",
+    "nacionalidad",
+    "actos_16",
+    "actos_15",
+    "iva_no_acreditable_16",
+    "actos_11",
+    "actos_10",
+    "actos_8_frontera",
+    "iva_no_acreditable_11",
+    "iva_no_acreditable_8",
+    "importacion_16",
+    "iva_no_acreditable_importacion_16",
+    "importacion_11",
+    "iva_no_acreditable_importacion_11",
+    "importacion_exentos",
+    "actos_0",
+    "actos_exentos",
+    "iva_retenido",
+    "iva_devoluciones",
+]
+
+TERCERO_NACIONAL = "04"
+TERCERO_EXTRANJERO = "05"
+TERCERO_GLOBAL = "15"
+RFC_EXTRANJERO = "XEXX010101000"
+RFC_GLOBAL = "XAXX010101000"
+
+# 03 servicios profesionales, 06 arrendamiento de inmuebles, 85 otros
+TIPOS_OPERACION = ("03", "06", "85")
+
+
+def _pesos(valor: Optional[int]) -> str:
+    """Importe (ya redondeado en SQL); cero queda vacío."""
+    return str(valor) if valor else ""
+
+
+def renglon(fila: Row, tipo_operacion: str = "85") -> list[str]:
+    """Los 24 campos de un proveedor a partir de una fila de ``diot_por_proveedor``."""
+    campos = dict.fromkeys(CAMPOS, "")
+    rfc = (fila.rfc or "").upper()
+    if rfc == RFC_EXTRANJERO:
+        campos["tipo_tercero"] = TERCERO_EXTRANJERO
+        campos["nombre_extranjero"] = fila.nombre or ""
+    elif rfc == RFC_GLOBAL:
+        campos["tipo_tercero"] = TERCERO_GLOBAL
+    else:
+        campos["tipo_tercero"] = TERCERO_NACIONAL
+        campos["rfc"] = rfc
+    campos["tipo_operacion"] = tipo_operacion
+    campos["actos_16"] = _pesos(fila.base_16)
+    campos["actos_8_frontera"] = _pesos(fila.base_8)
+    campos["actos_0"] = _pesos(fila.base_0)
+    campos["actos_exentos"] = _pesos(fila.base_exento)
+    campos["iva_retenido"] = _pesos(fila.iva_retenido)
+    return [campos[c] for c in CAMPOS]
+
+
+def respuesta_diot(rfc: str, year: int, month: int, tipo_operacion: Optional[str] = None) -> StreamingResponse:
+    """Descarga ``DIOT_<rfc>_<año><mes>.txt`` generada por flujo."""
+    tipo_operacion = tipo_operacion if tipo_operacion in TIPOS_OPERACION else "85"
+    filas = exportar.filas_csv(
+        queries.diot_por_proveedor(rfc, year, month),
+        convertir=lambda fila: renglon(fila, tipo_operacion),
+        encabezado=False,
+        delimitador="|",
+        anios=(year,),
+    )
+    return StreamingResponse(
+        filas,
+        media_type="text/plain; charset=utf-8",
+        headers={"Content-Disposition": f"attachment; filename=DIOT_{rfc}_{year}{month:02d}.txt"},
+    )
@@ -0,0 +1,43 @@
+"""Estado interno persistido en la tabla ``parametros``."""
+
+from __future__ import annotations
+
+from typing import Optional
+
+from sqlalchemy import cast, Integer
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session
+
+from models import Parametro
+
+
+DATA_VERSION_KEY = "data_version"
+
+
+def get_parametro(db: Session, clave: str) -> Optional[str]:
+    p = db.get(Parametro, clave)
+    return p.valor if p else None
+
+
+def set_parametro(db: Session, clave: str, valor: Optional[str]) -> None:
+    db.merge(Parametro(clave=clave, valor=valor))
+
+
+def get_data_version(db: Session) -> int:
+    """Versión de los datos; cambia cada vez que se escriben facturas/retenciones."""
+    v = get_parametro(db, DATA_VERSION_KEY)
+    return int(v) if v else 0
+
+
+def bump_data_version(db: Session) -> None:
+    """Incrementa la versión de datos dentro de la transacción actual.
+
+    Cualquier resumen/rollup calculado con una versión anterior queda invalidado
+    al confirmar la transacción.
+    """
+    stmt = sqlite_insert(Parametro).values(clave=DATA_VERSION_KEY, valor="1")
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[Parametro.clave],
+        set_={"valor": cast(cast(Parametro.valor, Integer) + 1, Parametro.valor.type)},
+    )
+    db.execute(stmt)
@@ -0,0 +1,79 @@
+"""Exportaciones CSV por flujo (``/export/*.csv``).
+
+La consulta se recorre con ``yield_per`` sobre un cursor de SQLite (que entrega los
+renglones conforme avanza, sin cargarlos todos) y el CSV se envía por bloques, así
+que el primer byte sale de inmediato y la memoria no depende del rango exportado.
+"""
+
+from __future__ import annotations
+
+import csv
+import io
+import zlib
+from typing import Callable, Container, Iterable, Iterator, Optional, Sequence
+
+from fastapi.responses import StreamingResponse
+from sqlalchemy import Row, Select
+
+import archivo
+from db import ReadSessionLocal
+
+
+FILAS_POR_BLOQUE = 2000
+
+
+def filas_csv(
+    stmt: Select,
+    convertir: Optional[Callable[[Row], Sequence]] = None,
+    encabezado: bool = True,
+    delimitador: str = ",",
+    anios: Container[int] = (),
+) -> Iterator[bytes]:
+    """Encabezado (nombres de columna del ``select``) y renglones del CSV, por bloques.
+
+    ``convertir`` transforma cada renglón antes de escribirlo (p.ej. al layout de la
+    DIOT). La sesión de lectura vive mientras dura el generador: la abre el primer
+    bloque y se cierra al terminar o cuando el cliente corta la descarga. ``anios``:
+    ejercicios que abarca la consulta, por si alguno está en el archivo frío.
+    """
+    db = archivo.sesion_lectura(anios) if anios else ReadSessionLocal()
+    try:
+        result = db.execute(stmt.execution_options(yield_per=FILAS_POR_BLOQUE))
+        buf = io.StringIO()
+        w = csv.writer(buf, delimiter=delimitador)
+        if encabezado:
+            w.writerow(result.keys())
+        for bloque in result.partitions():
+            w.writerows(map(convertir, bloque) if convertir else bloque)
+            yield buf.getvalue().encode("utf-8")
+            buf.seek(0)
+            buf.truncate()
+        if buf.tell():
+            yield buf.getvalue().encode("utf-8")  # solo el encabezado: no hubo renglones
+    finally:
+        db.close()
+
+
+def gzip_stream(chunks: Iterable[bytes]) -> Iterator[bytes]:
+    """Comprime en formato gzip conforme llegan los bloques."""
+    z = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits=31: encabezado gzip
+    for chunk in chunks:
+        out = z.compress(chunk)
+        if out:
+            yield out
+    yield z.flush()
+
+
+def respuesta_csv(stmt: Select, nombre: str, gzip: bool = False, anios: Container[int] = ()) -> StreamingResponse:
+    """``StreamingResponse`` de descarga para ``stmt``; con ``gzip`` el archivo es ``.csv.gz``."""
+    if gzip:
+        return StreamingResponse(
+            gzip_stream(filas_csv(stmt, anios=anios)),
+            media_type="application/gzip",
+            headers={"Content-Disposition": f"attachment; filename={nombre}.csv.gz"},
+        )
+    return StreamingResponse(
+        filas_csv(stmt, anios=anios),
+        media_type="text/csv; charset=utf-8",
+        headers={"Content-Disposition": f"attachment; filename={nombre}.csv"},
+    )
@@ -0,0 +1,564 @@
+"""Escritura por lotes de CFDI y retenciones parseados."""
+
+from __future__ import annotations
+
+from typing import Optional
+
+from collections import defaultdict
+
+from sqlalchemy import case, delete, func, insert, or_, select, union, update
+from sqlalchemy.orm import Session, aliased
+
+import complementos  # noqa: F401  registra Nómina, Comercio Exterior, ...
+import contribuyentes
+from config import MI_RFC
+from db import Base
+from estado import bump_data_version, get_parametro, set_parametro
+from models import (
+    CfdiRelacionado,
+    Factura,
+    Concepto,
+    ImpuestoConcepto,
+    ImpuestoComprobante,
+    MetadataSAT,
+    Pago,
+    PagoDocumento,
+    RetencionPlataforma,
+    UuidArchivado,
+)
+from parser_xml import (
+    PARSER_VERSION,
+    detect_xml_kind,
+    parse_cfdi_40,
+    parse_retenciones_plataforma,
+    tablas_complemento,
+)
+from deducciones import clasificar
+from queries import sustituido
+from tipos_cambio import normalizar
+
+# Columna que liga las filas de un complemento con su documento
+_COLUMNA_PADRE = {"cfdi": "factura_id", "retenciones": "retencion_id"}
+
+
+def _create_factura_from_parsed(parsed: dict) -> Factura:
+    """Crea objeto Factura desde datos parseados de CFDI."""
+    factura = Factura(
+        titular_rfc=parsed.get("titular_rfc"),
+        uuid=parsed.get("uuid"),
+        version=parsed.get("version"),
+        tipo_comprobante=parsed.get("tipo_comprobante"),
+        fecha_emision=parsed.get("fecha_emision"),
+        year_emision=parsed.get("year_emision"),
+        month_emision=parsed.get("month_emision"),
+        naturaleza=parsed.get("naturaleza"),
+        emisor_rfc=parsed.get("emisor_rfc"),
+        emisor_id=parsed.get("emisor_id"),
+        receptor_rfc=parsed.get("receptor_rfc"),
+        receptor_id=parsed.get("receptor_id"),
+        uso_cfdi=parsed.get("uso_cfdi"),
+        moneda=parsed.get("moneda"),
+        tipo_cambio=parsed.get("tipo_cambio"),
+        metodo_pago=parsed.get("metodo_pago"),
+        forma_pago=parsed.get("forma_pago"),
+        subtotal=parsed.get("subtotal"),
+        descuento=parsed.get("descuento"),
+        total=parsed.get("total"),
+        total_trasladados=parsed.get("total_trasladados"),
+        total_retenidos=parsed.get("total_retenidos"),
+        parser_version=PARSER_VERSION,
+        xml_text=parsed.get("xml_text", ""),
+    )
+
+    # Agregar conceptos (con sus traslados/retenciones)
+    for c in parsed.get("conceptos", []):
+        concepto = Concepto(
+            clave_prod_serv=c.get("clave_prod_serv"),
+            cantidad=c.get("cantidad"),
+            clave_unidad=c.get("clave_unidad"),
+            descripcion=c.get("descripcion"),
+            valor_unitario=c.get("valor_unitario"),
+            importe=c.get("importe"),
+            objeto_imp=c.get("objeto_imp"),
+            categoria_deduccion=clasificar(c.get("clave_prod_serv"), parsed.get("uso_cfdi"), parsed.get("forma_pago")),
+        )
+        for i in c.get("impuestos", []):
+            concepto.impuestos.append(ImpuestoConcepto(factura=factura, **i))
+        factura.conceptos.append(concepto)
+
+    # Traslados/retenciones a nivel comprobante
+    for i in parsed.get("impuestos", []):
+        factura.impuestos.append(ImpuestoComprobante(**i))
+
+    # Agregar pagos (solo si tipo=P) con sus documentos relacionados
+    for p in parsed.get("pagos", []):
+        pago = Pago(
+            titular_rfc=parsed.get("titular_rfc"),
+            fecha_pago=p.get("fecha_pago"),
+            year_pago=p.get("year_pago"),
+            month_pago=p.get("month_pago"),
+            monto=p.get("monto"),
+            moneda_p=p.get("moneda_p"),
+            tipo_cambio_p=p.get("tipo_cambio_p"),
+            forma_pago_p=p.get("forma_pago_p"),
+        )
+        for d in p.get("documentos", []):
+            pago.documentos.append(PagoDocumento(factura=factura, titular_rfc=parsed.get("titular_rfc"), **d))
+        factura.pagos.append(pago)
+
+    # CfdiRelacionados: aristas hacia otros UUID (sustitución, notas de crédito, anticipos)
+    for r in parsed.get("relacionados", []):
+        factura.relacionados.append(CfdiRelacionado(titular_rfc=parsed.get("titular_rfc"), **r))
+
+    return factura
+
+
+def _create_retencion_from_parsed(parsed: dict) -> RetencionPlataforma:
+    """Crea objeto RetencionPlataforma desde datos parseados."""
+    return RetencionPlataforma(
+        titular_rfc=parsed.get("titular_rfc"),
+        uuid=parsed.get("uuid"),
+        version=parsed.get("version"),
+        fecha_exp=parsed.get("fecha_exp"),
+        ejercicio=parsed.get("ejercicio"),
+        mes_ini=parsed.get("mes_ini"),
+        mes_fin=parsed.get("mes_fin"),
+        emisor_rfc=parsed.get("emisor_rfc"),
+        emisor_id=parsed.get("emisor_id"),
+        receptor_rfc=parsed.get("receptor_rfc"),
+        receptor_id=parsed.get("receptor_id"),
+        monto_tot_operacion=parsed.get("monto_tot_operacion"),
+        monto_tot_grav=parsed.get("monto_tot_grav"),
+        monto_tot_exent=parsed.get("monto_tot_exent"),
+        monto_tot_ret=parsed.get("monto_tot_ret"),
+        periodicidad=parsed.get("periodicidad"),
+        num_serv=parsed.get("num_serv"),
+        mon_tot_serv_siva=parsed.get("mon_tot_serv_siva"),
+        total_iva_trasladado=parsed.get("total_iva_trasladado"),
+        total_iva_retenido=parsed.get("total_iva_retenido"),
+        total_isr_retenido=parsed.get("total_isr_retenido"),
+        dif_iva_entregado_prest_serv=parsed.get("dif_iva_entregado_prest_serv"),
+        mon_total_por_uso_plataforma=parsed.get("mon_total_por_uso_plataforma"),
+        parser_version=PARSER_VERSION,
+        xml_text=parsed.get("xml_text", ""),
+    )
+
+
+def _crear(kind: str, parsed: dict) -> Factura | RetencionPlataforma:
+    return _create_factura_from_parsed(parsed) if kind == "cfdi" else _create_retencion_from_parsed(parsed)
+
+
+def _saldo_uuids(parsed: dict) -> set[str]:
+    """UUIDs de facturas PPD cuyo saldo puede cambiar al escribir este CFDI."""
+    uuids = {d.get("id_documento") for p in parsed.get("pagos", []) for d in p.get("documentos", [])}
+    if (parsed.get("metodo_pago") or "").upper() == "PPD":
+        uuids.add(parsed.get("uuid"))
+    return {u for u in uuids if u}
+
+
+def actualizar_saldos_ppd(db: Session, titular_rfc: Optional[str], uuids: set[str]) -> None:
+    """Recalcula ``saldo_pagado``/``saldo_pendiente`` solo de las facturas PPD indicadas.
+
+    Un UPDATE por bloque de UUIDs con subconsulta correlacionada sobre el índice
+    (titular_rfc, id_documento) de pago_documento; no recorre el resto del archivo.
+    Los complementos de pago cancelados en el SAT o sustituidos (relación 04) no cuentan.
+    """
+    uuids = sorted(u for u in uuids if u)
+    complemento = aliased(Factura)
+    pagado = (
+        select(func.coalesce(func.sum(PagoDocumento.imp_pagado), 0))
+        .join(complemento, complemento.id == PagoDocumento.factura_id)
+        .where(
+            PagoDocumento.titular_rfc == Factura.titular_rfc,
+            PagoDocumento.id_documento == Factura.uuid,
+            complemento.fecha_cancelacion.is_(None),
+            ~sustituido(complemento),
+        )
+        .scalar_subquery()
+    )
+    for i in range(0, len(uuids), 500):
+        db.execute(
+            update(Factura)
+            .where(Factura.titular_rfc == titular_rfc, Factura.uuid.in_(uuids[i:i + 500]), Factura.metodo_pago == "PPD")
+            .values(saldo_pagado=pagado, saldo_pendiente=func.coalesce(Factura.total, 0) - pagado)
+            .execution_options(synchronize_session=False)
+        )
+
+
+def _actualizar_saldos_de(db: Session, parsed_list: list[dict]) -> None:
+    por_titular: dict[Optional[str], set[str]] = defaultdict(set)
+    for parsed in parsed_list:
+        por_titular[parsed.get("titular_rfc")] |= _saldo_uuids(parsed)
+    for titular_rfc, uuids in por_titular.items():
+        actualizar_saldos_ppd(db, titular_rfc, uuids)
+
+
+def aplicar_estatus_sat(db: Session, titular_rfc: Optional[str], factura_ids: Optional[list[int]] = None) -> int:
+    """Copia a ``facturas`` el estatus de ``metadata_sat`` en un solo ``UPDATE ... FROM``.
+
+    Solo escribe las filas cuyo estatus cambia (por ``uq_facturas_titular_uuid`` y la
+    llave primaria de metadata_sat); ``factura_ids`` lo acota a las recién insertadas.
+    Si se cancela (o se revierte) un complemento de pago, recalcula el saldo de las
+    facturas PPD que paga. Regresa cuántas facturas cambiaron; no hace commit.
+    """
+    m = MetadataSAT
+    cancelacion = case((m.estatus == "cancelado", func.coalesce(m.fecha_cancelacion, m.cargado_en)))
+    stmt = update(Factura).where(
+        Factura.titular_rfc == titular_rfc,
+        m.titular_rfc == Factura.titular_rfc,
+        m.uuid == Factura.uuid,
+        or_(Factura.estatus_sat.is_distinct_from(m.estatus), Factura.fecha_cancelacion.is_distinct_from(cancelacion)),
+    )
+    if factura_ids is not None:
+        if not factura_ids:
+            return 0
+        stmt = stmt.where(Factura.id.in_(factura_ids))
+    cambiadas = db.execute(
+        stmt.values(estatus_sat=m.estatus, fecha_cancelacion=cancelacion)
+        .returning(Factura.id, Factura.tipo_comprobante)
+        .execution_options(synchronize_session=False)
+    ).all()
+
+    pagos = [fid for fid, tipo in cambiadas if (tipo or "").upper() == "P"]
+    for i in range(0, len(pagos), 500):
+        uuids = set(
+            db.scalars(select(PagoDocumento.id_documento).where(PagoDocumento.factura_id.in_(pagos[i:i + 500])))
+        )
+        actualizar_saldos_ppd(db, titular_rfc, uuids)
+    return len(cambiadas)
+
+
+def migrar_uuids(db: Session) -> int:
+    """Pasa a mayúsculas los UUID guardados como los escribió el PAC (bases anteriores).
+
+    El parser ya los normaliza (``parser_xml._uuid``); aquí se corrigen una sola vez las
+    filas existentes (una marca por tabla en ``parametros``) y se vuelven a cruzar las
+    facturas con ``metadata_sat`` y los saldos PPD que dependían de ellas. Regresa cuántas
+    filas cambiaron; no hace commit.
+    """
+    cambiadas = 0
+    if not get_parametro(db, "uuids_mayusculas:facturas"):
+        # OR IGNORE: si ya existe el gemelo en mayúsculas (mismo CFDI de otro PAC) se deja como está
+        facturas = db.execute(
+            update(Factura)
+            .prefix_with("OR IGNORE")
+            .where(Factura.uuid != func.upper(func.trim(Factura.uuid)))
+            .values(uuid=func.upper(func.trim(Factura.uuid)))
+            .returning(Factura.titular_rfc, Factura.id, Factura.uuid)
+            .execution_options(synchronize_session=False)
+        ).all()
+        for modelo in (RetencionPlataforma, UuidArchivado):
+            cambiadas += db.execute(
+                update(modelo)
+                .prefix_with("OR IGNORE")
+                .where(modelo.uuid != func.upper(func.trim(modelo.uuid)))
+                .values(uuid=func.upper(func.trim(modelo.uuid)))
+                .execution_options(synchronize_session=False)
+            ).rowcount
+        por_titular_ids: dict[Optional[str], list[int]] = defaultdict(list)
+        por_titular_uuids: dict[Optional[str], set[str]] = defaultdict(set)
+        for titular_rfc, factura_id, uuid in facturas:
+            por_titular_ids[titular_rfc].append(factura_id)
+            por_titular_uuids[titular_rfc].add(uuid)
+        # ahora sí cruzan con metadata_sat (ya en mayúsculas) y con los complementos de pago
+        for titular_rfc, ids in por_titular_ids.items():
+            for i in range(0, len(ids), 500):
+                aplicar_estatus_sat(db, titular_rfc, ids[i:i + 500])
+            actualizar_saldos_ppd(db, titular_rfc, por_titular_uuids[titular_rfc])
+        set_parametro(db, "uuids_mayusculas:facturas", "1")
+        cambiadas += len(facturas)
+    if not get_parametro(db, "uuids_mayusculas:pago_documento"):
+        docs = db.execute(
+            update(PagoDocumento)
+            .where(PagoDocumento.id_documento != func.upper(func.trim(PagoDocumento.id_documento)))
+            .values(id_documento=func.upper(func.trim(PagoDocumento.id_documento)))
+            .returning(PagoDocumento.titular_rfc, PagoDocumento.id_documento)
+            .execution_options(synchronize_session=False)
+        ).all()
+        por_titular: dict[Optional[str], set[str]] = defaultdict(set)
+        for titular_rfc, uuid in docs:
+            por_titular[titular_rfc].add(uuid)
+        for titular_rfc, uuids in por_titular.items():
+            actualizar_saldos_ppd(db, titular_rfc, uuids)
+        set_parametro(db, "uuids_mayusculas:pago_documento", "1")
+        cambiadas += len(docs)
+    if not get_parametro(db, "uuids_mayusculas:cfdi_relacionados"):
+        rels = db.execute(
+            update(CfdiRelacionado)
+            .where(CfdiRelacionado.uuid_relacionado != func.upper(func.trim(CfdiRelacionado.uuid_relacionado)))
+            .values(uuid_relacionado=func.upper(func.trim(CfdiRelacionado.uuid_relacionado)))
+            .returning(CfdiRelacionado.titular_rfc, CfdiRelacionado.uuid_relacionado, CfdiRelacionado.tipo_relacion)
+            .execution_options(synchronize_session=False)
+        ).all()
+        # un complemento de pago que ahora sí aparece sustituido deja de abonar a sus facturas
+        sustituidos: dict[Optional[str], set[str]] = defaultdict(set)
+        for titular_rfc, uuid, tipo in rels:
+            if tipo == "04":
+                sustituidos[titular_rfc].add(uuid)
+        for titular_rfc, uuids in sustituidos.items():
+            uuids = sorted(uuids)
+            for i in range(0, len(uuids), 500):
+                pagadas = set(
+                    db.scalars(
+                        select(PagoDocumento.id_documento)
+                        .join(Factura, Factura.id == PagoDocumento.factura_id)
+                        .where(Factura.titular_rfc == titular_rfc, Factura.uuid.in_(uuids[i:i + 500]))
+                    )
+                )
+                actualizar_saldos_ppd(db, titular_rfc, pagadas)
+        set_parametro(db, "uuids_mayusculas:cfdi_relacionados", "1")
+        cambiadas += len(rels)
+    if cambiadas:
+        bump_data_version(db)
+    return cambiadas
+
+
+def insertar_complementos(db: Session, kind: str, parsed_by_id: dict[int, dict]) -> None:
+    """Inserta las filas de complementos (``parsed["complementos"]``) con un ``executemany`` por tabla."""
+    columna = _COLUMNA_PADRE[kind]
+    por_tabla: dict[str, list[dict]] = defaultdict(list)
+    for doc_id, parsed in parsed_by_id.items():
+        for tabla, filas in parsed.get("complementos", {}).items():
+            por_tabla[tabla].extend({columna: doc_id, **f} for f in filas)
+    for tabla, filas in por_tabla.items():
+        db.execute(insert(Base.metadata.tables[tabla]), filas)
+
+
+def reemplazar_complementos(db: Session, kind: str, parsed_by_id: dict[int, dict]) -> None:
+    """Borra las filas de complementos de los documentos indicados y las vuelve a insertar."""
+    if not parsed_by_id:
+        return
+    columna = _COLUMNA_PADRE[kind]
+    ids = list(parsed_by_id)
+    for tabla in tablas_complemento(kind):
+        t = Base.metadata.tables[tabla]
+        db.execute(delete(t).where(t.c[columna].in_(ids)))
+    insertar_complementos(db, kind, parsed_by_id)
+
+
+def replace_children(db: Session, parsed_by_id: dict[int, dict]) -> None:
+    """Reemplaza conceptos, impuestos, pagos, relacionados y complementos de facturas existentes con INSERT por lotes.
+
+    Usado al re-derivar desde ``xml_text``: borra los hijos actuales y los vuelve a
+    insertar con ``executemany`` (sin cargar objetos ORM), y recalcula los importes en MXN.
+    """
+    if not parsed_by_id:
+        return
+    ids = list(parsed_by_id)
+
+    db.execute(delete(PagoDocumento).where(PagoDocumento.factura_id.in_(ids)))
+    db.execute(delete(ImpuestoConcepto).where(ImpuestoConcepto.factura_id.in_(ids)))
+    db.execute(delete(ImpuestoComprobante).where(ImpuestoComprobante.factura_id.in_(ids)))
+    db.execute(delete(Concepto).where(Concepto.factura_id.in_(ids)))
+    db.execute(delete(Pago).where(Pago.factura_id.in_(ids)))
+    db.execute(delete(CfdiRelacionado).where(CfdiRelacionado.factura_id.in_(ids)))
+
+    concepto_rows: list[dict] = []
+    concepto_imps: list[list[dict]] = []
+    comprobante_imps: list[dict] = []
+    pago_rows: list[dict] = []
+    pago_docs: list[list[dict]] = []
+    relacionado_rows: list[dict] = []
+    for factura_id, parsed in parsed_by_id.items():
+        for c in parsed.get("conceptos", []):
+            row = {k: v for k, v in c.items() if k != "impuestos"}
+            row["categoria_deduccion"] = clasificar(c.get("clave_prod_serv"), parsed.get("uso_cfdi"), parsed.get("forma_pago"))
+            concepto_rows.append({"factura_id": factura_id, **row})
+            concepto_imps.append([{"factura_id": factura_id, **i} for i in c.get("impuestos", [])])
+        comprobante_imps.extend({"factura_id": factura_id, **i} for i in parsed.get("impuestos", []))
+        titular_rfc = parsed.get("titular_rfc")
+        for p in parsed.get("pagos", []):
+            row = {k: v for k, v in p.items() if k != "documentos"}
+            pago_rows.append({"factura_id": factura_id, "titular_rfc": titular_rfc, **row})
+            pago_docs.append(
+                [{"factura_id": factura_id, "titular_rfc": titular_rfc, **d} for d in p.get("documentos", [])]
+            )
+        relacionado_rows.extend(
+            {"factura_id": factura_id, "titular_rfc": titular_rfc, **r} for r in parsed.get("relacionados", [])
+        )
+
+    if concepto_rows:
+        concepto_ids = db.scalars(
+            insert(Concepto).returning(Concepto.id, sort_by_parameter_order=True), concepto_rows
+        ).all()
+        imp_rows = [
+            {"concepto_id": cid, **i} for cid, imps in zip(concepto_ids, concepto_imps) for i in imps
+        ]
+        if imp_rows:
+            db.execute(insert(ImpuestoConcepto), imp_rows)
+    if comprobante_imps:
+        db.execute(insert(ImpuestoComprobante), comprobante_imps)
+    if pago_rows:
+        pago_ids = db.scalars(insert(Pago).returning(Pago.id, sort_by_parameter_order=True), pago_rows).all()
+        doc_rows = [{"pago_id": pid, **d} for pid, docs in zip(pago_ids, pago_docs) for d in docs]
+        if doc_rows:
+            db.execute(insert(PagoDocumento), doc_rows)
+    if relacionado_rows:
+        db.execute(insert(CfdiRelacionado), relacionado_rows)
+
+    reemplazar_complementos(db, "cfdi", parsed_by_id)
+    normalizar(db, ids)
+    _actualizar_saldos_de(db, list(parsed_by_id.values()))
+
+
+class BulkWriter:
+    """Acumula XML parseados y los inserta por lotes.
+
+    Cada lote hace una sola consulta de duplicados por tabla (``uuid IN (...)``) y un
+    solo commit; el ORM agrupa los INSERT de facturas, conceptos e impuestos en
+    sentencias multi-renglón. Si el lote falla, se reintenta documento por documento
+    para aislar el XML problemático.
+
+    Todo lo escrito pertenece a ``titular_rfc`` (default: config.MI_RFC); la naturaleza
+    se clasifica contra ese RFC y los duplicados se buscan dentro del mismo titular.
+
+    ``stats`` conserva las llaves que usa el mensaje de ``/importar``; ``flush()``
+    regresa el resultado por documento (ref, kind, uuid, status, error) y
+    ``facturas_insertadas`` acumula los ids de las facturas que este writer insertó.
+    """
+
+    def __init__(self, db: Session, titular_rfc: Optional[str] = None, batch_size: int = 500):
+        self.db = db
+        self.titular_rfc = (titular_rfc or MI_RFC or "").upper()
+        self.batch_size = batch_size
+        self.stats = {
+            "cfdi_insertados": 0,
+            "cfdi_duplicados": 0,
+            "retenciones_insertadas": 0,
+            "retenciones_duplicadas": 0,
+            "errores": 0,
+        }
+        self._pending: list[tuple[str, dict, Optional[str]]] = []  # (kind, parsed, ref)
+        self._results: list[dict] = []
+        self.facturas_insertadas: list[int] = []
+
+    def add_xml(self, xml_bytes: bytes, ref: Optional[str] = None) -> None:
+        """Detecta el tipo de XML, lo parsea y lo encola para el siguiente lote."""
+        try:
+            kind = detect_xml_kind(xml_bytes)
+            if kind == "cfdi":
+                parsed = parse_cfdi_40(xml_bytes, self.titular_rfc)
+            elif kind == "retenciones":
+                parsed = parse_retenciones_plataforma(xml_bytes)
+            else:
+                self._error(ref, kind, None, "XML no reconocido")
+                return
+        except Exception as e:
+            self._error(ref, "unknown", None, str(e) or e.__class__.__name__)
+            return
+
+        parsed["xml_text"] = xml_bytes.decode("utf-8", errors="replace")
+        parsed["titular_rfc"] = self.titular_rfc
+        self._pending.append((kind, parsed, ref))
+        if len(self._pending) >= self.batch_size:
+            self.flush()
+
+    def flush(self) -> list[dict]:
+        """Inserta lo pendiente y regresa los resultados acumulados desde el último flush."""
+        if self._pending:
+            pending, self._pending = self._pending, []
+            self._write_batch(pending)
+        results, self._results = self._results, []
+        return results
+
+    # ------------------------------------------------------------------
+
+    def _error(self, ref: Optional[str], kind: str, uuid: Optional[str], error: str) -> None:
+        self.stats["errores"] += 1
+        self._results.append({"ref": ref, "kind": kind, "uuid": uuid, "status": "error", "error": error})
+
+    def _existing_uuids(self, model, uuids: set[str]) -> set[str]:
+        """UUIDs ya importados, en la base activa o en un ejercicio archivado (ver archivo.py)."""
+        if not uuids:
+            return set()
+        return set(
+            self.db.scalars(
+                union(
+                    select(model.uuid).where(model.titular_rfc == self.titular_rfc, model.uuid.in_(uuids)),
+                    select(UuidArchivado.uuid).where(
+                        UuidArchivado.titular_rfc == self.titular_rfc,
+                        UuidArchivado.tabla == model.__tablename__,
+                        UuidArchivado.uuid.in_(uuids),
+                    ),
+                )
+            ).all()
+        )
+
+    def _write_batch(self, pending: list[tuple[str, dict, Optional[str]]]) -> None:
+        existing = {
+            "cfdi": self._existing_uuids(Factura, {p["uuid"] for k, p, _ in pending if k == "cfdi" and p.get("uuid")}),
+            "retenciones": self._existing_uuids(
+                RetencionPlataforma, {p["uuid"] for k, p, _ in pending if k == "retenciones" and p.get("uuid")}
+            ),
+        }
+
+        to_insert: list[tuple[str, dict, Optional[str]]] = []
+        for kind, parsed, ref in pending:
+            uuid = parsed.get("uuid")
+            if uuid and uuid in existing[kind]:
+                self._count(kind, "duplicado")
+                self._results.append({"ref": ref, "kind": kind, "uuid": uuid, "status": "duplicado", "error": None})
+                continue
+            if uuid:
+                existing[kind].add(uuid)  # duplicados dentro del mismo lote
+            to_insert.append((kind, parsed, ref))
+
+        if not to_insert:
+            return
+
+        try:
+            # Emisores/receptores a id en una sola ida a la base por lote (solo los que no están en caché)
+            resueltos = contribuyentes.asignar_ids(self.db, [parsed for _, parsed, _ in to_insert])
+            objetos = [_crear(kind, parsed) for kind, parsed, _ in to_insert]
+            self.db.add_all(objetos)
+            self.db.flush()
+            for tipo in ("cfdi", "retenciones"):
+                insertar_complementos(
+                    self.db, tipo, {o.id: parsed for o, (kind, parsed, _) in zip(objetos, to_insert) if kind == tipo}
+                )
+            factura_ids = [o.id for o in objetos if isinstance(o, Factura)]
+            normalizar(self.db, factura_ids)
+            # Estatus de la metadata SAT ya cargada (antes de los saldos: un P cancelado no abona)
+            aplicar_estatus_sat(self.db, self.titular_rfc, factura_ids)
+            _actualizar_saldos_de(self.db, [parsed for kind, parsed, _ in to_insert if kind == "cfdi"])
+            bump_data_version(self.db)
+            self.db.commit()
+            contribuyentes.cache.recordar(resueltos)
+            self.facturas_insertadas.extend(factura_ids)
+            for kind, parsed, ref in to_insert:
+                self._inserted(kind, parsed, ref)
+            return
+        except Exception:
+            self.db.rollback()
+
+        # Reintento uno por uno para aislar errores
+        for kind, parsed, ref in to_insert:
+            try:
+                resueltos = contribuyentes.asignar_ids(self.db, [parsed])
+                objeto = _crear(kind, parsed)
+                self.db.add(objeto)
+                self.db.flush()
+                insertar_complementos(self.db, kind, {objeto.id: parsed})
+                if kind == "cfdi":
+                    normalizar(self.db, [objeto.id])
+                    aplicar_estatus_sat(self.db, self.titular_rfc, [objeto.id])
+                    _actualizar_saldos_de(self.db, [parsed])
+                bump_data_version(self.db)
+                self.db.commit()
+                contribuyentes.cache.recordar(resueltos)
+                if isinstance(objeto, Factura):
+                    self.facturas_insertadas.append(objeto.id)
+                self._inserted(kind, parsed, ref)
+            except Exception as e:
+                self.db.rollback()
+                self._error(ref, kind, parsed.get("uuid"), str(e) or e.__class__.__name__)
+
+    def _inserted(self, kind: str, parsed: dict, ref: Optional[str]) -> None:
+        self._count(kind, "insertado")
+        self._results.append({"ref": ref, "kind": kind, "uuid": parsed.get("uuid"), "status": "insertado", "error": None})
+
+    def _count(self, kind: str, status: str) -> None:
+        if kind == "cfdi":
+            self.stats["cfdi_insertados" if status == "insertado" else "cfdi_duplicados"] += 1
+        else:
+            self.stats["retenciones_insertadas" if status == "insertado" else "retenciones_duplicadas"] += 1
@@ -0,0 +1,176 @@
+"""Ingesta de CFDI por flujo (``POST /api/ingest``) para clientes máquina (ERP).
+
+El cuerpo se lee conforme llega y los documentos se escriben por lotes con
+``BulkWriter``; por cada documento se regresa una línea NDJSON con su resultado
+(``ref``, ``kind``, ``uuid``, ``status``, ``error``), agrupadas por lote y no necesariamente
+en el orden de envío, y al final una línea ``{"resumen": ...}``.
+En memoria solo hay un lote a la vez, sin importar cuántos documentos traiga la conexión.
+
+Formatos del cuerpo:
+
+- ``application/x-ndjson``: una línea JSON por documento, ``{"ref": "...", "xml": "<cfdi:...>"}``
+  o ``{"ref": "...", "xml_base64": "..."}``. ``ref`` es opcional (default: número de línea).
+- ``application/octet-stream``: cada documento precedido por su longitud en 4 bytes
+  (entero sin signo, big-endian).
+"""
+
+from __future__ import annotations
+
+import base64
+import binascii
+import json
+import time
+from typing import AsyncIterator, Optional
+
+from starlette.concurrency import run_in_threadpool
+
+from db import write_session
+from importer import BulkWriter
+from titulares import registrar_titular
+
+
+FORMATOS = {
+    "application/x-ndjson": "ndjson",
+    "application/jsonl": "ndjson",
+    "application/octet-stream": "prefijado",
+}
+
+LOTE = 500  # documentos por transacción
+ESPERA_MAX_S = 1.0  # un lote incompleto se escribe si el cliente tarda más que esto en completarlo
+MAX_DOCUMENTO = 20 * 1024 * 1024  # bytes por documento
+
+# (ref, xml, error): xml es None cuando el documento no se pudo extraer del flujo
+Documento = tuple[str, Optional[bytes], Optional[str]]
+
+
+def _doc_ndjson(linea: bytes, n: int) -> Optional[Documento]:
+    if not linea.strip():
+        return None
+    try:
+        obj = json.loads(linea)
+    except ValueError as e:
+        return f"línea {n}", None, f"JSON inválido: {e}"
+    if not isinstance(obj, dict):
+        return f"línea {n}", None, "Se esperaba un objeto JSON"
+    ref = str(obj.get("ref") or f"línea {n}")
+    if isinstance(obj.get("xml"), str):
+        return ref, obj["xml"].encode("utf-8"), None
+    if isinstance(obj.get("xml_base64"), str):
+        try:
+            return ref, base64.b64decode(obj["xml_base64"], validate=True), None
+        except (binascii.Error, ValueError):
+            return ref, None, "xml_base64 inválido"
+    return ref, None, "Falta el campo xml o xml_base64"
+
+
+async def leer_ndjson(chunks: AsyncIterator[bytes]) -> AsyncIterator[Documento]:
+    buf = bytearray()
+    n = 0
+    inicio = 0  # desde dónde buscar el siguiente salto de línea
+    descartando = False  # línea demasiado larga: se ignora hasta el siguiente salto
+    async for chunk in chunks:
+        buf += chunk
+        while (i := buf.find(b"\n", inicio)) >= 0:
+            linea = bytes(buf[:i])
+            del buf[: i + 1]
+            inicio = 0
+            n += 1
+            if descartando:
+                descartando = False
+                continue
+            if len(linea) > MAX_DOCUMENTO:
+                yield f"línea {n}", None, f"Documento mayor a {MAX_DOCUMENTO} bytes"
+                continue
+            doc = _doc_ndjson(linea, n)
+            if doc:
+                yield doc
+        inicio = len(buf)
+        if len(buf) > MAX_DOCUMENTO and not descartando:
+            descartando = True
+            yield f"línea {n + 1}", None, f"Documento mayor a {MAX_DOCUMENTO} bytes"
+        if descartando:
+            buf.clear()
+            inicio = 0
+    if buf and not descartando:
+        doc = _doc_ndjson(bytes(buf), n + 1)
+        if doc:
+            yield doc
+
+
+async def leer_prefijado(chunks: AsyncIterator[bytes]) -> AsyncIterator[Documento]:
+    buf = bytearray()
+    n = 0
+    async for chunk in chunks:
+        buf += chunk
+        while len(buf) >= 4:
+            largo = int.from_bytes(buf[:4], "big")
+            if largo > MAX_DOCUMENTO:
+                # Sin un delimitador no hay forma de resincronizar el flujo
+                yield f"doc {n + 1}", None, f"Documento mayor a {MAX_DOCUMENTO} bytes; se detiene la lectura"
+                return
+            if len(buf) < 4 + largo:
+                break
+            n += 1
+            yield f"doc {n}", bytes(buf[4 : 4 + largo]), None
+            del buf[: 4 + largo]
+    if buf:
+        yield f"doc {n + 1}", None, "Flujo truncado: faltan bytes del último documento"
+
+
+def escribir_lote(titular_rfc: str, docs: list[tuple[str, bytes]]) -> tuple[list[dict], dict]:
+    """Parsea e inserta un lote en una transacción. Regresa (resultados, stats)."""
+    with write_session(bulk=True) as db:
+        registrar_titular(db, titular_rfc)
+        db.commit()
+        writer = BulkWriter(db, titular_rfc=titular_rfc, batch_size=len(docs) + 1)
+        for ref, xml in docs:
+            writer.add_xml(xml, ref=ref)
+        return writer.flush(), writer.stats
+
+
+def _linea(obj: dict) -> bytes:
+    return json.dumps(obj, ensure_ascii=False).encode("utf-8") + b"\n"
+
+
+async def procesar(
+    chunks: AsyncIterator[bytes], formato: str, titular_rfc: str, solo_errores: bool = False
+) -> AsyncIterator[bytes]:
+    """Lee documentos del flujo, los escribe por lotes y genera las líneas de respuesta."""
+    lector = leer_ndjson(chunks) if formato == "ndjson" else leer_prefijado(chunks)
+    total = {
+        "documentos": 0,
+        "cfdi_insertados": 0,
+        "cfdi_duplicados": 0,
+        "retenciones_insertadas": 0,
+        "retenciones_duplicadas": 0,
+        "errores": 0,
+    }
+    lote: list[tuple[str, bytes]] = []
+    desde = 0.0  # llegada del primer documento del lote
+
+    async def escribir() -> AsyncIterator[bytes]:
+        resultados, stats = await run_in_threadpool(escribir_lote, titular_rfc, lote)
+        for k, v in stats.items():
+            total[k] += v
+        for r in resultados:
+            if not solo_errores or r["status"] == "error":
+                yield _linea(r)
+
+    async for ref, xml, error in lector:
+        total["documentos"] += 1
+        if error:
+            total["errores"] += 1
+            yield _linea({"ref": ref, "kind": None, "uuid": None, "status": "error", "error": error})
+            continue
+        if not lote:
+            desde = time.monotonic()
+        lote.append((ref, xml))
+        if len(lote) >= LOTE or time.monotonic() - desde >= ESPERA_MAX_S:
+            async for linea in escribir():
+                yield linea
+            lote = []
+
+    if lote:
+        async for linea in escribir():
+            yield linea
+    yield _linea({"resumen": total})
@@ -0,0 +1,263 @@
+"""Importaciones de XML en segundo plano.
+
+``/importar`` solo recibe los archivos: los copia a ``DATA_DIR/importaciones/<id>/``,
+registra un ``ImportJob`` y encola su id. Un worker (hilo) lo procesa por lotes con
+``BulkWriter``; cada lote es una transacción propia que también actualiza el avance
+del trabajo y guarda el resultado de cada archivo (``ImportJobArchivo``), así que el
+avance se puede consultar mientras corre y los errores quedan después de terminar.
+
+La cola es acotada (``COLA_MAX``): si está llena, ``crear_trabajo`` lanza
+``ColaLlena`` antes de copiar nada y la ruta responde 503.
+
+Al arrancar, los trabajos que quedaron ``en_cola`` o ``procesando`` se vuelven a encolar
+desde su carpeta; reprocesar es seguro porque los duplicados se omiten por UUID.
+
+Al terminar un trabajo, los ids de los CFDI que insertó pasan a la cola del verificador:
+un hilo aparte que revisa sello y timbre en un pool de procesos (``sellos.verificar``),
+así que el worker sigue con el siguiente trabajo sin esperar las firmas RSA. Lo que quede
+pendiente (p.ej. tras un reinicio) lo retoma ``python sellos.py verificar``.
+"""
+
+from __future__ import annotations
+
+import json
+import multiprocessing
+import queue
+import shutil
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from pathlib import Path
+from typing import BinaryIO, Iterable, Optional
+
+from sqlalchemy import delete, insert, select, update
+
+import sellos
+from db import DATA_DIR, ReadSessionLocal, write_session
+from importer import BulkWriter
+from models import ImportJob, ImportJobArchivo
+from titulares import registrar_titular
+
+
+SPOOL_DIR = DATA_DIR / "importaciones"
+
+COLA_MAX = 4  # trabajos en espera (sin contar los que ya se procesan)
+WORKERS = 1  # SQLite admite un escritor a la vez; más workers solo esperarían el candado
+LOTE = 500  # archivos por transacción / actualización de avance
+
+ESTADOS_FINALES = ("terminado", "fallido")
+
+_CONTADORES = ("cfdi_insertados", "cfdi_duplicados", "retenciones_insertadas", "retenciones_duplicadas", "errores")
+
+_cola: "queue.Queue[int]" = queue.Queue(maxsize=COLA_MAX)
+_workers: list[threading.Thread] = []
+_pool_sellos: Optional[ProcessPoolExecutor] = None
+# (titular, ids de facturas insertadas) por verificar; sin límite: cada entrada es una lista de ids
+_cola_sellos: "queue.SimpleQueue[tuple[str, list[int]]]" = queue.SimpleQueue()
+
+
+class ColaLlena(Exception):
+    """La cola de importaciones está llena; reintentar más tarde."""
+
+
+def _carpeta(job_id: int) -> Path:
+    return SPOOL_DIR / str(job_id)
+
+
+def crear_trabajo(titular_rfc: str, archivos: Iterable[tuple[Optional[str], BinaryIO]]) -> int:
+    """Copia los archivos (nombre, archivo abierto) a disco y encola el trabajo. Regresa su id.
+
+    Corre en el threadpool: la copia es síncrona.
+    """
+    if _cola.full():
+        raise ColaLlena()
+
+    with write_session() as db:
+        job = ImportJob(titular_rfc=titular_rfc, estado="recibiendo")
+        db.add(job)
+        db.commit()
+        job_id = job.id
+
+    carpeta = _carpeta(job_id)
+    carpeta.mkdir(parents=True, exist_ok=True)
+    nombres: list[Optional[str]] = []
+    for i, (nombre, origen) in enumerate(archivos):
+        with open(carpeta / f"{i:06d}.xml", "wb") as destino:
+            shutil.copyfileobj(origen, destino)
+        nombres.append(nombre)
+    (carpeta / "nombres.json").write_text(json.dumps(nombres, ensure_ascii=False), encoding="utf-8")
+
+    with write_session() as db:
+        db.execute(
+            update(ImportJob).where(ImportJob.id == job_id).values(estado="en_cola", total_archivos=len(nombres))
+        )
+        db.commit()
+
+    try:
+        _cola.put_nowait(job_id)
+    except queue.Full:
+        _finalizar(job_id, "fallido", "Cola de importación llena; vuelve a subir los archivos.")
+        raise ColaLlena() from None
+    return job_id
+
+
+def procesar_trabajo(job_id: int) -> None:
+    """Importa los archivos del trabajo por lotes, actualizando su avance tras cada lote."""
+    carpeta = _carpeta(job_id)
+    nombres = json.loads((carpeta / "nombres.json").read_text(encoding="utf-8"))
+
+    with write_session() as db:
+        job = db.get(ImportJob, job_id)
+        titular_rfc = job.titular_rfc
+        # Si se reanuda tras un reinicio se empieza de cero; lo ya insertado sale como duplicado
+        db.execute(delete(ImportJobArchivo).where(ImportJobArchivo.job_id == job_id))
+        job.estado = "procesando"
+        job.started_at = datetime.utcnow()
+        job.procesados = 0
+        for campo in _CONTADORES:
+            setattr(job, campo, 0)
+        registrar_titular(db, titular_rfc)
+        db.commit()
+
+    insertadas: list[int] = []
+
+    for inicio in range(0, len(nombres), LOTE):
+        fin = min(inicio + LOTE, len(nombres))
+        with write_session(bulk=True) as db:
+            writer = BulkWriter(db, titular_rfc=titular_rfc, batch_size=LOTE)
+            for i in range(inicio, fin):
+                writer.add_xml((carpeta / f"{i:06d}.xml").read_bytes(), ref=nombres[i])
+            resultados = writer.flush()
+            insertadas.extend(writer.facturas_insertadas)
+
+            if resultados:
+                db.execute(insert(ImportJobArchivo), [{"job_id": job_id, **r} for r in resultados])
+            db.execute(
+                update(ImportJob)
+                .where(ImportJob.id == job_id)
+                .values(
+                    procesados=ImportJob.procesados + (fin - inicio),
+                    **{c: getattr(ImportJob, c) + writer.stats[c] for c in _CONTADORES},
+                )
+            )
+            db.commit()
+
+    _finalizar(job_id, "terminado")
+    shutil.rmtree(carpeta, ignore_errors=True)
+    if insertadas:
+        _cola_sellos.put((titular_rfc, insertadas))
+
+
+def _verificar_sellos(titular_rfc: str, ids: list[int]) -> None:
+    """Verifica sello y timbre de los CFDI ``ids`` (los que insertó un trabajo).
+
+    Solo esos: los que ``/api/ingest`` inserta mientras tanto no entran. El pool usa
+    ``spawn``: los workers no heredan hilos ni conexiones de la app. Si algo falla, los
+    CFDI quedan pendientes (``sello_estatus`` NULL) y el trabajo sigue terminado.
+    """
+    global _pool_sellos
+    try:
+        if _pool_sellos is None:
+            _pool_sellos = ProcessPoolExecutor(
+                max_workers=sellos.WORKERS, mp_context=multiprocessing.get_context("spawn")
+            )
+        sellos.verificar(titular_rfc, ids=ids, pool=_pool_sellos)
+    except Exception:
+        if _pool_sellos is not None:
+            _pool_sellos.shutdown(wait=False, cancel_futures=True)
+        _pool_sellos = None  # se vuelve a crear en el siguiente trabajo
+
+
+def _finalizar(job_id: int, estado: str, mensaje: Optional[str] = None) -> None:
+    with write_session() as db:
+        db.execute(
+            update(ImportJob)
+            .where(ImportJob.id == job_id)
+            .values(estado=estado, mensaje=mensaje, finished_at=datetime.utcnow())
+        )
+        db.commit()
+
+
+def _worker() -> None:
+    while True:
+        job_id = _cola.get()
+        try:
+            procesar_trabajo(job_id)
+        except Exception as e:
+            _finalizar(job_id, "fallido", str(e) or e.__class__.__name__)
+            shutil.rmtree(_carpeta(job_id), ignore_errors=True)
+        finally:
+            _cola.task_done()
+
+
+def _verificador() -> None:
+    while True:
+        titular_rfc, ids = _cola_sellos.get()
+        _verificar_sellos(titular_rfc, ids)
+
+
+def _reencolar(ids: list[int]) -> None:
+    for job_id in ids:
+        _cola.put(job_id)  # bloquea mientras la cola esté llena
+
+
+def iniciar() -> None:
+    """Arranca los workers y reanuda los trabajos interrumpidos. Idempotente."""
+    if _workers:
+        return
+
+    with write_session() as db:
+        pendientes = []
+        for job in db.scalars(
+            select(ImportJob).where(ImportJob.estado.in_(("recibiendo", "en_cola", "procesando"))).order_by(ImportJob.id)
+        ):
+            if job.estado == "recibiendo" or not (_carpeta(job.id) / "nombres.json").exists():
+                job.estado = "fallido"
+                job.mensaje = "Interrumpida por un reinicio antes de recibir todos los archivos."
+                job.finished_at = datetime.utcnow()
+            else:
+                job.estado = "en_cola"
+                pendientes.append(job.id)
+        db.commit()
+
+    for n in range(WORKERS):
+        t = threading.Thread(target=_worker, name=f"importador-{n}", daemon=True)
+        t.start()
+        _workers.append(t)
+    t = threading.Thread(target=_verificador, name="verificador-sellos", daemon=True)
+    t.start()
+    _workers.append(t)
+    if pendientes:
+        threading.Thread(target=_reencolar, args=(pendientes,), name="importador-reanudar", daemon=True).start()
+
+
+def progreso(job: ImportJob) -> dict:
+    """Avance de un trabajo para ``progreso.json`` y los eventos SSE."""
+    ref = job.finished_at or datetime.utcnow()
+    segundos = (ref - job.started_at).total_seconds() if job.started_at else 0.0
+    return {
+        "id": job.id,
+        "titular_rfc": job.titular_rfc,
+        "estado": job.estado,
+        "terminado": job.estado in ESTADOS_FINALES,
+        "mensaje": job.mensaje,
+        "total_archivos": job.total_archivos,
+        "procesados": job.procesados,
+        "porcentaje": round(100 * job.procesados / job.total_archivos, 1) if job.total_archivos else 0.0,
+        **{c: getattr(job, c) for c in _CONTADORES},
+        "segundos": round(segundos, 1),
+        "archivos_por_segundo": round(job.procesados / segundos, 1) if segundos > 0 else None,
+        "en_cola": _cola.qsize(),
+        "created_at": job.created_at,
+        "started_at": job.started_at,
+        "finished_at": job.finished_at,
+    }
+
+
+def leer_progreso(job_id: int) -> Optional[dict]:
+    db = ReadSessionLocal()
+    try:
+        job = db.get(ImportJob, job_id)
+        return progreso(job) if job else None
+    finally:
+        db.close()
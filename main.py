@@ -2,22 +2,44 @@
 
 from __future__ import annotations
 
+import asyncio
 import re
+import time
 from pathlib import Path
 from typing import Optional
-from datetime import datetime
+from urllib.parse import urlsplit
+from datetime import date, datetime
+from decimal import Decimal
 
-from fastapi import FastAPI, Request, UploadFile, File
-from fastapi.responses import HTMLResponse, RedirectResponse, Response
+from fastapi import FastAPI, Request, UploadFile, File, Form
+from fastapi.responses import HTMLResponse, RedirectResponse, Response, StreamingResponse
 from fastapi.templating import Jinja2Templates
+from starlette.concurrency import run_in_threadpool
 
-from sqlalchemy import select, desc, and_
 from sqlalchemy.orm import Session
 
-from db import engine, SessionLocal, PDF_DIR
-from models import Base, Factura, Concepto, Pago, RetencionPlataforma, DeclaracionPDF
-from parser_xml import detect_xml_kind, parse_cfdi_40, parse_retenciones_plataforma
+from db import ReadSessionLocal, PDF_DIR, engine, sync_schema, write_session
+from models import Base, Factura, RetencionPlataforma, DeclaracionPDF, ImportJob
+from periodos import Periodo, calc_income_and_iva_sources
+import archivo
+import busqueda
+import complementos  # noqa: F401  registra Nómina, Comercio Exterior, ...
+import contabilidad
+import contribuyentes
+import deducciones
+import diot
+import exportar
+import ingest
+import jobs
+import metadata_sat
+import periodos
+import queries
+import tipos_cambio
+from importer import migrar_uuids
+from reclasificar import reclasificar_naturaleza
+from titulares import listar_titulares, registrar_titular, sincronizar_titular_default
 from parser_pdf import extract_pdf_text, parse_sat_declaracion_summary
+from parser_xml import tablas_complemento
 from config import MI_RFC
 from utils import (
     sha256_bytes,
@@ -25,7 +47,9 @@ from utils import (
     json_default_encoder,
     format_money,
     serialize_to_json,
-    apply_sign_factor,
+    is_valid_rfc,
+    parse_iso_datetime,
+    extract_period_parts,
 )
 
 # Configuración base de FastAPI
@@ -41,207 +65,269 @@ templates.env.filters["money"] = format_money
 @app.on_event("startup")
 def on_startup() -> None:
     """Inicializa la base de datos al arrancar la aplicación."""
-    Base.metadata.create_all(bind=engine)
+    sync_schema(Base.metadata)
+    # Índices de búsqueda (FTS5); la primera vez indexa lo que ya hay en la base
+    busqueda.crear_indices_fts(engine)
+    # Bases anteriores: nombres de emisor/receptor por fila -> tabla contribuyentes
+    contribuyentes.migrar(engine)
+    # UUID en mayúsculas en bases anteriores (el parser ya los normaliza)
+    with write_session() as db:
+        migrar_uuids(db)
+        db.commit()
+    # Importes en MXN de lo que espera tipo de cambio (con una base anterior, de todo)
+    tipos_cambio.normalizar_pendientes()
+    # Categoría de deducción de los conceptos importados antes de las reglas
+    deducciones.clasificar_pendientes()
+
+    # Asigna filas sin titular a MI_RFC y, si cambió MI_RFC, reclasifica sin re-importar
+    with write_session() as db:
+        sincronizar_titular_default(db)
+        db.commit()
+
+    # Workers de importación en segundo plano; reanuda las que quedaron a medias
+    jobs.iniciar()
+
+
+def get_db(*years: Optional[int]) -> Session:
+    """Sesión de solo lectura para las vistas (GET); las escrituras usan ``write_session``.
+
+    Con ``years`` (los del periodo que se muestra), si alguno está en el archivo frío la
+    sesión también lo lee (ver archivo.py); sin años solo se lee la base activa.
+    """
+    years = tuple(y for y in years if y is not None)
+    return archivo.sesion_lectura(years) if years else ReadSessionLocal()
+
+
+TITULAR_COOKIE = "titular"
 
 
-def get_db() -> Session:
-    """Factory para obtener sesión de base de datos."""
-    return SessionLocal()
+def _titular(request: Request) -> str:
+    """RFC titular activo: ``?rfc=`` > cookie > config.MI_RFC."""
+    rfc = request.query_params.get("rfc") or request.cookies.get(TITULAR_COOKIE) or MI_RFC
+    return (rfc or "").strip().upper()
 
 
 @app.get("/", response_class=HTMLResponse)
 def home(request: Request, msg: Optional[str] = None) -> HTMLResponse:
     """Página de inicio de la aplicación."""
+    db = get_db()
+    try:
+        titulares = listar_titulares(db)
+    finally:
+        db.close()
     return templates.TemplateResponse(
         "index.html",
-        {"request": request, "mi_rfc": MI_RFC, "msg": msg},
+        {"request": request, "mi_rfc": _titular(request), "titulares": titulares, "msg": msg},
     )
 
 
-# ============================================================================
-# Funciones auxiliares internas
-# ============================================================================
-
-
-def _create_factura_from_parsed(parsed: dict) -> Factura:
-    """Crea objeto Factura desde datos parseados de CFDI."""
-    factura = Factura(
-        uuid=parsed.get("uuid"),
-        version=parsed.get("version"),
-        tipo_comprobante=parsed.get("tipo_comprobante"),
-        fecha_emision=parsed.get("fecha_emision"),
-        year_emision=parsed.get("year_emision"),
-        month_emision=parsed.get("month_emision"),
-        naturaleza=parsed.get("naturaleza"),
-        emisor_rfc=parsed.get("emisor_rfc"),
-        emisor_nombre=parsed.get("emisor_nombre"),
-        receptor_rfc=parsed.get("receptor_rfc"),
-        receptor_nombre=parsed.get("receptor_nombre"),
-        uso_cfdi=parsed.get("uso_cfdi"),
-        moneda=parsed.get("moneda"),
-        metodo_pago=parsed.get("metodo_pago"),
-        forma_pago=parsed.get("forma_pago"),
-        subtotal=parsed.get("subtotal"),
-        descuento=parsed.get("descuento"),
-        total=parsed.get("total"),
-        total_trasladados=parsed.get("total_trasladados"),
-        total_retenidos=parsed.get("total_retenidos"),
-        xml_text=parsed.get("xml_text", ""),
-    )
-    
-    # Agregar conceptos
-    for c in parsed.get("conceptos", []):
-        factura.conceptos.append(
-            Concepto(
-                clave_prod_serv=c.get("clave_prod_serv"),
-                cantidad=c.get("cantidad"),
-                clave_unidad=c.get("clave_unidad"),
-                descripcion=c.get("descripcion"),
-                valor_unitario=c.get("valor_unitario"),
-                importe=c.get("importe"),
-                objeto_imp=c.get("objeto_imp"),
+@app.get("/titular")
+def seleccionar_titular(rfc: str, next: str = "/") -> RedirectResponse:
+    """Cambia el RFC titular activo (cookie) y regresa a ``next`` (solo rutas de esta app)."""
+    # "//host", "/\\host" y "/<tab>/host" (el navegador quita tabs y saltos) llevan a otro sitio
+    destino = urlsplit(next)
+    if (
+        not next.startswith("/")
+        or next.startswith(("//", "/\\"))
+        or destino.scheme
+        or destino.netloc
+        or any(c < " " for c in next)
+    ):
+        next = "/"
+    resp = RedirectResponse(url=next, status_code=303)
+    resp.set_cookie(TITULAR_COOKIE, rfc.strip().upper(), samesite="lax")
+    return resp
+
+
+@app.post("/titulares")
+def alta_titular(rfc: str = Form(...), nombre: Optional[str] = Form(None)) -> RedirectResponse:
+    """Registra un nuevo titular (contribuyente) y lo deja activo."""
+    rfc = rfc.strip().upper()
+    if not is_valid_rfc(rfc):
+        return RedirectResponse(url=f"/?msg=RFC inválido: {rfc}", status_code=303)
+    with write_session() as db:
+        registrar_titular(db, rfc, nombre)
+        db.commit()
+    resp = RedirectResponse(url=f"/?msg=Titular {rfc} registrado.", status_code=303)
+    resp.set_cookie(TITULAR_COOKIE, rfc, samesite="lax")
+    return resp
+
+
+# Starlette limita un formulario a 1000 archivos; una carpeta de un año de CFDI puede traer más
+MAX_ARCHIVOS_IMPORTACION = 20000
+
+
+@app.post("/importar")
+async def importar(request: Request):
+    """Recibe archivos XML (CFDI y retenciones de plataforma) y los encola como importación.
+
+    El formulario se lee aquí (campo ``files``) para subir el límite de archivos. Los
+    archivos se copian a disco y un worker los importa en segundo plano (ver jobs.py);
+    la respuesta redirige a la página de avance. Si la cola está llena responde 503.
+    """
+    async with request.form(max_files=MAX_ARCHIVOS_IMPORTACION) as form:
+        files = [f for f in form.getlist("files") if not isinstance(f, str)]
+        try:
+            job_id = await run_in_threadpool(
+                jobs.crear_trabajo, _titular(request), [(f.filename, f.file) for f in files]
             )
-        )
-    
-    # Agregar pagos (solo si tipo=P)
-    for p in parsed.get("pagos", []):
-        factura.pagos.append(
-            Pago(
-                fecha_pago=p.get("fecha_pago"),
-                year_pago=p.get("year_pago"),
-                month_pago=p.get("month_pago"),
-                monto=p.get("monto"),
-                moneda_p=p.get("moneda_p"),
-                forma_pago_p=p.get("forma_pago_p"),
+        except jobs.ColaLlena:
+            return Response(
+                content="Hay demasiadas importaciones en cola; intenta de nuevo en unos minutos.",
+                status_code=503,
+                headers={"Retry-After": "30"},
             )
-        )
-    
-    return factura
-
-
-def _create_retencion_from_parsed(parsed: dict) -> RetencionPlataforma:
-    """Crea objeto RetencionPlataforma desde datos parseados."""
-    return RetencionPlataforma(
-        uuid=parsed.get("uuid"),
-        version=parsed.get("version"),
-        fecha_exp=parsed.get("fecha_exp"),
-        ejercicio=parsed.get("ejercicio"),
-        mes_ini=parsed.get("mes_ini"),
-        mes_fin=parsed.get("mes_fin"),
-        emisor_rfc=parsed.get("emisor_rfc"),
-        emisor_nombre=parsed.get("emisor_nombre"),
-        receptor_rfc=parsed.get("receptor_rfc"),
-        receptor_nombre=parsed.get("receptor_nombre"),
-        monto_tot_operacion=parsed.get("monto_tot_operacion"),
-        monto_tot_grav=parsed.get("monto_tot_grav"),
-        monto_tot_exent=parsed.get("monto_tot_exent"),
-        monto_tot_ret=parsed.get("monto_tot_ret"),
-        periodicidad=parsed.get("periodicidad"),
-        num_serv=parsed.get("num_serv"),
-        mon_tot_serv_siva=parsed.get("mon_tot_serv_siva"),
-        total_iva_trasladado=parsed.get("total_iva_trasladado"),
-        total_iva_retenido=parsed.get("total_iva_retenido"),
-        total_isr_retenido=parsed.get("total_isr_retenido"),
-        dif_iva_entregado_prest_serv=parsed.get("dif_iva_entregado_prest_serv"),
-        mon_total_por_uso_plataforma=parsed.get("mon_total_por_uso_plataforma"),
-        xml_text=parsed.get("xml_text", ""),
-    )
+    return RedirectResponse(url=f"/importaciones/{job_id}", status_code=303)
 
 
-@app.post("/importar")
-async def importar(files: list[UploadFile] = File(...)):
-    """Importa archivos XML (CFDI y retenciones de plataforma)."""
-    stats = {
-        "cfdi_insertados": 0,
-        "cfdi_duplicados": 0,
-        "retenciones_insertadas": 0,
-        "retenciones_duplicadas": 0,
-        "errores": 0,
-    }
+@app.get("/importaciones", response_class=HTMLResponse)
+def importaciones(request: Request) -> HTMLResponse:
+    """Importaciones recientes del titular activo."""
+    rfc = _titular(request)
+    db = get_db()
+    try:
+        rows = [jobs.progreso(j) for j in db.scalars(queries.importaciones_listado(rfc)).all()]
+    finally:
+        db.close()
+    return templates.TemplateResponse("importaciones.html", {"request": request, "mi_rfc": rfc, "rows": rows})
 
+
+@app.get("/importaciones/{job_id}", response_class=HTMLResponse)
+def importacion_detalle(request: Request, job_id: int, status: Optional[str] = "error"):
+    """Avance de una importación y resultado por archivo (por omisión, solo los errores)."""
     db = get_db()
     try:
-        for file in files:
-            try:
-                xml_bytes = await file.read()
-                kind = detect_xml_kind(xml_bytes)
-
-                if kind == "cfdi":
-                    parsed = parse_cfdi_40(xml_bytes)
-                    uuid = parsed.get("uuid")
-
-                    if uuid:
-                        exists = db.scalar(select(Factura.id).where(Factura.uuid == uuid))
-                        if exists:
-                            stats["cfdi_duplicados"] += 1
-                            continue
-
-                    # Agregar XML_text al parsed dict
-                    parsed["xml_text"] = xml_bytes.decode("utf-8", errors="replace")
-                    factura = _create_factura_from_parsed(parsed)
-                    
-                    db.add(factura)
-                    db.commit()
-                    stats["cfdi_insertados"] += 1
-
-                elif kind == "retenciones":
-                    parsed = parse_retenciones_plataforma(xml_bytes)
-                    uuid = parsed.get("uuid")
-
-                    if uuid:
-                        exists = db.scalar(select(RetencionPlataforma.id).where(RetencionPlataforma.uuid == uuid))
-                        if exists:
-                            stats["retenciones_duplicadas"] += 1
-                            continue
-
-                    parsed["xml_text"] = xml_bytes.decode("utf-8", errors="replace")
-                    ret = _create_retencion_from_parsed(parsed)
-                    
-                    db.add(ret)
-                    db.commit()
-                    stats["retenciones_insertadas"] += 1
-
-                else:
-                    stats["errores"] += 1
-
-            except Exception as e:
-                db.rollback()
-                stats["errores"] += 1
+        job = db.get(ImportJob, job_id)
+        if not job or job.titular_rfc != _titular(request):
+            return Response(content="No encontrada", status_code=404)
+        archivos = db.scalars(queries.importacion_archivos(job_id, status or None)).all()
+        return templates.TemplateResponse(
+            "importacion.html",
+            {"request": request, "job": jobs.progreso(job), "archivos": archivos, "status": status},
+        )
+    finally:
+        db.close()
 
+
+@app.get("/importaciones/{job_id}/progreso.json")
+def importacion_progreso_json(request: Request, job_id: int):
+    """Avance de una importación (para consultar por polling)."""
+    data = jobs.leer_progreso(job_id)
+    if not data or data["titular_rfc"] != _titular(request):
+        return Response(content="No encontrada", status_code=404)
+    return Response(content=serialize_to_json(data), media_type="application/json; charset=utf-8")
+
+
+@app.get("/importaciones/{job_id}/archivos.json")
+def importacion_archivos_json(request: Request, job_id: int, status: Optional[str] = None, limit: int = 5000):
+    """Resultado por archivo (ref, kind, uuid, status, error); ``status=error`` para solo los errores."""
+    db = get_db()
+    try:
+        job = db.get(ImportJob, job_id)
+        if not job or job.titular_rfc != _titular(request):
+            return Response(content="No encontrada", status_code=404)
+        rows = db.scalars(queries.importacion_archivos(job_id, status, limit)).all()
+        payload = [{"ref": a.ref, "kind": a.kind, "uuid": a.uuid, "status": a.status, "error": a.error} for a in rows]
+        return Response(content=serialize_to_json(payload), media_type="application/json; charset=utf-8")
     finally:
         db.close()
 
-    msg = (
-        f"CFDI: {stats['cfdi_insertados']} insertados, {stats['cfdi_duplicados']} duplicados. "
-        f"Retenciones: {stats['retenciones_insertadas']} insertadas, {stats['retenciones_duplicadas']} duplicadas. "
-        f"Errores: {stats['errores']}."
+
+@app.get("/importaciones/{job_id}/eventos")
+async def importacion_eventos(request: Request, job_id: int):
+    """Avance de una importación como Server-Sent Events; termina cuando el trabajo termina."""
+    rfc = _titular(request)
+
+    async def eventos():
+        anterior = None
+        while not await request.is_disconnected():
+            data = await run_in_threadpool(jobs.leer_progreso, job_id)
+            if not data or data["titular_rfc"] != rfc:
+                yield "event: no_encontrada\ndata: {}\n\n"
+                return
+            actual = serialize_to_json(data, indent=None)
+            if actual != anterior:
+                yield f"data: {actual}\n\n"
+                anterior = actual
+            if data["terminado"]:
+                return
+            await asyncio.sleep(1)
+
+    return StreamingResponse(eventos(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+
+class _RespuestaDuplex(StreamingResponse):
+    """``StreamingResponse`` que no escucha la desconexión en paralelo.
+
+    La versión normal consume ``receive()`` en otra tarea y se quedaría con los
+    fragmentos del cuerpo que el generador todavía está leyendo.
+    """
+
+    async def __call__(self, scope, receive, send) -> None:
+        await self.stream_response(send)
+
+
+@app.post("/api/ingest")
+async def api_ingest(request: Request, detalle: str = "todos"):
+    """Ingesta por flujo de CFDI/retenciones para el titular ``?rfc=`` (ver ingest.py).
+
+    Responde NDJSON mientras lee el cuerpo: una línea por documento y un resumen al
+    final. Con ``detalle=errores`` solo se regresan los errores y el resumen, para
+    clientes que envían todo el cuerpo antes de empezar a leer la respuesta.
+    """
+    rfc = _titular(request)
+    if not is_valid_rfc(rfc):
+        return Response(content=f"RFC inválido: {rfc}", status_code=400)
+    content_type = request.headers.get("content-type", "").split(";")[0].strip().lower()
+    formato = ingest.FORMATOS.get(content_type)
+    if not formato:
+        return Response(
+            content="Content-Type debe ser application/x-ndjson o application/octet-stream",
+            status_code=415,
+        )
+    return _RespuestaDuplex(
+        ingest.procesar(request.stream(), formato, rfc, solo_errores=detalle == "errores"),
+        media_type="application/x-ndjson",
     )
-    return RedirectResponse(url=f"/?msg={msg}", status_code=303)
 
-@app.post("/importar_pdf")
-async def importar_pdf(
-    files: list[UploadFile] = File(...),
-    year: Optional[int] = None,
-    month: Optional[int] = None,
-):
-    """Importa PDFs de acuse/declaración SAT."""
-    stats = {"insertados": 0, "duplicados": 0, "errores": 0}
-    db = get_db()
 
-    try:
+@app.get("/api/cache/periodos")
+def cache_periodos_stats():
+    """Aciertos/fallos y tamaño de la caché de periodos (instrumentación)."""
+    return Response(content=serialize_to_json(periodos.cache.stats()), media_type="application/json; charset=utf-8")
+
+
+@app.post("/reclasificar")
+def reclasificar(request: Request) -> RedirectResponse:
+    """Recalcula naturaleza de las facturas del titular activo."""
+    with write_session() as db:
+        n = reclasificar_naturaleza(db, _titular(request))
+        db.commit()
+    return RedirectResponse(url=f"/?msg=Reclasificación: {n} facturas actualizadas.", status_code=303)
+
+
+def _importar_pdfs(rfc: str, files: list[UploadFile], year: Optional[int], month: Optional[int]) -> dict:
+    """Parte síncrona de /importar_pdf (extracción de texto y escritura); corre en el threadpool.
+
+    Los acuses se guardan con el titular activo (``rfc``); los de otro RFC se rechazan
+    (``otro_rfc``) en lugar de quedar con un titular que no está en ``titulares``.
+    """
+    stats = {"insertados": 0, "duplicados": 0, "otro_rfc": 0, "errores": 0}
+    with write_session() as db:
         for file in files:
             try:
-                pdf_bytes = await file.read()
+                original_name = getattr(file, "filename", None)
+                pdf_bytes = file.file.read()
                 sha = sha256_bytes(pdf_bytes)
 
                 # Verificar duplicados
-                exists = db.scalar(select(DeclaracionPDF.id).where(DeclaracionPDF.sha256 == sha))
+                exists = db.scalar(queries.declaracion_por_sha(sha))
                 if exists:
                     stats["duplicados"] += 1
                     continue
 
                 # Guardar PDF en disco
-                filename = safe_pdf_filename(sha, getattr(file, "filename", None))
+                filename = safe_pdf_filename(sha, original_name)
                 pdf_path = PDF_DIR / filename
                 pdf_path.write_bytes(pdf_bytes)
 
@@ -259,6 +345,12 @@ async def importar_pdf(
                 except Exception:
                     summary = {}
 
+                rfc_acuse = ((summary.get("rfc") if isinstance(summary, dict) else None) or "").upper()
+                if rfc_acuse and rfc_acuse != rfc.upper():
+                    pdf_path.unlink(missing_ok=True)
+                    stats["otro_rfc"] += 1
+                    continue
+
                 # Determinar periodo
                 y, mth = year, month
                 per = summary.get("periodo") if isinstance(summary, dict) else None
@@ -277,6 +369,7 @@ async def importar_pdf(
 
                 # Crear registro
                 rec = DeclaracionPDF(
+                    titular_rfc=rfc.upper(),
                     year=int(y),
                     month=int(mth),
                     rfc=summary.get("rfc") if isinstance(summary, dict) else None,
@@ -284,7 +377,7 @@ async def importar_pdf(
                     fecha_presentacion=summary.get("fecha_presentacion") if isinstance(summary, dict) else None,
                     sha256=sha,
                     filename=filename,
-                    original_name=getattr(file, "filename", None),
+                    original_name=original_name,
                     num_pages=int(num_pages) if num_pages is not None else None,
                     text_excerpt=text[:20000] if text else None,
                 )
@@ -296,13 +389,68 @@ async def importar_pdf(
                 db.rollback()
                 stats["errores"] += 1
 
-    finally:
-        db.close()
+    return stats
 
+
+@app.post("/importar_pdf")
+async def importar_pdf(
+    request: Request,
+    files: list[UploadFile] = File(...),
+    year: Optional[int] = None,
+    month: Optional[int] = None,
+):
+    """Importa PDFs de acuse/declaración SAT."""
+    stats = await run_in_threadpool(_importar_pdfs, _titular(request), files, year, month)
     msg = f"PDF: {stats['insertados']} importados, {stats['duplicados']} duplicados. Errores: {stats['errores']}."
+    if stats["otro_rfc"]:
+        msg += f" {stats['otro_rfc']} acuses de otro RFC no se importaron (selecciona ese titular en /titular)."
     return RedirectResponse(url=f"/?msg={msg}", status_code=303)
 
 
+@app.post("/importar_metadata")
+async def importar_metadata(request: Request, files: list[UploadFile] = File(...)):
+    """Carga metadata de descarga masiva SAT (.txt o .zip) y actualiza el estatus de los CFDI."""
+    try:
+        res = await run_in_threadpool(
+            metadata_sat.cargar, [(f.filename or "metadata.txt", f.file) for f in files], _titular(request)
+        )
+    except metadata_sat.MetadataInvalida as e:
+        return RedirectResponse(url=f"/metadata?msg={e}", status_code=303)
+    msg = (
+        f"Metadata: {res.cargados} renglones del titular ({res.cancelados} cancelados), "
+        f"{res.ajenos} de otros RFC, {res.errores} con error. "
+        f"{res.facturas_actualizadas} CFDI cambiaron de estatus."
+    )
+    return RedirectResponse(url=f"/metadata?msg={msg}", status_code=303)
+
+
+@app.get("/metadata", response_class=HTMLResponse)
+def metadata_sin_xml(
+    request: Request, year: Optional[int] = None, month: Optional[int] = None, msg: Optional[str] = None
+) -> HTMLResponse:
+    """CFDI vigentes según la metadata del SAT que no tienen XML importado."""
+    rfc = _titular(request)
+    db = get_db()
+    try:
+        filas = db.scalars(queries.metadata_sin_xml(rfc, year, month)).all()
+        total, monto = db.execute(queries.metadata_sin_xml_conteo(rfc, year, month)).one()
+        return templates.TemplateResponse(
+            "metadata.html",
+            {
+                "request": request,
+                "mi_rfc": rfc,
+                "year": year,
+                "month": month,
+                "filas": filas,
+                "total": total,
+                "monto": float(monto or 0.0),
+                "msg": msg,
+            },
+        )
+    finally:
+        db.close()
+
+
 @app.get("/declaraciones", response_class=HTMLResponse)
 def listar_declaraciones(
     request: Request,
@@ -311,14 +459,11 @@ def listar_declaraciones(
     month: Optional[int] = None,
 ) -> HTMLResponse:
     """Lista declaraciones PDF importadas con filtros opcionales."""
+    rfc = _titular(request)
     db = get_db()
     try:
         # Obtener periodos disponibles
-        opts_raw = db.execute(
-            select(DeclaracionPDF.year, DeclaracionPDF.month)
-            .where(DeclaracionPDF.year.isnot(None), DeclaracionPDF.month.isnot(None))
-            .group_by(DeclaracionPDF.year, DeclaracionPDF.month)
-        ).all()
+        opts_raw = db.execute(queries.declaraciones_periodos(rfc)).all()
 
         uniq = {(int(y), int(m)) for (y, m) in opts_raw if y and m}
         period_options = [f"{y}-{m:02d}" for (y, m) in sorted(uniq, reverse=True)]
@@ -331,17 +476,7 @@ def listar_declaraciones(
             except Exception:
                 pass
 
-        q = select(DeclaracionPDF).order_by(
-            desc(DeclaracionPDF.year),
-            desc(DeclaracionPDF.month),
-            desc(DeclaracionPDF.created_at),
-        )
-        if year is not None:
-            q = q.where(DeclaracionPDF.year == year)
-        if month is not None:
-            q = q.where(DeclaracionPDF.month == month)
-
-        rows = db.scalars(q).all()
+        rows = db.scalars(queries.declaraciones_listado(rfc, year, month)).all()
         return templates.TemplateResponse(
             "declaraciones.html",
             {
@@ -351,7 +486,7 @@ def listar_declaraciones(
                 "month": month,
                 "period_options": period_options,
                 "selected_period": selected_period,
-                "mi_rfc": MI_RFC,
+                "mi_rfc": rfc,
             },
         )
     finally:
@@ -405,10 +540,11 @@ def _build_declaracion_payload(dec: DeclaracionPDF) -> dict:
 @app.get("/declaraciones/{dec_id}", response_class=HTMLResponse)
 def detalle_declaracion(request: Request, dec_id: int) -> HTMLResponse:
     """Detalle de una declaración PDF importada."""
+    rfc = _titular(request)
     db = get_db()
     try:
         dec = db.get(DeclaracionPDF, dec_id)
-        if not dec:
+        if not dec or dec.titular_rfc != rfc:
             return HTMLResponse("No encontrada", status_code=404)
 
         resumen: list[str] = []
@@ -433,7 +569,7 @@ def detalle_declaracion(request: Request, dec_id: int) -> HTMLResponse:
                 "dec": dec,
                 "resumen": resumen,
                 "resumen_json": resumen_json,
-                "mi_rfc": MI_RFC,
+                "mi_rfc": rfc,
                 "payload": payload,
             },
         )
@@ -441,11 +577,11 @@ def detalle_declaracion(request: Request, dec_id: int) -> HTMLResponse:
         db.close()
 
 @app.get("/declaraciones/{dec_id}/archivo.pdf")
-def descargar_declaracion_pdf(dec_id: int):
+def descargar_declaracion_pdf(request: Request, dec_id: int):
     db = get_db()
     try:
         dec = db.get(DeclaracionPDF, dec_id)
-        if not dec:
+        if not dec or dec.titular_rfc != _titular(request):
             return Response(content="No encontrada", status_code=404)
         pdf_path = (PDF_DIR / dec.filename)
         if not pdf_path.exists():
@@ -461,12 +597,12 @@ def descargar_declaracion_pdf(dec_id: int):
 
 
 @app.get("/declaraciones/{dec_id}/resumen.json")
-def declaracion_pdf_resumen_json(dec_id: int):
+def declaracion_pdf_resumen_json(request: Request, dec_id: int):
     """Exporta el resumen de una declaración como JSON."""
     db = get_db()
     try:
         dec = db.get(DeclaracionPDF, dec_id)
-        if not dec:
+        if not dec or dec.titular_rfc != _titular(request):
             return Response(content="No encontrada", status_code=404)
 
         payload = _build_declaracion_payload(dec)
@@ -488,37 +624,27 @@ def listar_facturas(
     naturaleza: Optional[str] = None,
 ) -> HTMLResponse:
     """Lista CFDI de facturas con filtros opcionales."""
-    db = get_db()
+    rfc = _titular(request)
+    year_i = int(year) if year and year.isdigit() else None
+    month_i = int(month) if month and month.isdigit() else None
+    db = get_db(year_i)
     try:
-        month_options = _month_options(db)
+        month_options = _month_options(db, rfc)
         year_options = sorted({y for (y, _) in month_options}, reverse=True)
 
-        year_i = int(year) if year and year.isdigit() else None
-        month_i = int(month) if month and month.isdigit() else None
-
         months_for_year = (
             sorted({m for (y, m) in month_options if y == year_i})
             if year_i is not None
             else sorted({m for (_, m) in month_options})
         )
 
-        q = select(Factura).order_by(desc(Factura.fecha_emision).nullslast(), desc(Factura.id))
-        if year_i is not None:
-            q = q.where(Factura.year_emision == year_i)
-        if month_i is not None:
-            q = q.where(Factura.month_emision == month_i)
-        if tipo:
-            q = q.where(Factura.tipo_comprobante == tipo.upper())
-        if naturaleza:
-            q = q.where(Factura.naturaleza == naturaleza.lower())
-
-        facturas = db.scalars(q.limit(500)).all()
+        facturas = db.scalars(queries.facturas_listado(rfc, year_i, month_i, tipo, naturaleza)).all()
         return templates.TemplateResponse(
             "facturas.html",
             {
                 "request": request,
                 "facturas": facturas,
-                "mi_rfc": MI_RFC,
+                "mi_rfc": rfc,
                 "tipo": tipo or "",
                 "naturaleza": naturaleza or "",
                 "year": year_i,
@@ -532,6 +658,211 @@ def listar_facturas(
 
 
 
+def _fecha(value: Optional[str]) -> Optional[date]:
+    """Fecha ``YYYY-MM-DD`` de un filtro de formulario; vacía o inválida = sin filtro."""
+    dt = parse_iso_datetime(value)
+    return dt.date() if dt else None
+
+
+def _anios_export(desde: Optional[date], hasta: Optional[date]) -> tuple[int, ...]:
+    """Ejercicios archivados que abarca el rango: los que la exportación tiene que adjuntar."""
+    db = get_db()
+    try:
+        archivados = archivo.anios_archivados(db)
+    finally:
+        db.close()
+    return tuple(y for y in archivados if (desde is None or y >= desde.year) and (hasta is None or y <= hasta.year))
+
+
+def _anios_excedidos(anios: tuple[int, ...]) -> Optional[Response]:
+    """400 si el rango abarca más años archivados de los que SQLite puede adjuntar."""
+    if len(anios) <= archivo.MAX_ADJUNTOS:
+        return None
+    return Response(
+        content=f"El rango abarca {len(anios)} ejercicios archivados ({anios[0]}–{anios[-1]}); "
+        f"el máximo es {archivo.MAX_ADJUNTOS}. Acota desde/hasta.",
+        status_code=400,
+    )
+
+
+def _nombre_export(base: str, rfc: str, desde: Optional[date], hasta: Optional[date]) -> str:
+    rango = f"_{desde or 'inicio'}_{hasta or 'hoy'}" if desde or hasta else ""
+    return f"{base}_{rfc}{rango}"
+
+
+@app.get("/export/facturas.csv")
+def export_facturas_csv(
+    request: Request,
+    desde: Optional[str] = None,
+    hasta: Optional[str] = None,
+    tipo: Optional[str] = None,
+    naturaleza: Optional[str] = None,
+    contraparte: Optional[str] = None,
+    gzip: bool = False,
+):
+    """Exporta (por flujo) los CFDI del titular por rango de fecha de emisión y filtros.
+
+    ``contraparte`` filtra por RFC emisor o receptor; ``gzip=1`` descarga ``.csv.gz``.
+    """
+    rfc = _titular(request)
+    desde_d, hasta_d = _fecha(desde), _fecha(hasta)
+    anios = _anios_export(desde_d, hasta_d)
+    if (error := _anios_excedidos(anios)) is not None:
+        return error
+    stmt = queries.export_facturas(rfc, desde_d, hasta_d, tipo, naturaleza, contraparte)
+    return exportar.respuesta_csv(stmt, _nombre_export("facturas", rfc, desde_d, hasta_d), gzip, anios)
+
+
+@app.get("/export/conceptos.csv")
+def export_conceptos_csv(
+    request: Request,
+    desde: Optional[str] = None,
+    hasta: Optional[str] = None,
+    tipo: Optional[str] = None,
+    naturaleza: Optional[str] = None,
+    contraparte: Optional[str] = None,
+    gzip: bool = False,
+):
+    """Exporta (por flujo) los conceptos de los CFDI que cumplen los mismos filtros que facturas.csv."""
+    rfc = _titular(request)
+    desde_d, hasta_d = _fecha(desde), _fecha(hasta)
+    anios = _anios_export(desde_d, hasta_d)
+    if (error := _anios_excedidos(anios)) is not None:
+        return error
+    stmt = queries.export_conceptos(rfc, desde_d, hasta_d, tipo, naturaleza, contraparte)
+    return exportar.respuesta_csv(stmt, _nombre_export("conceptos", rfc, desde_d, hasta_d), gzip, anios)
+
+
+BUSQUEDA_FUENTES = {
+    "conceptos": queries.buscar_conceptos,
+    "contrapartes": queries.buscar_contrapartes,
+    "acuses": queries.buscar_acuses,
+}
+BUSQUEDA_POR_PAGINA = 20
+BUSQUEDA_LIMIT_MAX = 100
+
+# Columnas con marcadores de coincidencia (snippet/highlight) que se entregan como HTML
+_COLUMNAS_RESALTADAS = ("fragmento", "nombre_resaltado")
+
+
+def _buscar(rfc: str, q: Optional[str], fuente: str, limit: int, offset: int) -> dict:
+    """Resultados ordenados por relevancia de una fuente, con ``siguiente`` para paginar.
+
+    Los índices FTS5 viven solo en la base activa: ``anios_archivados`` dice qué
+    ejercicios no cubre la búsqueda.
+    """
+    consulta = busqueda.consulta_fts(q)
+    t0 = time.perf_counter()
+    filas = []
+    anios = []
+    if consulta:
+        buscar_en = BUSQUEDA_FUENTES[fuente]
+        db = get_db()
+        try:
+            anios = archivo.anios_archivados(db)
+            # Con muchas coincidencias se ordena por relevancia solo entre las más recientes;
+            # si en esa ventana no alcanzan para la página (otro titular, páginas lejanas) se usan todas
+            corte = None
+            if offset + limit < busqueda.VENTANA_RANKING:
+                corte = db.execute(queries.fts_corte(fuente, consulta, busqueda.VENTANA_RANKING)).scalar()
+            filas = db.execute(buscar_en(rfc, consulta, limit + 1, offset, desde_rowid=corte)).mappings().all()
+            if corte is not None and len(filas) <= limit:
+                filas = db.execute(buscar_en(rfc, consulta, limit + 1, offset)).mappings().all()
+        finally:
+            db.close()
+
+    resultados = []
+    for fila in filas[:limit]:
+        r = {k: float(v) if isinstance(v, Decimal) else v for k, v in fila.items()}
+        for col in _COLUMNAS_RESALTADAS:
+            if col in r:
+                r[col] = str(busqueda.fragmento_html(r[col]))
+        resultados.append(r)
+    return {
+        "q": q or "",
+        "fuente": fuente,
+        "offset": offset,
+        "limit": limit,
+        "resultados": resultados,
+        "siguiente": offset + limit if len(filas) > limit else None,
+        "anios_archivados": anios,
+        "ms": round((time.perf_counter() - t0) * 1000, 1),
+    }
+
+
+@app.get("/buscar", response_class=HTMLResponse)
+def buscar(request: Request, q: Optional[str] = None, fuente: str = "conceptos", page: int = 1) -> HTMLResponse:
+    """Búsqueda de texto en conceptos, contrapartes (nombre o RFC) y acuses PDF."""
+    rfc = _titular(request)
+    if fuente not in BUSQUEDA_FUENTES:
+        fuente = "conceptos"
+    page = max(page, 1)
+    res = _buscar(rfc, q, fuente, BUSQUEDA_POR_PAGINA, (page - 1) * BUSQUEDA_POR_PAGINA)
+    return templates.TemplateResponse(
+        "buscar.html",
+        {
+            "request": request,
+            "mi_rfc": rfc,
+            "fuentes": list(BUSQUEDA_FUENTES),
+            "page": page,
+            **res,
+        },
+    )
+
+
+@app.get("/api/buscar")
+def buscar_json(request: Request, q: str, fuente: str = "conceptos", limit: int = BUSQUEDA_POR_PAGINA, offset: int = 0):
+    """Búsqueda en JSON: ``resultados`` por relevancia y ``siguiente`` (offset) o null.
+
+    Los fragmentos (``fragmento``, ``nombre_resaltado``) vienen como HTML escapado con
+    las coincidencias en ``<mark>``. ``anios_archivados``: ejercicios en el archivo frío,
+    que la búsqueda no cubre.
+    """
+    if fuente not in BUSQUEDA_FUENTES:
+        return Response(content=f"fuente debe ser una de: {', '.join(BUSQUEDA_FUENTES)}", status_code=400)
+    limit = min(max(limit, 1), BUSQUEDA_LIMIT_MAX)
+    res = _buscar(_titular(request), q, fuente, limit, max(offset, 0))
+    return Response(content=serialize_to_json(res), media_type="application/json; charset=utf-8")
+
+
+CONTRAPARTES_NATURALEZAS = ("gasto", "ingreso")
+
+
+@app.get("/contrapartes", response_class=HTMLResponse)
+def listar_contrapartes(
+    request: Request,
+    naturaleza: str = "gasto",
+    year: Optional[int] = None,
+    month: Optional[int] = None,
+    limit: int = 50,
+) -> HTMLResponse:
+    """Principales proveedores (gasto) o clientes (ingreso) por total de CFDI."""
+    rfc = _titular(request)
+    if naturaleza not in CONTRAPARTES_NATURALEZAS:
+        naturaleza = "gasto"
+    limit = min(max(limit, 1), 500)
+    db = get_db(year)
+    try:
+        year_options = sorted({y for (y, _) in _month_options(db, rfc)}, reverse=True)
+        filas = db.execute(queries.totales_por_contraparte(rfc, naturaleza, year, month, limit)).mappings().all()
+        return templates.TemplateResponse(
+            "contrapartes.html",
+            {
+                "request": request,
+                "mi_rfc": rfc,
+                "naturaleza": naturaleza,
+                "naturalezas": CONTRAPARTES_NATURALEZAS,
+                "year": year,
+                "month": month,
+                "year_options": year_options,
+                "limit": limit,
+                "filas": filas,
+            },
+        )
+    finally:
+        db.close()
+
+
 @app.get("/retenciones", response_class=HTMLResponse)
 def listar_retenciones(
     request: Request,
@@ -540,17 +871,14 @@ def listar_retenciones(
     month: Optional[int] = None,
 ) -> HTMLResponse:
     """Lista retenciones de plataforma con filtros opcionales."""
-    db = get_db()
+    rfc = _titular(request)
+    selected_period = (period or "").strip()
+    if selected_period and re.match(r"^\d{4}-\d{2}$", selected_period):
+        year, month = int(selected_period[:4]), int(selected_period[5:])
+    db = get_db(year)
     try:
         # Obtener periodos disponibles
-        opts_raw = db.execute(
-            select(RetencionPlataforma.ejercicio, RetencionPlataforma.mes_ini, RetencionPlataforma.mes_fin)
-            .where(
-                RetencionPlataforma.ejercicio.isnot(None),
-                RetencionPlataforma.mes_fin.isnot(None),
-            )
-            .group_by(RetencionPlataforma.ejercicio, RetencionPlataforma.mes_ini, RetencionPlataforma.mes_fin)
-        ).all()
+        opts_raw = db.execute(queries.retenciones_rangos(rfc)).all()
 
         periods: set[tuple[int, int]] = set()
         for y, mi, mf in opts_raw:
@@ -564,39 +892,17 @@ def listar_retenciones(
                     periods.add((y_i, int(mm)))
             else:
                 periods.add((y_i, mf_i))
+        periods |= {(int(y), int(m)) for (y, m) in db.execute(queries.periodos_archivados(rfc, "retenciones_plataforma")).all()}
 
         period_options = [f"{y}-{m:02d}" for (y, m) in sorted(periods, reverse=True)]
 
-        selected_period = (period or "").strip()
-        if selected_period and re.match(r"^\d{4}-\d{2}$", selected_period):
-            try:
-                year = int(selected_period.split("-")[0])
-                month = int(selected_period.split("-")[1])
-            except Exception:
-                pass
-
-        q = (
-            select(RetencionPlataforma)
-            .order_by(
-                desc(RetencionPlataforma.ejercicio),
-                desc(RetencionPlataforma.mes_fin),
-                desc(RetencionPlataforma.fecha_exp).nullslast(),
-                desc(RetencionPlataforma.id),
-            )
-            .limit(300)
-        )
-        if year is not None:
-            q = q.where(RetencionPlataforma.ejercicio == year)
-        if month is not None:
-            q = q.where(and_(RetencionPlataforma.mes_ini <= month, RetencionPlataforma.mes_fin >= month))
-
-        rows = db.scalars(q).all()
+        rows = db.scalars(queries.retenciones_listado(rfc, year, month)).all()
         return templates.TemplateResponse(
             "retenciones.html",
             {
                 "request": request,
                 "rows": rows,
-                "mi_rfc": MI_RFC,
+                "mi_rfc": rfc,
                 "year": year,
                 "month": month,
                 "period_options": period_options,
@@ -607,52 +913,97 @@ def listar_retenciones(
         db.close()
 
 
+def _complementos(db: Session, documento: str, doc_id: int) -> list[tuple[str, list]]:
+    """(tabla, filas) de los complementos registrados que trae el documento."""
+    out = []
+    for tabla in tablas_complemento(documento):
+        filas = db.execute(queries.complemento_filas(tabla, doc_id)).mappings().all()
+        if filas:
+            out.append((tabla, filas))
+    return out
+
+
 @app.get("/retenciones/{ret_id}", response_class=HTMLResponse)
 def detalle_retencion(request: Request, ret_id: int) -> HTMLResponse:
-    db = get_db()
+    rfc = _titular(request)
+    db = get_db() if ret_id > 0 else archivo.sesion_lectura()  # ids negativos: archivo frío
     try:
         ret = db.get(RetencionPlataforma, ret_id)
-        if not ret:
+        if not ret or ret.titular_rfc != rfc:
             return HTMLResponse("No encontrada", status_code=404)
-        return templates.TemplateResponse("retencion_detalle.html", {"request": request, "ret": ret, "mi_rfc": MI_RFC})
+        return templates.TemplateResponse(
+            "retencion_detalle.html",
+            {"request": request, "ret": ret, "complementos": _complementos(db, "retenciones", ret.id), "mi_rfc": rfc},
+        )
     finally:
         db.close()
 
 
 @app.get("/facturas/{factura_id}", response_class=HTMLResponse)
 def detalle_factura(request: Request, factura_id: int) -> HTMLResponse:
-    db = get_db()
+    rfc = _titular(request)
+    db = get_db() if factura_id > 0 else archivo.sesion_lectura()  # ids negativos: archivo frío
     try:
         factura = db.get(Factura, factura_id)
-        if not factura:
+        if not factura or factura.titular_rfc != rfc:
             return HTMLResponse("No encontrada", status_code=404)
         _ = factura.conceptos
-        _ = factura.pagos
-        return templates.TemplateResponse("detalle.html", {"request": request, "factura": factura, "mi_rfc": MI_RFC})
+        for p in factura.pagos:
+            _ = p.documentos
+
+        # Parcialidades que liquidan esta factura (si es PPD)
+        abonos = []
+        if (factura.metodo_pago or "").upper() == "PPD" and factura.uuid:
+            abonos = db.execute(queries.abonos_factura(rfc, factura.uuid)).all()
+
+        # CfdiRelacionados en ambos sentidos: los que declara y los que lo relacionan
+        declarados = db.execute(queries.relaciones_declaradas(factura.id)).all()
+        recibidos = db.execute(queries.relaciones_recibidas(rfc, factura.uuid)).all() if factura.uuid else []
+        return templates.TemplateResponse(
+            "detalle.html",
+            {
+                "request": request,
+                "factura": factura,
+                "abonos": abonos,
+                "relaciones_declaradas": declarados,
+                "relaciones_recibidas": recibidos,
+                "tipos_relacion": queries.TIPOS_RELACION,
+                "complementos": _complementos(db, "cfdi", factura.id),
+                "mi_rfc": rfc,
+            },
+        )
     finally:
         db.close()
 
 
-def _signed(value: Optional[float], tipo: Optional[str]) -> float:
-    """Aplica factor de signo: tipo 'E' (egreso) multiplica por -1."""
-    return apply_sign_factor(value, tipo)
-
+@app.get("/pendientes", response_class=HTMLResponse)
+def facturas_pendientes(request: Request) -> HTMLResponse:
+    """Facturas PPD del titular con saldo pendiente (por cobrar y por pagar)."""
+    rfc = _titular(request)
+    db = get_db()
+    try:
+        rows = db.scalars(queries.facturas_pendientes(rfc)).all()
+        por_cobrar = [f for f in rows if f.naturaleza == "ingreso"]
+        por_pagar = [f for f in rows if f.naturaleza == "gasto"]
+        return templates.TemplateResponse(
+            "pendientes.html",
+            {
+                "request": request,
+                "mi_rfc": rfc,
+                "por_cobrar": por_cobrar,
+                "por_pagar": por_pagar,
+                "total_por_cobrar": sum(float(f.saldo_pendiente or 0.0) for f in por_cobrar),
+                "total_por_pagar": sum(float(f.saldo_pendiente or 0.0) for f in por_pagar),
+            },
+        )
+    finally:
+        db.close()
 
-def _pick_default_period(db: Session) -> tuple[Optional[int], Optional[int]]:
-    """Obtiene el periodo más reciente con datos (facturas o retenciones)."""
-    last_fact = db.execute(
-        select(Factura.year_emision, Factura.month_emision)
-        .where(Factura.year_emision.isnot(None), Factura.month_emision.isnot(None))
-        .order_by(desc(Factura.year_emision), desc(Factura.month_emision))
-        .limit(1)
-    ).first()
 
-    last_ret = db.execute(
-        select(RetencionPlataforma.ejercicio, RetencionPlataforma.mes_fin)
-        .where(RetencionPlataforma.ejercicio.isnot(None), RetencionPlataforma.mes_fin.isnot(None))
-        .order_by(desc(RetencionPlataforma.ejercicio), desc(RetencionPlataforma.mes_fin))
-        .limit(1)
-    ).first()
+def _pick_default_period(db: Session, rfc: str) -> tuple[Optional[int], Optional[int]]:
+    """Obtiene el periodo más reciente con datos (facturas o retenciones) del titular."""
+    last_fact = db.execute(queries.facturas_ultimo_periodo(rfc)).first()
+    last_ret = db.execute(queries.retenciones_ultimo_periodo(rfc)).first()
 
     candidates = []
     if last_fact:
@@ -663,94 +1014,54 @@ def _pick_default_period(db: Session) -> tuple[Optional[int], Optional[int]]:
     return max(candidates) if candidates else (None, None)
 
 
-def _month_options(db: Session) -> list[tuple[int, int]]:
-    """Obtiene lista de periodos disponibles (año, mes) ordenados descendentemente."""
-    m1 = db.execute(
-        select(Factura.year_emision, Factura.month_emision)
-        .where(Factura.year_emision.isnot(None), Factura.month_emision.isnot(None))
-        .group_by(Factura.year_emision, Factura.month_emision)
-    ).all()
+def _month_options(db: Session, rfc: str) -> list[tuple[int, int]]:
+    """Obtiene lista de periodos disponibles (año, mes) del titular, ordenados descendentemente."""
+    m1 = db.execute(queries.facturas_periodos(rfc)).all()
+    m2 = db.execute(queries.retenciones_periodos(rfc)).all()
+    m3 = db.execute(queries.periodos_archivados(rfc)).all()
 
-    m2 = db.execute(
-        select(RetencionPlataforma.ejercicio, RetencionPlataforma.mes_fin)
-        .where(RetencionPlataforma.ejercicio.isnot(None), RetencionPlataforma.mes_fin.isnot(None))
-        .group_by(RetencionPlataforma.ejercicio, RetencionPlataforma.mes_fin)
-    ).all()
+    return sorted({(int(y), int(m)) for (y, m) in (m1 + m2 + m3) if y and m}, reverse=True)
 
-    return sorted({(int(y), int(m)) for (y, m) in (m1 + m2) if y and m}, reverse=True)
 
+# Columnas de ``queries.facturas_por_mes`` que pasan tal cual al resumen
+_TOTALES_EMISION = (
+    "ingresos_total", "ingresos_base", "ingresos_trasl", "ingresos_ret",
+    "gastos_total", "gastos_base", "gastos_trasl", "gastos_ret",
+)
 
-def _compute_period_data(db: Session, year: int, month: int) -> dict:
+
+def _compute_period_data(db: Session, rfc: str, year: int, month: int) -> dict:
     """
-    Calcula todos los datos agregados de un periodo para reportes.
+    Calcula todos los datos agregados de un periodo del titular para reportes.
     
     Returns:
         Dict con ingresos, gastos, retenciones, IVA, etc.
     """
     # CFDI por emisión
-    docs = db.scalars(
-        select(Factura)
-        .where(Factura.year_emision == year, Factura.month_emision == month)
-        .order_by(desc(Factura.fecha_emision).nullslast(), desc(Factura.id))
-    ).all()
-
-    # Precargar relaciones
-    for d in docs:
-        _ = d.pagos
-
-    # Inicializar acumuladores
-    ingresos_total = ingresos_trasl = ingresos_ret = 0.0
-    gastos_total = gastos_trasl = gastos_ret = 0.0
-    ingresos_base = 0.0
-    p_count = 0
-
-    # Procesar CFDI de ingresos y gastos (excluyendo tipo P)
-    for d in docs:
-        tipo = (d.tipo_comprobante or "").upper()
-        if tipo == "P":
-            p_count += 1
-            continue
+    docs = db.scalars(queries.facturas_periodo(rfc, year, month)).all()
+    # Sustituidos (relación 04) por otro CFDI vigente: la consulta resuelve el grafo con el índice
+    sustituidos = set(db.scalars(queries.facturas_sustituidas_periodo(rfc, year, month)))
+
+    cancelados_count = sum(1 for d in docs if d.fecha_cancelacion is not None)
+
+    # Totales de emisión en SQL sobre las columnas en MXN (excluye tipo P, cancelados y sustituidos)
+    mes = (year, month)
+    emision = db.execute(queries.facturas_por_mes(rfc, mes, mes)).mappings().first() or {}
+    totales = {k: float(emision.get(k) or 0.0) for k in _TOTALES_EMISION}
+    p_count = int(emision.get("p_count") or 0)
+
+    # Pagos (tipo P vigentes) por FechaPago: la lista y sus sumas en MXN
+    pagos_rows = db.execute(queries.pagos_periodo(rfc, year, month)).all()
+    flujo = db.execute(queries.pagos_por_mes(rfc, mes, mes)).mappings().first() or {}
+    cash_in = float(flujo.get("cash_in") or 0.0)
+    cash_out = float(flujo.get("cash_out") or 0.0)
+    pagos_count = int(flujo.get("pagos_count") or 0)
 
-        base = float(d.subtotal or 0.0) - float(d.descuento or 0.0)
-
-        if d.naturaleza == "ingreso":
-            ingresos_total += _signed(d.total, tipo)
-            ingresos_trasl += _signed(d.total_trasladados, tipo)
-            ingresos_ret += _signed(d.total_retenidos, tipo)
-            ingresos_base += _signed(base, tipo)
-        elif d.naturaleza == "gasto":
-            gastos_total += _signed(d.total, tipo)
-            gastos_trasl += _signed(d.total_trasladados, tipo)
-            gastos_ret += _signed(d.total_retenidos, tipo)
-
-    # Pagos (tipo P) por FechaPago
-    pagos_rows = db.execute(
-        select(Pago, Factura.naturaleza)
-        .join(Factura, Pago.factura_id == Factura.id)
-        .where(Pago.year_pago == year, Pago.month_pago == month)
-        .order_by(desc(Pago.fecha_pago).nullslast(), desc(Pago.id))
-    ).all()
-
-    cash_in = cash_out = 0.0
-    pagos_count = 0
-    for pago, nat in pagos_rows:
-        pagos_count += 1
-        monto = float(pago.monto or 0.0)
-        if nat == "cobro":
-            cash_in += monto
-        elif nat == "pago":
-            cash_out += monto
+    # IVA efectivamente cobrado/pagado (flujo): IVA de los DoctoRelacionado de los pagos del periodo
+    iva_cobrado_flujo, iva_pagado_flujo = db.execute(queries.iva_flujo_periodo(rfc, year, month)).one()
 
     # Retenciones de plataformas
-    ret_rows = db.scalars(
-        select(RetencionPlataforma)
-        .where(
-            RetencionPlataforma.ejercicio == year,
-            RetencionPlataforma.mes_ini <= month,
-            RetencionPlataforma.mes_fin >= month,
-        )
-        .order_by(desc(RetencionPlataforma.fecha_exp).nullslast(), desc(RetencionPlataforma.id))
-    ).all()
+    ret_rows = db.scalars(queries.retenciones_periodo(rfc, year, month)).all()
 
     plat_ing_siva = sum(float(r.mon_tot_serv_siva or 0.0) for r in ret_rows)
     plat_iva_tras = sum(float(r.total_iva_trasladado or 0.0) for r in ret_rows)
@@ -762,17 +1073,15 @@ def _compute_period_data(db: Session, year: int, month: int) -> dict:
         "docs": docs,
         "pagos_rows": pagos_rows,
         "ret_rows": ret_rows,
-        "ingresos_total": ingresos_total,
-        "ingresos_base": ingresos_base,
-        "ingresos_trasl": ingresos_trasl,
-        "ingresos_ret": ingresos_ret,
-        "gastos_total": gastos_total,
-        "gastos_trasl": gastos_trasl,
-        "gastos_ret": gastos_ret,
+        **totales,
         "p_count": p_count,
+        "cancelados_count": cancelados_count,
+        "sustituidos": sustituidos,
         "cash_in": cash_in,
         "cash_out": cash_out,
         "pagos_count": pagos_count,
+        "iva_cobrado_flujo": float(iva_cobrado_flujo or 0.0),
+        "iva_pagado_flujo": float(iva_pagado_flujo or 0.0),
         "plat_ing_siva": plat_ing_siva,
         "plat_iva_tras": plat_iva_tras,
         "plat_iva_ret": plat_iva_ret,
@@ -781,59 +1090,245 @@ def _compute_period_data(db: Session, year: int, month: int) -> dict:
     }
 
 
-def _calc_income_and_iva_sources(
-    data: dict, income_source: Optional[str]
-) -> tuple[float, float, str]:
+# Reportes de varios meses: límite para no agrupar rangos arbitrariamente largos
+RANGO_MAX_MESES = 120
+
+
+_CEROS_MES = (
+    *_TOTALES_EMISION,
+    "cash_in", "cash_out", "iva_cobrado_flujo", "iva_pagado_flujo",
+    "plat_ing_siva", "plat_iva_tras", "plat_iva_ret", "plat_isr_ret", "plat_comision",
+)
+
+
+def _meses(desde: tuple[int, int], hasta: tuple[int, int]) -> list[tuple[int, int]]:
+    """Meses (año, mes) de ``desde`` a ``hasta`` inclusive."""
+    out = []
+    y, m = desde
+    while (y, m) <= hasta:
+        out.append((y, m))
+        y, m = (y + 1, 1) if m == 12 else (y, m + 1)
+    return out
+
+
+def _compute_range_data(db: Session, rfc: str, desde: tuple[int, int], hasta: tuple[int, int]) -> list[dict]:
     """
-    Calcula ingresos e IVA evitando doble conteo (plataforma vs CFDI).
+    Calcula los agregados de ``_compute_period_data`` para cada mes de un rango.
+
+    Una consulta agrupada por fuente (facturas, pagos, IVA de flujo, retenciones) cubre
+    todo el rango, así que 12 meses cuestan lo mismo que uno. Las filas no traen las
+    listas de documentos (docs, pagos_rows, ret_rows).
 
     Returns:
-        (ingresos_sin_iva, iva_trasladado, effective_source)
+        Lista de dicts (uno por mes, en orden) con year, month y los totales del mes.
     """
-    income_source = (income_source or "auto").lower().strip()
+    meses = {
+        p: {"year": p[0], "month": p[1], **dict.fromkeys(_CEROS_MES, 0.0), "p_count": 0, "pagos_count": 0, "ret_count": 0}
+        for p in _meses(desde, hasta)
+    }
 
-    plat_income = float(data.get("plat_ing_siva") or 0.0)
-    cfdi_income = float(data.get("ingresos_base") or 0.0)
+    for row in db.execute(queries.facturas_por_mes(rfc, desde, hasta)).mappings():
+        d = meses[(row["year_emision"], row["month_emision"])]
+        for k in _TOTALES_EMISION:
+            d[k] = float(row[k] or 0.0)
+        d["p_count"] = int(row["p_count"] or 0)
+
+    for row in db.execute(queries.pagos_por_mes(rfc, desde, hasta)).mappings():
+        d = meses[(row["year_pago"], row["month_pago"])]
+        d["cash_in"] = float(row["cash_in"] or 0.0)
+        d["cash_out"] = float(row["cash_out"] or 0.0)
+        d["pagos_count"] = int(row["pagos_count"] or 0)
+
+    for y, m, cobrado, pagado in db.execute(queries.iva_flujo_por_mes(rfc, desde, hasta)).all():
+        meses[(y, m)]["iva_cobrado_flujo"] = float(cobrado or 0.0)
+        meses[(y, m)]["iva_pagado_flujo"] = float(pagado or 0.0)
+
+    # Una retención cuenta en cada mes de su periodo (mes_ini..mes_fin), como en retenciones_periodo
+    for row in db.execute(queries.retenciones_por_rango(rfc, desde[0], hasta[0])).mappings():
+        if row["mes_ini"] is None or row["mes_fin"] is None:
+            continue
+        for m in range(row["mes_ini"], row["mes_fin"] + 1):
+            d = meses.get((row["ejercicio"], m))
+            if d is None:
+                continue
+            for k in ("plat_ing_siva", "plat_iva_tras", "plat_iva_ret", "plat_isr_ret", "plat_comision"):
+                d[k] += float(row[k] or 0.0)
+            d["ret_count"] += int(row["ret_count"] or 0)
+
+    return list(meses.values())
+
+
+# Columnas del reporte de varios meses (CSV y /anual). Las "_acum" son acumuladas del
+# ejercicio (enero a la fecha), base de los pagos provisionales de ISR.
+COLUMNAS_REPORTE_RANGO = [
+    "periodo",
+    "ingresos_plataforma_sin_iva",
+    "ingresos_cfdi_sin_iva_aprox",
+    "ingresos_total_sin_iva",
+    "gastos_cfdi_sin_iva",
+    "isr_retenido_plataforma",
+    "iva_trasladado_plataforma",
+    "iva_retenido_plataforma",
+    "iva_trasladado_cfdi",
+    "iva_acreditable_gastos_cfdi",
+    "iva_neto_sugerido",
+    "fuente_ingresos",
+    "ingresos_acum",
+    "deducciones_acum",
+    "utilidad_acum",
+    "isr_retenido_acum",
+]
+
+_ACUMULABLES = {
+    "ingresos_acum": "ingresos_total_sin_iva",
+    "deducciones_acum": "gastos_cfdi_sin_iva",
+    "isr_retenido_acum": "isr_retenido_plataforma",
+}
+
+
+def _reporte_rango(meses: list[dict], income_source: str) -> tuple[list[dict], dict[int, dict]]:
+    """
+    Filas del reporte por mes (con acumulados del ejercicio) y totales por año.
+
+    Returns:
+        (filas_mensuales, {year: fila_total})
+    """
+    filas: list[dict] = []
+    totales: dict[int, dict] = {}
+    for d in meses:
+        ingresos, iva_tras, effective = calc_income_and_iva_sources(d, income_source)
+        fila = {
+            "year": d["year"],
+            "month": d["month"],
+            "periodo": f"{d['year']}-{d['month']:02d}",
+            "ingresos_plataforma_sin_iva": d["plat_ing_siva"],
+            "ingresos_cfdi_sin_iva_aprox": d["ingresos_base"],
+            "ingresos_total_sin_iva": ingresos,
+            "gastos_cfdi_sin_iva": d["gastos_base"],
+            "isr_retenido_plataforma": d["plat_isr_ret"],
+            "iva_trasladado_plataforma": d["plat_iva_tras"],
+            "iva_retenido_plataforma": d["plat_iva_ret"],
+            "iva_trasladado_cfdi": d["ingresos_trasl"],
+            "iva_acreditable_gastos_cfdi": d["gastos_trasl"],
+            "iva_neto_sugerido": iva_tras - d["gastos_trasl"] - d["plat_iva_ret"],
+            "fuente_ingresos": effective,
+        }
+
+        total = totales.get(d["year"])
+        if total is None:
+            total = totales[d["year"]] = {
+                "year": d["year"],
+                "month": None,
+                "periodo": f"{d['year']}-total",
+                "fuente_ingresos": "",
+                **{k: 0.0 for k in COLUMNAS_REPORTE_RANGO if k not in ("periodo", "fuente_ingresos")},
+            }
+        for k, v in fila.items():
+            if isinstance(v, float) and k in total:
+                total[k] += v
+
+        # Los acumulados empiezan en enero; si el rango empieza a media año, desde su primer mes
+        for acum, col in _ACUMULABLES.items():
+            fila[acum] = total[col]
+        fila["utilidad_acum"] = fila["ingresos_acum"] - fila["deducciones_acum"]
+        filas.append(fila)
+
+    for total in totales.values():
+        for acum, col in _ACUMULABLES.items():
+            total[acum] = total[col]
+        total["utilidad_acum"] = total["ingresos_acum"] - total["deducciones_acum"]
+    return filas, totales
+
+
+IMPUESTO_NOMBRES = {"001": "ISR", "002": "IVA", "003": "IEPS"}
+
+
+def _impuestos_por_tasa(db: Session, rfc: str, year: int, month: int) -> list[dict]:
+    """
+    Agrupa traslados/retenciones de comprobante por impuesto y tasa (16%, 8%, 0%, exento).
 
-    plat_iva_tras = float(data.get("plat_iva_tras") or 0.0)
-    cfdi_iva_tras = float(data.get("ingresos_trasl") or 0.0)
+    Una sola consulta agrupada sobre impuestos_comprobante; los tipo E restan.
 
-    if income_source == "plataforma":
-        return plat_income, plat_iva_tras, "plataforma"
-    elif income_source == "cfdi":
-        return cfdi_income, cfdi_iva_tras, "cfdi"
-    elif income_source == "ambos":
-        return plat_income + cfdi_income, plat_iva_tras + cfdi_iva_tras, "ambos"
-    else:
-        # auto: preferir plataforma si existen datos para evitar doble conteo
-        if plat_income > 0 or plat_iva_tras > 0:
-            return plat_income, plat_iva_tras, "plataforma"
+    Returns:
+        Lista de dicts con naturaleza, tipo, impuesto, tasa, base e importe.
+    """
+    rows = db.execute(queries.impuestos_por_tasa(rfc, year, month)).all()
+
+    out = []
+    for nat, tipo, impuesto, tipo_factor, tasa, base, importe in rows:
+        if (tipo_factor or "").lower() == "exento":
+            tasa_txt = "Exento"
+        elif tasa is not None and (tipo_factor or "").lower() == "tasa":
+            tasa_txt = f"{float(tasa) * 100:g}%"
         else:
-            return cfdi_income, cfdi_iva_tras, "cfdi"
+            tasa_txt = f"{tipo_factor or ''} {float(tasa) if tasa is not None else ''}".strip()
+        out.append({
+            "naturaleza": nat,
+            "tipo": tipo,
+            "impuesto": IMPUESTO_NOMBRES.get(impuesto or "", impuesto or ""),
+            "tasa": tasa_txt,
+            "base": float(base or 0.0),
+            "importe": float(importe or 0.0),
+        })
+    return out
+
+
+# Orden del desglose por categoría: lo deducible primero, lo no deducible al final
+_TRATAMIENTOS = {"deducible": "Deducible", "parcial": "Deducible en parte", "inversion": "Inversión",
+                 "personal": "Deducción personal", "no_deducible": "No deducible"}
+
+
+def _gastos_por_categoria(db: Session, rfc: str, year: int, month: int) -> list[dict]:
+    """
+    Desglose de los gastos del periodo por categoría de deducción (ver deducciones.py).
+
+    Returns:
+        Lista de dicts con categoria, etiqueta, tratamiento, conceptos e importe, en el
+        orden de ``_TRATAMIENTOS`` y de mayor a menor importe.
+    """
+    rows = db.execute(queries.gastos_por_categoria(rfc, year, month)).all()
+
+    orden = list(_TRATAMIENTOS)
+    out, rango = [], []
+    for categoria, conceptos, importe in rows:
+        nombre, tratamiento = deducciones.etiqueta(categoria)
+        out.append({
+            "categoria": categoria or deducciones.SIN_CLASIFICAR,
+            "etiqueta": nombre,
+            "tratamiento": _TRATAMIENTOS.get(tratamiento or "", "Revisar"),
+            "conceptos": conceptos,
+            "importe": float(importe or 0.0),
+        })
+        rango.append(orden.index(tratamiento) if tratamiento in orden else len(orden))
+    return [r for _, r in sorted(zip(rango, out), key=lambda x: (x[0], -x[1]["importe"]))]
 
 
-def _build_hoja_sat_text(
-    year: int, month: int, income_source: Optional[str], data: dict
-) -> tuple[str, str]:
+def _periodo(db: Session, rfc: str, year: int, month: int) -> Periodo:
+    """Agregados del periodo desde la caché compartida (``periodos.py``)."""
+    return periodos.cache.obtener(db, rfc, year, month, _compute_period_data)
+
+
+def _build_hoja_sat_text(periodo: Periodo, income_source: Optional[str]) -> tuple[str, str]:
     """
     Construye texto de hoja SAT para copiar/pegar a la declaración.
 
     Returns:
         (texto_hoja_sat, effective_source_usado)
     """
-    ingresos_sin_iva, iva_trasladado, effective = _calc_income_and_iva_sources(data, income_source)
+    data = periodo.data
+    ingresos_sin_iva, iva_trasladado, effective = periodo.fuentes(income_source)
 
     isr_retenido = float(data.get("plat_isr_ret") or 0.0)
     iva_retenido = float(data.get("plat_iva_ret") or 0.0)
     iva_acreditable = float(data.get("gastos_trasl") or 0.0)
 
-    iva_neto_sugerido = iva_trasladado - iva_acreditable - iva_retenido
+    iva_neto_sugerido = periodo.iva_neto(income_source)
 
     def fmt(x: float) -> str:
         return format_money(x)
 
     text = "\n".join([
-        f"PERIODO: {year}-{month:02d}",
+        f"PERIODO: {periodo.periodo}",
         f"FUENTE_INGRESOS: {effective.upper()} (selector: {income_source})",
         "",
         "ISR (Pago provisional)",
@@ -856,7 +1351,7 @@ def _build_hoja_sat_text(
 
 
 def _checklist(
-    db: Session, year: int, month: int, data: dict, income_source: str, effective_income_source: str
+    db: Session, rfc: str, year: int, month: int, data: dict, income_source: str, effective_income_source: str
 ) -> list[dict]:
     """
     Genera checklist de validaciones para el periodo.
@@ -866,7 +1361,8 @@ def _checklist(
     """
     checks = []
     ret_rows = data["ret_rows"]
-    docs = data["docs"]
+    # Los cancelados en el SAT y los sustituidos no cuentan en ninguna validación (ver 9)
+    docs = [d for d in data["docs"] if d.fecha_cancelacion is None and d.id not in data["sustituidos"]]
 
     # 1. Retenciones presentes
     if not ret_rows:
@@ -885,7 +1381,7 @@ def _checklist(
     # 2. RFC receptor coincide
     if ret_rows:
         receivers = sorted({(r.receptor_rfc or "").upper() for r in ret_rows if r.receptor_rfc})
-        if receivers and (MI_RFC or "").upper() not in receivers:
+        if receivers and (rfc or "").upper() not in receivers:
             checks.append({
                 "level": "warn",
                 "title": "RFC receptor no coincide",
@@ -957,17 +1453,84 @@ def _checklist(
             "detail": "Puede ser XML incompleto o namespace distinto.",
         })
 
-    # 8. Moneda no MXN
+    # 8. Moneda no MXN: los totales usan los importes *_mxn (ver tipos_cambio.py)
     other_cur = sorted(
         {(d.moneda or "").upper() for d in docs if d.moneda and (d.moneda or "").upper() != "MXN"}
     )
-    if other_cur:
+    sin_tc = [(d.moneda or "?").upper() for d in docs if d.tipo_cambio_mxn is None] + [
+        (p.moneda_p or "?").upper() for p, _ in data["pagos_rows"] if p.tipo_cambio_mxn is None
+    ]
+    if sin_tc:
+        monedas = sorted(set(sin_tc))
+        checks.append({
+            "level": "warn",
+            "title": f"{len(sin_tc)} CFDI/pagos sin tipo de cambio ({', '.join(monedas)})",
+            "detail": "No traen TipoCambio y no hay tipo de cambio cargado para su fecha; "
+                      "cuentan como 0 en los totales. Carga el CSV del DOF/Banxico con "
+                      "`python tipos_cambio.py cargar archivo.csv`.",
+        })
+    elif other_cur:
         checks.append({
             "level": "info",
             "title": f"Moneda distinta: {', '.join(other_cur)}",
-            "detail": "Debes convertir a MXN con tipo de cambio.",
+            "detail": "Convertidos a MXN con el TipoCambio del CFDI o, si no lo trae, con el tipo de cambio cargado.",
         })
 
+    # 9. Cancelados según la metadata del SAT y sustituidos por otro CFDI
+    if data["cancelados_count"]:
+        checks.append({
+            "level": "info",
+            "title": f"{data['cancelados_count']} CFDI cancelados en el SAT",
+            "detail": "Según la metadata de descarga masiva; no entran en los totales del periodo.",
+        })
+    if data["sustituidos"]:
+        checks.append({
+            "level": "info",
+            "title": f"{len(data['sustituidos'])} CFDI sustituidos",
+            "detail": "Otro CFDI vigente los sustituye (relación 04); cuenta el sustituto, no el original.",
+        })
+
+    # 10. CFDI vigentes en la metadata del SAT sin XML importado
+    sin_xml, monto_sin_xml = db.execute(queries.metadata_sin_xml_conteo(rfc, year, month)).one()
+    if sin_xml:
+        checks.append({
+            "level": "warn",
+            "title": f"{sin_xml} CFDI del SAT sin XML importado",
+            "detail": f"Suman {format_money(float(monto_sin_xml or 0.0))}; descárgalos e impórtalos (ver /metadata?year={year}&month={month}).",
+        })
+
+    # 11. Sello del emisor y timbre del SAT (verificación offline, ver sellos.py)
+    sellos_invalidos = [d for d in docs if d.sello_estatus == "invalido"]
+    sellos_pendientes = sum(1 for d in docs if d.sello_estatus is None)
+    sellos_otros = {e: sum(1 for d in docs if d.sello_estatus == e) for e in ("sin_cert_sat", "no_soportado", "error")}
+    if sellos_invalidos:
+        checks.append({
+            "level": "error",
+            "title": f"{len(sellos_invalidos)} CFDI con sello o timbre inválido",
+            "detail": "; ".join(f"{d.uuid}: {d.sello_detalle}" for d in sellos_invalidos[:3])
+            + ("; ..." if len(sellos_invalidos) > 3 else ""),
+        })
+    if sellos_pendientes:
+        checks.append({
+            "level": "info",
+            "title": f"{sellos_pendientes} CFDI sin verificar sello",
+            "detail": "Se verifican al terminar cada importación; también con: python sellos.py verificar",
+        })
+    elif docs and not sellos_invalidos:
+        otros = ", ".join(f"{n} {e}" for e, n in sellos_otros.items() if n)
+        if otros:
+            checks.append({
+                "level": "info",
+                "title": "Sellos verificados en parte",
+                "detail": f"Ninguno inválido, pero no se pudieron verificar todos: {otros} (ver el detalle de cada CFDI).",
+            })
+        else:
+            checks.append({
+                "level": "ok",
+                "title": "Sellos verificados",
+                "detail": "Sello y timbre válidos en todos los CFDI del periodo.",
+            })
+
     return checks
 
 
@@ -978,19 +1541,22 @@ def resumen_mensual(
     month: Optional[int] = None,
 ) -> HTMLResponse:
     """Resumen de ingresos, gastos, retenciones e IVA de un periodo."""
-    db = get_db()
+    rfc = _titular(request)
+    db = get_db(year)
     try:
         if year is None or month is None:
-            year, month = _pick_default_period(db)
+            year, month = _pick_default_period(db, rfc)
 
         if year is None or month is None:
-            return templates.TemplateResponse("empty.html", {"request": request, "mi_rfc": MI_RFC})
+            return templates.TemplateResponse("empty.html", {"request": request, "mi_rfc": rfc})
 
-        month_options = _month_options(db)
+        month_options = _month_options(db, rfc)
         year_options = sorted({y for (y, _) in month_options}, reverse=True)
         months_for_year = sorted({m for (y, m) in month_options if y == year})
 
-        data = _compute_period_data(db, year, month)
+        data = _periodo(db, rfc, year, month).data
+        impuestos_por_tasa = _impuestos_por_tasa(db, rfc, year, month)
+        gastos_por_categoria = _gastos_por_categoria(db, rfc, year, month)
 
         # Cálculos de IVA sugerido
         iva_causado_sugerido = data["plat_iva_tras"] + data["ingresos_trasl"]
@@ -1002,7 +1568,7 @@ def resumen_mensual(
             "summary.html",
             {
                 "request": request,
-                "mi_rfc": MI_RFC,
+                "mi_rfc": rfc,
                 "year": year,
                 "month": month,
                 "month_options": month_options,
@@ -1013,6 +1579,8 @@ def resumen_mensual(
                 "iva_acreditable_sugerido": iva_acreditable_sugerido,
                 "iva_retenido_plat": iva_retenido_plat,
                 "iva_neto_sugerido": iva_neto_sugerido,
+                "impuestos_por_tasa": impuestos_por_tasa,
+                "gastos_por_categoria": gastos_por_categoria,
             },
         )
     finally:
@@ -1032,37 +1600,32 @@ def modo_declaracion(
     Args:
         income_source: "auto"|"plataforma"|"cfdi"|"ambos" - evita doble conteo
     """
-    db = get_db()
+    rfc = _titular(request)
+    db = get_db(year)
     try:
         if year is None or month is None:
-            year, month = _pick_default_period(db)
+            year, month = _pick_default_period(db, rfc)
 
         if year is None or month is None:
-            return templates.TemplateResponse("empty.html", {"request": request, "mi_rfc": MI_RFC})
+            return templates.TemplateResponse("empty.html", {"request": request, "mi_rfc": rfc})
 
-        month_options = _month_options(db)
+        month_options = _month_options(db, rfc)
         year_options = sorted({y for (y, _) in month_options}, reverse=True)
         months_for_year = sorted({m for (y, m) in month_options if y == year})
 
-        data = _compute_period_data(db, year, month)
+        periodo = _periodo(db, rfc, year, month)
+        data = periodo.data
 
         # Calcular ingresos e IVA evitando doble conteo
-        ingresos_total_sin_iva, iva_trasladado_total, effective_income_source = (
-            _calc_income_and_iva_sources(data, income_source)
-        )
+        ingresos_total_sin_iva, iva_trasladado_total, effective_income_source = periodo.fuentes(income_source)
 
         isr_retenido = float(data.get("plat_isr_ret") or 0.0)
         iva_retenido = float(data.get("plat_iva_ret") or 0.0)
 
-        checks = _checklist(db, year, month, data, income_source, effective_income_source)
+        checks = _checklist(db, rfc, year, month, data, income_source, effective_income_source)
 
         # Obtener declaración PDF si existe
-        declaracion_pdf = db.scalars(
-            select(DeclaracionPDF)
-            .where(DeclaracionPDF.year == year, DeclaracionPDF.month == month)
-            .order_by(desc(DeclaracionPDF.created_at))
-            .limit(1)
-        ).first()
+        declaracion_pdf = db.scalars(queries.declaracion_del_periodo(rfc, year, month)).first()
 
         acuse_payload = None
         acuse_checks: list[dict] = []
@@ -1076,7 +1639,7 @@ def modo_declaracion(
             "declaracion.html",
             {
                 "request": request,
-                "mi_rfc": MI_RFC,
+                "mi_rfc": rfc,
                 "year": year,
                 "month": month,
                 "month_options": month_options,
@@ -1098,12 +1661,12 @@ def modo_declaracion(
     finally:
         db.close()
 @app.get("/sat_hoja.txt")
-def sat_hoja_txt(year: int, month: int, income_source: str = "auto"):
+def sat_hoja_txt(request: Request, year: int, month: int, income_source: str = "auto"):
     """Exporta hoja SAT como texto plano."""
-    db = get_db()
+    rfc = _titular(request)
+    db = get_db(year)
     try:
-        data = _compute_period_data(db, year, month)
-        hoja_text, effective = _build_hoja_sat_text(year, month, income_source, data)
+        hoja_text, effective = _build_hoja_sat_text(_periodo(db, rfc, year, month), income_source)
         return Response(
             content=hoja_text,
             media_type="text/plain; charset=utf-8",
@@ -1121,15 +1684,15 @@ def sat_hoja_view(
     income_source: str = "auto",
 ) -> HTMLResponse:
     """Vista HTML de hoja SAT con texto para copiar/pegar."""
-    db = get_db()
+    rfc = _titular(request)
+    db = get_db(year)
     try:
-        data = _compute_period_data(db, year, month)
-        hoja_text, effective = _build_hoja_sat_text(year, month, income_source, data)
+        hoja_text, effective = _build_hoja_sat_text(_periodo(db, rfc, year, month), income_source)
         return templates.TemplateResponse(
             "sat_hoja.html",
             {
                 "request": request,
-                "mi_rfc": MI_RFC,
+                "mi_rfc": rfc,
                 "year": year,
                 "month": month,
                 "income_source": income_source,
@@ -1141,57 +1704,200 @@ def sat_hoja_view(
         db.close()
 
 
+def _sat_report_csv(periodo: Periodo, income_source: str) -> str:
+    """CSV de papel de trabajo mensual (encabezado y un renglón)."""
+    import csv
+    import io
+
+    data = periodo.data
+    ingresos_total_sin_iva, _, _ = periodo.fuentes(income_source)
+
+    out = io.StringIO()
+    w = csv.writer(out)
+    w.writerow([
+        "periodo",
+        "ingresos_plataforma_sin_iva",
+        "ingresos_cfdi_sin_iva_aprox",
+        "ingresos_total_sin_iva",
+        "isr_retenido_plataforma",
+        "iva_trasladado_plataforma",
+        "iva_retenido_plataforma",
+        "iva_trasladado_cfdi",
+        "iva_acreditable_gastos_cfdi",
+        "iva_neto_sugerido",
+        "fuente_ingresos",
+    ])
+    w.writerow([
+        periodo.periodo,
+        f"{data['plat_ing_siva']:.2f}",
+        f"{data['ingresos_base']:.2f}",
+        f"{ingresos_total_sin_iva:.2f}",
+        f"{data['plat_isr_ret']:.2f}",
+        f"{data['plat_iva_tras']:.2f}",
+        f"{data['plat_iva_ret']:.2f}",
+        f"{data['ingresos_trasl']:.2f}",
+        f"{data['gastos_trasl']:.2f}",
+        f"{periodo.iva_neto(income_source):.2f}",
+        income_source,
+    ])
+    return out.getvalue()
+
+
 @app.get("/sat_report.csv")
-def sat_report_csv(year: int, month: int, income_source: str = "auto"):
+def sat_report_csv(request: Request, year: int, month: int, income_source: str = "auto"):
     """Genera CSV de papel de trabajo mensual."""
-    db = get_db()
+    rfc = _titular(request)
+    db = get_db(year)
     try:
-        data = _compute_period_data(db, year, month)
-
-        ingresos_total_sin_iva, iva_tras_total, effective_income_source = (
-            _calc_income_and_iva_sources(data, income_source)
+        return Response(
+            content=_sat_report_csv(_periodo(db, rfc, year, month), income_source),
+            media_type="text/csv; charset=utf-8",
+            headers={"Content-Disposition": f"attachment; filename=sat_report_{year}_{month:02d}.csv"},
         )
+    finally:
+        db.close()
 
-        iva_causado = iva_tras_total
-        iva_acreditable = data["gastos_trasl"]
-        iva_neto = iva_causado - iva_acreditable - data["plat_iva_ret"]
-
-        import csv
-        import io
-
-        out = io.StringIO()
-        w = csv.writer(out)
-        w.writerow([
-            "periodo",
-            "ingresos_plataforma_sin_iva",
-            "ingresos_cfdi_sin_iva_aprox",
-            "ingresos_total_sin_iva",
-            "isr_retenido_plataforma",
-            "iva_trasladado_plataforma",
-            "iva_retenido_plataforma",
-            "iva_trasladado_cfdi",
-            "iva_acreditable_gastos_cfdi",
-            "iva_neto_sugerido",
-            "fuente_ingresos",
-        ])
-        w.writerow([
-            f"{year}-{month:02d}",
-            f"{data['plat_ing_siva']:.2f}",
-            f"{data['ingresos_base']:.2f}",
-            f"{ingresos_total_sin_iva:.2f}",
-            f"{data['plat_isr_ret']:.2f}",
-            f"{data['plat_iva_tras']:.2f}",
-            f"{data['plat_iva_ret']:.2f}",
-            f"{data['ingresos_trasl']:.2f}",
-            f"{data['gastos_trasl']:.2f}",
-            f"{iva_neto:.2f}",
-            income_source,
-        ])
 
+@app.get("/diot.txt")
+def diot_txt(request: Request, year: int, month: int, tipo_operacion: str = "85"):
+    """DIOT del mes en formato de carga masiva (``|``), generada por flujo."""
+    if not 1 <= month <= 12:
+        return Response(content="month debe estar entre 1 y 12", status_code=400)
+    if tipo_operacion not in diot.TIPOS_OPERACION:
+        return Response(content=f"tipo_operacion debe ser uno de: {', '.join(diot.TIPOS_OPERACION)}", status_code=400)
+    return diot.respuesta_diot(_titular(request), year, month, tipo_operacion)
+
+
+def _validar_contabilidad(year: int, month: Optional[int], ingresos: str, tipo_envio: str) -> Optional[Response]:
+    if month is not None and not 1 <= month <= 12:
+        return Response(content="month debe estar entre 1 y 12", status_code=400)
+    if not 1900 <= year <= 9999:
+        return Response(content="year no válido", status_code=400)
+    if ingresos not in contabilidad.FUENTES_INGRESOS:
+        return Response(content=f"ingresos debe ser uno de: {', '.join(contabilidad.FUENTES_INGRESOS)}", status_code=400)
+    if tipo_envio not in contabilidad.TIPOS_ENVIO:
+        return Response(content="tipo_envio debe ser N o C", status_code=400)
+    return None
+
+
+def _descarga(chunks, media_type: str, nombre: str) -> StreamingResponse:
+    return StreamingResponse(chunks, media_type=media_type, headers={"Content-Disposition": f"attachment; filename={nombre}"})
+
+
+@app.get("/contabilidad/catalogo.xml")
+def contabilidad_catalogo(request: Request, year: int, month: int):
+    """Catálogo de cuentas de la contabilidad electrónica (XML 1.3)."""
+    error = _validar_contabilidad(year, month, "ambos", "N")
+    if error:
+        return error
+    rfc = _titular(request)
+    return _descarga(
+        contabilidad.catalogo_xml(rfc, year, month),
+        "application/xml",
+        contabilidad.nombre_archivo(rfc, year, month, "CT"),
+    )
+
+
+@app.get("/contabilidad/balanza.xml")
+def contabilidad_balanza(request: Request, year: int, month: int, ingresos: str = "ambos", tipo_envio: str = "N"):
+    """Balanza de comprobación del mes (XML 1.3), derivada de CFDI, pagos y retenciones."""
+    error = _validar_contabilidad(year, month, ingresos, tipo_envio)
+    if error:
+        return error
+    rfc = _titular(request)
+    return _descarga(
+        contabilidad.balanza_xml(rfc, year, month, ingresos, tipo_envio),
+        "application/xml",
+        contabilidad.nombre_archivo(rfc, year, month, "B" + tipo_envio),
+    )
+
+
+@app.get("/contabilidad/balanzas.zip")
+def contabilidad_balanzas_zip(request: Request, year: int, ingresos: str = "ambos", tipo_envio: str = "N"):
+    """Las doce balanzas del ejercicio en un ZIP enviado por flujo."""
+    error = _validar_contabilidad(year, None, ingresos, tipo_envio)
+    if error:
+        return error
+    rfc = _titular(request)
+    return _descarga(
+        contabilidad.balanzas_zip(rfc, year, ingresos, tipo_envio), "application/zip", f"balanzas_{rfc}_{year}.zip"
+    )
+
+
+def _rango_periodos(desde: Optional[str], hasta: Optional[str]) -> Optional[tuple[tuple[int, int], tuple[int, int]]]:
+    """Valida ``desde``/``hasta`` (YYYY-MM). Regresa None si el rango no es válido."""
+    d = extract_period_parts(desde)
+    h = extract_period_parts(hasta)
+    if None in d or None in h or not (1 <= d[1] <= 12 and 1 <= h[1] <= 12) or d > h:
+        return None
+    if len(_meses(d, h)) > RANGO_MAX_MESES:
+        return None
+    return d, h
+
+
+@app.get("/sat_report_range.csv")
+def sat_report_range_csv(request: Request, desde: str, hasta: str, income_source: str = "auto"):
+    """CSV de papel de trabajo de varios meses: un renglón por mes y uno de total por año."""
+    rango = _rango_periodos(desde, hasta)
+    if rango is None:
         return Response(
-            content=out.getvalue(),
-            media_type="text/csv; charset=utf-8",
-            headers={"Content-Disposition": f"attachment; filename=sat_report_{year}_{month:02d}.csv"},
+            content=f"Rango inválido: usa desde/hasta como YYYY-MM, desde <= hasta, hasta {RANGO_MAX_MESES} meses",
+            status_code=400,
         )
+    rfc = _titular(request)
+    (dy, dm), (hy, hm) = rango
+    db = get_db(*range(dy, hy + 1))
+    try:
+        filas, totales = _reporte_rango(_compute_range_data(db, rfc, *rango), income_source)
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+    import csv
+    import io
+
+    def renglon(fila: dict) -> list:
+        return [f"{v:.2f}" if isinstance(v, float) else v for v in (fila[c] for c in COLUMNAS_REPORTE_RANGO)]
+
+    out = io.StringIO()
+    w = csv.writer(out)
+    w.writerow(COLUMNAS_REPORTE_RANGO)
+    for fila in filas:
+        w.writerow(renglon(fila))
+        if fila["month"] == 12 or fila is filas[-1]:
+            w.writerow(renglon(totales[fila["year"]]))
+
+    return Response(
+        content=out.getvalue(),
+        media_type="text/csv; charset=utf-8",
+        headers={"Content-Disposition": f"attachment; filename=sat_report_{dy}_{dm:02d}_{hy}_{hm:02d}.csv"},
+    )
+
+
+@app.get("/anual", response_class=HTMLResponse)
+def resumen_anual(request: Request, year: Optional[int] = None, income_source: str = "auto") -> HTMLResponse:
+    """Resumen del ejercicio: los 12 meses con acumulados para pagos provisionales."""
+    rfc = _titular(request)
+    db = get_db(year)
+    try:
+        if year is None:
+            year, _ = _pick_default_period(db, rfc)
+        if year is None:
+            return templates.TemplateResponse("empty.html", {"request": request, "mi_rfc": rfc})
+
+        year_options = sorted({y for (y, _) in _month_options(db, rfc)} | {year}, reverse=True)
+        filas, totales = _reporte_rango(_compute_range_data(db, rfc, (year, 1), (year, 12)), income_source)
+
+        return templates.TemplateResponse(
+            "anual.html",
+            {
+                "request": request,
+                "mi_rfc": rfc,
+                "year": year,
+                "year_options": year_options,
+                "income_source": income_source,
+                "filas": filas,
+                "total": totales[year],
+            },
+        )
+    finally:
+        db.close()
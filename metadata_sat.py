@@ -0,0 +1,279 @@
+"""Metadata de la descarga masiva del SAT: estatus (vigente/cancelado) de cada CFDI.
+
+La descarga masiva entrega, además de los XML, archivos de metadata de texto (separados
+por ``~``, con encabezado; a veces dentro de un ``.zip``) con un renglón por CFDI:
+``Uuid~RfcEmisor~NombreEmisor~RfcReceptor~NombreReceptor~RfcPac~FechaEmision~
+FechaCertificacionSat~Monto~EfectoComprobante~Estatus~FechaCancelacion``. Pueden ser
+millones de renglones, así que:
+
+- El archivo se lee por flujo (renglón a renglón, también dentro del zip) y se carga a
+  ``metadata_sat`` en lotes de ``--lote`` renglones con un ``executemany`` por lote
+  (``INSERT ... ON CONFLICT DO UPDATE``: recargar un archivo solo reescribe los que
+  cambiaron de estatus). Cada lote es su propia transacción corta, así que las
+  importaciones de XML no esperan a que termine la carga.
+- Al final, un solo ``UPDATE facturas ... FROM metadata_sat`` copia el estatus a los CFDI
+  importados (``importer.aplicar_estatus_sat``); los que se importen después lo toman al
+  insertarse. Un CFDI con ``fecha_cancelacion`` sale de todos los agregados (resumen,
+  reportes, DIOT, contabilidad electrónica) por el índice parcial de vigentes.
+- Los UUID vigentes de la metadata sin XML importado se listan en ``/metadata`` y en el
+  checklist de la declaración (``queries.metadata_sin_xml``).
+
+Solo se guardan los renglones donde el titular es emisor o receptor. Los ejercicios del
+archivo frío no se actualizan.
+
+Uso:
+    python metadata_sat.py cargar Metadata.txt [otro.zip ...] --rfc XAXX010101000
+"""
+
+from __future__ import annotations
+
+import argparse
+import io
+import sys
+import time
+import zipfile
+from dataclasses import dataclass, field
+from datetime import datetime
+from pathlib import Path
+from typing import BinaryIO, Iterable, Iterator, Optional
+
+from config import MI_RFC
+from db import sync_schema, write_session
+from estado import bump_data_version
+from importer import aplicar_estatus_sat
+from models import Base
+from utils import parse_iso_datetime
+
+
+LOTE = 50_000  # renglones por executemany / transacción
+SEPARADOR = "~"
+MAX_ERRORES = 20  # renglones con error que se reportan (se cuentan todos)
+
+# Columnas del encabezado que se usan, en minúsculas (las demás, como los nombres, se ignoran)
+COLUMNAS = (
+    "uuid",
+    "rfcemisor",
+    "rfcreceptor",
+    "fechaemision",
+    "monto",
+    "efectocomprobante",
+    "estatus",
+    "fechacancelacion",
+)
+ESTATUS = {"1": "vigente", "0": "cancelado", "vigente": "vigente", "cancelado": "cancelado"}
+
+
+class MetadataInvalida(Exception):
+    """El archivo no tiene el encabezado de la metadata del SAT."""
+
+
+@dataclass
+class Resumen:
+    renglones: int = 0
+    cargados: int = 0
+    cancelados: int = 0
+    ajenos: int = 0  # el titular no es emisor ni receptor
+    facturas_actualizadas: int = 0
+    errores: int = 0
+    detalle_errores: list[str] = field(default_factory=list)
+
+    def error(self, msg: str) -> None:
+        self.errores += 1
+        if len(self.detalle_errores) < MAX_ERRORES:
+            self.detalle_errores.append(msg)
+
+
+def _lineas(nombre: str, archivo: BinaryIO) -> Iterator[tuple[str, str]]:
+    """Renglones de texto (nombre, renglón) de un ``.txt`` o de cada ``.txt`` de un ``.zip``."""
+    inicio = archivo.read(4)
+    archivo.seek(0)
+    if inicio.startswith(b"PK"):
+        with zipfile.ZipFile(archivo) as zf:
+            for miembro in zf.infolist():
+                if miembro.is_dir():
+                    continue
+                with zf.open(miembro) as f:
+                    texto = io.TextIOWrapper(f, encoding="utf-8-sig", errors="replace", newline="")
+                    yield from ((f"{nombre}/{miembro.filename}", linea) for linea in texto)
+        return
+    texto = io.TextIOWrapper(archivo, encoding="utf-8-sig", errors="replace", newline="")
+    try:
+        yield from ((nombre, linea) for linea in texto)
+    finally:
+        texto.detach()  # el llamador cierra el archivo
+
+
+def _fecha_sql(texto: str) -> Optional[str]:
+    """Fecha de la metadata (``AAAA-MM-DD HH:MM:SS``) en el formato de ``DateTime`` de SQLAlchemy en SQLite.
+
+    Camino rápido sin ``datetime`` para el formato del SAT; cualquier otro pasa por el
+    parser ISO. ``ValueError`` si no es una fecha.
+    """
+    if not texto:
+        return None
+    if len(texto) == 19 and texto[10] in " T" and texto[:4].isdigit() and texto[5:7].isdigit():
+        return f"{texto[:10]} {texto[11:]}.000000"
+    dt = parse_iso_datetime(texto)
+    if dt is None:
+        raise ValueError(f"fecha inválida {texto!r}")
+    return dt.strftime("%Y-%m-%d %H:%M:%S.%f")
+
+
+# Orden de los parámetros de ``_UPSERT``
+_CAMPOS = (
+    "titular_rfc",
+    "uuid",
+    "emisor_rfc",
+    "receptor_rfc",
+    "fecha_emision",
+    "year_emision",
+    "month_emision",
+    "monto",
+    "efecto",
+    "estatus",
+    "fecha_cancelacion",
+    "cargado_en",
+)
+
+# executemany directo al driver: con millones de renglones el procesamiento de tipos
+# del ORM por parámetro es la mayor parte del tiempo. Si el UUID ya estaba solo se
+# reescribe cuando cambia el estatus.
+_UPSERT = (
+    f"INSERT INTO metadata_sat ({', '.join(_CAMPOS)}) VALUES ({', '.join('?' * len(_CAMPOS))}) "
+    "ON CONFLICT (titular_rfc, uuid) DO UPDATE SET "
+    "estatus = excluded.estatus, fecha_cancelacion = excluded.fecha_cancelacion, cargado_en = excluded.cargado_en "
+    "WHERE metadata_sat.estatus IS NOT excluded.estatus "
+    "OR metadata_sat.fecha_cancelacion IS NOT excluded.fecha_cancelacion"
+)
+
+
+def leer(nombre: str, archivo: BinaryIO, titular_rfc: str, resumen: Resumen) -> Iterator[tuple]:
+    """Renglones de metadata del titular como tuplas de ``_CAMPOS`` (sin ``cargado_en``), por flujo.
+
+    Cada archivo (o miembro del zip) empieza con su encabezado; los renglones vacíos se
+    omiten y los mal formados se cuentan en ``resumen``.
+    """
+    posiciones: Optional[list[Optional[int]]] = None
+    n_campos = 0
+    actual = None
+    for origen, linea in _lineas(nombre, archivo):
+        if origen != actual:
+            actual, posiciones = origen, None
+        linea = linea.rstrip("\r\n")
+        if not linea.strip():
+            continue
+        campos = linea.split(SEPARADOR)
+        if posiciones is None:
+            encabezado = {c.strip().lower(): i for i, c in enumerate(campos)}
+            if "uuid" not in encabezado or "estatus" not in encabezado:
+                raise MetadataInvalida(f"{origen}: no es un archivo de metadata del SAT (encabezado: {linea[:80]!r})")
+            # Posición de cada llave de COLUMNAS (None si el archivo no la trae)
+            posiciones = [encabezado.get(c) for c in COLUMNAS]
+            n_campos = len(campos)
+            continue
+
+        resumen.renglones += 1
+        if len(campos) != n_campos:
+            resumen.error(f"{origen}: renglón {resumen.renglones} con {len(campos)} campos en lugar de {n_campos}")
+            continue
+        uuid, emisor, receptor, fecha, monto, efecto, estatus, cancelacion = (
+            campos[i].strip() if i is not None else "" for i in posiciones
+        )
+        estatus = ESTATUS.get(estatus.lower())
+        if not uuid or estatus is None:
+            resumen.error(f"{origen}: renglón {resumen.renglones} sin UUID o con Estatus inválido")
+            continue
+        emisor, receptor = emisor.upper(), receptor.upper()
+        if titular_rfc != emisor and titular_rfc != receptor:
+            resumen.ajenos += 1
+            continue
+        try:
+            fecha = _fecha_sql(fecha)
+            cancelacion = _fecha_sql(cancelacion)
+            monto = float(monto.replace("$", "").replace(",", "")) if monto else None
+        except ValueError as e:
+            resumen.error(f"{origen}: renglón {resumen.renglones}: {e}")
+            continue
+        if estatus == "cancelado":
+            resumen.cancelados += 1
+        yield (
+            titular_rfc,
+            uuid.upper(),
+            emisor or None,
+            receptor or None,
+            fecha,
+            int(fecha[:4]) if fecha else None,
+            int(fecha[5:7]) if fecha else None,
+            monto,
+            efecto[:5].upper() or None,
+            estatus,
+            cancelacion,
+        )
+
+
+def _cargar_lote(filas: list[tuple], resumen: Resumen) -> None:
+    ahora = (datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S.%f"),)
+    with write_session(bulk=True) as db:
+        db.connection().exec_driver_sql(_UPSERT, [f + ahora for f in filas])
+        db.commit()
+    resumen.cargados += len(filas)
+
+
+def cargar(fuentes: Iterable[tuple[str, BinaryIO]], titular_rfc: Optional[str] = None, lote: int = LOTE) -> Resumen:
+    """Carga archivos de metadata (nombre, archivo binario) y aplica el estatus a ``facturas``.
+
+    La memoria depende de ``lote``, no del tamaño del archivo. Lanza ``MetadataInvalida``
+    si un archivo no trae el encabezado esperado (lo ya cargado se conserva).
+    """
+    titular_rfc = (titular_rfc or MI_RFC or "").upper()
+    resumen = Resumen()
+    filas: list[tuple] = []
+    for nombre, archivo in fuentes:
+        for fila in leer(nombre, archivo, titular_rfc, resumen):
+            filas.append(fila)
+            if len(filas) >= lote:
+                _cargar_lote(filas, resumen)
+                filas = []
+    if filas:
+        _cargar_lote(filas, resumen)
+
+    with write_session() as db:
+        resumen.facturas_actualizadas = aplicar_estatus_sat(db, titular_rfc)
+        if resumen.facturas_actualizadas:
+            bump_data_version(db)
+        db.commit()
+    return resumen
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="Metadata de la descarga masiva del SAT (estatus de CFDI).")
+    sub = ap.add_subparsers(dest="comando", required=True)
+    p = sub.add_parser("cargar", help="Carga archivos de metadata (.txt o .zip) y actualiza el estatus")
+    p.add_argument("archivos", type=Path, nargs="+")
+    p.add_argument("--rfc", default=None, help="RFC titular (default: config.MI_RFC)")
+    p.add_argument("--lote", type=int, default=LOTE, help=f"Renglones por transacción (default {LOTE})")
+    args = ap.parse_args()
+
+    sync_schema(Base.metadata)
+    t0 = time.perf_counter()
+    abiertos = [open(ruta, "rb") for ruta in args.archivos]
+    try:
+        res = cargar(((str(r), f) for r, f in zip(args.archivos, abiertos)), args.rfc, args.lote)
+    except MetadataInvalida as e:
+        print(f"error: {e}", file=sys.stderr)
+        sys.exit(2)
+    finally:
+        for f in abiertos:
+            f.close()
+    dt = time.perf_counter() - t0
+    print(
+        f"{res.renglones} renglones ({res.renglones / max(dt, 1e-9):.0f}/s): {res.cargados} del titular, "
+        f"{res.cancelados} cancelados, {res.ajenos} de otros RFC, {res.errores} con error; "
+        f"{res.facturas_actualizadas} facturas cambiaron de estatus en {dt:.1f} s"
+    )
+    for msg in res.detalle_errores:
+        print(f"  {msg}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,7 @@
 from __future__ import annotations
 
-from datetime import datetime
-from sqlalchemy import String, DateTime, Numeric, Integer, ForeignKey, UniqueConstraint, Text
+from datetime import date, datetime
+from sqlalchemy import String, Date, DateTime, Numeric, Integer, ForeignKey, UniqueConstraint, Text, Index, text
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 
 from db import Base
@@ -12,26 +12,30 @@ class Factura(Base):
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
 
+    # Contribuyente dueño de la contabilidad (modo multi-RFC)
+    titular_rfc: Mapped[str | None] = mapped_column(String(20), nullable=True)
+
     # Identificación
     uuid: Mapped[str | None] = mapped_column(String(40), index=True, nullable=True)
 
     # CFDI
     version: Mapped[str | None] = mapped_column(String(10), nullable=True)
-    tipo_comprobante: Mapped[str | None] = mapped_column(String(5), index=True, nullable=True)  # I, E, P, T, N...
-    fecha_emision: Mapped[datetime | None] = mapped_column(DateTime, index=True, nullable=True)
+    tipo_comprobante: Mapped[str | None] = mapped_column(String(5), nullable=True)  # I, E, P, T, N...
+    fecha_emision: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
 
-    year_emision: Mapped[int | None] = mapped_column(Integer, index=True, nullable=True)
-    month_emision: Mapped[int | None] = mapped_column(Integer, index=True, nullable=True)
+    year_emision: Mapped[int | None] = mapped_column(Integer, nullable=True)
+    month_emision: Mapped[int | None] = mapped_column(Integer, nullable=True)
 
     # Clasificación automática
     # ingreso / gasto / cobro (P emitido) / pago (P recibido) / otro
-    naturaleza: Mapped[str | None] = mapped_column(String(12), index=True, nullable=True)
+    naturaleza: Mapped[str | None] = mapped_column(String(12), nullable=True)
 
+    # El RFC se queda en la fila (clasificación y filtros); el nombre vive en ``contribuyentes``
     emisor_rfc: Mapped[str | None] = mapped_column(String(20), index=True, nullable=True)
-    emisor_nombre: Mapped[str | None] = mapped_column(String(300), nullable=True)
+    emisor_id: Mapped[int | None] = mapped_column(ForeignKey("contribuyentes.id"), nullable=True)
 
     receptor_rfc: Mapped[str | None] = mapped_column(String(20), index=True, nullable=True)
-    receptor_nombre: Mapped[str | None] = mapped_column(String(300), nullable=True)
+    receptor_id: Mapped[int | None] = mapped_column(ForeignKey("contribuyentes.id"), nullable=True)
     uso_cfdi: Mapped[str | None] = mapped_column(String(10), nullable=True)
 
     moneda: Mapped[str | None] = mapped_column(String(10), nullable=True)
@@ -45,6 +49,32 @@ class Factura(Base):
     total_trasladados: Mapped[float | None] = mapped_column(Numeric(18, 6), nullable=True)
     total_retenidos: Mapped[float | None] = mapped_column(Numeric(18, 6), nullable=True)
 
+    # Importes en MXN para los agregados (ver tipos_cambio.py). ``tipo_cambio`` es el del XML;
+    # ``tipo_cambio_mxn`` el que se aplicó: 1 en MXN, el del XML o el de ``tipos_cambio``.
+    # NULL = moneda extranjera sin tipo de cambio (los *_mxn quedan NULL y no suman).
+    tipo_cambio: Mapped[float | None] = mapped_column(Numeric(18, 6), nullable=True)
+    tipo_cambio_mxn: Mapped[float | None] = mapped_column(Numeric(18, 6), nullable=True)
+    base_mxn: Mapped[float | None] = mapped_column(Numeric(18, 6), nullable=True)  # SubTotal - Descuento
+    total_mxn: Mapped[float | None] = mapped_column(Numeric(18, 6), nullable=True)
+    trasladados_mxn: Mapped[float | None] = mapped_column(Numeric(18, 6), nullable=True)
+    retenidos_mxn: Mapped[float | None] = mapped_column(Numeric(18, 6), nullable=True)
+
+    # Saldo de facturas PPD: se recalcula al importar sus complementos de pago (pago_documento)
+    saldo_pagado: Mapped[float | None] = mapped_column(Numeric(18, 6), nullable=True)
+    saldo_pendiente: Mapped[float | None] = mapped_column(Numeric(18, 6), nullable=True)
+
+    # Estatus según la metadata de descarga masiva del SAT (ver metadata_sat.py); NULL = sin metadata.
+    # Un CFDI está cancelado si tiene fecha_cancelacion: no entra en ningún agregado.
+    estatus_sat: Mapped[str | None] = mapped_column(String(10), nullable=True)  # vigente / cancelado
+    fecha_cancelacion: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
+
+    # Verificación offline del sello y el timbre (ver sellos.py); NULL = sin verificar.
+    sello_estatus: Mapped[str | None] = mapped_column(String(15), nullable=True)
+    sello_detalle: Mapped[str | None] = mapped_column(String(200), nullable=True)
+
+    # Versión del parser que generó las columnas derivadas (ver rederive.py)
+    parser_version: Mapped[int | None] = mapped_column(Integer, index=True, nullable=True)
+
     xml_text: Mapped[str] = mapped_column(Text, nullable=False)
 
     conceptos: Mapped[list["Concepto"]] = relationship(
@@ -57,8 +87,50 @@ class Factura(Base):
         cascade="all, delete-orphan",
     )
 
+    relacionados: Mapped[list["CfdiRelacionado"]] = relationship(
+        back_populates="factura",
+        cascade="all, delete-orphan",
+    )
+
+    impuestos: Mapped[list["ImpuestoComprobante"]] = relationship(
+        back_populates="factura",
+        cascade="all, delete-orphan",
+    )
+
+    emisor: Mapped["Contribuyente | None"] = relationship(foreign_keys=[emisor_id])
+    receptor: Mapped["Contribuyente | None"] = relationship(foreign_keys=[receptor_id])
+
+    @property
+    def emisor_nombre(self) -> str | None:
+        return self.emisor.nombre if self.emisor else None
+
+    @property
+    def receptor_nombre(self) -> str | None:
+        return self.receptor.nombre if self.receptor else None
+
+    # Índices por consulta de ruta (ver queries.py y scripts/check_query_plans.py); la fecha al
+    # final deja el resultado ya ordenado y evita el sort temporal.
     __table_args__ = (
-        UniqueConstraint("uuid", name="uq_facturas_uuid"),
+        UniqueConstraint("titular_rfc", "uuid", name="uq_facturas_titular_uuid"),
+        Index("ix_facturas_titular_periodo_fecha", "titular_rfc", "year_emision", "month_emision", "fecha_emision"),
+        # Parcial: solo vigentes. Los agregados por periodo filtran ``fecha_cancelacion IS NULL``
+        # y recorren este índice, así que los cancelados ni siquiera se leen.
+        Index(
+            "ix_facturas_vigentes_periodo",
+            "titular_rfc",
+            "year_emision",
+            "month_emision",
+            "fecha_emision",
+            sqlite_where=text("fecha_cancelacion IS NULL"),
+        ),
+        Index("ix_facturas_titular_fecha", "titular_rfc", "fecha_emision"),
+        # Parcial: la cola de ``sellos.verificar`` (casi siempre vacía) sin recorrer la tabla
+        Index("ix_facturas_sello_pendiente", "id", sqlite_where=text("sello_estatus IS NULL")),
+        # Parcial: los que esperan tipo de cambio (``tipos_cambio.normalizar_pendientes``)
+        Index("ix_facturas_mxn_pendiente", "id", sqlite_where=text("tipo_cambio_mxn IS NULL")),
+        Index("ix_facturas_titular_metodo_fecha", "titular_rfc", "metodo_pago", "fecha_emision"),
+        Index("ix_facturas_titular_emisor", "titular_rfc", "emisor_id"),
+        Index("ix_facturas_titular_receptor", "titular_rfc", "receptor_id"),
     )
 
 
@@ -78,8 +150,73 @@ class Concepto(Base):
 
     objeto_imp: Mapped[str | None] = mapped_column(String(5), nullable=True)
 
+    # Categoría de deducción según ClaveProdServ, UsoCFDI y FormaPago (ver deducciones.py);
+    # NULL = sin clasificar todavía (base anterior), "sin_clasificar" = ninguna regla aplica.
+    categoria_deduccion: Mapped[str | None] = mapped_column(String(30), nullable=True)
+
     factura: Mapped["Factura"] = relationship(back_populates="conceptos")
 
+    impuestos: Mapped[list["ImpuestoConcepto"]] = relationship(
+        back_populates="concepto",
+        cascade="all, delete-orphan",
+    )
+
+    __table_args__ = (
+        # Parcial: los que esperan clasificación (``deducciones.clasificar_pendientes``)
+        Index("ix_conceptos_sin_categoria", "factura_id", sqlite_where=text("categoria_deduccion IS NULL")),
+    )
+
+
+class ImpuestoConcepto(Base):
+    """Traslados/Retenciones de cada concepto (cfdi:Concepto/cfdi:Impuestos)."""
+
+    __tablename__ = "impuestos_concepto"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    concepto_id: Mapped[int] = mapped_column(ForeignKey("conceptos.id"), index=True)
+    factura_id: Mapped[int] = mapped_column(ForeignKey("facturas.id"), index=True)
+
+    tipo: Mapped[str] = mapped_column(String(10))  # traslado / retencion
+    impuesto: Mapped[str | None] = mapped_column(String(5), nullable=True)  # 001 ISR, 002 IVA, 003 IEPS
+    tipo_factor: Mapped[str | None] = mapped_column(String(10), nullable=True)  # Tasa / Cuota / Exento
+    tasa_o_cuota: Mapped[float | None] = mapped_column(Numeric(18, 6), nullable=True)
+
+    base: Mapped[float | None] = mapped_column(Numeric(18, 6), nullable=True)
+    importe: Mapped[float | None] = mapped_column(Numeric(18, 6), nullable=True)
+
+    concepto: Mapped["Concepto"] = relationship(back_populates="impuestos")
+    factura: Mapped["Factura"] = relationship()
+
+    __table_args__ = (
+        Index("ix_imp_concepto_tipo_impuesto_tasa", "tipo", "impuesto", "tasa_o_cuota"),
+    )
+
+
+class ImpuestoComprobante(Base):
+    """Traslados/Retenciones a nivel comprobante (cfdi:Comprobante/cfdi:Impuestos)."""
+
+    __tablename__ = "impuestos_comprobante"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    factura_id: Mapped[int] = mapped_column(ForeignKey("facturas.id"), index=True)
+
+    tipo: Mapped[str] = mapped_column(String(10))  # traslado / retencion
+    impuesto: Mapped[str | None] = mapped_column(String(5), nullable=True)
+    tipo_factor: Mapped[str | None] = mapped_column(String(10), nullable=True)
+    tasa_o_cuota: Mapped[float | None] = mapped_column(Numeric(18, 6), nullable=True)
+
+    base: Mapped[float | None] = mapped_column(Numeric(18, 6), nullable=True)
+    importe: Mapped[float | None] = mapped_column(Numeric(18, 6), nullable=True)
+    # Con el ``tipo_cambio_mxn`` de la factura
+    base_mxn: Mapped[float | None] = mapped_column(Numeric(18, 6), nullable=True)
+    importe_mxn: Mapped[float | None] = mapped_column(Numeric(18, 6), nullable=True)
+
+    factura: Mapped["Factura"] = relationship(back_populates="impuestos")
+
+    __table_args__ = (
+        Index("ix_imp_comprobante_tipo_impuesto_tasa", "tipo", "impuesto", "tasa_o_cuota"),
+    )
+
 
 class Pago(Base):
     """Renglones del Complemento de Pagos (TipoDeComprobante='P')"""
@@ -88,17 +225,91 @@ class Pago(Base):
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
     factura_id: Mapped[int] = mapped_column(ForeignKey("facturas.id"), index=True)
+    titular_rfc: Mapped[str | None] = mapped_column(String(20), nullable=True)
 
-    fecha_pago: Mapped[datetime | None] = mapped_column(DateTime, index=True, nullable=True)
-    year_pago: Mapped[int | None] = mapped_column(Integer, index=True, nullable=True)
-    month_pago: Mapped[int | None] = mapped_column(Integer, index=True, nullable=True)
+    fecha_pago: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
+    year_pago: Mapped[int | None] = mapped_column(Integer, nullable=True)
+    month_pago: Mapped[int | None] = mapped_column(Integer, nullable=True)
 
     monto: Mapped[float | None] = mapped_column(Numeric(18, 6), nullable=True)
     moneda_p: Mapped[str | None] = mapped_column(String(10), nullable=True)
     forma_pago_p: Mapped[str | None] = mapped_column(String(10), nullable=True)
 
+    # Como en Factura: TipoCambioP del XML, el aplicado (NULL = sin tipo de cambio) y el monto en MXN
+    tipo_cambio_p: Mapped[float | None] = mapped_column(Numeric(18, 6), nullable=True)
+    tipo_cambio_mxn: Mapped[float | None] = mapped_column(Numeric(18, 6), nullable=True)
+    monto_mxn: Mapped[float | None] = mapped_column(Numeric(18, 6), nullable=True)
+
     factura: Mapped["Factura"] = relationship(back_populates="pagos")
 
+    documentos: Mapped[list["PagoDocumento"]] = relationship(
+        back_populates="pago",
+        cascade="all, delete-orphan",
+    )
+
+    __table_args__ = (
+        Index("ix_pagos_titular_periodo_fecha", "titular_rfc", "year_pago", "month_pago", "fecha_pago"),
+        Index("ix_pagos_mxn_pendiente", "factura_id", sqlite_where=text("tipo_cambio_mxn IS NULL")),
+    )
+
+
+class PagoDocumento(Base):
+    """DoctoRelacionado de un pago: liga el complemento P con la factura PPD que liquida."""
+
+    __tablename__ = "pago_documento"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    pago_id: Mapped[int] = mapped_column(ForeignKey("pagos.id"), index=True)
+    factura_id: Mapped[int] = mapped_column(ForeignKey("facturas.id"), index=True)  # el CFDI tipo P
+    titular_rfc: Mapped[str | None] = mapped_column(String(20), nullable=True)
+
+    id_documento: Mapped[str | None] = mapped_column(String(40), nullable=True)  # UUID de la factura pagada
+    serie: Mapped[str | None] = mapped_column(String(30), nullable=True)
+    folio: Mapped[str | None] = mapped_column(String(60), nullable=True)
+    moneda_dr: Mapped[str | None] = mapped_column(String(10), nullable=True)
+    equivalencia_dr: Mapped[float | None] = mapped_column(Numeric(18, 6), nullable=True)
+    num_parcialidad: Mapped[int | None] = mapped_column(Integer, nullable=True)
+
+    imp_saldo_ant: Mapped[float | None] = mapped_column(Numeric(18, 6), nullable=True)
+    imp_pagado: Mapped[float | None] = mapped_column(Numeric(18, 6), nullable=True)
+    imp_saldo_insoluto: Mapped[float | None] = mapped_column(Numeric(18, 6), nullable=True)
+    objeto_imp_dr: Mapped[str | None] = mapped_column(String(5), nullable=True)
+
+    # IVA (002) trasladado en ImpuestosDR, en moneda del documento; en MXN con el tipo de cambio del pago
+    iva_dr: Mapped[float | None] = mapped_column(Numeric(18, 6), nullable=True)
+    iva_mxn: Mapped[float | None] = mapped_column(Numeric(18, 6), nullable=True)
+
+    pago: Mapped["Pago"] = relationship(back_populates="documentos")
+    factura: Mapped["Factura"] = relationship()
+
+    __table_args__ = (
+        Index("ix_pago_doc_titular_documento_parc", "titular_rfc", "id_documento", "num_parcialidad"),
+    )
+
+
+class CfdiRelacionado(Base):
+    """CfdiRelacionado: arista del CFDI que la declara hacia el UUID relacionado.
+
+    ``tipo_relacion`` 01 nota de crédito, 04 sustitución, 07 aplicación de anticipo, ...
+    Un CFDI relacionado con 04 por otro vigente está sustituido y no entra en los agregados
+    (``queries.EFECTIVO``: anti-join sobre ``ix_cfdi_rel_titular_uuid_tipo``).
+    """
+
+    __tablename__ = "cfdi_relacionados"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    factura_id: Mapped[int] = mapped_column(ForeignKey("facturas.id"), index=True)  # el CFDI que declara la relación
+    titular_rfc: Mapped[str | None] = mapped_column(String(20), nullable=True)
+
+    tipo_relacion: Mapped[str | None] = mapped_column(String(5), nullable=True)
+    uuid_relacionado: Mapped[str] = mapped_column(String(40))
+
+    factura: Mapped["Factura"] = relationship(back_populates="relacionados")
+
+    __table_args__ = (
+        Index("ix_cfdi_rel_titular_uuid_tipo", "titular_rfc", "uuid_relacionado", "tipo_relacion"),
+    )
+
 
 class RetencionPlataforma(Base):
     """CFDI de Retenciones e Información de Pagos (Retenciones 2.0) con complemento de Plataformas Tecnológicas."""
@@ -106,22 +317,24 @@ class RetencionPlataforma(Base):
     __tablename__ = "retenciones_plataforma"
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    titular_rfc: Mapped[str | None] = mapped_column(String(20), nullable=True)
 
     uuid: Mapped[str | None] = mapped_column(String(40), index=True, nullable=True)
     version: Mapped[str | None] = mapped_column(String(10), nullable=True)
 
-    fecha_exp: Mapped[datetime | None] = mapped_column(DateTime, index=True, nullable=True)
+    fecha_exp: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
 
     # Periodo (el que importa para tu declaración mensual)
-    ejercicio: Mapped[int | None] = mapped_column(Integer, index=True, nullable=True)
-    mes_ini: Mapped[int | None] = mapped_column(Integer, index=True, nullable=True)
-    mes_fin: Mapped[int | None] = mapped_column(Integer, index=True, nullable=True)
+    ejercicio: Mapped[int | None] = mapped_column(Integer, nullable=True)
+    mes_ini: Mapped[int | None] = mapped_column(Integer, nullable=True)
+    mes_fin: Mapped[int | None] = mapped_column(Integer, nullable=True)
 
+    # El RFC se queda en la fila (clasificación y filtros); el nombre vive en ``contribuyentes``
     emisor_rfc: Mapped[str | None] = mapped_column(String(20), index=True, nullable=True)
-    emisor_nombre: Mapped[str | None] = mapped_column(String(300), nullable=True)
+    emisor_id: Mapped[int | None] = mapped_column(ForeignKey("contribuyentes.id"), nullable=True)
 
     receptor_rfc: Mapped[str | None] = mapped_column(String(20), index=True, nullable=True)
-    receptor_nombre: Mapped[str | None] = mapped_column(String(300), nullable=True)
+    receptor_id: Mapped[int | None] = mapped_column(ForeignKey("contribuyentes.id"), nullable=True)
 
     # Totales generales de Retenciones 2.0
     monto_tot_operacion: Mapped[float | None] = mapped_column(Numeric(18, 6), nullable=True)
@@ -141,20 +354,173 @@ class RetencionPlataforma(Base):
     dif_iva_entregado_prest_serv: Mapped[float | None] = mapped_column(Numeric(18, 6), nullable=True)
     mon_total_por_uso_plataforma: Mapped[float | None] = mapped_column(Numeric(18, 6), nullable=True)
 
+    parser_version: Mapped[int | None] = mapped_column(Integer, index=True, nullable=True)
+
     xml_text: Mapped[str] = mapped_column(Text, nullable=False)
 
+    emisor: Mapped["Contribuyente | None"] = relationship(foreign_keys=[emisor_id])
+    receptor: Mapped["Contribuyente | None"] = relationship(foreign_keys=[receptor_id])
+
+    @property
+    def emisor_nombre(self) -> str | None:
+        return self.emisor.nombre if self.emisor else None
+
+    @property
+    def receptor_nombre(self) -> str | None:
+        return self.receptor.nombre if self.receptor else None
+
     __table_args__ = (
-        UniqueConstraint("uuid", name="uq_ret_plat_uuid"),
+        UniqueConstraint("titular_rfc", "uuid", name="uq_ret_plat_titular_uuid"),
+        Index("ix_ret_plat_titular_periodo_fecha", "titular_rfc", "ejercicio", "mes_fin", "mes_ini", "fecha_exp"),
     )
 
 
+# ---------------------------------------------------------------------------
+# Complementos (uno por tabla; los llena el registro de parser_xml/complementos.py)
+# ---------------------------------------------------------------------------
+
+
+class Nomina(Base):
+    """Complemento de Nómina 1.2 (totales del recibo)."""
+
+    __tablename__ = "nominas"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    factura_id: Mapped[int] = mapped_column(ForeignKey("facturas.id"), index=True)
+
+    version: Mapped[str | None] = mapped_column(String(10), nullable=True)
+    tipo_nomina: Mapped[str | None] = mapped_column(String(5), nullable=True)  # O ordinaria, E extraordinaria
+    fecha_pago: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
+    fecha_inicial_pago: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
+    fecha_final_pago: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
+    num_dias_pagados: Mapped[float | None] = mapped_column(Numeric(18, 3), nullable=True)
+    curp: Mapped[str | None] = mapped_column(String(20), nullable=True)
+    num_empleado: Mapped[str | None] = mapped_column(String(20), nullable=True)
+
+    total_percepciones: Mapped[float | None] = mapped_column(Numeric(18, 6), nullable=True)
+    total_deducciones: Mapped[float | None] = mapped_column(Numeric(18, 6), nullable=True)
+    total_otros_pagos: Mapped[float | None] = mapped_column(Numeric(18, 6), nullable=True)
+    total_sueldos: Mapped[float | None] = mapped_column(Numeric(18, 6), nullable=True)
+    total_gravado: Mapped[float | None] = mapped_column(Numeric(18, 6), nullable=True)
+    total_exento: Mapped[float | None] = mapped_column(Numeric(18, 6), nullable=True)
+    total_impuestos_retenidos: Mapped[float | None] = mapped_column(Numeric(18, 6), nullable=True)  # ISR
+    total_otras_deducciones: Mapped[float | None] = mapped_column(Numeric(18, 6), nullable=True)
+
+
+class ComercioExterior(Base):
+    """Complemento de Comercio Exterior 1.1 / 2.0 (datos de la exportación)."""
+
+    __tablename__ = "comercio_exterior"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    factura_id: Mapped[int] = mapped_column(ForeignKey("facturas.id"), index=True)
+
+    version: Mapped[str | None] = mapped_column(String(10), nullable=True)
+    clave_de_pedimento: Mapped[str | None] = mapped_column(String(5), nullable=True)
+    certificado_origen: Mapped[int | None] = mapped_column(Integer, nullable=True)
+    incoterm: Mapped[str | None] = mapped_column(String(5), nullable=True)
+    tipo_cambio_usd: Mapped[float | None] = mapped_column(Numeric(18, 6), nullable=True)
+    total_usd: Mapped[float | None] = mapped_column(Numeric(18, 6), nullable=True)
+
+
+class ImpuestoLocal(Base):
+    """Traslados y retenciones del complemento Impuestos Locales (ISH, 5 al millar, ...)."""
+
+    __tablename__ = "impuestos_locales"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    factura_id: Mapped[int] = mapped_column(ForeignKey("facturas.id"), index=True)
+
+    tipo: Mapped[str] = mapped_column(String(10))  # traslado | retencion
+    impuesto: Mapped[str | None] = mapped_column(String(50), nullable=True)  # nombre libre del impuesto local
+    tasa: Mapped[float | None] = mapped_column(Numeric(18, 6), nullable=True)  # porcentaje
+    importe: Mapped[float | None] = mapped_column(Numeric(18, 6), nullable=True)
+
+
+class Dividendo(Base):
+    """Complemento de Dividendos de una constancia de retenciones."""
+
+    __tablename__ = "dividendos"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    retencion_id: Mapped[int] = mapped_column(ForeignKey("retenciones_plataforma.id"), index=True)
+
+    cve_tip_div_o_util: Mapped[str | None] = mapped_column(String(5), nullable=True)
+    tipo_soc_distr_div: Mapped[str | None] = mapped_column(String(30), nullable=True)
+    mont_isr_acred_ret_mexico: Mapped[float | None] = mapped_column(Numeric(18, 6), nullable=True)
+    mont_isr_acred_ret_extranjero: Mapped[float | None] = mapped_column(Numeric(18, 6), nullable=True)
+    mont_ret_ext_div_ext: Mapped[float | None] = mapped_column(Numeric(18, 6), nullable=True)
+    mont_isr_acred_nal: Mapped[float | None] = mapped_column(Numeric(18, 6), nullable=True)
+    mont_div_acum_nal: Mapped[float | None] = mapped_column(Numeric(18, 6), nullable=True)
+    mont_div_acum_ext: Mapped[float | None] = mapped_column(Numeric(18, 6), nullable=True)
+    proporcion_rem: Mapped[float | None] = mapped_column(Numeric(18, 6), nullable=True)
+
+
+class EnajenacionAcciones(Base):
+    """Complemento de Enajenación de Acciones de una constancia de retenciones."""
+
+    __tablename__ = "enajenaciones_acciones"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    retencion_id: Mapped[int] = mapped_column(ForeignKey("retenciones_plataforma.id"), index=True)
+
+    contrato_intermediacion: Mapped[str | None] = mapped_column(String(300), nullable=True)
+    ganancia: Mapped[float | None] = mapped_column(Numeric(18, 6), nullable=True)
+    perdida: Mapped[float | None] = mapped_column(Numeric(18, 6), nullable=True)
+
+
+class MetadataSAT(Base):
+    """Renglón de la metadata de descarga masiva del SAT (ver metadata_sat.py).
+
+    Una fila por (titular, UUID) con el último estatus cargado; de aquí sale el estatus
+    de ``facturas`` y la lista de UUID que el SAT reporta y no tienen XML importado.
+    """
+
+    __tablename__ = "metadata_sat"
+
+    titular_rfc: Mapped[str] = mapped_column(String(20), primary_key=True)
+    uuid: Mapped[str] = mapped_column(String(40), primary_key=True)
+
+    emisor_rfc: Mapped[str | None] = mapped_column(String(20), nullable=True)
+    receptor_rfc: Mapped[str | None] = mapped_column(String(20), nullable=True)
+    fecha_emision: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
+    year_emision: Mapped[int | None] = mapped_column(Integer, nullable=True)
+    month_emision: Mapped[int | None] = mapped_column(Integer, nullable=True)
+    monto: Mapped[float | None] = mapped_column(Numeric(18, 6), nullable=True)
+    efecto: Mapped[str | None] = mapped_column(String(5), nullable=True)  # I, E, P, N, T
+    estatus: Mapped[str] = mapped_column(String(10))  # vigente / cancelado
+    fecha_cancelacion: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
+    cargado_en: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        Index("ix_metadata_sat_titular_periodo_fecha", "titular_rfc", "year_emision", "month_emision", "fecha_emision"),
+    )
+
+
+class TipoCambio(Base):
+    """Tipo de cambio (pesos por unidad de ``moneda``) publicado en ``fecha`` (ver tipos_cambio.py).
+
+    La llave primaria (moneda, fecha) es el índice de la búsqueda del último tipo de cambio
+    en o antes de la fecha de cada CFDI.
+    """
+
+    __tablename__ = "tipos_cambio"
+
+    moneda: Mapped[str] = mapped_column(String(10), primary_key=True)
+    fecha: Mapped[date] = mapped_column(Date, primary_key=True)
+    tipo_cambio: Mapped[float] = mapped_column(Numeric(18, 6))
+    fuente: Mapped[str | None] = mapped_column(String(60), nullable=True)  # archivo de donde se cargó
+    cargado_en: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+
+
 class DeclaracionPDF(Base):
     __tablename__ = "declaraciones_pdf"
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    titular_rfc: Mapped[str | None] = mapped_column(String(20), nullable=True)
 
-    year: Mapped[int] = mapped_column(Integer, index=True)
-    month: Mapped[int] = mapped_column(Integer, index=True)
+    year: Mapped[int] = mapped_column(Integer)
+    month: Mapped[int] = mapped_column(Integer)
 
     rfc: Mapped[str | None] = mapped_column(String(20), index=True, nullable=True)
     folio: Mapped[str | None] = mapped_column(String(80), index=True, nullable=True)
@@ -169,3 +535,126 @@ class DeclaracionPDF(Base):
 
     created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
 
+    __table_args__ = (
+        Index("ix_decl_pdf_titular_periodo_creado", "titular_rfc", "year", "month", "created_at"),
+    )
+
+
+class Contribuyente(Base):
+    """Emisor o receptor de CFDI/retenciones: un renglón por RFC con el último nombre visto.
+
+    Facturas y retenciones lo referencian por ``emisor_id``/``receptor_id`` en lugar de
+    repetir el nombre en cada fila (ver contribuyentes.py).
+    """
+
+    __tablename__ = "contribuyentes"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    rfc: Mapped[str] = mapped_column(String(20), unique=True)
+    nombre: Mapped[str | None] = mapped_column(String(300), nullable=True)
+    updated_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+
+
+class ArchivoFrio(Base):
+    """Ejercicio cerrado movido a su propia base ``data/archivo/<año>.sqlite`` (ver archivo.py).
+
+    El archivo solo cuenta cuando existe este renglón: se registra en la misma
+    transacción que borra las filas de la base activa.
+    """
+
+    __tablename__ = "archivos_frios"
+
+    year: Mapped[int] = mapped_column(Integer, primary_key=True)
+    facturas: Mapped[int] = mapped_column(Integer, default=0)
+    retenciones: Mapped[int] = mapped_column(Integer, default=0)
+    bytes: Mapped[int] = mapped_column(Integer, default=0)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+
+
+class PeriodoArchivado(Base):
+    """Meses (por titular) con CFDI o retenciones en un archivo frío, para los selectores de periodo."""
+
+    __tablename__ = "periodos_archivados"
+
+    titular_rfc: Mapped[str] = mapped_column(String(20), primary_key=True)
+    tabla: Mapped[str] = mapped_column(String(30), primary_key=True)  # facturas / retenciones_plataforma
+    year: Mapped[int] = mapped_column(Integer, primary_key=True)
+    month: Mapped[int] = mapped_column(Integer, primary_key=True)
+
+
+class UuidArchivado(Base):
+    """UUID de un documento archivado: el importador lo sigue contando como duplicado."""
+
+    __tablename__ = "uuids_archivados"
+
+    titular_rfc: Mapped[str] = mapped_column(String(20), primary_key=True)
+    tabla: Mapped[str] = mapped_column(String(30), primary_key=True)  # facturas / retenciones_plataforma
+    uuid: Mapped[str] = mapped_column(String(40), primary_key=True)
+
+
+class Titular(Base):
+    """Contribuyente cuya contabilidad se lleva en esta base (modo multi-RFC)."""
+
+    __tablename__ = "titulares"
+
+    rfc: Mapped[str] = mapped_column(String(20), primary_key=True)
+    nombre: Mapped[str | None] = mapped_column(String(300), nullable=True)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+
+
+
+class Parametro(Base):
+    """Valores clave/valor de estado interno (p.ej. avance de procesos reanudables)."""
+
+    __tablename__ = "parametros"
+
+    clave: Mapped[str] = mapped_column(String(80), primary_key=True)
+    valor: Mapped[str | None] = mapped_column(Text, nullable=True)
+
+
+class ImportJob(Base):
+    """Importación de XML en segundo plano (ver jobs.py)."""
+
+    __tablename__ = "import_jobs"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    titular_rfc: Mapped[str] = mapped_column(String(20))
+
+    # recibiendo / en_cola / procesando / terminado / fallido
+    estado: Mapped[str] = mapped_column(String(12), default="recibiendo")
+    mensaje: Mapped[str | None] = mapped_column(Text, nullable=True)
+
+    total_archivos: Mapped[int] = mapped_column(Integer, default=0)
+    procesados: Mapped[int] = mapped_column(Integer, default=0)
+    cfdi_insertados: Mapped[int] = mapped_column(Integer, default=0)
+    cfdi_duplicados: Mapped[int] = mapped_column(Integer, default=0)
+    retenciones_insertadas: Mapped[int] = mapped_column(Integer, default=0)
+    retenciones_duplicadas: Mapped[int] = mapped_column(Integer, default=0)
+    errores: Mapped[int] = mapped_column(Integer, default=0)
+
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+    started_at: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
+    finished_at: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
+
+    __table_args__ = (
+        Index("ix_import_jobs_titular", "titular_rfc"),
+    )
+
+
+class ImportJobArchivo(Base):
+    """Resultado por archivo de una importación (insertado / duplicado / error)."""
+
+    __tablename__ = "import_job_archivos"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    job_id: Mapped[int] = mapped_column(ForeignKey("import_jobs.id"))
+
+    ref: Mapped[str | None] = mapped_column(String(260), nullable=True)  # nombre del archivo subido
+    kind: Mapped[str | None] = mapped_column(String(20), nullable=True)  # cfdi / retenciones / unknown
+    uuid: Mapped[str | None] = mapped_column(String(40), nullable=True)
+    status: Mapped[str] = mapped_column(String(12))
+    error: Mapped[str | None] = mapped_column(Text, nullable=True)
+
+    __table_args__ = (
+        Index("ix_import_job_archivos_job", "job_id"),
+    )
@@ -1,8 +1,10 @@
 from __future__ import annotations
 
+from dataclasses import dataclass
 from datetime import datetime
 from decimal import Decimal
 import io
+from typing import Callable
 import xml.etree.ElementTree as ET
 
 from config import MI_RFC
@@ -18,6 +20,9 @@ PLAT_10_NS = "http://www.sat.gob.mx/esquemas/retencionpago/1/PlataformasTecnolog
 PAGOS20_NS = "http://www.sat.gob.mx/Pagos20"
 PAGOS10_NS = "http://www.sat.gob.mx/Pagos"
 
+# Incrementar cuando cambie lo que se deriva del XML; rederive.py actualiza las filas viejas.
+PARSER_VERSION = 5
+
 
 def _to_decimal(val: str | None) -> Decimal | None:
     if val is None or val == "":
@@ -28,6 +33,12 @@ def _to_decimal(val: str | None) -> Decimal | None:
         return None
 
 
+def _uuid(val: str | None) -> str | None:
+    """UUID en mayúsculas y sin espacios: se compara contra ``Factura.uuid`` y cada PAC lo escribe distinto."""
+    val = (val or "").strip().upper()
+    return val or None
+
+
 def _to_int(val: str | None) -> int | None:
     if val is None or val == "":
         return None
@@ -60,18 +71,13 @@ def _ns_from_tag(tag: str) -> str | None:
     return None
 
 
-def _collect_namespaces(xml_bytes: bytes) -> dict[str, str]:
-    ns: dict[str, str] = {}
-    for event, elem in ET.iterparse(io.BytesIO(xml_bytes), events=("start-ns",)):
-        prefix, uri = elem
-        ns[prefix or ""] = uri
-    return ns
-
-
 def detect_xml_kind(xml_bytes: bytes) -> str:
-    """Devuelve: 'cfdi' | 'retenciones' | 'unknown'"""
+    """Devuelve: 'cfdi' | 'retenciones' | 'unknown'
+
+    Solo lee hasta la etiqueta raíz; el documento completo se parsea una sola vez después.
+    """
     try:
-        root = ET.fromstring(xml_bytes.lstrip(b"\xef\xbb\xbf"))
+        _, root = next(ET.iterparse(io.BytesIO(xml_bytes.lstrip(b"\xef\xbb\xbf")), events=("start",)))
     except Exception:
         return "unknown"
 
@@ -92,11 +98,13 @@ def _signed_factor(tipo: str | None) -> int:
     return 1
 
 
-def _clasifica_naturaleza(tipo: str | None, emisor_rfc: str | None, receptor_rfc: str | None) -> str:
+def _clasifica_naturaleza(
+    tipo: str | None, emisor_rfc: str | None, receptor_rfc: str | None, mi_rfc: str | None = None
+) -> str:
     tipo_u = (tipo or "").upper()
     em = (emisor_rfc or "").upper()
     rec = (receptor_rfc or "").upper()
-    mi = (MI_RFC or "").upper()
+    mi = (mi_rfc or MI_RFC or "").upper()
 
     if tipo_u == "P":
         # Complemento de pago: si tú lo emites normalmente es cobro; si tú lo recibes es pago
@@ -113,19 +121,176 @@ def _clasifica_naturaleza(tipo: str | None, emisor_rfc: str | None, receptor_rfc
     return "otro"
 
 
-def parse_cfdi_40(xml_bytes: bytes) -> dict:
+# ---------------------------------------------------------------------------
+# Registro de complementos
+# ---------------------------------------------------------------------------
+
+
+@dataclass(frozen=True)
+class Manejador:
+    """Parser de un nodo hijo de ``Complemento``.
+
+    ``funcion(nodo, data)`` recibe el nodo y el dict del documento. Con ``tabla`` regresa
+    las filas (dict o lista de dicts) que el importador inserta en esa tabla, ligadas al
+    documento; sin ``tabla`` llena campos del propio documento (UUID, pagos, ...).
+    """
+
+    funcion: Callable[[ET.Element, dict], dict | list[dict] | None]
+    tabla: str | None = None
+
+
+# Por tipo de documento: "{namespace}Nodo" -> Manejador
+COMPLEMENTOS: dict[str, dict[str, Manejador]] = {"cfdi": {}, "retenciones": {}}
+
+
+def registrar_complemento(ns: str, nodo: str, documentos: tuple[str, ...] = ("cfdi",), tabla: str | None = None):
+    """Decorador: registra el parser del complemento ``{ns}nodo`` (ver complementos.py).
+
+    Solo se despachan los hijos directos de ``Complemento``: un nodo anidado (p.ej. dentro
+    de ``nomina12:Nomina``) o uno bajo ``cfdi:Addenda`` nunca llega a su manejador; lo lee
+    el manejador del nodo de primer nivel que lo contiene.
+    """
+
+    def decorador(funcion):
+        for documento in documentos:
+            COMPLEMENTOS[documento][f"{{{ns}}}{nodo}"] = Manejador(funcion, tabla)
+        return funcion
+
+    return decorador
+
+
+def tablas_complemento(documento: str) -> list[str]:
+    """Tablas que llenan los complementos registrados para ``documento`` (cfdi | retenciones)."""
+    return sorted({m.tabla for m in COMPLEMENTOS[documento].values() if m.tabla})
+
+
+def _despachar_complementos(root: ET.Element, complemento_tag: str, documento: str, data: dict) -> None:
+    """Recorre una sola vez los hijos de ``Complemento`` y despacha cada uno por su tag.
+
+    La búsqueda en el registro es un dict, así que registrar más complementos no agrega
+    pasadas sobre el documento; los nodos sin manejador se saltan.
+    """
+    registro = COMPLEMENTOS[documento]
+    for complemento in root.iterfind(complemento_tag):
+        for nodo in complemento:
+            manejador = registro.get(nodo.tag)
+            if manejador is None:
+                continue
+            filas = manejador.funcion(nodo, data)
+            if manejador.tabla and filas:
+                destino = data["complementos"].setdefault(manejador.tabla, [])
+                destino.extend(filas if isinstance(filas, list) else [filas])
+
+
+@registrar_complemento(TFD_NS, "TimbreFiscalDigital", documentos=("cfdi", "retenciones"))
+def _timbre(nodo: ET.Element, data: dict) -> None:
+    data["uuid"] = _uuid(nodo.attrib.get("UUID"))
+
+
+@registrar_complemento(PAGOS20_NS, "Pagos")
+@registrar_complemento(PAGOS10_NS, "Pagos")
+def _pagos(nodo: ET.Element, data: dict) -> None:
+    if (data["tipo_comprobante"] or "").upper() != "P":
+        return
+    pagos_ns = _ns_from_tag(nodo.tag)
+    for p in nodo.findall(f"{{{pagos_ns}}}Pago"):
+        fecha_pago = _parse_dt(p.attrib.get("FechaPago"))
+        data["pagos"].append(
+            {
+                "fecha_pago": fecha_pago,
+                "year_pago": fecha_pago.year if fecha_pago else None,
+                "month_pago": fecha_pago.month if fecha_pago else None,
+                "monto": _to_decimal(p.attrib.get("Monto")),
+                "moneda_p": p.attrib.get("MonedaP"),
+                "tipo_cambio_p": _to_decimal(p.attrib.get("TipoCambioP")),
+                "forma_pago_p": p.attrib.get("FormaDePagoP"),
+                "documentos": [
+                    _parse_docto_relacionado(d, pagos_ns) for d in p.findall(f"{{{pagos_ns}}}DoctoRelacionado")
+                ],
+            }
+        )
+
+
+@registrar_complemento(PLAT_10_NS, "ServiciosPlataformasTecnologicas", documentos=("retenciones",))
+def _plataformas(nodo: ET.Element, data: dict) -> None:
+    data["periodicidad"] = nodo.attrib.get("Periodicidad")
+    data["num_serv"] = _to_int(nodo.attrib.get("NumServ"))
+    data["mon_tot_serv_siva"] = _to_decimal(nodo.attrib.get("MonTotServSIVA"))
+    data["total_iva_trasladado"] = _to_decimal(nodo.attrib.get("TotalIVATrasladado"))
+    data["total_iva_retenido"] = _to_decimal(nodo.attrib.get("TotalIVARetenido"))
+    data["total_isr_retenido"] = _to_decimal(nodo.attrib.get("TotalISRRetenido"))
+    data["dif_iva_entregado_prest_serv"] = _to_decimal(nodo.attrib.get("DifIVAEntregadoPrestServ"))
+    data["mon_total_por_uso_plataforma"] = _to_decimal(nodo.attrib.get("MonTotalporUsoPlataforma"))
+
+
+# ---------------------------------------------------------------------------
+# Documentos
+# ---------------------------------------------------------------------------
+
+
+def _parse_impuestos(impuestos: ET.Element | None, cfdi_ns: str) -> list[dict]:
+    """Extrae los nodos Traslado/Retencion de un nodo cfdi:Impuestos (concepto o comprobante)."""
+    out: list[dict] = []
+    if impuestos is None:
+        return out
+
+    for tipo, padre, hijo in (("traslado", "Traslados", "Traslado"), ("retencion", "Retenciones", "Retencion")):
+        for n in impuestos.findall(f"{{{cfdi_ns}}}{padre}/{{{cfdi_ns}}}{hijo}"):
+            out.append(
+                {
+                    "tipo": tipo,
+                    "impuesto": n.attrib.get("Impuesto"),
+                    "tipo_factor": n.attrib.get("TipoFactor"),
+                    "tasa_o_cuota": _to_decimal(n.attrib.get("TasaOCuota")),
+                    "base": _to_decimal(n.attrib.get("Base")),
+                    "importe": _to_decimal(n.attrib.get("Importe")),
+                }
+            )
+    return out
+
+
+def _parse_docto_relacionado(d: ET.Element, pagos_ns: str) -> dict:
+    """Extrae un pago20:DoctoRelacionado (o pago10) con el IVA trasladado que liquida."""
+    iva = None
+    for t in d.findall(f"{{{pagos_ns}}}ImpuestosDR/{{{pagos_ns}}}TrasladosDR/{{{pagos_ns}}}TrasladoDR"):
+        if t.attrib.get("ImpuestoDR") == "002":
+            importe = _to_decimal(t.attrib.get("ImporteDR"))
+            if importe is not None:
+                iva = (iva or Decimal("0")) + importe
+    return {
+        "id_documento": _uuid(d.attrib.get("IdDocumento")),
+        "serie": d.attrib.get("Serie"),
+        "folio": d.attrib.get("Folio"),
+        "moneda_dr": d.attrib.get("MonedaDR"),
+        # Pagos 2.0 usa EquivalenciaDR; Pagos 1.0 usaba TipoCambioDR
+        "equivalencia_dr": _to_decimal(d.attrib.get("EquivalenciaDR") or d.attrib.get("TipoCambioDR")),
+        "num_parcialidad": _to_int(d.attrib.get("NumParcialidad")),
+        "imp_saldo_ant": _to_decimal(d.attrib.get("ImpSaldoAnt")),
+        "imp_pagado": _to_decimal(d.attrib.get("ImpPagado")),
+        "imp_saldo_insoluto": _to_decimal(d.attrib.get("ImpSaldoInsoluto")),
+        "objeto_imp_dr": d.attrib.get("ObjetoImpDR"),
+        "iva_dr": iva,
+    }
+
+
+def parse_cfdi_40(xml_bytes: bytes, mi_rfc: str | None = None) -> dict:
     """Parsea CFDI 4.0 (I/E/P/T/N...) usando solo stdlib.
 
+    ``mi_rfc`` es el titular contra el que se clasifica la naturaleza (default: config.MI_RFC).
+
     Retorna:
     - factura: dict con campos para tabla Factura
-    - conceptos: lista de dicts para Concepto
-    - pagos: lista de dicts para Pago (solo si tipo=P y viene complemento)
+    - conceptos: lista de dicts para Concepto (cada uno con sus impuestos)
+    - impuestos: Traslados/Retenciones a nivel comprobante
+    - pagos: lista de dicts para Pago (solo si tipo=P y viene complemento), cada uno
+      con sus DoctoRelacionado en "documentos"
+    - relacionados: CfdiRelacionado de cada grupo CfdiRelacionados (tipo_relacion, uuid_relacionado)
+    - complementos: filas por tabla de los demás complementos registrados
     - factor: +1 o -1 (para resúmenes: E resta)
     """
-    nsmap = _collect_namespaces(xml_bytes)
     root = ET.fromstring(xml_bytes.lstrip(b"\xef\xbb\xbf"))
 
-    cfdi_ns = _ns_from_tag(root.tag) or nsmap.get("cfdi") or CFDI_40_NS
+    cfdi_ns = _ns_from_tag(root.tag) or CFDI_40_NS
 
     def q(ns: str, t: str) -> str:
         return f"{{{ns}}}{t}"
@@ -149,6 +314,7 @@ def parse_cfdi_40(xml_bytes: bytes) -> dict:
         "receptor_nombre": None,
         "uso_cfdi": None,
         "moneda": root.attrib.get("Moneda"),
+        "tipo_cambio": _to_decimal(root.attrib.get("TipoCambio")),
         "metodo_pago": root.attrib.get("MetodoPago"),
         "forma_pago": root.attrib.get("FormaPago"),
         "subtotal": _to_decimal(root.attrib.get("SubTotal")),
@@ -157,10 +323,21 @@ def parse_cfdi_40(xml_bytes: bytes) -> dict:
         "total_trasladados": None,
         "total_retenidos": None,
         "conceptos": [],
+        "impuestos": [],
         "pagos": [],
+        "relacionados": [],
+        "complementos": {},
         "factor": _signed_factor(tipo),
     }
 
+    # CFDI 4.0 admite varios grupos CfdiRelacionados, uno por TipoRelacion
+    for grupo in root.findall(q(cfdi_ns, "CfdiRelacionados")):
+        tipo_relacion = grupo.attrib.get("TipoRelacion")
+        for r in grupo.findall(q(cfdi_ns, "CfdiRelacionado")):
+            uuid_relacionado = _uuid(r.attrib.get("UUID"))
+            if uuid_relacionado:
+                data["relacionados"].append({"tipo_relacion": tipo_relacion, "uuid_relacionado": uuid_relacionado})
+
     emisor = root.find(q(cfdi_ns, "Emisor"))
     if emisor is not None:
         data["emisor_rfc"] = emisor.attrib.get("Rfc")
@@ -172,17 +349,13 @@ def parse_cfdi_40(xml_bytes: bytes) -> dict:
         data["receptor_nombre"] = receptor.attrib.get("Nombre")
         data["uso_cfdi"] = receptor.attrib.get("UsoCFDI")
 
-    data["naturaleza"] = _clasifica_naturaleza(tipo, data["emisor_rfc"], data["receptor_rfc"])
+    data["naturaleza"] = _clasifica_naturaleza(tipo, data["emisor_rfc"], data["receptor_rfc"], mi_rfc)
 
     impuestos = root.find(q(cfdi_ns, "Impuestos"))
     if impuestos is not None:
         data["total_trasladados"] = _to_decimal(impuestos.attrib.get("TotalImpuestosTrasladados"))
         data["total_retenidos"] = _to_decimal(impuestos.attrib.get("TotalImpuestosRetenidos"))
-
-    # UUID
-    timbre = root.find(f".//{{{TFD_NS}}}TimbreFiscalDigital")
-    if timbre is not None:
-        data["uuid"] = timbre.attrib.get("UUID")
+    data["impuestos"] = _parse_impuestos(impuestos, cfdi_ns)
 
     # Conceptos
     conceptos_parent = root.find(q(cfdi_ns, "Conceptos"))
@@ -197,32 +370,12 @@ def parse_cfdi_40(xml_bytes: bytes) -> dict:
                     "valor_unitario": _to_decimal(c.attrib.get("ValorUnitario")),
                     "importe": _to_decimal(c.attrib.get("Importe")),
                     "objeto_imp": c.attrib.get("ObjetoImp"),
+                    "impuestos": _parse_impuestos(c.find(q(cfdi_ns, "Impuestos")), cfdi_ns),
                 }
             )
 
-    # Complemento de pagos (Tipo=P)
-    if (tipo or "").upper() == "P":
-        pagos_ns = None
-        if PAGOS20_NS in nsmap.values():
-            pagos_ns = PAGOS20_NS
-        elif PAGOS10_NS in nsmap.values():
-            pagos_ns = PAGOS10_NS
-
-        if pagos_ns:
-            for p in root.findall(f".//{{{pagos_ns}}}Pago"):
-                fecha_pago = _parse_dt(p.attrib.get("FechaPago"))
-                y = fecha_pago.year if fecha_pago else None
-                m = fecha_pago.month if fecha_pago else None
-                data["pagos"].append(
-                    {
-                        "fecha_pago": fecha_pago,
-                        "year_pago": y,
-                        "month_pago": m,
-                        "monto": _to_decimal(p.attrib.get("Monto")),
-                        "moneda_p": p.attrib.get("MonedaP"),
-                        "forma_pago_p": p.attrib.get("FormaDePagoP"),
-                    }
-                )
+    # Timbre, pagos (tipo P) y demás complementos
+    _despachar_complementos(root, q(cfdi_ns, "Complemento"), "cfdi", data)
 
     return data
 
@@ -230,13 +383,12 @@ def parse_cfdi_40(xml_bytes: bytes) -> dict:
 def parse_retenciones_plataforma(xml_bytes: bytes) -> dict:
     """Parsea Retenciones 2.0 con complemento Servicios de Plataformas Tecnológicas 1.0.
 
-    Retorna dict con campos para RetencionPlataforma.
+    Retorna dict con campos para RetencionPlataforma (y en "complementos" las filas de
+    los demás complementos registrados, p. ej. Dividendos).
     """
-    xml_bytes = xml_bytes.lstrip(b"\xef\xbb\xbf")
-    nsmap = _collect_namespaces(xml_bytes)
-    root = ET.fromstring(xml_bytes)
+    root = ET.fromstring(xml_bytes.lstrip(b"\xef\xbb\xbf"))
 
-    ret_ns = _ns_from_tag(root.tag) or nsmap.get("retenciones") or RET_20_NS
+    ret_ns = _ns_from_tag(root.tag) or RET_20_NS
 
     def q(ns: str, t: str) -> str:
         return f"{{{ns}}}{t}"
@@ -264,6 +416,7 @@ def parse_retenciones_plataforma(xml_bytes: bytes) -> dict:
         "total_isr_retenido": None,
         "dif_iva_entregado_prest_serv": None,
         "mon_total_por_uso_plataforma": None,
+        "complementos": {},
     }
 
     emisor = root.find(q(ret_ns, "Emisor"))
@@ -292,23 +445,8 @@ def parse_retenciones_plataforma(xml_bytes: bytes) -> dict:
         out["monto_tot_exent"] = _to_decimal(tot.attrib.get("MontoTotExent"))
         out["monto_tot_ret"] = _to_decimal(tot.attrib.get("MontoTotRet"))
 
-    comp = root.find(q(ret_ns, "Complemento"))
-    if comp is not None:
-        # UUID del timbre
-        tfd = comp.find(f".//{{{TFD_NS}}}TimbreFiscalDigital")
-        if tfd is not None:
-            out["uuid"] = tfd.attrib.get("UUID")
-
-        # Complemento Plataformas Tecnológicas
-        plat = comp.find(f".//{{{PLAT_10_NS}}}ServiciosPlataformasTecnologicas")
-        if plat is not None:
-            out["periodicidad"] = plat.attrib.get("Periodicidad")
-            out["num_serv"] = _to_int(plat.attrib.get("NumServ"))
-            out["mon_tot_serv_siva"] = _to_decimal(plat.attrib.get("MonTotServSIVA"))
-            out["total_iva_trasladado"] = _to_decimal(plat.attrib.get("TotalIVATrasladado"))
-            out["total_iva_retenido"] = _to_decimal(plat.attrib.get("TotalIVARetenido"))
-            out["total_isr_retenido"] = _to_decimal(plat.attrib.get("TotalISRRetenido"))
-            out["dif_iva_entregado_prest_serv"] = _to_decimal(plat.attrib.get("DifIVAEntregadoPrestServ"))
-            out["mon_total_por_uso_plataforma"] = _to_decimal(plat.attrib.get("MonTotalporUsoPlataforma"))
+    # Timbre, Plataformas Tecnológicas y demás complementos
+    _despachar_complementos(root, q(ret_ns, "Complemento"), "retenciones", out)
 
     return out
+
@@ -0,0 +1,145 @@
+"""Cálculo de un periodo (mes) memoizado para las vistas de declaración.
+
+``/declaracion``, ``/sat_hoja``, ``/sat_hoja.txt`` y ``/sat_report.csv`` (y ``/summary``)
+suelen abrirse una tras otra para el mismo mes. En lugar de recalcular los agregados
+en cada una, el ``Periodo`` calculado se guarda en un LRU acotado con llave
+``(rfc, año, mes, data_version)``. ``data_version`` (``estado.py``) cambia con cada
+importación o reclasificación, así que una entrada nunca sobrevive a un cambio de datos.
+"""
+
+from __future__ import annotations
+
+import threading
+from collections import OrderedDict
+from typing import Callable, Optional
+
+from sqlalchemy.orm import Session
+
+from estado import get_data_version
+
+
+CACHE_PERIODOS_MAX = 32  # periodos (titular, año, mes) en memoria
+
+
+def calc_income_and_iva_sources(data: dict, income_source: Optional[str]) -> tuple[float, float, str]:
+    """
+    Calcula ingresos e IVA evitando doble conteo (plataforma vs CFDI).
+
+    Returns:
+        (ingresos_sin_iva, iva_trasladado, effective_source)
+    """
+    income_source = (income_source or "auto").lower().strip()
+
+    plat_income = float(data.get("plat_ing_siva") or 0.0)
+    cfdi_income = float(data.get("ingresos_base") or 0.0)
+
+    plat_iva_tras = float(data.get("plat_iva_tras") or 0.0)
+    cfdi_iva_tras = float(data.get("ingresos_trasl") or 0.0)
+
+    if income_source == "plataforma":
+        return plat_income, plat_iva_tras, "plataforma"
+    elif income_source == "cfdi":
+        return cfdi_income, cfdi_iva_tras, "cfdi"
+    elif income_source == "ambos":
+        return plat_income + cfdi_income, plat_iva_tras + cfdi_iva_tras, "ambos"
+    else:
+        # auto: preferir plataforma si existen datos para evitar doble conteo
+        if plat_income > 0 or plat_iva_tras > 0:
+            return plat_income, plat_iva_tras, "plataforma"
+        else:
+            return cfdi_income, cfdi_iva_tras, "cfdi"
+
+
+class Periodo:
+    """Agregados de un mes del titular y sus cifras derivadas por fuente de ingresos.
+
+    ``data`` es el dict de ``_compute_period_data`` (main.py); sus listas de documentos
+    quedan desligadas de la sesión, con los pagos ya precargados. Se comparte entre
+    solicitudes: no debe modificarse.
+    """
+
+    def __init__(self, rfc: str, year: int, month: int, data_version: int, data: dict) -> None:
+        self.rfc = rfc
+        self.year = year
+        self.month = month
+        self.data_version = data_version
+        self.data = data
+
+    @property
+    def periodo(self) -> str:
+        return f"{self.year}-{self.month:02d}"
+
+    def fuentes(self, income_source: Optional[str]) -> tuple[float, float, str]:
+        """(ingresos_sin_iva, iva_trasladado, fuente_efectiva) según el selector."""
+        return calc_income_and_iva_sources(self.data, income_source)
+
+    def iva_neto(self, income_source: Optional[str]) -> float:
+        """IVA trasladado - IVA acreditable de gastos - IVA retenido por plataformas."""
+        _, iva_trasladado, _ = self.fuentes(income_source)
+        return iva_trasladado - self.data["gastos_trasl"] - self.data["plat_iva_ret"]
+
+
+class PeriodoCache:
+    """LRU de ``Periodo`` acotado a ``maxsize`` entradas, seguro entre hilos.
+
+    Dos solicitudes simultáneas del mismo periodo sin calcular lo calculan ambas; la
+    segunda solo reemplaza la entrada.
+    """
+
+    def __init__(self, maxsize: int = CACHE_PERIODOS_MAX) -> None:
+        self.maxsize = maxsize
+        self._items: "OrderedDict[tuple[str, int, int, int], Periodo]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def obtener(
+        self,
+        db: Session,
+        rfc: str,
+        year: int,
+        month: int,
+        calcular: Callable[[Session, str, int, int], dict],
+    ) -> Periodo:
+        """Periodo de la caché o, si falta, ``calcular(db, rfc, year, month)``.
+
+        La versión se lee antes de calcular y en la misma transacción de lectura, así
+        que los datos guardados corresponden exactamente a la versión de su llave.
+        """
+        version = get_data_version(db)
+        llave = (rfc, year, month, version)
+        with self._lock:
+            p = self._items.get(llave)
+            if p is not None:
+                self._items.move_to_end(llave)
+                self.hits += 1
+                return p
+            self.misses += 1
+
+        p = Periodo(rfc, year, month, version, calcular(db, rfc, year, month))
+        with self._lock:
+            # Entradas de versiones anteriores ya no pueden pedirse: se liberan de una vez
+            for vieja in [k for k in self._items if k[3] < version]:
+                del self._items[vieja]
+            self._items[llave] = p
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+        return p
+
+    def limpiar(self) -> None:
+        with self._lock:
+            self._items.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entradas": len(self._items),
+                "max": self.maxsize,
+                "aciertos": self.hits,
+                "fallos": self.misses,
+                "tasa_aciertos": round(self.hits / total, 3) if total else None,
+            }
+
+
+cache = PeriodoCache()
@@ -0,0 +1,959 @@
+"""Consultas de las rutas de ``main.py``.
+
+Cada función regresa la sentencia ``select`` (sin ejecutarla) para que
+``scripts/check_query_plans.py`` pueda revisar su ``EXPLAIN QUERY PLAN``. Los
+filtros y el ``ORDER BY`` de cada una están alineados con un índice compuesto de
+``models.py``; si se cambia una consulta hay que revisar que siga usando su índice.
+"""
+
+from __future__ import annotations
+
+from datetime import date, datetime, timedelta
+from typing import Optional
+
+from sqlalchemy import Integer, Select, and_, case, cast, desc, exists, func, literal, literal_column, or_, select, tuple_, union_all
+from sqlalchemy.orm import aliased, defer, selectinload
+
+import busqueda
+
+from models import (
+    Base,
+    CfdiRelacionado,
+    Concepto,
+    Contribuyente,
+    DeclaracionPDF,
+    Factura,
+    ImportJob,
+    ImportJobArchivo,
+    ImpuestoComprobante,
+    MetadataSAT,
+    Pago,
+    PagoDocumento,
+    PeriodoArchivado,
+    RetencionPlataforma,
+    UuidArchivado,
+)
+
+
+# ---------------------------------------------------------------------------
+# Facturas (ix_facturas_titular_periodo_fecha / ix_facturas_titular_fecha)
+#
+# Los agregados solo suman CFDI efectivos: filtran ``EFECTIVO``, que es ``VIGENTE`` (mismo
+# predicado que el índice parcial ix_facturas_vigentes_periodo) y además no sustituido
+# por otro CFDI vigente (relación 04). Los listados muestran también cancelados y sustituidos.
+
+VIGENTE = Factura.fecha_cancelacion.is_(None)
+
+
+def sustituido(f=Factura):
+    """``EXISTS``: algún CFDI vigente declara una relación 04 (sustitución) hacia ``f``.
+
+    Negado es un anti-join por ix_cfdi_rel_titular_uuid_tipo y la llave primaria del
+    sustituto; casi ningún CFDI tiene relaciones, así que cuesta una búsqueda en el índice
+    por fila.
+    """
+    sustituto = aliased(Factura)
+    return exists().where(
+        CfdiRelacionado.titular_rfc == f.titular_rfc,
+        CfdiRelacionado.uuid_relacionado == f.uuid,
+        CfdiRelacionado.tipo_relacion == "04",
+        sustituto.id == CfdiRelacionado.factura_id,
+        sustituto.fecha_cancelacion.is_(None),
+    )
+
+
+EFECTIVO = and_(VIGENTE, ~sustituido())
+
+
+def facturas_listado(
+    rfc: str,
+    year: Optional[int] = None,
+    month: Optional[int] = None,
+    tipo: Optional[str] = None,
+    naturaleza: Optional[str] = None,
+    limit: int = 500,
+) -> Select:
+    q = select(Factura).where(Factura.titular_rfc == rfc)
+    if year is not None and month is not None:
+        q = q.where(Factura.year_emision == year, Factura.month_emision == month)
+    elif year is not None:
+        # Rango sobre fecha_emision (de donde sale year_emision) para recorrer el índice ya ordenado
+        q = q.where(Factura.fecha_emision >= datetime(year, 1, 1), Factura.fecha_emision < datetime(year + 1, 1, 1))
+    elif month is not None:
+        q = q.where(Factura.month_emision == month)
+    if tipo:
+        q = q.where(Factura.tipo_comprobante == tipo.upper())
+    if naturaleza:
+        q = q.where(Factura.naturaleza == naturaleza.lower())
+    return q.order_by(desc(Factura.fecha_emision).nullslast(), desc(Factura.id)).limit(limit)
+
+
+def facturas_periodo(rfc: str, year: int, month: int) -> Select:
+    """CFDI emitidos en el periodo, con sus pagos precargados y sin ``xml_text``."""
+    return (
+        select(Factura)
+        .where(Factura.titular_rfc == rfc, Factura.year_emision == year, Factura.month_emision == month)
+        .order_by(desc(Factura.fecha_emision).nullslast(), desc(Factura.id))
+        .options(defer(Factura.xml_text), selectinload(Factura.pagos))
+    )
+
+
+def facturas_ultimo_periodo(rfc: str) -> Select:
+    return (
+        select(Factura.year_emision, Factura.month_emision)
+        .where(Factura.titular_rfc == rfc, Factura.year_emision.isnot(None), Factura.month_emision.isnot(None))
+        .order_by(desc(Factura.year_emision), desc(Factura.month_emision))
+        .limit(1)
+    )
+
+
+def facturas_periodos(rfc: str) -> Select:
+    return (
+        select(Factura.year_emision, Factura.month_emision)
+        .where(Factura.titular_rfc == rfc, Factura.year_emision.isnot(None), Factura.month_emision.isnot(None))
+        .group_by(Factura.year_emision, Factura.month_emision)
+    )
+
+
+def periodos_archivados(rfc: str, tabla: Optional[str] = None) -> Select:
+    """Meses del titular que viven en un archivo frío (PK de periodos_archivados)."""
+    stmt = select(PeriodoArchivado.year, PeriodoArchivado.month).where(PeriodoArchivado.titular_rfc == rfc)
+    if tabla is not None:
+        stmt = stmt.where(PeriodoArchivado.tabla == tabla)
+    return stmt
+
+
+def facturas_pendientes(rfc: str) -> Select:
+    """Facturas PPD con saldo pendiente (ix_facturas_titular_metodo_fecha)."""
+    return (
+        select(Factura)
+        .where(Factura.titular_rfc == rfc, Factura.metodo_pago == "PPD", Factura.saldo_pendiente > 0.005, EFECTIVO)
+        .order_by(Factura.fecha_emision, Factura.id)
+        .options(defer(Factura.xml_text), selectinload(Factura.emisor), selectinload(Factura.receptor))
+    )
+
+
+def _filtros_export(
+    q: Select,
+    rfc: str,
+    desde: Optional[date],
+    hasta: Optional[date],
+    tipo: Optional[str],
+    naturaleza: Optional[str],
+    contraparte: Optional[str],
+) -> Select:
+    q = q.where(Factura.titular_rfc == rfc)
+    if desde:
+        q = q.where(Factura.fecha_emision >= datetime.combine(desde, datetime.min.time()))
+    if hasta:
+        q = q.where(Factura.fecha_emision < datetime.combine(hasta + timedelta(days=1), datetime.min.time()))
+    if tipo:
+        q = q.where(Factura.tipo_comprobante == tipo.upper())
+    if naturaleza:
+        q = q.where(Factura.naturaleza == naturaleza.lower())
+    if contraparte:
+        contraparte = contraparte.strip().upper()
+        q = q.where(or_(Factura.emisor_rfc == contraparte, Factura.receptor_rfc == contraparte))
+    return q.order_by(Factura.fecha_emision, Factura.id)
+
+
+def export_facturas(
+    rfc: str,
+    desde: Optional[date] = None,
+    hasta: Optional[date] = None,
+    tipo: Optional[str] = None,
+    naturaleza: Optional[str] = None,
+    contraparte: Optional[str] = None,
+) -> Select:
+    """Columnas de ``/export/facturas.csv`` (sin ``xml_text``), por fecha de emisión (desde/hasta inclusive)."""
+    emisor, receptor = aliased(Contribuyente), aliased(Contribuyente)
+    q = select(
+        Factura.uuid,
+        Factura.fecha_emision,
+        Factura.tipo_comprobante,
+        Factura.naturaleza,
+        Factura.emisor_rfc,
+        emisor.nombre.label("emisor_nombre"),
+        Factura.receptor_rfc,
+        receptor.nombre.label("receptor_nombre"),
+        Factura.uso_cfdi,
+        Factura.moneda,
+        Factura.metodo_pago,
+        Factura.forma_pago,
+        Factura.subtotal,
+        Factura.descuento,
+        Factura.total,
+        Factura.total_trasladados,
+        Factura.total_retenidos,
+        Factura.saldo_pendiente,
+        Factura.estatus_sat,
+        Factura.fecha_cancelacion,
+    )
+    q = q.outerjoin(emisor, emisor.id == Factura.emisor_id).outerjoin(receptor, receptor.id == Factura.receptor_id)
+    return _filtros_export(q, rfc, desde, hasta, tipo, naturaleza, contraparte)
+
+
+def export_conceptos(
+    rfc: str,
+    desde: Optional[date] = None,
+    hasta: Optional[date] = None,
+    tipo: Optional[str] = None,
+    naturaleza: Optional[str] = None,
+    contraparte: Optional[str] = None,
+) -> Select:
+    """Columnas de ``/export/conceptos.csv``: un renglón por concepto con los datos de su CFDI."""
+    q = select(
+        Factura.uuid,
+        Factura.fecha_emision,
+        Factura.tipo_comprobante,
+        Factura.naturaleza,
+        Factura.emisor_rfc,
+        Factura.receptor_rfc,
+        Factura.moneda,
+        Concepto.clave_prod_serv,
+        Concepto.cantidad,
+        Concepto.clave_unidad,
+        Concepto.descripcion,
+        Concepto.valor_unitario,
+        Concepto.importe,
+        Concepto.objeto_imp,
+    ).join(Concepto, Concepto.factura_id == Factura.id)
+    return _filtros_export(q, rfc, desde, hasta, tipo, naturaleza, contraparte).order_by(Concepto.id)
+
+
+def impuestos_por_tasa(rfc: str, year: int, month: int) -> Select:
+    signo = case((Factura.tipo_comprobante == "E", -1), else_=1)
+    return (
+        select(
+            Factura.naturaleza,
+            ImpuestoComprobante.tipo,
+            ImpuestoComprobante.impuesto,
+            ImpuestoComprobante.tipo_factor,
+            ImpuestoComprobante.tasa_o_cuota,
+            func.sum(ImpuestoComprobante.base_mxn * signo),
+            func.sum(ImpuestoComprobante.importe_mxn * signo),
+        )
+        .join(Factura, ImpuestoComprobante.factura_id == Factura.id)
+        .where(
+            Factura.titular_rfc == rfc,
+            Factura.year_emision == year,
+            Factura.month_emision == month,
+            Factura.naturaleza.in_(("ingreso", "gasto")),
+            EFECTIVO,
+        )
+        .group_by(
+            Factura.naturaleza,
+            ImpuestoComprobante.tipo,
+            ImpuestoComprobante.impuesto,
+            ImpuestoComprobante.tipo_factor,
+            ImpuestoComprobante.tasa_o_cuota,
+        )
+        .order_by(
+            Factura.naturaleza,
+            ImpuestoComprobante.tipo,
+            ImpuestoComprobante.impuesto,
+            ImpuestoComprobante.tipo_factor,
+            ImpuestoComprobante.tasa_o_cuota,
+        )
+    )
+
+
+def gastos_por_categoria(rfc: str, year: int, month: int) -> Select:
+    """Conceptos de gastos del periodo por categoría de deducción (ver deducciones.py).
+
+    Importe de los conceptos en MXN (antes de descuentos); los tipo E restan.
+    """
+    signo = case((Factura.tipo_comprobante == "E", -1), else_=1)
+    return (
+        select(
+            Concepto.categoria_deduccion,
+            func.count(),
+            func.sum(Concepto.importe * Factura.tipo_cambio_mxn * signo),
+        )
+        .join(Factura, Concepto.factura_id == Factura.id)
+        .where(
+            Factura.titular_rfc == rfc,
+            Factura.year_emision == year,
+            Factura.month_emision == month,
+            Factura.naturaleza == "gasto",
+            EFECTIVO,
+        )
+        .group_by(Concepto.categoria_deduccion)
+    )
+
+
+def facturas_por_mes(rfc: str, desde: tuple[int, int], hasta: tuple[int, int]) -> Select:
+    """Totales de CFDI por mes de emisión en ``desde..hasta`` (año, mes), una fila por mes.
+
+    Acumuladores del resumen (``_compute_period_data`` en main.py) sobre las columnas en
+    MXN: los tipo E restan y los tipo P solo se cuentan. La naturaleza va en agregados
+    condicionales para agrupar solo por (año, mes), en el orden del índice.
+    """
+    signo = case((Factura.tipo_comprobante == "E", -1), else_=1)
+    es_p = func.upper(func.coalesce(Factura.tipo_comprobante, "")) == "P"
+
+    def suma(naturaleza: str, valor) -> object:
+        return func.coalesce(
+            func.sum(case((~es_p & (Factura.naturaleza == naturaleza), func.coalesce(valor, 0) * signo))), 0
+        )
+
+    periodo = tuple_(Factura.year_emision, Factura.month_emision)
+    return (
+        select(
+            Factura.year_emision,
+            Factura.month_emision,
+            suma("ingreso", Factura.total_mxn).label("ingresos_total"),
+            suma("ingreso", Factura.base_mxn).label("ingresos_base"),
+            suma("ingreso", Factura.trasladados_mxn).label("ingresos_trasl"),
+            suma("ingreso", Factura.retenidos_mxn).label("ingresos_ret"),
+            suma("gasto", Factura.total_mxn).label("gastos_total"),
+            suma("gasto", Factura.base_mxn).label("gastos_base"),
+            suma("gasto", Factura.trasladados_mxn).label("gastos_trasl"),
+            suma("gasto", Factura.retenidos_mxn).label("gastos_ret"),
+            func.count(case((es_p, 1))).label("p_count"),
+        )
+        .where(Factura.titular_rfc == rfc, periodo >= desde, periodo <= hasta, EFECTIVO)
+        .group_by(Factura.year_emision, Factura.month_emision)
+    )
+
+
+def facturas_por_mes_metodo(rfc: str, desde: tuple[int, int], hasta: tuple[int, int]) -> Select:
+    """Ingresos y gastos por mes de emisión, separados en PPD y no PPD (contabilidad electrónica).
+
+    Una fila por (año, mes, naturaleza, es_ppd) con base, IVA trasladado y retenciones en MXN;
+    los tipo E restan y los P no cuentan. Los PPD quedan en clientes/proveedores hasta
+    que llega su complemento de pago.
+    """
+    signo = case((Factura.tipo_comprobante == "E", -1), else_=1)
+    es_ppd = case((Factura.metodo_pago == "PPD", 1), else_=0).label("es_ppd")
+    periodo = tuple_(Factura.year_emision, Factura.month_emision)
+
+    def suma(valor, nombre: str):
+        return func.coalesce(func.sum(func.coalesce(valor, 0) * signo), 0).label(nombre)
+
+    return (
+        select(
+            Factura.year_emision,
+            Factura.month_emision,
+            Factura.naturaleza,
+            es_ppd,
+            suma(Factura.base_mxn, "base"),
+            suma(Factura.trasladados_mxn, "trasladados"),
+            suma(Factura.retenidos_mxn, "retenidos"),
+        )
+        .where(
+            Factura.titular_rfc == rfc,
+            periodo >= desde,
+            periodo <= hasta,
+            Factura.naturaleza.in_(("ingreso", "gasto")),
+            func.upper(func.coalesce(Factura.tipo_comprobante, "")) != "P",
+            EFECTIVO,
+        )
+        .group_by(Factura.year_emision, Factura.month_emision, Factura.naturaleza, es_ppd)
+    )
+
+
+def totales_por_contraparte(
+    rfc: str, naturaleza: str, year: Optional[int] = None, month: Optional[int] = None, limit: int = 50
+) -> Select:
+    """Principales proveedores (``gasto``, por emisor) o clientes (``ingreso``, por receptor).
+
+    Agrupa por el id entero de ``contribuyentes`` y une el RFC/nombre solo para las filas
+    agrupadas. Importes en MXN; los tipo E restan y los P no se cuentan, como en
+    ``facturas_por_mes``.
+    """
+    llave = Factura.emisor_id if naturaleza == "gasto" else Factura.receptor_id
+    signo = case((Factura.tipo_comprobante == "E", -1), else_=1)
+    total = func.sum(func.coalesce(Factura.total_mxn, 0) * signo)
+    q = (
+        select(
+            llave.label("contribuyente_id"),
+            Contribuyente.rfc,
+            Contribuyente.nombre,
+            func.count().label("cfdi"),
+            func.sum(func.coalesce(Factura.base_mxn, 0) * signo).label("base"),
+            func.sum(func.coalesce(Factura.trasladados_mxn, 0) * signo).label("iva_trasladado"),
+            total.label("total"),
+        )
+        .join(Contribuyente, Contribuyente.id == llave)
+        .where(
+            Factura.titular_rfc == rfc,
+            Factura.naturaleza == naturaleza,
+            func.upper(func.coalesce(Factura.tipo_comprobante, "")) != "P",
+            EFECTIVO,
+        )
+    )
+    if year is not None and month is not None:
+        q = q.where(Factura.year_emision == year, Factura.month_emision == month)
+    elif year is not None:
+        q = q.where(Factura.fecha_emision >= datetime(year, 1, 1), Factura.fecha_emision < datetime(year + 1, 1, 1))
+    return q.group_by(llave).order_by(desc(total), llave).limit(limit)
+
+
+# ---------------------------------------------------------------------------
+# Pagos (ix_pagos_titular_periodo_fecha, ix_pago_doc_titular_documento_parc)
+
+
+def pagos_periodo(rfc: str, year: int, month: int) -> Select:
+    return (
+        select(Pago, Factura.naturaleza)
+        .join(Factura, Pago.factura_id == Factura.id)
+        .where(Pago.titular_rfc == rfc, Pago.year_pago == year, Pago.month_pago == month, EFECTIVO)
+        .order_by(desc(Pago.fecha_pago).nullslast(), desc(Pago.id))
+    )
+
+
+def iva_flujo_periodo(rfc: str, year: int, month: int) -> Select:
+    """IVA de los DoctoRelacionado pagados en el periodo: (cobrado, pagado) en MXN."""
+    iva = PagoDocumento.iva_mxn
+    return (
+        select(
+            func.sum(case((Factura.naturaleza == "cobro", iva))),
+            func.sum(case((Factura.naturaleza == "pago", iva))),
+        )
+        .select_from(Pago)
+        .join(PagoDocumento, PagoDocumento.pago_id == Pago.id)
+        .join(Factura, Pago.factura_id == Factura.id)
+        .where(Pago.titular_rfc == rfc, Pago.year_pago == year, Pago.month_pago == month, EFECTIVO)
+    )
+
+
+def pagos_por_mes(rfc: str, desde: tuple[int, int], hasta: tuple[int, int]) -> Select:
+    """Cobros/pagos (complementos P, en MXN) por mes de FechaPago en ``desde..hasta``."""
+    periodo = tuple_(Pago.year_pago, Pago.month_pago)
+    monto = func.coalesce(Pago.monto_mxn, 0)
+    return (
+        select(
+            Pago.year_pago,
+            Pago.month_pago,
+            func.coalesce(func.sum(case((Factura.naturaleza == "cobro", monto))), 0).label("cash_in"),
+            func.coalesce(func.sum(case((Factura.naturaleza == "pago", monto))), 0).label("cash_out"),
+            func.count().label("pagos_count"),
+        )
+        .join(Factura, Pago.factura_id == Factura.id)
+        .where(Pago.titular_rfc == rfc, periodo >= desde, periodo <= hasta, EFECTIVO)
+        .group_by(Pago.year_pago, Pago.month_pago)
+    )
+
+
+def iva_flujo_por_mes(rfc: str, desde: tuple[int, int], hasta: tuple[int, int]) -> Select:
+    """``iva_flujo_periodo`` agrupado por mes de FechaPago."""
+    iva = PagoDocumento.iva_mxn
+    periodo = tuple_(Pago.year_pago, Pago.month_pago)
+    return (
+        select(
+            Pago.year_pago,
+            Pago.month_pago,
+            func.sum(case((Factura.naturaleza == "cobro", iva))),
+            func.sum(case((Factura.naturaleza == "pago", iva))),
+        )
+        .select_from(Pago)
+        .join(PagoDocumento, PagoDocumento.pago_id == Pago.id)
+        .join(Factura, Pago.factura_id == Factura.id)
+        .where(Pago.titular_rfc == rfc, periodo >= desde, periodo <= hasta, EFECTIVO)
+        .group_by(Pago.year_pago, Pago.month_pago)
+    )
+
+
+def abonos_factura(rfc: str, uuid: str) -> Select:
+    """Parcialidades (DoctoRelacionado) que liquidan una factura PPD."""
+    return (
+        select(PagoDocumento, Pago.fecha_pago)
+        .join(Pago, PagoDocumento.pago_id == Pago.id)
+        .where(PagoDocumento.titular_rfc == rfc, PagoDocumento.id_documento == uuid)
+        .order_by(PagoDocumento.num_parcialidad, PagoDocumento.id)
+    )
+
+
+# c_TipoRelacion del SAT
+TIPOS_RELACION = {
+    "01": "Nota de crédito",
+    "02": "Nota de débito",
+    "03": "Devolución de mercancía",
+    "04": "Sustitución",
+    "05": "Traslados previamente facturados",
+    "06": "Factura por traslados previos",
+    "07": "Aplicación de anticipo",
+}
+
+
+def relaciones_declaradas(factura_id: int) -> Select:
+    """CfdiRelacionado que declara el CFDI, con el relacionado si está importado (uq_facturas_titular_uuid)."""
+    relacionado = aliased(Factura)
+    return (
+        select(
+            CfdiRelacionado.tipo_relacion,
+            CfdiRelacionado.uuid_relacionado,
+            relacionado.id,
+            relacionado.tipo_comprobante,
+            relacionado.fecha_emision,
+            relacionado.total,
+            relacionado.moneda,
+            relacionado.fecha_cancelacion,
+        )
+        .outerjoin(
+            relacionado,
+            and_(
+                relacionado.titular_rfc == CfdiRelacionado.titular_rfc,
+                relacionado.uuid == CfdiRelacionado.uuid_relacionado,
+            ),
+        )
+        .where(CfdiRelacionado.factura_id == factura_id)
+        .order_by(CfdiRelacionado.id)
+    )
+
+
+def relaciones_recibidas(rfc: str, uuid: str) -> Select:
+    """CFDI que declaran una relación hacia ``uuid`` (ix_cfdi_rel_titular_uuid_tipo)."""
+    return (
+        select(
+            CfdiRelacionado.tipo_relacion,
+            Factura.id,
+            Factura.uuid,
+            Factura.tipo_comprobante,
+            Factura.fecha_emision,
+            Factura.total,
+            Factura.moneda,
+            Factura.fecha_cancelacion,
+        )
+        .join(Factura, Factura.id == CfdiRelacionado.factura_id)
+        .where(CfdiRelacionado.titular_rfc == rfc, CfdiRelacionado.uuid_relacionado == uuid)
+        .order_by(CfdiRelacionado.tipo_relacion, CfdiRelacionado.id)
+    )
+
+
+def facturas_sustituidas_periodo(rfc: str, year: int, month: int) -> Select:
+    """Ids de los CFDI vigentes del periodo sustituidos por otro vigente (semi-join de ``sustituido``)."""
+    return select(Factura.id).where(
+        Factura.titular_rfc == rfc,
+        Factura.year_emision == year,
+        Factura.month_emision == month,
+        VIGENTE,
+        sustituido(),
+    )
+
+
+def complemento_filas(tabla: str, doc_id: int) -> Select:
+    """Filas de una tabla de complemento (models.Nomina, ...) de un documento (índice de su padre)."""
+    t = Base.metadata.tables[tabla]
+    padre = t.c.factura_id if "factura_id" in t.c else t.c.retencion_id
+    return select(*[c for c in t.c if c.name not in ("id", padre.name)]).where(padre == doc_id).order_by(t.c.id)
+
+
+# ---------------------------------------------------------------------------
+# DIOT (ix_facturas_titular_periodo_fecha, ix_pagos_titular_periodo_fecha)
+
+
+def _diot_importes(factor) -> list:
+    """Sumas por tasa de IVA (en MXN) de los ``ImpuestoComprobante`` de un CFDI, multiplicadas por ``factor``."""
+    ic = ImpuestoComprobante
+    iva = ic.impuesto == "002"
+    traslado = and_(iva, ic.tipo == "traslado", ic.tipo_factor == "Tasa")
+    tasa = func.round(ic.tasa_o_cuota, 2)
+
+    def suma(condicion, valor, nombre):
+        return func.coalesce(func.sum(case((condicion, func.coalesce(valor, 0) * factor))), 0).label(nombre)
+
+    return [
+        suma(and_(traslado, tasa == 0.16), ic.base_mxn, "base_16"),
+        suma(and_(traslado, tasa == 0.16), ic.importe_mxn, "iva_16"),
+        suma(and_(traslado, tasa == 0.08), ic.base_mxn, "base_8"),
+        suma(and_(traslado, tasa == 0.08), ic.importe_mxn, "iva_8"),
+        suma(and_(traslado, tasa == 0), ic.base_mxn, "base_0"),
+        suma(and_(iva, ic.tipo == "traslado", ic.tipo_factor == "Exento"), ic.base_mxn, "base_exento"),
+        suma(and_(iva, ic.tipo == "retencion"), ic.importe_mxn, "iva_retenido"),
+    ]
+
+
+def diot_por_proveedor(rfc: str, year: int, month: int) -> Select:
+    """Actos pagados a cada proveedor en el mes, por tasa de IVA (base de la DIOT).
+
+    Flujo de efectivo, como la DIOT: los gastos PUE cuentan en su mes de emisión y los
+    PPD en el mes de cada complemento de pago recibido, en proporción a lo pagado
+    (``ImpPagado / Total``, ambos en MXN); no cuentan las facturas pagadas canceladas ni
+    sustituidas. Los tipo E restan. Una fila por RFC emisor, agregada en SQL, con importes
+    en MXN redondeados a pesos enteros.
+    """
+    signo = case((Factura.tipo_comprobante == "E", -1), else_=1)
+    pue = (
+        select(Factura.emisor_rfc.label("rfc"), Factura.emisor_id.label("contribuyente_id"), *_diot_importes(signo))
+        .join(ImpuestoComprobante, ImpuestoComprobante.factura_id == Factura.id)
+        .where(
+            Factura.titular_rfc == rfc,
+            Factura.year_emision == year,
+            Factura.month_emision == month,
+            Factura.naturaleza == "gasto",
+            func.coalesce(Factura.metodo_pago, "") != "PPD",
+            EFECTIVO,
+        )
+        .group_by(Factura.emisor_rfc)
+    )
+
+    pagada = aliased(Factura)
+    # ImpPagado viene en la moneda del documento: a la del pago con EquivalenciaDR y a MXN con el
+    # tipo de cambio del pago, contra el total en MXN (como ``PagoDocumento.iva_mxn``)
+    pagado_mxn = PagoDocumento.imp_pagado / func.coalesce(PagoDocumento.equivalencia_dr, 1) * Pago.tipo_cambio_mxn
+    proporcion = pagado_mxn / func.nullif(pagada.total_mxn, 0)
+    ppd = (
+        select(pagada.emisor_rfc.label("rfc"), pagada.emisor_id.label("contribuyente_id"), *_diot_importes(proporcion))
+        .select_from(Pago)
+        .join(Factura, Pago.factura_id == Factura.id)
+        .join(PagoDocumento, PagoDocumento.pago_id == Pago.id)
+        .join(pagada, and_(pagada.titular_rfc == rfc, pagada.uuid == PagoDocumento.id_documento))
+        .join(ImpuestoComprobante, ImpuestoComprobante.factura_id == pagada.id)
+        .where(
+            Pago.titular_rfc == rfc,
+            Pago.year_pago == year,
+            Pago.month_pago == month,
+            Factura.naturaleza == "pago",
+            pagada.naturaleza == "gasto",
+            EFECTIVO,
+            pagada.fecha_cancelacion.is_(None),
+            ~sustituido(pagada),
+        )
+        .group_by(pagada.emisor_rfc)
+    )
+
+    partes = union_all(pue, ppd).subquery()
+    columnas = ["base_16", "iva_16", "base_8", "iva_8", "base_0", "base_exento", "iva_retenido"]
+    por_rfc = (
+        select(
+            partes.c.rfc,
+            func.max(partes.c.contribuyente_id).label("contribuyente_id"),
+            # Pesos enteros, como los pide la DIOT
+            *[cast(func.round(func.sum(partes.c[c])), Integer).label(c) for c in columnas],
+        )
+        .group_by(partes.c.rfc)
+        .subquery()
+    )
+    return (
+        select(por_rfc, Contribuyente.nombre)
+        .outerjoin(Contribuyente, Contribuyente.id == por_rfc.c.contribuyente_id)
+        .order_by(por_rfc.c.rfc)
+    )
+
+
+# ---------------------------------------------------------------------------
+# Metadata SAT (ix_metadata_sat_titular_periodo_fecha; anti-join por uq_facturas_titular_uuid)
+
+
+def _metadata_sin_xml(rfc: str, year: Optional[int], month: Optional[int]) -> list:
+    """UUID vigentes de la metadata sin XML en la base activa ni en un ejercicio archivado."""
+    filtros = [
+        MetadataSAT.titular_rfc == rfc,
+        MetadataSAT.estatus == "vigente",
+        ~exists().where(Factura.titular_rfc == rfc, Factura.uuid == MetadataSAT.uuid),
+        ~exists().where(
+            UuidArchivado.titular_rfc == rfc,
+            UuidArchivado.tabla == "facturas",
+            UuidArchivado.uuid == MetadataSAT.uuid,
+        ),
+    ]
+    if year is not None:
+        filtros.append(MetadataSAT.year_emision == year)
+    if month is not None:
+        filtros.append(MetadataSAT.month_emision == month)
+    return filtros
+
+
+def metadata_sin_xml(rfc: str, year: Optional[int] = None, month: Optional[int] = None, limit: int = 500) -> Select:
+    """CFDI que el SAT reporta vigentes y no se han importado, del más reciente al más antiguo."""
+    return (
+        select(MetadataSAT)
+        .where(*_metadata_sin_xml(rfc, year, month))
+        .order_by(desc(MetadataSAT.year_emision), desc(MetadataSAT.month_emision), desc(MetadataSAT.fecha_emision))
+        .limit(limit)
+    )
+
+
+def metadata_sin_xml_conteo(rfc: str, year: Optional[int] = None, month: Optional[int] = None) -> Select:
+    """(cuántos, monto) de ``metadata_sin_xml`` sin límite."""
+    return select(func.count(), func.coalesce(func.sum(MetadataSAT.monto), 0)).where(
+        *_metadata_sin_xml(rfc, year, month)
+    )
+
+
+# ---------------------------------------------------------------------------
+# Retenciones (ix_ret_plat_titular_periodo_fecha)
+
+_RET_ORDEN = (
+    desc(RetencionPlataforma.ejercicio),
+    desc(RetencionPlataforma.mes_fin),
+    desc(RetencionPlataforma.mes_ini),
+    desc(RetencionPlataforma.fecha_exp).nullslast(),
+    desc(RetencionPlataforma.id),
+)
+
+
+def retenciones_listado(rfc: str, year: Optional[int] = None, month: Optional[int] = None, limit: int = 300) -> Select:
+    q = select(RetencionPlataforma).where(RetencionPlataforma.titular_rfc == rfc)
+    if year is not None:
+        q = q.where(RetencionPlataforma.ejercicio == year)
+    if month is not None:
+        q = q.where(RetencionPlataforma.mes_ini <= month, RetencionPlataforma.mes_fin >= month)
+    return q.order_by(*_RET_ORDEN).limit(limit)
+
+
+def retenciones_periodo(rfc: str, year: int, month: int) -> Select:
+    """Retenciones cuyo periodo (mes_ini..mes_fin) incluye el mes."""
+    return (
+        select(RetencionPlataforma)
+        .where(
+            RetencionPlataforma.titular_rfc == rfc,
+            RetencionPlataforma.ejercicio == year,
+            RetencionPlataforma.mes_ini <= month,
+            RetencionPlataforma.mes_fin >= month,
+        )
+        .order_by(*_RET_ORDEN)
+        .options(defer(RetencionPlataforma.xml_text))
+    )
+
+
+def retenciones_rangos(rfc: str) -> Select:
+    """Combinaciones (ejercicio, mes_ini, mes_fin) para armar el selector de periodos."""
+    return (
+        select(RetencionPlataforma.ejercicio, RetencionPlataforma.mes_ini, RetencionPlataforma.mes_fin)
+        .where(
+            RetencionPlataforma.titular_rfc == rfc,
+            RetencionPlataforma.ejercicio.isnot(None),
+            RetencionPlataforma.mes_fin.isnot(None),
+        )
+        .group_by(RetencionPlataforma.ejercicio, RetencionPlataforma.mes_fin, RetencionPlataforma.mes_ini)
+    )
+
+
+def retenciones_por_rango(rfc: str, year_ini: int, year_fin: int) -> Select:
+    """Totales de retenciones por (ejercicio, mes_fin, mes_ini); quien llama reparte cada
+    fila en los meses que cubre, igual que ``retenciones_periodo``."""
+    r = RetencionPlataforma
+    return (
+        select(
+            r.ejercicio,
+            r.mes_fin,
+            r.mes_ini,
+            func.coalesce(func.sum(r.mon_tot_serv_siva), 0).label("plat_ing_siva"),
+            func.coalesce(func.sum(r.total_iva_trasladado), 0).label("plat_iva_tras"),
+            func.coalesce(func.sum(r.total_iva_retenido), 0).label("plat_iva_ret"),
+            func.coalesce(func.sum(r.total_isr_retenido), 0).label("plat_isr_ret"),
+            func.coalesce(func.sum(r.mon_total_por_uso_plataforma), 0).label("plat_comision"),
+            func.count().label("ret_count"),
+        )
+        .where(r.titular_rfc == rfc, r.ejercicio >= year_ini, r.ejercicio <= year_fin)
+        .group_by(r.ejercicio, r.mes_fin, r.mes_ini)
+    )
+
+
+def retenciones_ultimo_periodo(rfc: str) -> Select:
+    return (
+        select(RetencionPlataforma.ejercicio, RetencionPlataforma.mes_fin)
+        .where(
+            RetencionPlataforma.titular_rfc == rfc,
+            RetencionPlataforma.ejercicio.isnot(None),
+            RetencionPlataforma.mes_fin.isnot(None),
+        )
+        .order_by(desc(RetencionPlataforma.ejercicio), desc(RetencionPlataforma.mes_fin))
+        .limit(1)
+    )
+
+
+def retenciones_periodos(rfc: str) -> Select:
+    return (
+        select(RetencionPlataforma.ejercicio, RetencionPlataforma.mes_fin)
+        .where(
+            RetencionPlataforma.titular_rfc == rfc,
+            RetencionPlataforma.ejercicio.isnot(None),
+            RetencionPlataforma.mes_fin.isnot(None),
+        )
+        .group_by(RetencionPlataforma.ejercicio, RetencionPlataforma.mes_fin)
+    )
+
+
+# ---------------------------------------------------------------------------
+# Declaraciones PDF (ix_decl_pdf_titular_periodo_creado)
+
+
+def declaraciones_listado(rfc: str, year: Optional[int] = None, month: Optional[int] = None) -> Select:
+    q = select(DeclaracionPDF).where(DeclaracionPDF.titular_rfc == rfc)
+    if year is not None:
+        q = q.where(DeclaracionPDF.year == year)
+    if month is not None and year is None:
+        # Sin año, "month + 0" evita que SQLite trate el mes como constante y descarte el orden del índice
+        q = q.where(DeclaracionPDF.month + 0 == month)
+    elif month is not None:
+        q = q.where(DeclaracionPDF.month == month)
+    return q.order_by(desc(DeclaracionPDF.year), desc(DeclaracionPDF.month), desc(DeclaracionPDF.created_at))
+
+
+def declaraciones_periodos(rfc: str) -> Select:
+    return (
+        select(DeclaracionPDF.year, DeclaracionPDF.month)
+        .where(DeclaracionPDF.titular_rfc == rfc, DeclaracionPDF.year.isnot(None), DeclaracionPDF.month.isnot(None))
+        .group_by(DeclaracionPDF.year, DeclaracionPDF.month)
+    )
+
+
+def declaracion_del_periodo(rfc: str, year: int, month: int) -> Select:
+    """La declaración PDF más reciente del periodo."""
+    return (
+        select(DeclaracionPDF)
+        .where(DeclaracionPDF.titular_rfc == rfc, DeclaracionPDF.year == year, DeclaracionPDF.month == month)
+        .order_by(desc(DeclaracionPDF.created_at))
+        .limit(1)
+    )
+
+
+def declaracion_por_sha(sha256: str) -> Select:
+    return select(DeclaracionPDF.id).where(DeclaracionPDF.sha256 == sha256)
+
+
+# ---------------------------------------------------------------------------
+# Importaciones en segundo plano (ix_import_jobs_titular, ix_import_job_archivos_job)
+
+
+def importaciones_listado(rfc: str, limit: int = 50) -> Select:
+    return select(ImportJob).where(ImportJob.titular_rfc == rfc).order_by(desc(ImportJob.id)).limit(limit)
+
+
+def importacion_archivos(job_id: int, status: Optional[str] = None, limit: int = 500) -> Select:
+    """Resultado por archivo de una importación, en el orden en que se procesaron."""
+    q = select(ImportJobArchivo).where(ImportJobArchivo.job_id == job_id)
+    if status:
+        q = q.where(ImportJobArchivo.status == status)
+    return q.order_by(ImportJobArchivo.id).limit(limit)
+
+
+# ---------------------------------------------------------------------------
+# Búsqueda de texto completo (índices FTS5 de busqueda.py, orden por rank/bm25)
+#
+# ``consulta`` ya viene de ``busqueda.consulta_fts``. El filtro por titular se aplica
+# al unir con la tabla de contenido por su llave primaria. Con ``desde_rowid`` el
+# ranking se limita a las coincidencias más recientes (ver ``fts_corte``).
+
+
+def _marcas() -> tuple[str, str]:
+    return busqueda.INICIO_MARCA, busqueda.FIN_MARCA
+
+
+def fts_corte(fuente: str, consulta: str, ventana: int) -> Select:
+    """rowid de la coincidencia número ``ventana`` contando desde la más reciente.
+
+    FTS5 recorre las coincidencias en orden de rowid sin calcular bm25, así que cuesta
+    lo mismo que leer ``ventana`` entradas del índice. Sin renglón = hay menos coincidencias.
+    """
+    fts = busqueda.TABLAS_FTS[fuente]
+    return (
+        select(fts.c.rowid)
+        .where(fts.c[fts.name].match(consulta))
+        .order_by(desc(fts.c.rowid))
+        .limit(1)
+        .offset(ventana)
+    )
+
+
+def _rango_fts(q: Select, fts, desde_rowid: Optional[int]) -> Select:
+    return q.where(fts.c.rowid >= desde_rowid) if desde_rowid is not None else q
+
+
+def buscar_conceptos(
+    rfc: str, consulta: str, limit: int = 20, offset: int = 0, desde_rowid: Optional[int] = None
+) -> Select:
+    fts = busqueda.conceptos_fts
+    emisor, receptor = aliased(Contribuyente), aliased(Contribuyente)
+    q = (
+        select(
+            Concepto.id.label("concepto_id"),
+            Factura.id.label("factura_id"),
+            Factura.uuid,
+            Factura.fecha_emision,
+            Factura.naturaleza,
+            Factura.emisor_rfc,
+            emisor.nombre.label("emisor_nombre"),
+            Factura.receptor_rfc,
+            receptor.nombre.label("receptor_nombre"),
+            Concepto.clave_prod_serv,
+            Concepto.importe,
+            Factura.moneda,
+            func.snippet(literal_column("conceptos_fts"), 0, *_marcas(), "…", 16).label("fragmento"),
+            fts.c.rank,
+        )
+        .select_from(fts)
+        .join(Concepto, Concepto.id == fts.c.rowid)
+        .join(Factura, Factura.id == Concepto.factura_id)
+        .outerjoin(emisor, emisor.id == Factura.emisor_id)
+        .outerjoin(receptor, receptor.id == Factura.receptor_id)
+        .where(fts.c.conceptos_fts.match(consulta), Factura.titular_rfc == rfc)
+        .order_by(fts.c.rank)
+        .limit(limit)
+        .offset(offset)
+    )
+    return _rango_fts(q, fts, desde_rowid)
+
+
+def buscar_contrapartes(
+    rfc: str, consulta: str, limit: int = 20, offset: int = 0, desde_rowid: Optional[int] = None
+) -> Select:
+    """Contribuyentes que coinciden por nombre o RFC y tienen CFDI con el titular.
+
+    Los conteos y el filtro usan ix_facturas_titular_emisor / ix_facturas_titular_receptor.
+    """
+    fts = busqueda.contribuyentes_fts
+    emitidos = (
+        select(func.count())
+        .where(Factura.titular_rfc == rfc, Factura.emisor_id == Contribuyente.id)
+        .correlate(Contribuyente)
+        .scalar_subquery()
+    )
+    recibidos = (
+        select(func.count())
+        .where(Factura.titular_rfc == rfc, Factura.receptor_id == Contribuyente.id)
+        .correlate(Contribuyente)
+        .scalar_subquery()
+    )
+    q = (
+        select(
+            Contribuyente.id.label("contribuyente_id"),
+            Contribuyente.rfc,
+            func.highlight(literal_column("contribuyentes_fts"), 0, *_marcas()).label("nombre_resaltado"),
+            emitidos.label("cfdi_emitidos"),
+            recibidos.label("cfdi_recibidos"),
+            fts.c.rank,
+        )
+        .select_from(fts)
+        .join(Contribuyente, Contribuyente.id == fts.c.rowid)
+        .where(
+            fts.c.contribuyentes_fts.match(consulta),
+            Contribuyente.rfc != rfc,
+            or_(
+                exists().where(Factura.titular_rfc == rfc, Factura.emisor_id == Contribuyente.id),
+                exists().where(Factura.titular_rfc == rfc, Factura.receptor_id == Contribuyente.id),
+            ),
+        )
+        .order_by(fts.c.rank)
+        .limit(limit)
+        .offset(offset)
+    )
+    return _rango_fts(q, fts, desde_rowid)
+
+
+def buscar_acuses(
+    rfc: str, consulta: str, limit: int = 20, offset: int = 0, desde_rowid: Optional[int] = None
+) -> Select:
+    fts = busqueda.declaraciones_fts
+    q = (
+        select(
+            DeclaracionPDF.id.label("declaracion_id"),
+            DeclaracionPDF.year,
+            DeclaracionPDF.month,
+            DeclaracionPDF.folio,
+            DeclaracionPDF.original_name,
+            func.snippet(literal_column("declaraciones_fts"), 0, *_marcas(), "…", 24).label("fragmento"),
+            fts.c.rank,
+        )
+        .select_from(fts)
+        .join(DeclaracionPDF, DeclaracionPDF.id == fts.c.rowid)
+        .where(fts.c.declaraciones_fts.match(consulta), DeclaracionPDF.titular_rfc == rfc)
+        .order_by(fts.c.rank)
+        .limit(limit)
+        .offset(offset)
+    )
+    return _rango_fts(q, fts, desde_rowid)
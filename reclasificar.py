@@ -0,0 +1,76 @@
+"""Reclasifica ``naturaleza`` de todas las facturas sin re-parsear XML.
+
+La clasificación (ingreso / gasto / cobro / pago / otro) depende del RFC titular
+y se congela al importar. Este comando la recalcula con un solo ``UPDATE ... CASE``
+sobre ``emisor_rfc`` / ``receptor_rfc`` / ``tipo_comprobante`` comparando contra el
+``titular_rfc`` de cada fila (misma regla que ``parser_xml._clasifica_naturaleza``)
+e invalida los resúmenes en la misma transacción.
+
+Uso:
+    python reclasificar.py [--rfc RFC_TITULAR]
+"""
+
+from __future__ import annotations
+
+import argparse
+import time
+from typing import Optional
+
+from sqlalchemy import and_, case, func, update
+from sqlalchemy.orm import Session
+
+from db import SessionLocal, sync_schema
+from estado import bump_data_version
+from models import Base, Factura
+
+
+def _naturaleza_expr():
+    """Expresión SQL equivalente a ``_clasifica_naturaleza`` usando el titular de cada fila."""
+    mi = func.upper(func.coalesce(Factura.titular_rfc, ""))
+    tipo = func.upper(func.coalesce(Factura.tipo_comprobante, ""))
+    em = func.upper(func.coalesce(Factura.emisor_rfc, ""))
+    rec = func.upper(func.coalesce(Factura.receptor_rfc, ""))
+    return case(
+        (and_(tipo == "P", em == mi), "cobro"),
+        (and_(tipo == "P", rec == mi), "pago"),
+        (tipo == "P", "otro"),
+        (em == mi, "ingreso"),
+        (rec == mi, "gasto"),
+        else_="otro",
+    )
+
+
+def reclasificar_naturaleza(db: Session, titular_rfc: Optional[str] = None) -> int:
+    """Recalcula ``naturaleza`` en un solo UPDATE. Regresa el número de filas cambiadas.
+
+    Sin ``titular_rfc`` se reclasifican todos los titulares en la misma sentencia.
+    No hace commit: el llamador confirma la transacción (incluye el cambio de versión de datos).
+    """
+    nueva = _naturaleza_expr()
+    stmt = update(Factura).where(Factura.naturaleza.is_distinct_from(nueva))
+    if titular_rfc:
+        stmt = stmt.where(Factura.titular_rfc == titular_rfc.upper())
+    result = db.execute(stmt.values(naturaleza=nueva).execution_options(synchronize_session=False))
+    if result.rowcount:
+        bump_data_version(db)
+    return result.rowcount or 0
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="Reclasifica naturaleza de facturas según su RFC titular.")
+    ap.add_argument("--rfc", default=None, help="Solo este titular (default: todos)")
+    args = ap.parse_args()
+
+    sync_schema(Base.metadata)
+    db = SessionLocal()
+    try:
+        t0 = time.perf_counter()
+        n = reclasificar_naturaleza(db, args.rfc)
+        db.commit()
+        print(f"{n} facturas reclasificadas en {time.perf_counter() - t0:.2f}s")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
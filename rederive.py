@@ -0,0 +1,265 @@
+"""Re-deriva columnas de facturas/retenciones a partir del ``xml_text`` guardado.
+
+Cuando cambia la lógica del parser (``parser_xml.PARSER_VERSION``), las filas ya
+importadas conservan sus columnas viejas. Este comando:
+
+1. Lee ``(id, xml_text)`` por bloques ordenados por id.
+2. Re-parsea cada bloque en un pool de procesos con el parser actual.
+3. Compara contra las columnas guardadas y aplica solo las filas que cambiaron
+   con ``UPDATE`` por lotes (``executemany``).
+4. Si la fila fue generada por otra versión del parser, reconstruye también sus
+   conceptos, impuestos, pagos y documentos relacionados (con sus saldos PPD) y las
+   filas de sus complementos (Nómina, Dividendos, ...).
+5. Guarda el último id procesado en ``parametros`` en la misma transacción, para
+   poder reanudar tras una interrupción.
+
+Uso:
+    python rederive.py [--tabla facturas|retenciones|todas] [--chunk 1000]
+                       [--workers N] [--reiniciar]
+"""
+
+from __future__ import annotations
+
+import argparse
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from decimal import Decimal
+from typing import Optional
+
+from sqlalchemy import bindparam, select, update
+from sqlalchemy.orm import Session
+
+import busqueda
+import complementos  # noqa: F401  registra Nómina, Comercio Exterior, ...
+import contribuyentes
+from db import SessionLocal, engine, sync_schema
+from estado import bump_data_version, get_parametro, set_parametro
+from importer import reemplazar_complementos, replace_children
+from models import Base, Factura, RetencionPlataforma
+from parser_xml import PARSER_VERSION, parse_cfdi_40, parse_retenciones_plataforma
+from tipos_cambio import normalizar
+
+
+FACTURA_COLS = [
+    "uuid",
+    "version",
+    "tipo_comprobante",
+    "fecha_emision",
+    "year_emision",
+    "month_emision",
+    "naturaleza",
+    "emisor_rfc",
+    "emisor_id",
+    "receptor_rfc",
+    "receptor_id",
+    "uso_cfdi",
+    "moneda",
+    "tipo_cambio",
+    "metodo_pago",
+    "forma_pago",
+    "subtotal",
+    "descuento",
+    "total",
+    "total_trasladados",
+    "total_retenidos",
+]
+
+RETENCION_COLS = [
+    "uuid",
+    "version",
+    "fecha_exp",
+    "ejercicio",
+    "mes_ini",
+    "mes_fin",
+    "emisor_rfc",
+    "emisor_id",
+    "receptor_rfc",
+    "receptor_id",
+    "monto_tot_operacion",
+    "monto_tot_grav",
+    "monto_tot_exent",
+    "monto_tot_ret",
+    "periodicidad",
+    "num_serv",
+    "mon_tot_serv_siva",
+    "total_iva_trasladado",
+    "total_iva_retenido",
+    "total_isr_retenido",
+    "dif_iva_entregado_prest_serv",
+    "mon_total_por_uso_plataforma",
+]
+
+TABLAS = {
+    "facturas": (Factura, FACTURA_COLS),
+    "retenciones": (RetencionPlataforma, RETENCION_COLS),
+}
+
+
+def _reparse(args: tuple[str, int, str, Optional[str]]) -> tuple[int, Optional[dict]]:
+    """Se ejecuta en el pool: re-parsea un XML guardado. Regresa (id, parsed|None)."""
+    tabla, row_id, xml_text, titular_rfc = args
+    try:
+        if tabla == "facturas":
+            parsed = parse_cfdi_40(xml_text.encode("utf-8"), titular_rfc)
+        else:
+            parsed = parse_retenciones_plataforma(xml_text.encode("utf-8"))
+    except Exception:
+        return row_id, None
+    parsed["titular_rfc"] = titular_rfc
+    return row_id, parsed
+
+
+def _norm(v):
+    # SQLite guarda DateTime sin zona y Numeric como REAL; se normaliza antes de comparar.
+    if isinstance(v, datetime) and v.tzinfo is not None:
+        return v.replace(tzinfo=None)
+    if isinstance(v, float):
+        return Decimal(str(v))
+    return v
+
+
+def _same(a, b) -> bool:
+    a, b = _norm(a), _norm(b)
+    if isinstance(a, Decimal) and isinstance(b, Decimal):
+        return a.compare(b) == 0
+    return a == b
+
+
+def _state_key(tabla: str) -> str:
+    return f"rederive:{tabla}:v{PARSER_VERSION}"
+
+
+def _get_last_id(db: Session, tabla: str) -> int:
+    v = get_parametro(db, _state_key(tabla))
+    return int(v) if v else 0
+
+
+def _set_last_id(db: Session, tabla: str, last_id: int) -> None:
+    set_parametro(db, _state_key(tabla), str(last_id))
+
+
+def rederive_tabla(
+    tabla: str,
+    chunk_size: int = 1000,
+    workers: Optional[int] = None,
+    reiniciar: bool = False,
+    pool: Optional[ProcessPoolExecutor] = None,
+) -> dict:
+    """Re-deriva una tabla completa (reanudable). Regresa estadísticas."""
+    model, cols = TABLAS[tabla]
+    stats = {"leidos": 0, "actualizados": 0, "hijos_reconstruidos": 0, "errores": 0, "ultimo_id": 0}
+
+    own_pool = pool is None
+    pool = pool or ProcessPoolExecutor(max_workers=workers)
+    db = SessionLocal()
+    try:
+        if reiniciar:
+            _set_last_id(db, tabla, 0)
+            db.commit()
+        last_id = _get_last_id(db, tabla)
+        stats["ultimo_id"] = last_id
+
+        upd = (
+            update(model.__table__)
+            .where(model.__table__.c.id == bindparam("_id"))
+            .values({c: bindparam(f"v_{c}") for c in cols + ["parser_version"]})
+        )
+
+        while True:
+            rows = db.execute(
+                select(model.id, model.xml_text, model.titular_rfc)
+                .where(model.id > last_id)
+                .order_by(model.id)
+                .limit(chunk_size)
+            ).all()
+            if not rows:
+                break
+
+            ids = [r[0] for r in rows]
+            tasks = [(tabla, i, x, t) for i, x, t in rows]
+            reparsed = dict(pool.map(_reparse, tasks, chunksize=max(1, chunk_size // 32)))
+
+            stored = {
+                r[0]: r
+                for r in db.execute(
+                    select(model.id, model.parser_version, *[getattr(model, c) for c in cols]).where(model.id.in_(ids))
+                ).all()
+            }
+
+            # Nombres de emisor/receptor a id de contribuyentes antes de comparar
+            resueltos = contribuyentes.asignar_ids(db, [p for p in reparsed.values() if p is not None])
+
+            updates: list[dict] = []
+            rebuild: dict[int, dict] = {}
+            for row_id in ids:
+                parsed = reparsed.get(row_id)
+                if parsed is None:
+                    stats["errores"] += 1
+                    continue
+                current = stored[row_id]
+                old_version = current[1]
+                changed = any(not _same(parsed.get(c), current[2 + n]) for n, c in enumerate(cols))
+                if changed or old_version != PARSER_VERSION:
+                    values = {f"v_{c}": parsed.get(c) for c in cols}
+                    updates.append({"_id": row_id, "v_parser_version": PARSER_VERSION, **values})
+                if old_version != PARSER_VERSION:
+                    rebuild[row_id] = parsed
+
+            if updates:
+                db.execute(upd, updates)
+            if rebuild and tabla == "facturas":
+                replace_children(db, rebuild)
+            elif rebuild:
+                reemplazar_complementos(db, "retenciones", rebuild)
+            if tabla == "facturas":
+                # Importes en MXN de lo que cambió (replace_children ya los calculó para ``rebuild``)
+                normalizar(db, [u["_id"] for u in updates if u["_id"] not in rebuild])
+            if updates or rebuild:
+                bump_data_version(db)
+
+            last_id = ids[-1]
+            _set_last_id(db, tabla, last_id)
+            db.commit()
+            contribuyentes.cache.recordar(resueltos)
+
+            stats["leidos"] += len(ids)
+            stats["actualizados"] += len(updates)
+            stats["hijos_reconstruidos"] += len(rebuild)
+            stats["ultimo_id"] = last_id
+    finally:
+        db.close()
+        if own_pool:
+            pool.shutdown()
+
+    return stats
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="Re-deriva columnas desde el XML guardado.")
+    ap.add_argument("--tabla", choices=["facturas", "retenciones", "todas"], default="todas")
+    ap.add_argument("--chunk", type=int, default=1000, help="Filas por bloque (default 1000)")
+    ap.add_argument("--workers", type=int, default=None, help="Procesos del pool (default: CPUs)")
+    ap.add_argument("--reiniciar", action="store_true", help="Ignora el avance guardado y empieza desde el id 0")
+    args = ap.parse_args()
+
+    sync_schema(Base.metadata)
+    busqueda.crear_indices_fts(engine)
+    contribuyentes.migrar(engine)
+    tablas = ["facturas", "retenciones"] if args.tabla == "todas" else [args.tabla]
+
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        for tabla in tablas:
+            t0 = time.perf_counter()
+            stats = rederive_tabla(tabla, args.chunk, reiniciar=args.reiniciar, pool=pool)
+            dt = time.perf_counter() - t0
+            rate = stats["leidos"] / dt if dt > 0 else 0.0
+            print(
+                f"{tabla} (parser v{PARSER_VERSION}): {stats['leidos']} leídos, {stats['actualizados']} actualizados, "
+                f"{stats['hijos_reconstruidos']} con hijos reconstruidos, {stats['errores']} errores; "
+                f"último id {stats['ultimo_id']} ({rate:,.0f} filas/s)"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,419 @@
+"""Respaldos en línea de la base SQLite y de los PDF de acuses.
+
+La base se copia con la API de respaldo de SQLite (``Connection.backup``) en pasos de
+``--paginas`` páginas. La conexión de origen es de solo lectura y mantiene abierta una
+transacción de lectura durante toda la copia: en modo WAL eso fija una instantánea
+consistente sin detener a las importaciones (los escritores siguen agregando al WAL y
+la copia no se reinicia aunque la base cambie mientras tanto).
+
+Los PDF se guardan con su SHA256 como nombre (``utils.safe_pdf_filename``), así que un
+respaldo incremental solo tiene que comparar nombres: cada respaldo lleva en un
+``pdfs.tar.gz`` (escrito por flujo) los PDF que no estaban en la cadena de respaldos
+anteriores, y su ``manifiesto.json`` apunta al respaldo base. Los ejercicios del archivo
+frío (``data/archivo/<año>.sqlite``, ver archivo.py) no cambian una vez registrados, así
+que se tratan igual: cada uno va una sola vez en la cadena.
+
+Estructura de ``data/respaldos/<AAAAMMDD-HHMMSS>/``::
+
+    contabilidad.sqlite.gz   copia de la base (gzip)
+    pdfs.tar.gz              PDF nuevos desde el respaldo base
+    archivo/<año>.sqlite.gz  ejercicios archivados nuevos desde el respaldo base
+    manifiesto.json          base, SHA256 de la base, lista de PDF incluidos
+
+``restaurar`` reconstruye una carpeta de datos siguiendo la cadena hasta el respaldo
+completo y la verifica: ``PRAGMA integrity_check``, SHA256 de cada PDF contra su nombre
+(en paralelo), que cada acuse registrado tenga su archivo y ``integrity_check`` de cada
+ejercicio archivado.
+
+Uso:
+    python respaldo.py crear [--completo] [--destino DIR]
+    python respaldo.py restaurar data/respaldos/20250301-120000 --destino /ruta/datos
+    python respaldo.py verificar [DIR]
+"""
+
+from __future__ import annotations
+
+import argparse
+import gzip
+import hashlib
+import json
+import os
+import re
+import shutil
+import sqlite3
+import sys
+import tarfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from datetime import datetime
+from pathlib import Path
+from typing import Iterator, Optional
+
+from archivo import ARCHIVO_DIR
+from db import DATA_DIR, DB_PATH, PDF_DIR
+
+
+RESPALDOS_DIR = DATA_DIR / "respaldos"
+
+ARCHIVO_DB = "contabilidad.sqlite.gz"
+ARCHIVO_PDFS = "pdfs.tar.gz"
+MANIFIESTO = "manifiesto.json"
+
+PAGINAS_POR_PASO = 1024  # 4 MiB con páginas de 4 KiB
+BLOQUE = 1 << 20  # lectura por bloques de 1 MiB al comprimir y al calcular hashes
+NIVEL_GZIP = 1  # los PDF ya vienen comprimidos; en la base, más nivel cuesta mucho tiempo y poco espacio
+
+_NOMBRE_PDF = re.compile(r"^[0-9a-f]{64}\.pdf$")
+_NOMBRE_FRIO = re.compile(r"^\d{4}\.sqlite$")
+
+
+class RespaldoInvalido(Exception):
+    """El respaldo no existe, está incompleto o su cadena está rota."""
+
+
+@dataclass
+class Verificacion:
+    pdfs: int = 0
+    bytes_pdfs: int = 0
+    integridad: str = ""
+    hash_incorrecto: list[str] = field(default_factory=list)
+    faltantes: list[str] = field(default_factory=list)
+    frios: int = 0
+    frios_danados: list[str] = field(default_factory=list)
+
+    @property
+    def ok(self) -> bool:
+        return self.integridad == "ok" and not self.hash_incorrecto and not self.faltantes and not self.frios_danados
+
+
+# ---------------------------------------------------------------------------
+# Crear
+# ---------------------------------------------------------------------------
+
+
+def _sha256_archivo(path: Path) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        while bloque := f.read(BLOQUE):
+            h.update(bloque)
+    return h.hexdigest()
+
+
+def _pdfs_en(carpeta: Path) -> Iterator[Path]:
+    """PDF direccionados por contenido (``<sha256>.pdf``) de una carpeta."""
+    if not carpeta.is_dir():
+        return
+    for entrada in os.scandir(carpeta):
+        if entrada.is_file() and _NOMBRE_PDF.match(entrada.name):
+            yield Path(entrada.path)
+
+
+def _frios_en(carpeta: Path) -> Iterator[Path]:
+    """Ejercicios archivados terminados (``<año>.sqlite``; los temporales empiezan con punto)."""
+    if not carpeta.is_dir():
+        return
+    for entrada in os.scandir(carpeta):
+        if entrada.is_file() and _NOMBRE_FRIO.match(entrada.name):
+            yield Path(entrada.path)
+
+
+def _leer_manifiesto(respaldo: Path) -> dict:
+    try:
+        return json.loads((respaldo / MANIFIESTO).read_text(encoding="utf-8"))
+    except (OSError, ValueError) as e:
+        raise RespaldoInvalido(f"{respaldo}: sin {MANIFIESTO} válido") from e
+
+
+def _ultimo_respaldo(carpeta: Path) -> Optional[Path]:
+    """Respaldo más reciente terminado (los que están a medias empiezan con punto)."""
+    if not carpeta.is_dir():
+        return None
+    terminados = sorted(p for p in carpeta.iterdir() if not p.name.startswith(".") and (p / MANIFIESTO).is_file())
+    return terminados[-1] if terminados else None
+
+
+def cadena(respaldo: Path) -> list[Path]:
+    """Respaldos desde el completo hasta ``respaldo`` (en ese orden)."""
+    resultado = [respaldo]
+    vistos = {respaldo.name}
+    base = _leer_manifiesto(respaldo).get("base")
+    while base:
+        anterior = respaldo.parent / base
+        if base in vistos or not (anterior / MANIFIESTO).is_file():
+            raise RespaldoInvalido(f"{respaldo}: falta el respaldo base {base}")
+        vistos.add(base)
+        resultado.append(anterior)
+        base = _leer_manifiesto(anterior).get("base")
+    return resultado[::-1]
+
+
+def copiar_base(origen: Path, destino: Path, paginas: int = PAGINAS_POR_PASO, progreso=None) -> None:
+    """Copia ``origen`` a ``destino`` con la API de respaldo, ``paginas`` por paso.
+
+    La transacción de lectura abierta antes de copiar fija la instantánea: la copia
+    corresponde al último commit anterior y no se reinicia si otra conexión escribe.
+    """
+    src = sqlite3.connect(f"file:{origen.as_posix()}?mode=ro", uri=True, isolation_level=None)
+    dst = sqlite3.connect(destino)
+    try:
+        src.execute("BEGIN")
+        src.execute("SELECT count(*) FROM sqlite_master").fetchone()
+        src.backup(dst, pages=paginas, progress=progreso)
+        src.execute("COMMIT")
+        dst.execute("PRAGMA journal_mode=DELETE")
+    finally:
+        dst.close()
+        src.close()
+
+
+def _comprimir(origen: Path, destino: Path) -> str:
+    """Escribe ``origen`` en gzip y regresa el SHA256 del contenido sin comprimir."""
+    h = hashlib.sha256()
+    with open(origen, "rb") as f, gzip.open(destino, "wb", compresslevel=NIVEL_GZIP) as gz:
+        while bloque := f.read(BLOQUE):
+            h.update(bloque)
+            gz.write(bloque)
+    return h.hexdigest()
+
+
+def crear_respaldo(
+    carpeta: Path = RESPALDOS_DIR,
+    completo: bool = False,
+    db_path: Path = DB_PATH,
+    pdf_dir: Path = PDF_DIR,
+    paginas: int = PAGINAS_POR_PASO,
+    archivo_dir: Path = ARCHIVO_DIR,
+) -> Path:
+    """Crea un respaldo (incremental si ya hay uno, salvo ``completo``) y regresa su carpeta.
+
+    Se escribe en ``.<nombre>.tmp`` y se renombra al final, así que un respaldo
+    interrumpido nunca se toma como base del siguiente.
+    """
+    carpeta.mkdir(parents=True, exist_ok=True)
+    base = None if completo else _ultimo_respaldo(carpeta)
+    conocidos: set[str] = set()
+    frios_conocidos: set[str] = set()
+    if base is not None:
+        for r in cadena(base):
+            m = _leer_manifiesto(r)
+            conocidos.update(m["pdfs"])
+            frios_conocidos.update(a["archivo"] for a in m.get("archivo", []))
+
+    nombre = datetime.now().strftime("%Y%m%d-%H%M%S")
+    while (carpeta / nombre).exists():
+        time.sleep(1)
+        nombre = datetime.now().strftime("%Y%m%d-%H%M%S")
+    tmp = carpeta / f".{nombre}.tmp"
+    shutil.rmtree(tmp, ignore_errors=True)
+    tmp.mkdir()
+
+    try:
+        copia = tmp / "contabilidad.sqlite"
+        copiar_base(db_path, copia, paginas)
+        db_bytes = copia.stat().st_size
+        db_sha = _comprimir(copia, tmp / ARCHIVO_DB)
+        copia.unlink()
+
+        nuevos = sorted(p for p in _pdfs_en(pdf_dir) if p.name not in conocidos)
+        with tarfile.open(tmp / ARCHIVO_PDFS, "w:gz", compresslevel=NIVEL_GZIP) as tar:
+            for p in nuevos:
+                tar.add(p, arcname=p.name, recursive=False)
+
+        frios = []
+        for p in sorted(_frios_en(archivo_dir)):
+            if p.name in frios_conocidos:
+                continue
+            (tmp / "archivo").mkdir(exist_ok=True)
+            sha = _comprimir(p, tmp / "archivo" / f"{p.name}.gz")
+            frios.append({"archivo": p.name, "sha256": sha, "bytes": p.stat().st_size})
+
+        manifiesto = {
+            "version": 1,
+            "creado": datetime.now().isoformat(timespec="seconds"),
+            "base": base.name if base is not None else None,
+            "db": {"archivo": ARCHIVO_DB, "sha256": db_sha, "bytes": db_bytes},
+            "pdfs": [p.name for p in nuevos],
+            "pdfs_total": len(conocidos) + len(nuevos),
+            "archivo": frios,
+        }
+        (tmp / MANIFIESTO).write_text(json.dumps(manifiesto, indent=1), encoding="utf-8")
+        destino = carpeta / nombre
+        tmp.rename(destino)
+    except BaseException:
+        shutil.rmtree(tmp, ignore_errors=True)
+        raise
+    return destino
+
+
+# ---------------------------------------------------------------------------
+# Restaurar y verificar
+# ---------------------------------------------------------------------------
+
+
+def _extraer_pdfs(tar_path: Path, pdf_dir: Path) -> int:
+    """Extrae por flujo solo miembros ``<sha256>.pdf`` regulares (sin rutas)."""
+    n = 0
+    with tarfile.open(tar_path, "r|gz") as tar:
+        for miembro in tar:
+            if not miembro.isfile() or not _NOMBRE_PDF.match(miembro.name):
+                continue
+            origen = tar.extractfile(miembro)
+            with open(pdf_dir / miembro.name, "wb") as destino:
+                shutil.copyfileobj(origen, destino, BLOQUE)
+            n += 1
+    return n
+
+
+def _descomprimir_verificado(origen: Path, destino: Path, sha256: str) -> None:
+    """Descomprime ``origen`` en ``destino`` (vía ``.tmp``) si su SHA256 coincide."""
+    tmp = destino.with_name(destino.name + ".tmp")
+    h = hashlib.sha256()
+    with gzip.open(origen, "rb") as gz, open(tmp, "wb") as f:
+        while bloque := gz.read(BLOQUE):
+            h.update(bloque)
+            f.write(bloque)
+    if h.hexdigest() != sha256:
+        tmp.unlink()
+        raise RespaldoInvalido(f"{origen}: no coincide con el SHA256 del manifiesto")
+    tmp.rename(destino)
+
+
+def restaurar(respaldo: Path, destino: Path, workers: Optional[int] = None) -> Verificacion:
+    """Reconstruye una carpeta de datos desde ``respaldo`` y su cadena, y la verifica.
+
+    No sobrescribe: ``destino`` no debe tener ya una base.
+    """
+    destino_db = destino / "contabilidad.sqlite"
+    if destino_db.exists():
+        raise RespaldoInvalido(f"{destino_db} ya existe; restaura en una carpeta vacía")
+    respaldos = cadena(respaldo)
+    manifiesto = _leer_manifiesto(respaldo)
+
+    pdf_dir = destino / "pdfs"
+    pdf_dir.mkdir(parents=True, exist_ok=True)
+    for r in respaldos:
+        _extraer_pdfs(r / ARCHIVO_PDFS, pdf_dir)
+        for a in _leer_manifiesto(r).get("archivo", []):
+            if not _NOMBRE_FRIO.match(a["archivo"]):
+                raise RespaldoInvalido(f"{r}: nombre de archivo frío inválido {a['archivo']!r}")
+            (destino / "archivo").mkdir(exist_ok=True)
+            _descomprimir_verificado(r / "archivo" / f"{a['archivo']}.gz", destino / "archivo" / a["archivo"], a["sha256"])
+
+    _descomprimir_verificado(respaldo / manifiesto["db"]["archivo"], destino_db, manifiesto["db"]["sha256"])
+
+    return verificar(destino, workers)
+
+
+def _revisar_pdf(path: Path) -> tuple[str, int, bool]:
+    return path.name, path.stat().st_size, _sha256_archivo(path) == path.name[:64]
+
+
+def verificar(carpeta: Path = DATA_DIR, workers: Optional[int] = None) -> Verificacion:
+    """Revisa la base y el SHA256 de cada PDF de ``carpeta`` (en paralelo).
+
+    ``hashlib`` suelta el GIL con bloques grandes, así que los hilos calculan en
+    paralelo de verdad.
+    """
+    res = Verificacion()
+    db_path = carpeta / "contabilidad.sqlite"
+    pdf_dir = carpeta / "pdfs"
+
+    presentes: set[str] = set()
+    with ThreadPoolExecutor(max_workers=workers or os.cpu_count()) as pool:
+        for nombre, tam, ok in pool.map(_revisar_pdf, _pdfs_en(pdf_dir)):
+            res.pdfs += 1
+            res.bytes_pdfs += tam
+            presentes.add(nombre)
+            if not ok:
+                res.hash_incorrecto.append(nombre)
+
+    if not db_path.is_file():
+        res.integridad = "sin base"
+        return res
+    conn = sqlite3.connect(f"file:{db_path.as_posix()}?mode=ro", uri=True)
+    try:
+        res.integridad = "; ".join(r[0] for r in conn.execute("PRAGMA integrity_check"))
+        try:
+            registrados = conn.execute("SELECT filename FROM declaraciones_pdf")
+            res.faltantes = sorted({f for (f,) in registrados if f not in presentes})
+        except sqlite3.OperationalError:
+            pass  # base sin la tabla de acuses
+        try:
+            anios = conn.execute("SELECT year FROM archivos_frios")
+            res.faltantes += [f"archivo/{y}.sqlite" for (y,) in anios if not (carpeta / "archivo" / f"{y}.sqlite").is_file()]
+        except sqlite3.OperationalError:
+            pass  # base anterior al archivo frío
+    finally:
+        conn.close()
+    for path in sorted(_frios_en(carpeta / "archivo")):
+        res.frios += 1
+        frio = sqlite3.connect(f"file:{path.as_posix()}?mode=ro", uri=True)
+        try:
+            if frio.execute("PRAGMA integrity_check").fetchone()[0] != "ok":
+                res.frios_danados.append(path.name)
+        finally:
+            frio.close()
+    res.hash_incorrecto.sort()
+    return res
+
+
+def _imprimir_verificacion(res: Verificacion) -> None:
+    print(
+        f"integridad: {res.integridad}; {res.pdfs} PDF ({res.bytes_pdfs / 1048576:.1f} MiB), "
+        f"{len(res.hash_incorrecto)} con hash incorrecto, {len(res.faltantes)} registrados sin archivo; "
+        f"{res.frios} ejercicios archivados, {len(res.frios_danados)} dañados"
+    )
+    for nombre in res.hash_incorrecto:
+        print(f"  hash incorrecto: {nombre}")
+    for nombre in res.faltantes:
+        print(f"  falta: {nombre}")
+    for nombre in res.frios_danados:
+        print(f"  archivo dañado: {nombre}")
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="Respaldos en línea de la base y los PDF.")
+    sub = ap.add_subparsers(dest="comando", required=True)
+
+    p = sub.add_parser("crear", help="Crea un respaldo (incremental si ya hay uno)")
+    p.add_argument("--destino", type=Path, default=RESPALDOS_DIR, help=f"Carpeta de respaldos (default {RESPALDOS_DIR})")
+    p.add_argument("--completo", action="store_true", help="No usa el último respaldo como base")
+    p.add_argument("--paginas", type=int, default=PAGINAS_POR_PASO, help="Páginas por paso de la copia")
+
+    p = sub.add_parser("restaurar", help="Reconstruye una carpeta de datos y la verifica")
+    p.add_argument("respaldo", type=Path)
+    p.add_argument("--destino", type=Path, required=True, help="Carpeta de datos nueva")
+    p.add_argument("--workers", type=int, default=None, help="Hilos para los hashes (default: CPUs)")
+
+    p = sub.add_parser("verificar", help="Verifica una carpeta de datos")
+    p.add_argument("carpeta", type=Path, nargs="?", default=DATA_DIR)
+    p.add_argument("--workers", type=int, default=None, help="Hilos para los hashes (default: CPUs)")
+    args = ap.parse_args()
+
+    t0 = time.perf_counter()
+    try:
+        if args.comando == "crear":
+            destino = crear_respaldo(args.destino, completo=args.completo, paginas=args.paginas)
+            m = _leer_manifiesto(destino)
+            tipo = f"incremental sobre {m['base']}" if m["base"] else "completo"
+            print(
+                f"{destino} ({tipo}): base {m['db']['bytes'] / 1048576:.1f} MiB, {len(m['pdfs'])} PDF nuevos "
+                f"de {m['pdfs_total']}, {len(m['archivo'])} ejercicios archivados nuevos en {time.perf_counter() - t0:.1f} s"
+            )
+            return
+        if args.comando == "restaurar":
+            res = restaurar(args.respaldo, args.destino, args.workers)
+        else:
+            res = verificar(args.carpeta, args.workers)
+    except RespaldoInvalido as e:
+        print(f"error: {e}", file=sys.stderr)
+        sys.exit(2)
+    _imprimir_verificacion(res)
+    print(f"{time.perf_counter() - t0:.1f} s")
+    if not res.ok:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1 @@
+"""Herramientas de mantenimiento; se ejecutan desde la raíz con ``python -m scripts.<nombre>``."""
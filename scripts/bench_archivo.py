@@ -0,0 +1,135 @@
+"""Mide las vistas de un ejercicio antes y después de pasarlo al archivo frío (``archivo.py``).
+
+Crea una base temporal (``CFDI_DATA_DIR``) con ``--filas`` CFDI repartidos en tres
+ejercicios, calcula el resumen de un mes de cada uno (el mismo cálculo de ``/summary``)
+y el listado de ``/facturas``, archiva el más antiguo y repite. Reporta los tiempos,
+el tamaño de la base activa tras ``VACUUM`` y el del archivo.
+
+Falla (código 1) si algún resultado cambia al archivar o si un mes archivado tarda más
+de ``--max-factor`` veces lo que tardaba en la base activa.
+
+Uso:
+    python -m scripts.bench_archivo [--filas 300000]
+"""
+
+from __future__ import annotations
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+RFC = "XAXX010101000"
+
+
+def _poblar(filas: int, primero: int, anios: int) -> None:
+    from sqlalchemy import insert
+
+    from db import write_session
+    from models import Factura
+
+    inicio = datetime(primero, 1, 1)
+    paso = timedelta(seconds=anios * 365 * 86400 / filas)
+    lote = 5000
+    for desde in range(0, filas, lote):
+        with write_session(bulk=True) as db:
+            docs = []
+            for i in range(desde, min(desde + lote, filas)):
+                fecha = inicio + paso * i
+                ingreso = i % 3 != 0
+                docs.append(
+                    {
+                        "titular_rfc": RFC,
+                        "uuid": f"{i:08d}-0000-4000-8000-000000000000",
+                        "tipo_comprobante": "I",
+                        "fecha_emision": fecha,
+                        "year_emision": fecha.year,
+                        "month_emision": fecha.month,
+                        "naturaleza": "ingreso" if ingreso else "gasto",
+                        "emisor_rfc": RFC if ingreso else "PROV010101AAA",
+                        "receptor_rfc": "CLI010101AAA" if ingreso else RFC,
+                        "metodo_pago": "PUE",
+                        "moneda": "MXN",
+                        "subtotal": 1000,
+                        "total": 1053.33 if ingreso else 1160,
+                        "total_trasladados": 160,
+                        "total_retenidos": 106.67 if ingreso else None,
+                        "xml_text": "<cfdi:Comprobante/>" + "x" * 1500,
+                    }
+                )
+            db.execute(insert(Factura), docs)
+            db.commit()
+
+
+def _medir(year: int, month: int) -> tuple[float, tuple]:
+    """Resumen del mes y primera página del listado; regresa (segundos, resultado)."""
+    import archivo
+    import main as app
+    import queries
+
+    t0 = time.perf_counter()
+    db = archivo.sesion_lectura([year])
+    try:
+        datos = app._compute_period_data(db, RFC, year, month)
+        filas = db.scalars(queries.facturas_listado(RFC, year=year, month=month, limit=200)).all()
+        totales = sorted((k, round(v, 2)) for k, v in datos.items() if isinstance(v, (int, float)))
+        resultado = (totales, [f.uuid for f in filas])
+    finally:
+        db.close()
+    return time.perf_counter() - t0, resultado
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="Vistas de un ejercicio activo contra archivado.")
+    ap.add_argument("--filas", type=int, default=300000, help="CFDI en total (default 300000)")
+    ap.add_argument("--repeticiones", type=int, default=5, help="Mediciones por mes (default 5)")
+    ap.add_argument("--max-factor", type=float, default=3.0, help="Lentitud máxima del mes archivado")
+    args = ap.parse_args()
+
+    os.environ["CFDI_DATA_DIR"] = tempfile.mkdtemp(prefix="bench_archivo_")
+    import archivo
+    from db import DB_PATH, sync_schema
+    from models import Base
+
+    primero = datetime.now().year - archivo.ANIOS_ACTIVOS - 2
+    meses = [(primero, 6), (primero + 2, 6)]
+    sync_schema(Base.metadata)
+    t0 = time.perf_counter()
+    _poblar(args.filas, primero, 3)
+    print(f"Base con {args.filas} CFDI en {primero}-{primero + 2} en {time.perf_counter() - t0:.1f} s")
+
+    def medir_todos() -> dict:
+        res = {}
+        for ym in meses:
+            _medir(*ym)  # calienta caché
+            tiempos = []
+            for _ in range(args.repeticiones):
+                dt, r = _medir(*ym)
+                tiempos.append(dt)
+            res[ym] = (min(tiempos), r)
+        return res
+
+    antes = medir_todos()
+    tam = DB_PATH.stat().st_size
+    t0 = time.perf_counter()
+    stats = archivo.archivar(primero)
+    print(f"archivar {primero}: {time.perf_counter() - t0:.1f} s, {stats['facturas']} CFDI, {stats['bytes'] / 1048576:.1f} MiB")
+    archivo.vacuum()
+    print(f"base activa: {tam / 1048576:.1f} MiB -> {DB_PATH.stat().st_size / 1048576:.1f} MiB")
+    despues = medir_todos()
+
+    falla = False
+    for ym in meses:
+        (t_a, r_a), (t_d, r_d) = antes[ym], despues[ym]
+        igual = r_a == r_d
+        print(f"{ym[0]}-{ym[1]:02d}: {t_a * 1000:.1f} ms -> {t_d * 1000:.1f} ms{'' if igual else ' (RESULTADO DISTINTO)'}")
+        falla |= not igual or t_d > t_a * args.max_factor
+    if falla:
+        print("FALLA: el archivo frío cambió un resultado o es demasiado lento")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+"""Mide la búsqueda de texto (``/api/buscar``) sobre millones de conceptos.
+
+Crea una base temporal (``CFDI_DATA_DIR``) con ``--conceptos`` conceptos (4 por CFDI)
+cuyas descripciones combinan un vocabulario de servicios; los índices FTS5 se llenan
+por sus triggers, como en una importación normal. Después mide la mediana y el máximo
+de varias consultas: términos raros, comunes, prefijos y la segunda página.
+
+Falla (código 1) si alguna consulta tarda más de ``--max-ms`` en su mediana.
+
+Uso:
+    python -m scripts.bench_busqueda [--conceptos 1000000]
+"""
+
+from __future__ import annotations
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+RFC = "XAXX010101000"
+
+VOCABULARIO = [
+    "servicio", "consultoría", "desarrollo", "software", "mantenimiento", "transporte", "gasolina",
+    "papelería", "arrendamiento", "oficina", "honorarios", "publicidad", "diseño", "hospedaje",
+    "alimentos", "internet", "telefonía", "licencia", "soporte", "capacitación", "equipo", "cómputo",
+    "limpieza", "seguridad", "envío", "paquetería", "viaje", "comisión", "plataforma", "suscripción",
+]
+RAROS = ["uber", "didi", "rappi", "amazon", "mercadolibre"]
+
+
+def _descripcion(rnd: random.Random, i: int) -> str:
+    palabras = rnd.sample(VOCABULARIO, 4)
+    if i % 997 == 0:
+        palabras.append(RAROS[(i // 997) % len(RAROS)])
+    return " ".join(palabras).capitalize() + f" {i % 5000}"
+
+
+def _poblar(conceptos: int) -> None:
+    from sqlalchemy import insert
+
+    from db import write_session
+    from models import Concepto, Contribuyente, Factura
+
+    rnd = random.Random(7)
+    with write_session(bulk=True) as db:
+        contrapartes = [
+            {"rfc": f"PRO{n:06d}AAA", "nombre": f"PROVEEDOR {rnd.choice(VOCABULARIO).upper()} {n} SA DE CV"}
+            for n in range(900)
+        ] + [{"rfc": RFC, "nombre": "TITULAR DE PRUEBA"}]
+        ids_c = db.scalars(
+            insert(Contribuyente).returning(Contribuyente.id, sort_by_parameter_order=True), contrapartes
+        ).all()
+        db.commit()
+    titular_id = ids_c[-1]
+    inicio = datetime(2024, 1, 1)
+    facturas = conceptos // 4
+    lote = 5000
+    for desde in range(0, facturas, lote):
+        with write_session(bulk=True) as db:
+            filas = []
+            for i in range(desde, min(desde + lote, facturas)):
+                fecha = inicio + timedelta(minutes=20 * i)
+                filas.append(
+                    {
+                        "titular_rfc": RFC,
+                        "uuid": f"{i:08d}-0000-4000-8000-000000000000",
+                        "tipo_comprobante": "I",
+                        "fecha_emision": fecha,
+                        "year_emision": fecha.year,
+                        "month_emision": fecha.month,
+                        "naturaleza": "gasto",
+                        "emisor_rfc": f"PRO{i % 900:06d}AAA",
+                        "emisor_id": ids_c[i % 900],
+                        "receptor_rfc": RFC,
+                        "receptor_id": titular_id,
+                        "moneda": "MXN",
+                        "subtotal": 1000,
+                        "total": 1160,
+                        "xml_text": "<cfdi:Comprobante/>",
+                    }
+                )
+            ids = db.scalars(insert(Factura).returning(Factura.id, sort_by_parameter_order=True), filas).all()
+            db.execute(
+                insert(Concepto),
+                [
+                    {"factura_id": fid, "clave_prod_serv": "81111500", "descripcion": _descripcion(rnd, 4 * n + k),
+                     "importe": 250}
+                    for n, fid in enumerate(ids, start=desde)
+                    for k in range(4)
+                ],
+            )
+            db.commit()
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="Latencia de la búsqueda FTS5 sobre muchos conceptos.")
+    ap.add_argument("--conceptos", type=int, default=1_000_000, help="Conceptos a generar (default 1000000)")
+    ap.add_argument("--repeticiones", type=int, default=5)
+    ap.add_argument("--max-ms", type=float, default=100.0, help="Mediana máxima aceptable por consulta")
+    args = ap.parse_args()
+
+    os.environ["CFDI_DATA_DIR"] = tempfile.mkdtemp(prefix="bench_busqueda_")
+    import busqueda
+    import main as app_main
+    from db import engine, sync_schema
+    from models import Base
+
+    sync_schema(Base.metadata)
+    busqueda.crear_indices_fts(engine)
+    t0 = time.perf_counter()
+    _poblar(args.conceptos)
+    print(f"Base con {args.conceptos} conceptos indexados en {time.perf_counter() - t0:.1f} s")
+
+    casos = [
+        ("raro", "uber", "conceptos", 0),
+        ("raro + común", "didi viaje", "conceptos", 0),
+        ("común", "consultoría", "conceptos", 0),
+        ("común, página 2", "consultoría", "conceptos", 20),
+        ("dos comunes", "servicio software", "conceptos", 0),
+        ("prefijo", "capacit", "conceptos", 0),
+        ("contraparte", "proveedor limpieza", "contrapartes", 0),
+    ]
+    print(f"{'consulta':18} {'texto':22} {'resultados':>10} {'mediana ms':>11} {'máx ms':>8}")
+    falla = False
+    for nombre, q, fuente, offset in casos:
+        tiempos = []
+        for _ in range(args.repeticiones):
+            t = time.perf_counter()
+            res = app_main._buscar(RFC, q, fuente, 20, offset)
+            tiempos.append((time.perf_counter() - t) * 1000)
+        mediana = statistics.median(tiempos)
+        print(f"{nombre:18} {q:22} {len(res['resultados']):>10} {mediana:>11.1f} {max(tiempos):>8.1f}")
+        falla |= mediana > args.max_ms
+
+    if falla:
+        print(f"FALLA: alguna consulta tardó más de {args.max_ms} ms (mediana)")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
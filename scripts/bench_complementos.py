@@ -0,0 +1,155 @@
+"""Mide el parseo de complementos (registro de ``parser_xml``) y su importación por lotes.
+
+1. Parsea ``--documentos`` CFDI sin complementos y con muchos (Nómina, Impuestos
+   Locales, Comercio Exterior y ``--desconocidos`` nodos sin manejador) y compara contra
+   ``ElementTree.fromstring`` solo, que es la única pasada completa sobre el documento.
+2. Registra ``--registrados`` manejadores de más (namespaces que no aparecen) y vuelve
+   a medir: el despacho es un dict por tag, así que el tiempo no debe cambiar.
+3. Importa los documentos con ``BulkWriter`` sobre una base temporal (``CFDI_DATA_DIR``)
+   y revisa que cada tabla de complemento tenga sus filas.
+
+Falla (código 1) si el registro grande hace el parseo más de ``--max-factor`` veces más
+lento, si el costo sobre ``fromstring`` crece con los complementos más que ese factor, o
+si faltan filas.
+
+Uso:
+    python -m scripts.bench_complementos [--documentos 5000] [--registrados 1000]
+"""
+
+from __future__ import annotations
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+import xml.etree.ElementTree as ET
+from datetime import datetime, timedelta
+
+from scripts.bench_importacion_concurrente import PLANTILLA
+
+RFC = "XAXX010101000"
+
+COMPLEMENTOS = """
+    <nomina12:Nomina xmlns:nomina12="http://www.sat.gob.mx/nomina12" Version="1.2" TipoNomina="O" FechaPago="{dia}" \
+FechaInicialPago="{dia}" FechaFinalPago="{dia}" NumDiasPagados="15" TotalPercepciones="1000.00" TotalDeducciones="160.00">
+      <nomina12:Receptor Curp="XAXX010101HDFXXX01" NumEmpleado="{n}"/>
+      <nomina12:Percepciones TotalSueldos="1000.00" TotalGravado="1000.00" TotalExento="0">
+        <nomina12:Percepcion TipoPercepcion="001" Clave="1" Concepto="Sueldo" ImporteGravado="1000.00" ImporteExento="0"/>
+      </nomina12:Percepciones>
+      <nomina12:Deducciones TotalImpuestosRetenidos="160.00">
+        <nomina12:Deduccion TipoDeduccion="002" Clave="2" Concepto="ISR" Importe="160.00"/>
+      </nomina12:Deducciones>
+    </nomina12:Nomina>
+    <implocal:ImpuestosLocales xmlns:implocal="http://www.sat.gob.mx/implocal" version="1.0" TotaldeRetenciones="5.00" TotaldeTraslados="30.00">
+      <implocal:RetencionesLocales ImpLocRetenido="5 al millar" TasadeRetencion="0.50" Importe="5.00"/>
+      <implocal:TrasladosLocales ImpLocTrasladado="ISH" TasadeTraslado="3.00" Importe="30.00"/>
+    </implocal:ImpuestosLocales>
+    <cce20:ComercioExterior xmlns:cce20="http://www.sat.gob.mx/ComercioExterior20" Version="2.0" ClaveDePedimento="A1" \
+CertificadoOrigen="0" Incoterm="FOB" TipoCambioUSD="17.50" TotalUSD="66.29"/>
+"""
+
+DESCONOCIDO = '    <x{i}:Otro xmlns:x{i}="urn:bench:desconocido{i}" A="1"><x{i}:Hijo B="2"/></x{i}:Otro>\n'
+
+
+def _documentos(n: int, desconocidos: int, con_complementos: bool) -> list[bytes]:
+    base = datetime(2024, 1, 1, 9)
+    extra = "".join(DESCONOCIDO.format(i=i) for i in range(desconocidos))
+    out = []
+    for i in range(n):
+        fecha = base + timedelta(hours=7 * i)
+        xml = PLANTILLA.format(
+            n=i,
+            fecha=fecha.strftime("%Y-%m-%dT%H:%M:%S"),
+            rfc=RFC,
+            uuid=f"{int(con_complementos):08X}-{i >> 16:04X}-4000-8000-{i:012X}",
+        )
+        if con_complementos:
+            xml = xml.replace("  </cfdi:Complemento>", COMPLEMENTOS.format(dia=fecha.date(), n=i) + extra + "  </cfdi:Complemento>")
+        out.append(xml.encode("utf-8"))
+    return out
+
+
+def _medir(funcion, docs: list[bytes], repeticiones: int = 3) -> float:
+    """Microsegundos por documento (mejor de ``repeticiones``)."""
+    mejor = float("inf")
+    for _ in range(repeticiones):
+        t0 = time.perf_counter()
+        for d in docs:
+            funcion(d)
+        mejor = min(mejor, time.perf_counter() - t0)
+    return mejor / len(docs) * 1e6
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="Parseo e importación de CFDI con muchos complementos.")
+    ap.add_argument("--documentos", type=int, default=5000, help="CFDI por variante (default 5000)")
+    ap.add_argument("--desconocidos", type=int, default=20, help="Complementos sin manejador por CFDI (default 20)")
+    ap.add_argument("--registrados", type=int, default=1000, help="Manejadores extra en el registro (default 1000)")
+    ap.add_argument("--max-factor", type=float, default=1.25, help="Crecimiento máximo permitido")
+    args = ap.parse_args()
+
+    os.environ["CFDI_DATA_DIR"] = tempfile.mkdtemp(prefix="bench_complementos_")
+    import parser_xml
+    from db import sync_schema, write_session
+    from importer import BulkWriter
+    from models import Base
+
+    simples = _documentos(args.documentos, 0, False)
+    muchos = _documentos(args.documentos, args.desconocidos, True)
+    parsear = lambda d: parser_xml.parse_cfdi_40(d, RFC)  # noqa: E731
+
+    base_simple = _medir(ET.fromstring, simples)
+    base_muchos = _medir(ET.fromstring, muchos)
+    t_simple = _medir(parsear, simples)
+    t_muchos = _medir(parsear, muchos)
+    print(f"sin complementos:  fromstring {base_simple:.0f} µs, parse_cfdi_40 {t_simple:.0f} µs/doc")
+    print(
+        f"con {3 + args.desconocidos} complementos: fromstring {base_muchos:.0f} µs, "
+        f"parse_cfdi_40 {t_muchos:.0f} µs/doc ({len(muchos[0]) / 1024:.1f} KiB)"
+    )
+
+    for i in range(args.registrados):
+        parser_xml.registrar_complemento(f"urn:bench:registrado{i}", "Nodo", tabla="nominas")(lambda nodo, data: None)
+    t_registro = _medir(parsear, muchos)
+    print(f"con {args.registrados} manejadores extra registrados: {t_registro:.0f} µs/doc")
+    for i in range(args.registrados):
+        del parser_xml.COMPLEMENTOS["cfdi"][f"{{urn:bench:registrado{i}}}Nodo"]
+
+    sync_schema(Base.metadata)
+    t0 = time.perf_counter()
+    for inicio in range(0, len(muchos), 500):
+        with write_session(bulk=True) as db:
+            writer = BulkWriter(db, titular_rfc=RFC, batch_size=500)
+            for d in muchos[inicio:inicio + 500]:
+                writer.add_xml(d)
+            writer.flush()
+    dt = time.perf_counter() - t0
+    print(f"importación: {len(muchos) / dt:.0f} CFDI/s con sus complementos")
+
+    from sqlalchemy import func, select
+
+    esperadas = {"nominas": 1, "impuestos_locales": 2, "comercio_exterior": 1}
+    with write_session() as db:
+        conteos = {
+            t: db.scalar(select(func.count()).select_from(Base.metadata.tables[t])) for t in esperadas
+        }
+    print("filas:", conteos)
+
+    # Costo propio del parser (sin la pasada de fromstring) con y sin complementos
+    propio_simple = t_simple - base_simple
+    propio_muchos = t_muchos - base_muchos
+    falla = (
+        t_registro > t_muchos * args.max_factor
+        or any(conteos[t] != n * len(muchos) for t, n in esperadas.items())
+    )
+    print(f"costo sobre fromstring: {propio_simple:.0f} µs -> {propio_muchos:.0f} µs por documento")
+    if propio_muchos > max(propio_simple, 1) * (1 + 3) * args.max_factor:
+        falla = True  # 3 complementos con manejador: su costo debe ser acotado, no una pasada más
+    if falla:
+        print("FALLA: el despacho depende del tamaño del registro o faltan filas de complementos")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+"""Mide las balanzas de un ejercicio (``/contabilidad/balanzas.zip``) sobre un archivo grande.
+
+Crea una base temporal (``CFDI_DATA_DIR``) con ``--filas`` CFDI repartidos en
+``--anios`` ejercicios (ingresos PUE/PPD y gastos) y genera el ZIP de las doce
+balanzas del último año. Reporta el tiempo, el crecimiento de la memoria anónima
+(``RssAnon``) y revisa que en cada balanza los cargos sumen lo mismo que los abonos.
+
+Falla (código 1) si la memoria crece más de ``--max-mb`` o alguna balanza no cuadra.
+
+Uso:
+    python -m scripts.bench_contabilidad [--filas 300000] [--anios 3]
+"""
+
+from __future__ import annotations
+
+import argparse
+import io
+import os
+import sys
+import tempfile
+import time
+import zipfile
+import xml.etree.ElementTree as ET
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+RFC = "XAXX010101000"
+
+
+def _rss_anon_mb() -> float:
+    """Memoria anónima residente (Linux, ``/proc/self/status``)."""
+    with open("/proc/self/status") as f:
+        for linea in f:
+            if linea.startswith("RssAnon:"):
+                return int(linea.split()[1]) / 1024
+    return 0.0
+
+
+def _poblar(filas: int, anios: int, ultimo: int) -> None:
+    from sqlalchemy import insert
+
+    from db import write_session
+    from models import Factura
+
+    inicio = datetime(ultimo - anios + 1, 1, 1)
+    paso = timedelta(seconds=anios * 365 * 86400 / filas)
+    lote = 5000
+    for desde in range(0, filas, lote):
+        with write_session(bulk=True) as db:
+            docs = []
+            for i in range(desde, min(desde + lote, filas)):
+                fecha = inicio + paso * i
+                ingreso = i % 3 != 0
+                docs.append(
+                    {
+                        "titular_rfc": RFC,
+                        "uuid": f"{i:08d}-0000-4000-8000-000000000000",
+                        "tipo_comprobante": "E" if i % 50 == 0 else "I",
+                        "fecha_emision": fecha,
+                        "year_emision": fecha.year,
+                        "month_emision": fecha.month,
+                        "naturaleza": "ingreso" if ingreso else "gasto",
+                        "emisor_rfc": RFC if ingreso else "PROV010101AAA",
+                        "receptor_rfc": "CLI010101AAA" if ingreso else RFC,
+                        "metodo_pago": "PPD" if i % 7 == 0 else "PUE",
+                        "moneda": "MXN",
+                        "subtotal": 1000,
+                        "total": 1053.33 if ingreso else 1160,
+                        "total_trasladados": 160,
+                        "total_retenidos": 106.67 if ingreso else None,
+                        "xml_text": "<cfdi:Comprobante/>",
+                    }
+                )
+            db.execute(insert(Factura), docs)
+            db.commit()
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="Balanzas de un ejercicio sobre un archivo grande.")
+    ap.add_argument("--filas", type=int, default=300000, help="CFDI en total (default 300000)")
+    ap.add_argument("--anios", type=int, default=3, help="Ejercicios en los que se reparten (default 3)")
+    ap.add_argument("--max-mb", type=float, default=50.0, help="Crecimiento máximo de memoria en MiB")
+    args = ap.parse_args()
+
+    os.environ["CFDI_DATA_DIR"] = tempfile.mkdtemp(prefix="bench_contabilidad_")
+    import contabilidad
+    from db import sync_schema
+    from models import Base
+
+    ultimo = 2025
+    sync_schema(Base.metadata)
+    t0 = time.perf_counter()
+    _poblar(args.filas, args.anios, ultimo)
+    print(f"Base con {args.filas} CFDI en {args.anios} ejercicios en {time.perf_counter() - t0:.1f} s")
+
+    antes = _rss_anon_mb()
+    pico = antes
+    partes = []
+    t0 = time.perf_counter()
+    for bloque in contabilidad.balanzas_zip(RFC, ultimo):
+        partes.append(bloque)
+        pico = max(pico, _rss_anon_mb())
+    dt = time.perf_counter() - t0
+    crecimiento = pico - antes
+    zip_bytes = b"".join(partes)
+    print(f"balanzas {ultimo}: {dt:.2f} s, {len(zip_bytes) / 1024:.0f} KiB, Δ memoria {crecimiento:.1f} MiB")
+
+    descuadres = []
+    with zipfile.ZipFile(io.BytesIO(zip_bytes)) as zf:
+        for nombre in zf.namelist():
+            ctas = [e.attrib for e in ET.fromstring(zf.read(nombre))]
+            hojas = [c for c in ctas if "." in c["NumCta"]]
+            debe = sum(Decimal(c["Debe"]) for c in hojas)
+            haber = sum(Decimal(c["Haber"]) for c in hojas)
+            if abs(debe - haber) > Decimal("0.05"):
+                descuadres.append((nombre, debe, haber))
+    print(f"{len(zf.namelist())} balanzas, {len(descuadres)} descuadradas")
+    for d in descuadres:
+        print("  ", *d)
+
+    if descuadres or crecimiento > args.max_mb:
+        print("FALLA: alguna balanza no cuadra o la memoria creció de más")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""Mide la clasificación de conceptos por categoría de deducción (``deducciones.py``).
+
+Sobre una base temporal (``CFDI_DATA_DIR``) inserta directo (sin XML) ``--facturas``
+facturas de gasto con ``--conceptos`` conceptos cada una, con claves ClaveProdServ,
+usos de CFDI y formas de pago al azar. Mide:
+
+- compilar las reglas en el trie y clasificar cada combinación distinta sin caché,
+- ``reclasificar`` de todos los conceptos (todos cambian) y de nuevo (ninguno cambia),
+- ``gastos_por_categoria`` de un mes.
+
+Falla (código 1) si queda algún concepto sin categoría o si una muestra no coincide con
+``deducciones.clasificar``.
+
+Uso:
+    python -m scripts.bench_deducciones [--facturas 50000] [--conceptos 20]
+"""
+
+from __future__ import annotations
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+RFC = "XAXX010101000"
+PREFIJOS = ("151015", "4321", "5610", "8111", "811121", "8311", "8013", "7811", "9010", "5020", "4410", "3910")
+USOS = ("G03", "G03", "G03", "G01", "G02", "I04", "D01", "S01", "CP01")
+FORMAS = ("01", "03", "04", "28", "99")
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="Reclasificación de conceptos por categoría de deducción.")
+    ap.add_argument("--facturas", type=int, default=50000, help="Facturas de gasto (default 50000)")
+    ap.add_argument("--conceptos", type=int, default=20, help="Conceptos por factura (default 20)")
+    args = ap.parse_args()
+
+    os.environ["CFDI_DATA_DIR"] = tempfile.mkdtemp(prefix="bench_deducciones_")
+    import deducciones
+    import queries
+    from db import ReadSessionLocal, sync_schema, write_session
+    from models import Base
+
+    sync_schema(Base.metadata)
+    azar = random.Random(50)
+    claves = [p + "".join(azar.choice("0123456789") for _ in range(8 - len(p))) for p in PREFIJOS for _ in range(40)]
+    t0 = time.perf_counter()
+    with write_session(bulk=True) as db:
+        conn = db.connection()
+        conn.exec_driver_sql(
+            "INSERT INTO facturas (id, titular_rfc, uuid, tipo_comprobante, year_emision, month_emision, naturaleza, "
+            "uso_cfdi, forma_pago, tipo_cambio_mxn, xml_text) VALUES (?, ?, ?, 'I', 2025, ?, 'gasto', ?, ?, 1, '')",
+            [
+                (i, RFC, f"0000DED0-{i >> 16:04X}-4000-8000-{i:012X}", 1 + i % 12, azar.choice(USOS), azar.choice(FORMAS))
+                for i in range(1, args.facturas + 1)
+            ],
+        )
+        conn.exec_driver_sql(
+            "INSERT INTO conceptos (factura_id, clave_prod_serv, importe) VALUES (?, ?, 100)",
+            [(i, azar.choice(claves)) for i in range(1, args.facturas + 1) for _ in range(args.conceptos)],
+        )
+        db.commit()
+    total = args.facturas * args.conceptos
+    print(f"{args.facturas} facturas y {total} conceptos insertados en {time.perf_counter() - t0:.1f} s")
+
+    t0 = time.perf_counter()
+    indice = deducciones.IndiceReglas(deducciones.REGLAS)
+    compilar_ms = (time.perf_counter() - t0) * 1000
+    combinaciones = [(c, u, f) for c in claves for u in USOS for f in FORMAS]
+    t0 = time.perf_counter()
+    for combinacion in combinaciones:
+        indice.categoria(*combinacion)
+    print(
+        f"reglas compiladas en {compilar_ms:.2f} ms; {len(combinaciones)} combinaciones sin caché: "
+        f"{(time.perf_counter() - t0) / len(combinaciones) * 1e6:.1f} µs c/u"
+    )
+
+    for vuelta in ("todos cambian", "ninguno cambia"):
+        t0 = time.perf_counter()
+        cambiados, distintas = deducciones.reclasificar()
+        print(
+            f"reclasificar ({vuelta}): {cambiados} conceptos, {distintas} combinaciones en "
+            f"{time.perf_counter() - t0:.2f} s"
+        )
+
+    db = ReadSessionLocal()
+    try:
+        t0 = time.perf_counter()
+        filas = db.execute(queries.gastos_por_categoria(RFC, 2025, 3)).all()
+        print(f"gastos_por_categoria (2025-03): {(time.perf_counter() - t0) * 1000:.1f} ms, {len(filas)} categorías")
+        sin_categoria = db.connection().exec_driver_sql(
+            "SELECT count(*) FROM conceptos WHERE categoria_deduccion IS NULL"
+        ).scalar_one()
+        muestra = db.connection().exec_driver_sql(
+            "SELECT c.clave_prod_serv, f.uso_cfdi, f.forma_pago, c.categoria_deduccion "
+            "FROM conceptos c JOIN facturas f ON f.id = c.factura_id ORDER BY random() LIMIT 1000"
+        ).all()
+    finally:
+        db.close()
+
+    distintas = sum(1 for clave, uso, forma, cat in muestra if deducciones.clasificar(clave, uso, forma) != cat)
+    if sin_categoria or distintas:
+        print(f"FALLA: {sin_categoria} conceptos sin categoría, {distintas} de la muestra no coinciden")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
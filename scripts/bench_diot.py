@@ -0,0 +1,176 @@
+"""Mide la generación de la DIOT (``/diot.txt``) de un mes con muchos proveedores.
+
+Crea una base temporal (``CFDI_DATA_DIR``) con ``--proveedores`` proveedores en un mes:
+por cada uno dos gastos PUE al 16% (uno con IVA retenido), una nota de crédito cada
+diez proveedores y una factura PPD del mes anterior pagada a la mitad con un
+complemento de pago recibido en el mes. Recorre el cuerpo de la respuesta y revisa
+los totales contra lo generado.
+
+Falla (código 1) si tarda más de ``--max-s`` segundos o si los totales no cuadran.
+
+Uso:
+    python -m scripts.bench_diot [--proveedores 10000]
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+RFC = "XAXX010101000"
+YEAR, MONTH = 2025, 3
+
+
+def _proveedor(n: int) -> str:
+    return f"PRO{n:06d}AAA"
+
+
+def _poblar(proveedores: int) -> dict[str, int]:
+    """Inserta los CFDI y regresa los totales esperados de la DIOT."""
+    from sqlalchemy import insert
+
+    from db import write_session
+    from models import Factura, ImpuestoComprobante, Pago, PagoDocumento
+
+    fecha = datetime(YEAR, MONTH, 10)
+    anterior = datetime(YEAR, MONTH - 1, 20)
+    esperado = {"actos_16": 0, "iva_retenido": 0}
+    lote = 2000
+    for desde in range(0, proveedores, lote):
+        with write_session(bulk=True) as db:
+            facturas, impuestos = [], []
+            ppd = []
+            for n in range(desde, min(desde + lote, proveedores)):
+                base = {
+                    "titular_rfc": RFC,
+                    "naturaleza": "gasto",
+                    "emisor_rfc": _proveedor(n),
+                    "receptor_rfc": RFC,
+                    "moneda": "MXN",
+                    "xml_text": "<cfdi:Comprobante/>",
+                }
+                docs = [
+                    # (uuid, tipo, metodo, fecha, subtotal, retiene)
+                    (f"{n:08d}-0001-4000-8000-000000000000", "I", "PUE", fecha, 1000, False),
+                    (f"{n:08d}-0002-4000-8000-000000000000", "I", "PUE", fecha, 2000, True),
+                    (f"{n:08d}-0003-4000-8000-000000000000", "I", "PPD", anterior, 4000, False),
+                ]
+                if n % 10 == 0:
+                    docs.append((f"{n:08d}-0004-4000-8000-000000000000", "E", "PUE", fecha, 100, False))
+                for uuid, tipo, metodo, f, subtotal, retiene in docs:
+                    facturas.append(
+                        {
+                            **base,
+                            "uuid": uuid,
+                            "tipo_comprobante": tipo,
+                            "metodo_pago": metodo,
+                            "fecha_emision": f,
+                            "year_emision": f.year,
+                            "month_emision": f.month,
+                            "subtotal": subtotal,
+                            "total": subtotal * 1.16,
+                            "total_trasladados": subtotal * 0.16,
+                        }
+                    )
+                    impuestos.append([("traslado", "Tasa", 0.16, subtotal, subtotal * 0.16)])
+                    if retiene:
+                        impuestos[-1].append(("retencion", None, None, subtotal, subtotal * 0.106667))
+                    signo = -1 if tipo == "E" else 1
+                    pagado = 0.5 if metodo == "PPD" else 1
+                    esperado["actos_16"] += round(subtotal * signo * pagado)
+                    if retiene:
+                        esperado["iva_retenido"] += round(subtotal * 0.106667)
+                ppd.append((n, docs[2][0]))
+
+            ids = db.scalars(insert(Factura).returning(Factura.id, sort_by_parameter_order=True), facturas).all()
+            db.execute(
+                insert(ImpuestoComprobante),
+                [
+                    {"factura_id": fid, "tipo": t, "impuesto": "002", "tipo_factor": tf, "tasa_o_cuota": tasa,
+                     "base": b, "importe": imp}
+                    for fid, imps in zip(ids, impuestos)
+                    for t, tf, tasa, b, imp in imps
+                ],
+            )
+
+            # Complementos de pago recibidos en el mes: la mitad de cada PPD
+            p_ids = db.scalars(
+                insert(Factura).returning(Factura.id, sort_by_parameter_order=True),
+                [
+                    {"titular_rfc": RFC, "uuid": f"{n:08d}-0005-4000-8000-000000000000", "tipo_comprobante": "P",
+                     "fecha_emision": fecha, "year_emision": YEAR, "month_emision": MONTH, "naturaleza": "pago",
+                     "emisor_rfc": _proveedor(n), "receptor_rfc": RFC, "moneda": "XXX", "subtotal": 0, "total": 0,
+                     "xml_text": "<cfdi:Comprobante/>"}
+                    for n, _ in ppd
+                ],
+            ).all()
+            pago_ids = db.scalars(
+                insert(Pago).returning(Pago.id, sort_by_parameter_order=True),
+                [
+                    {"factura_id": pid, "titular_rfc": RFC, "fecha_pago": fecha, "year_pago": YEAR,
+                     "month_pago": MONTH, "monto": 2320, "moneda_p": "MXN"}
+                    for pid in p_ids
+                ],
+            ).all()
+            db.execute(
+                insert(PagoDocumento),
+                [
+                    {"pago_id": pago_id, "factura_id": pid, "titular_rfc": RFC, "id_documento": uuid,
+                     "num_parcialidad": 1, "imp_saldo_ant": 4640, "imp_pagado": 2320, "imp_saldo_insoluto": 2320,
+                     "iva_dr": 320}
+                    for pago_id, pid, (_, uuid) in zip(pago_ids, p_ids, ppd)
+                ],
+            )
+            db.commit()
+    return esperado
+
+
+async def _leer(resp) -> bytes:
+    return b"".join([c async for c in resp.body_iterator])
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="Tiempo de la DIOT de un mes con muchos proveedores.")
+    ap.add_argument("--proveedores", type=int, default=10000, help="Proveedores en el mes (default 10000)")
+    ap.add_argument("--repeticiones", type=int, default=5)
+    ap.add_argument("--max-s", type=float, default=1.0, help="Segundos máximos por DIOT")
+    args = ap.parse_args()
+
+    os.environ["CFDI_DATA_DIR"] = tempfile.mkdtemp(prefix="bench_diot_")
+    import diot
+    from db import sync_schema
+    from models import Base
+
+    sync_schema(Base.metadata)
+    t0 = time.perf_counter()
+    esperado = _poblar(args.proveedores)
+    print(f"Base con {args.proveedores} proveedores en {time.perf_counter() - t0:.1f} s")
+
+    tiempos = []
+    for _ in range(args.repeticiones):
+        t = time.perf_counter()
+        cuerpo = asyncio.run(_leer(diot.respuesta_diot(RFC, YEAR, MONTH)))
+        tiempos.append(time.perf_counter() - t)
+
+    renglones = [linea.split("|") for linea in cuerpo.decode("utf-8").splitlines()]
+    i16, iret = diot.CAMPOS.index("actos_16"), diot.CAMPOS.index("iva_retenido")
+    obtenido = {
+        "actos_16": sum(int(r[i16] or 0) for r in renglones),
+        "iva_retenido": sum(int(r[iret] or 0) for r in renglones),
+    }
+    print(f"{len(renglones)} renglones, {len(cuerpo) / 1024:.0f} KiB; mejor {min(tiempos):.3f} s, peor {max(tiempos):.3f} s")
+    print(f"esperado {esperado}, obtenido {obtenido}")
+
+    falla = len(renglones) != args.proveedores or obtenido != esperado or min(tiempos) > args.max_s
+    if falla:
+        print("FALLA: la DIOT tardó demasiado o sus totales no cuadran")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+"""Mide la exportación por flujo de un año completo (``/export/facturas.csv`` y ``conceptos.csv``).
+
+Crea una base temporal (``CFDI_DATA_DIR``) con ``--filas`` facturas de un año y dos
+conceptos cada una, y recorre el cuerpo de la ``StreamingResponse`` que arma la ruta.
+Reporta el tiempo al primer bloque, el total, los renglones y cuánto creció la
+memoria anónima (``RssAnon``, muestreada en cada bloque) del proceso; las páginas de la
+base mapeadas con ``mmap_size`` no cuentan, son caché del archivo. La caché de páginas de
+SQLite (hasta 64 MiB por conexión, ver ``db.py``) sí cuenta, pero tampoco crece con el rango.
+
+Falla (código 1) si el primer bloque tarda más de ``--max-primer-byte`` segundos o si
+la memoria crece más de ``--max-mb``.
+
+Uso:
+    python -m scripts.bench_export [--filas 200000] [--gzip]
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import gzip as gzip_mod
+import os
+import sys
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+
+RFC = "XAXX010101000"
+YEAR = 2024
+
+
+def _rss_anon_mb() -> float:
+    """Memoria anónima residente (Linux, ``/proc/self/status``)."""
+    with open("/proc/self/status") as f:
+        for linea in f:
+            if linea.startswith("RssAnon:"):
+                return int(linea.split()[1]) / 1024
+    return 0.0
+
+
+def _poblar(filas: int) -> None:
+    from sqlalchemy import insert
+
+    from db import write_session
+    from models import Concepto, Factura
+
+    inicio = datetime(YEAR, 1, 1)
+    paso = timedelta(seconds=365 * 86400 / filas)
+    lote = 5000
+    for desde in range(0, filas, lote):
+        with write_session(bulk=True) as db:
+            facturas = []
+            for i in range(desde, min(desde + lote, filas)):
+                fecha = inicio + paso * i
+                facturas.append(
+                    {
+                        "titular_rfc": RFC,
+                        "uuid": f"{i:08d}-0000-4000-8000-000000000000",
+                        "tipo_comprobante": "I",
+                        "fecha_emision": fecha,
+                        "year_emision": fecha.year,
+                        "month_emision": fecha.month,
+                        "naturaleza": "ingreso" if i % 3 else "gasto",
+                        "emisor_rfc": RFC if i % 3 else "PROV010101AAA",
+                        "receptor_rfc": "CLI010101AAA" if i % 3 else RFC,
+                        "moneda": "MXN",
+                        "subtotal": 1000,
+                        "total": 1160,
+                        "total_trasladados": 160,
+                        "xml_text": "<cfdi:Comprobante/>" + "x" * 2000,
+                    }
+                )
+            ids = db.scalars(insert(Factura).returning(Factura.id, sort_by_parameter_order=True), facturas).all()
+            db.execute(
+                insert(Concepto),
+                [
+                    {"factura_id": fid, "clave_prod_serv": "81111500", "cantidad": 1, "clave_unidad": "E48",
+                     "descripcion": f"Servicio {n}", "valor_unitario": 500, "importe": 500, "objeto_imp": "02"}
+                    for fid in ids
+                    for n in (1, 2)
+                ],
+            )
+            db.commit()
+
+
+async def _recorrer(resp) -> tuple[float, float, int, float]:
+    """(segundos al primer bloque, segundos totales, bytes, máx. RssAnon MiB); no guarda el cuerpo."""
+    t0 = time.perf_counter()
+    primero = None
+    total = 0
+    pico = _rss_anon_mb()
+    async for chunk in resp.body_iterator:
+        if primero is None:
+            primero = time.perf_counter() - t0
+        total += len(chunk)
+        pico = max(pico, _rss_anon_mb())
+    return primero or 0.0, time.perf_counter() - t0, total, pico
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="Exportación CSV por flujo de un año completo.")
+    ap.add_argument("--filas", type=int, default=200000, help="Facturas del año (default 200000)")
+    ap.add_argument("--gzip", action="store_true", help="Exportar comprimido")
+    ap.add_argument("--max-primer-byte", type=float, default=1.0, help="Segundos máximos al primer bloque")
+    ap.add_argument("--max-mb", type=float, default=100.0, help="Crecimiento máximo de memoria en MiB")
+    args = ap.parse_args()
+
+    os.environ["CFDI_DATA_DIR"] = tempfile.mkdtemp(prefix="bench_export_")
+    import exportar
+    import queries
+    from db import sync_schema
+    from models import Base
+
+    sync_schema(Base.metadata)
+    t0 = time.perf_counter()
+    _poblar(args.filas)
+    print(f"Base con {args.filas} facturas ({2 * args.filas} conceptos) en {time.perf_counter() - t0:.1f} s")
+
+    desde, hasta = date(YEAR, 1, 1), date(YEAR, 12, 31)
+    print(f"{'export':10} {'primer bloque s':>16} {'total s':>8} {'MiB enviados':>13} {'Δ memoria MiB':>14}")
+    falla = False
+    for nombre, stmt in [
+        ("facturas", queries.export_facturas(RFC, desde, hasta)),
+        ("conceptos", queries.export_conceptos(RFC, desde, hasta)),
+    ]:
+        antes = _rss_anon_mb()
+        resp = exportar.respuesta_csv(stmt, nombre, gzip=args.gzip)
+        primero, total, enviados, pico = asyncio.run(_recorrer(resp))
+        crecimiento = pico - antes
+        print(f"{nombre:10} {primero:>16.3f} {total:>8.1f} {enviados / 2**20:>13.1f} {crecimiento:>14.1f}")
+        falla |= primero > args.max_primer_byte or crecimiento > args.max_mb
+
+    # Revisión de contenido: renglones del CSV de facturas
+    resp = exportar.respuesta_csv(queries.export_facturas(RFC, desde, hasta), "facturas", gzip=args.gzip)
+
+    async def _contar() -> int:
+        partes = [c async for c in resp.body_iterator]
+        data = b"".join(partes)
+        if args.gzip:
+            data = gzip_mod.decompress(data)
+        return data.count(b"\n") - 1
+
+    renglones = asyncio.run(_contar())
+    print(f"facturas.csv: {renglones} renglones")
+    if renglones != args.filas:
+        falla = True
+
+    if falla:
+        print("FALLA: la exportación tardó en empezar, creció en memoria o le faltan renglones")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+"""Verifica que la app siga atendiendo peticiones mientras corre una importación grande.
+
+Levanta la app en el mismo proceso (``httpx.ASGITransport``, un solo event loop) sobre
+una carpeta de datos temporal (``CFDI_DATA_DIR``), envía ``--archivos`` CFDI sintéticos a
+``POST /importar`` y sigue el trabajo con ``progreso.json`` hasta que termina (ver
+jobs.py). Mientras tanto pide ``GET /facturas`` en bucle y mide cuánto se retrasa el
+event loop.
+
+Falla (código 1) si no se atendió ninguna petición durante la importación, si el
+event loop se detuvo más de ``--max-lag`` segundos o si la importación tuvo errores.
+
+Uso:
+    python -m scripts.bench_importacion_concurrente [--archivos 10000]
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+PLANTILLA = """<?xml version="1.0" encoding="UTF-8"?>
+<cfdi:Comprobante xmlns:cfdi="http://www.sat.gob.mx/cfd/4" xmlns:tfd="http://www.sat.gob.mx/TimbreFiscalDigital" \
+Version="4.0" Serie="B" Folio="{n}" Fecha="{fecha}" FormaPago="03" SubTotal="1000.00" Moneda="MXN" Total="1160.00" \
+TipoDeComprobante="I" Exportacion="01" MetodoPago="PUE" LugarExpedicion="01000">
+  <cfdi:Emisor Rfc="{rfc}" Nombre="EMISOR PRUEBA" RegimenFiscal="612"/>
+  <cfdi:Receptor Rfc="CLI010101AAA" Nombre="CLIENTE SA" DomicilioFiscalReceptor="01000" RegimenFiscalReceptor="601" UsoCFDI="G03"/>
+  <cfdi:Conceptos>
+    <cfdi:Concepto ClaveProdServ="81111500" Cantidad="1" ClaveUnidad="E48" Descripcion="Servicio {n}" ValorUnitario="1000.00" Importe="1000.00" ObjetoImp="02">
+      <cfdi:Impuestos><cfdi:Traslados>
+        <cfdi:Traslado Base="1000.00" Impuesto="002" TipoFactor="Tasa" TasaOCuota="0.160000" Importe="160.00"/>
+      </cfdi:Traslados></cfdi:Impuestos>
+    </cfdi:Concepto>
+  </cfdi:Conceptos>
+  <cfdi:Impuestos TotalImpuestosTrasladados="160.00"><cfdi:Traslados>
+    <cfdi:Traslado Base="1000.00" Impuesto="002" TipoFactor="Tasa" TasaOCuota="0.160000" Importe="160.00"/>
+  </cfdi:Traslados></cfdi:Impuestos>
+  <cfdi:Complemento>
+    <tfd:TimbreFiscalDigital Version="1.1" UUID="{uuid}" FechaTimbrado="{fecha}" RfcProvCertif="SAT970701NN3" NoCertificadoSAT="00001000000500000002"/>
+  </cfdi:Complemento>
+</cfdi:Comprobante>
+"""
+
+
+def _archivos(n: int, rfc: str, semilla: int) -> list[tuple[str, tuple[str, bytes, str]]]:
+    base = datetime(2024, 1, 1, 9)
+    out = []
+    for i in range(n):
+        fecha = (base + timedelta(hours=7 * i)).strftime("%Y-%m-%dT%H:%M:%S")
+        uuid = f"{semilla:08X}-{i >> 16:04X}-4000-8000-{i:012X}"
+        xml = PLANTILLA.format(n=i, fecha=fecha, rfc=rfc, uuid=uuid).encode("utf-8")
+        out.append(("files", (f"cfdi_{i}.xml", xml, "text/xml")))
+    return out
+
+
+async def _correr(app, n: int, rfc: str, semilla: int) -> dict:
+    import httpx
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        req = client.build_request("POST", f"/importar?rfc={rfc}", files=_archivos(n, rfc, semilla))
+        termino = asyncio.Event()
+        lags: list[float] = []
+        gets: list[float] = []
+
+        async def latido() -> None:
+            while not termino.is_set():
+                t0 = time.perf_counter()
+                await asyncio.sleep(0.02)
+                lags.append(time.perf_counter() - t0 - 0.02)
+
+        async def lector() -> None:
+            while not termino.is_set():
+                t0 = time.perf_counter()
+                r = await client.get(f"/facturas?rfc={rfc}")
+                r.raise_for_status()
+                if not termino.is_set():
+                    gets.append(time.perf_counter() - t0)
+
+        async def importar() -> tuple[float, float, dict]:
+            t0 = time.perf_counter()
+            try:
+                r = await client.send(req)
+                if r.status_code != 303:
+                    raise RuntimeError(f"importación rechazada: {r.status_code} {r.text[:200]}")
+                aceptada = time.perf_counter() - t0
+                url = r.headers["location"] + "/progreso.json"
+                while True:
+                    p = (await client.get(f"{url}?rfc={rfc}")).json()
+                    if p["terminado"]:
+                        return aceptada, time.perf_counter() - t0, p
+                    await asyncio.sleep(0.2)
+            finally:
+                termino.set()
+
+        (aceptada, dur, prog), *_ = await asyncio.gather(importar(), latido(), lector())
+
+    if prog["estado"] != "terminado" or prog["errores"] or prog["cfdi_insertados"] != n:
+        raise RuntimeError(f"importación incompleta: {prog}")
+    return {
+        "archivos": n,
+        "aceptada_s": aceptada,
+        "import_s": dur,
+        "gets": len(gets),
+        "get_p50_ms": statistics.median(gets) * 1000 if gets else float("nan"),
+        "get_max_ms": max(gets) * 1000 if gets else float("nan"),
+        "lag_max_ms": max(lags) * 1000 if lags else float("nan"),
+    }
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="Peticiones atendidas durante una importación grande.")
+    ap.add_argument("--archivos", type=int, default=10000, help="CFDI a importar (default 10000)")
+    ap.add_argument("--max-lag", type=float, default=1.0, help="Retraso máximo aceptable del event loop en s")
+    args = ap.parse_args()
+
+    os.environ["CFDI_DATA_DIR"] = tempfile.mkdtemp(prefix="bench_import_")
+    import main as app_main  # después de fijar CFDI_DATA_DIR
+
+    app_main.on_startup()
+    r = asyncio.run(_correr(app_main.app, args.archivos, "XAX010101000", 1))
+
+    print(
+        f"{'archivos':>9} {'aceptada s':>11} {'import s':>9} {'GET atendidos':>14} {'GET p50 ms':>11} "
+        f"{'GET máx ms':>11} {'lag máx ms':>11}"
+    )
+    print(
+        f"{r['archivos']:>9} {r['aceptada_s']:>11.1f} {r['import_s']:>9.1f} {r['gets']:>14} {r['get_p50_ms']:>11.1f} "
+        f"{r['get_max_ms']:>11.1f} {r['lag_max_ms']:>11.1f}"
+    )
+
+    if r["gets"] == 0 or r["lag_max_ms"] > args.max_lag * 1000:
+        print("FALLA: el event loop dejó de atender peticiones durante la importación")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
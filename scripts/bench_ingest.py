@@ -0,0 +1,97 @@
+"""Envía muchos CFDI por una sola conexión a ``POST /api/ingest`` y mide la memoria.
+
+Levanta la app en el mismo proceso (``httpx.ASGITransport``) sobre una carpeta de datos
+temporal (``CFDI_DATA_DIR``). El cuerpo se genera al vuelo (NDJSON o con prefijo de
+longitud), así que la memoria del proceso refleja lo que retiene el servidor. Se pide
+``detalle=errores`` porque el transporte en proceso acumula la respuesta completa.
+
+Falla (código 1) si algún documento no se insertó o si la memoria máxima del proceso
+creció más de ``--max-mb`` durante la ingesta.
+
+Uso:
+    python -m scripts.bench_ingest [--documentos 100000] [--formato ndjson|prefijado]
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import os
+import resource
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from scripts.bench_importacion_concurrente import PLANTILLA
+
+RFC = "XAX010101000"
+
+
+def _rss_mb() -> float:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024  # Linux: KiB
+
+
+async def _cuerpo(n: int, formato: str):
+    base = datetime(2024, 1, 1, 9)
+    for i in range(n):
+        fecha = (base + timedelta(minutes=37 * i)).strftime("%Y-%m-%dT%H:%M:%S")
+        uuid = f"00000000-{i >> 16:04X}-4000-8000-{i:012X}"
+        xml = PLANTILLA.format(n=i, fecha=fecha, rfc=RFC, uuid=uuid)
+        if formato == "ndjson":
+            yield json.dumps({"ref": f"cfdi_{i}", "xml": xml}).encode("utf-8") + b"\n"
+        else:
+            data = xml.encode("utf-8")
+            yield len(data).to_bytes(4, "big") + data
+        if i % 1000 == 0:
+            await asyncio.sleep(0)
+
+
+async def _correr(app, n: int, formato: str) -> dict:
+    import httpx
+
+    tipo = "application/x-ndjson" if formato == "ndjson" else "application/octet-stream"
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        t0 = time.perf_counter()
+        r = await client.post(
+            f"/api/ingest?rfc={RFC}&detalle=errores", content=_cuerpo(n, formato), headers={"Content-Type": tipo}
+        )
+        dur = time.perf_counter() - t0
+    r.raise_for_status()
+    lineas = [json.loads(x) for x in r.text.splitlines() if x]
+    return {"segundos": dur, "errores": [x for x in lineas if "resumen" not in x], "resumen": lineas[-1]["resumen"]}
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="Ingesta por flujo de muchos CFDI en una conexión.")
+    ap.add_argument("--documentos", type=int, default=100000, help="CFDI a enviar (default 100000)")
+    ap.add_argument("--formato", choices=["ndjson", "prefijado"], default="ndjson")
+    ap.add_argument("--max-mb", type=float, default=150.0, help="Crecimiento máximo de memoria aceptable en MiB")
+    args = ap.parse_args()
+
+    os.environ["CFDI_DATA_DIR"] = tempfile.mkdtemp(prefix="bench_ingest_")
+    import main as app_main  # después de fijar CFDI_DATA_DIR
+
+    app_main.on_startup()
+    antes = _rss_mb()
+    r = asyncio.run(_correr(app_main.app, args.documentos, args.formato))
+    crecimiento = _rss_mb() - antes
+
+    res = r["resumen"]
+    print(f"{'documentos':>11} {'formato':>10} {'segundos':>9} {'docs/s':>8} {'insertados':>11} {'errores':>8} {'Δ memoria MiB':>14}")
+    print(
+        f"{res['documentos']:>11} {args.formato:>10} {r['segundos']:>9.1f} {res['documentos'] / r['segundos']:>8.0f} "
+        f"{res['cfdi_insertados']:>11} {res['errores']:>8} {crecimiento:>14.1f}"
+    )
+    for e in r["errores"][:10]:
+        print("  error:", e)
+
+    if res["cfdi_insertados"] != args.documentos or crecimiento > args.max_mb:
+        print("FALLA: faltaron documentos o la memoria creció con el tamaño del flujo")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
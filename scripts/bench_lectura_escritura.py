@@ -0,0 +1,235 @@
+"""Benchmark de lecturas concurrentes mientras corre una importación.
+
+Compara dos perfiles sobre una base temporal (no toca ``data/``):
+
+- ``legacy``: un solo engine, rollback journal y pragmas por omisión (como antes).
+- ``wal``: engines de ``db.py`` (WAL, pragmas, lectores ``mode=ro`` y escritor serializado).
+
+Un proceso escritor inserta lotes grandes de facturas en transacciones largas mientras
+varios hilos lectores ejecutan las consultas del resumen mensual (el escritor va en otro
+proceso para medir solo la espera por candados, no la competencia por el GIL). Se
+reporta la latencia de lectura (p50/p95/máx) y la duración de cada transacción de escritura.
+
+Al final el escritor deja abierta (sin confirmar) una transacción grande durante
+``--retener`` segundos y se ejecutan lecturas mientras tanto. Con el perfil ``wal``
+el script falla (código 1) si alguna de esas lecturas no terminó antes de que el
+escritor confirmara, es decir, si algún lector esperó a la importación. Esta prueba
+no depende de cuántos núcleos tenga la máquina; las latencias de la tabla sí.
+
+Uso:
+    python -m scripts.bench_lectura_escritura [--filas 20000] [--lotes 6] [--lote 3000] [--lectores 4]
+                                              [--retener 2]
+"""
+
+from __future__ import annotations
+
+import argparse
+import multiprocessing
+import random
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+
+from sqlalchemy import create_engine, insert
+from sqlalchemy.orm import Session, sessionmaker
+
+import queries
+from db import crear_engine_escritura, crear_engine_lectura, write_session
+from models import Base, Factura, ImpuestoComprobante
+
+
+RFC = "XAXX010101000"
+YEARS = (2022, 2023, 2024)
+XML_RELLENO = "<cfdi:Comprobante/>" + "x" * 2000  # tamaño típico de un CFDI guardado
+
+
+def _facturas(n: int, desde: int) -> list[dict]:
+    rows = []
+    for i in range(desde, desde + n):
+        year, month = YEARS[i % len(YEARS)], 1 + i % 12
+        rows.append(
+            {
+                "titular_rfc": RFC,
+                "uuid": f"{i:08d}-0000-0000-0000-000000000000",
+                "tipo_comprobante": "I",
+                "fecha_emision": datetime(year, month, 1 + i % 28, i % 24),
+                "year_emision": year,
+                "month_emision": month,
+                "naturaleza": "ingreso" if i % 2 else "gasto",
+                "subtotal": 1000,
+                "total": 1160,
+                "total_trasladados": 160,
+                "xml_text": XML_RELLENO,
+            }
+        )
+    return rows
+
+
+def _insertar_lote(db: Session, n: int, desde: int) -> None:
+    ids = db.scalars(
+        insert(Factura).returning(Factura.id, sort_by_parameter_order=True), _facturas(n, desde)
+    ).all()
+    db.execute(
+        insert(ImpuestoComprobante),
+        [
+            {"factura_id": fid, "tipo": "traslado", "impuesto": "002", "tipo_factor": "Tasa",
+             "tasa_o_cuota": 0.16, "base": 1000, "importe": 160}
+            for fid in ids
+        ],
+    )
+
+
+def _engine_escritura(perfil: str, path: Path):
+    if perfil == "wal":
+        return crear_engine_escritura(path)
+    return create_engine(f"sqlite:///{path.as_posix()}", connect_args={"check_same_thread": False})
+
+
+def _escritor(perfil: str, path: Path, desde: int, lotes: int, lote: int, retener: float, ev: dict, cola) -> None:
+    """Proceso escritor: reporta la duración de cada transacción y al final retiene una abierta."""
+    writer_engine = _engine_escritura(perfil, path)
+
+    def _sesion():
+        return write_session(bulk=True, bind=writer_engine) if perfil == "wal" else Session(writer_engine)
+
+    ev["inicio"].wait()
+    for n in range(lotes):
+        t0 = time.perf_counter()
+        with _sesion() as db:
+            _insertar_lote(db, lote, desde + n * lote)
+            db.commit()
+        cola.put(time.perf_counter() - t0)
+
+    # Transacción retenida: datos escritos en la base (flush) pero sin confirmar
+    with _sesion() as db:
+        _insertar_lote(db, lote, desde + lotes * lote)
+        ev["retenida"].set()
+        time.sleep(retener)
+        ev["confirmada"].set()
+        db.commit()
+    writer_engine.dispose()
+
+
+def _lector(read_factory, fin: threading.Event, latencias: list[float], errores: list[str]) -> None:
+    rnd = random.Random()
+    while not fin.is_set():
+        year, month = rnd.choice(YEARS), rnd.randint(1, 12)
+        t0 = time.perf_counter()
+        db = read_factory()
+        try:
+            db.scalars(queries.facturas_periodo(RFC, year, month)).all()
+            db.execute(queries.impuestos_por_tasa(RFC, year, month)).all()
+            db.execute(queries.pagos_periodo(RFC, year, month)).all()
+        except Exception as e:  # "database is locked" en el perfil legacy
+            errores.append(type(e).__name__)
+        finally:
+            db.close()
+        latencias.append(time.perf_counter() - t0)
+
+
+def _leer_durante_retencion(read_factory, ev: dict) -> tuple[int, int]:
+    """Lecturas mientras el escritor retiene su transacción. Regresa (terminadas a tiempo, total)."""
+    ev["retenida"].wait()
+    a_tiempo = total = 0
+    for year in YEARS:
+        db = read_factory()
+        try:
+            db.scalars(queries.facturas_periodo(RFC, year, 1)).all()
+        except Exception:
+            pass
+        finally:
+            db.close()
+        total += 1
+        if not ev["confirmada"].is_set():
+            a_tiempo += 1
+    return a_tiempo, total
+
+
+def correr(perfil: str, filas: int, lotes: int, lote: int, lectores: int, retener: float) -> dict:
+    tmp = Path(tempfile.mkdtemp(prefix=f"bench_{perfil}_"))
+    path = tmp / "bench.sqlite"
+
+    writer_engine = _engine_escritura(perfil, path)
+    Base.metadata.create_all(writer_engine)
+    with Session(writer_engine) as db:
+        _insertar_lote(db, filas, 0)
+        db.commit()
+    writer_engine.dispose()
+
+    read_engine = crear_engine_lectura(path) if perfil == "wal" else _engine_escritura(perfil, path)
+    read_factory = sessionmaker(bind=read_engine)
+
+    ctx = multiprocessing.get_context("spawn")
+    ev = {"inicio": ctx.Event(), "retenida": ctx.Event(), "confirmada": ctx.Event()}
+    cola = ctx.Queue()
+    escritor = ctx.Process(target=_escritor, args=(perfil, path, filas, lotes, lote, retener, ev, cola))
+    escritor.start()
+
+    fin = threading.Event()
+    latencias: list[float] = []
+    errores: list[str] = []
+    hilos = [threading.Thread(target=_lector, args=(read_factory, fin, latencias, errores)) for _ in range(lectores)]
+    for h in hilos:
+        h.start()
+    time.sleep(0.2)  # lecturas en frío antes de empezar a escribir
+
+    ev["inicio"].set()
+    transacciones = [cola.get() for _ in range(lotes)]
+    fin.set()
+    for h in hilos:
+        h.join()
+
+    a_tiempo, total = _leer_durante_retencion(read_factory, ev)
+    escritor.join()
+    read_engine.dispose()
+
+    lat = sorted(latencias)
+    return {
+        "perfil": perfil,
+        "lecturas": len(lat),
+        "errores": len(errores),
+        "p50_ms": statistics.median(lat) * 1000,
+        "p95_ms": lat[int(len(lat) * 0.95) - 1] * 1000,
+        "max_ms": lat[-1] * 1000,
+        "tx_min_ms": min(transacciones) * 1000,
+        "tx_max_ms": max(transacciones) * 1000,
+        "retenidas": f"{a_tiempo}/{total}",
+        "bloqueado": a_tiempo < total,
+    }
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="Latencia de lectura mientras corre una importación.")
+    ap.add_argument("--filas", type=int, default=20000, help="Facturas iniciales (default 20000)")
+    ap.add_argument("--lotes", type=int, default=6, help="Transacciones de escritura (default 6)")
+    ap.add_argument("--lote", type=int, default=3000, help="Facturas por transacción (default 3000)")
+    ap.add_argument("--lectores", type=int, default=4, help="Hilos lectores (default 4)")
+    ap.add_argument("--retener", type=float, default=2.0, help="Segundos con la última transacción abierta (default 2)")
+    ap.add_argument("--perfil", choices=["legacy", "wal", "ambos"], default="ambos")
+    args = ap.parse_args()
+
+    perfiles = ["legacy", "wal"] if args.perfil == "ambos" else [args.perfil]
+    resultados = [correr(p, args.filas, args.lotes, args.lote, args.lectores, args.retener) for p in perfiles]
+
+    print(
+        f"{'perfil':8} {'lecturas':>9} {'errores':>8} {'p50 ms':>8} {'p95 ms':>8} {'máx ms':>8} "
+        f"{'tx min ms':>10} {'tx máx ms':>10} {'leídas con tx abierta':>22}"
+    )
+    for r in resultados:
+        print(
+            f"{r['perfil']:8} {r['lecturas']:>9} {r['errores']:>8} {r['p50_ms']:>8.1f} {r['p95_ms']:>8.1f} "
+            f"{r['max_ms']:>8.1f} {r['tx_min_ms']:>10.1f} {r['tx_max_ms']:>10.1f} {r['retenidas']:>22}"
+        )
+
+    wal = next((r for r in resultados if r["perfil"] == "wal"), None)
+    if wal and (wal["errores"] or wal["bloqueado"]):
+        print("FALLA: algún lector esperó a la transacción de escritura")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
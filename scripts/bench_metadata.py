@@ -0,0 +1,152 @@
+"""Mide la carga de metadata de descarga masiva SAT (``metadata_sat.py``).
+
+Sobre una base temporal (``CFDI_DATA_DIR``) importa ``--facturas`` CFDI de ingreso y
+escribe un archivo de metadata de ``--renglones`` renglones: los UUID importados (uno
+de cada 10 cancelado) y el resto sin XML, más algunos de otros RFC. Mide la carga
+(renglones/s y memoria), el ``UPDATE ... FROM`` de estatus, una segunda carga del mismo
+archivo (no debe reescribir nada) y revisa que el resumen del periodo ya no sume los
+cancelados y que la cuenta de UUID sin XML sea la esperada.
+
+Falla (código 1) si algún total no cuadra o si la memoria de Python (``tracemalloc``)
+pasa de ``--max-mib`` MiB durante la carga: debe depender del lote, no del archivo.
+
+Uso:
+    python -m scripts.bench_metadata [--renglones 1000000] [--facturas 5000]
+"""
+
+from __future__ import annotations
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+from scripts.bench_importacion_concurrente import PLANTILLA
+
+RFC = "XAXX010101000"
+ENCABEZADO = (
+    "Uuid~RfcEmisor~NombreEmisor~RfcReceptor~NombreReceptor~RfcPac~FechaEmision~"
+    "FechaCertificacionSat~Monto~EfectoComprobante~Estatus~FechaCancelacion\r\n"
+)
+
+
+def _uuid(i: int) -> str:
+    return f"0000BEEF-{i >> 16:04X}-4000-8000-{i:012X}"
+
+
+def _fecha(i: int) -> datetime:
+    return datetime(2024, 1, 1, 9) + timedelta(minutes=7 * i)
+
+
+def _escribir_metadata(ruta: str, renglones: int, facturas: int) -> tuple[int, int, int]:
+    """Escribe el archivo por flujo. Regresa (con XML y estatus, cancelados con XML, vigentes sin XML).
+
+    Los primeros ``facturas`` UUID son los importados; uno de cada 10 renglones está
+    cancelado y uno de cada 50 es de otro RFC (no se carga).
+    """
+    con_estatus = cancelados = sin_xml = 0
+    with open(ruta, "w", encoding="utf-8", newline="") as f:
+        f.write(ENCABEZADO)
+        for i in range(renglones):
+            fecha = _fecha(i).strftime("%Y-%m-%d %H:%M:%S")
+            cancelado = i % 10 == 3
+            ajeno = i % 50 == 0
+            f.write(
+                f"{_uuid(i)}~{'AAA010101AAA' if ajeno else RFC}~EMISOR PRUEBA~CLI010101AAA~CLIENTE SA~SAT970701NN3~"
+                f"{fecha}~{fecha}~1160.00~I~{0 if cancelado else 1}~{fecha if cancelado else ''}\r\n"
+            )
+            if ajeno:
+                continue
+            if i < facturas:
+                con_estatus += 1
+                cancelados += cancelado
+            elif not cancelado:
+                sin_xml += 1
+    return con_estatus, cancelados, sin_xml
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="Carga de metadata SAT por flujo y UPDATE de estatus.")
+    ap.add_argument("--renglones", type=int, default=1_000_000, help="Renglones de metadata (default 1000000)")
+    ap.add_argument("--facturas", type=int, default=5000, help="CFDI importados con XML (default 5000)")
+    ap.add_argument("--lote", type=int, default=None, help="Renglones por transacción (default metadata_sat.LOTE)")
+    ap.add_argument("--max-mib", type=float, default=64, help="Memoria de Python máxima durante la carga (MiB)")
+    args = ap.parse_args()
+
+    tmp = tempfile.mkdtemp(prefix="bench_metadata_")
+    os.environ["CFDI_DATA_DIR"] = tmp
+    import metadata_sat
+    import queries
+    from db import ReadSessionLocal, sync_schema, write_session
+    from importer import BulkWriter
+    from models import Base
+
+    sync_schema(Base.metadata)
+    t0 = time.perf_counter()
+    with write_session(bulk=True) as db:
+        writer = BulkWriter(db, titular_rfc=RFC, batch_size=500)
+        for i in range(args.facturas):
+            fecha = _fecha(i).strftime("%Y-%m-%dT%H:%M:%S")
+            writer.add_xml(PLANTILLA.format(n=i, fecha=fecha, rfc=RFC, uuid=_uuid(i)).encode("utf-8"))
+        writer.flush()
+    print(f"{args.facturas} CFDI importados en {time.perf_counter() - t0:.1f} s")
+
+    ruta = os.path.join(tmp, "Metadata.txt")
+    t0 = time.perf_counter()
+    con_estatus, cancelados, sin_xml = _escribir_metadata(ruta, args.renglones, args.facturas)
+    print(f"metadata: {args.renglones} renglones, {os.path.getsize(ruta) / 1048576:.0f} MiB en {time.perf_counter() - t0:.1f} s")
+
+    lote = args.lote or metadata_sat.LOTE
+    actualizadas = []
+    for vuelta in ("primera carga", "recarga", "recarga con tracemalloc"):
+        if vuelta.endswith("tracemalloc"):
+            tracemalloc.start()  # solo aquí: tracemalloc hace más lenta la carga
+        t0 = time.perf_counter()
+        with open(ruta, "rb") as f:
+            res = metadata_sat.cargar([("Metadata.txt", f)], RFC, lote)
+        dt = time.perf_counter() - t0
+        print(
+            f"{vuelta}: {res.renglones / dt:.0f} renglones/s ({dt:.1f} s), {res.cargados} del titular, "
+            f"{res.ajenos} ajenos, {res.errores} errores, {res.facturas_actualizadas} facturas cambiaron"
+        )
+        actualizadas.append(res.facturas_actualizadas)
+    pico = tracemalloc.get_traced_memory()[1] / 1048576
+    tracemalloc.stop()
+    print(f"memoria de Python máxima durante la carga: {pico:.0f} MiB (lote {lote})")
+
+    # El UPDATE a solas (ya sin cambios): recorre las facturas del titular contra la PK de metadata
+    from importer import aplicar_estatus_sat
+
+    with write_session() as db:
+        t0 = time.perf_counter()
+        aplicar_estatus_sat(db, RFC)
+        db.rollback()
+    print(f"UPDATE de estatus sin cambios: {(time.perf_counter() - t0) * 1000:.0f} ms")
+
+    db = ReadSessionLocal()
+    try:
+        desde = (_fecha(0).year, _fecha(0).month)
+        hasta = (_fecha(args.facturas - 1).year, _fecha(args.facturas - 1).month)
+        ingresos = sum(float(r.ingresos_total) for r in db.execute(queries.facturas_por_mes(RFC, desde, hasta)))
+        faltantes, _ = db.execute(queries.metadata_sin_xml_conteo(RFC)).one()
+    finally:
+        db.close()
+    vigentes = args.facturas - cancelados
+    print(f"ingresos del rango: {ingresos:.2f} (esperado {vigentes * 1160:.2f}); sin XML: {faltantes} (esperado {sin_xml})")
+
+    falla = (
+        abs(ingresos - vigentes * 1160) > 0.01
+        or faltantes != sin_xml
+        or actualizadas != [con_estatus, 0, 0]
+        or pico > args.max_mib
+    )
+    if falla:
+        print("FALLA: totales distintos a lo esperado o la memoria creció con el archivo")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""Mide el costo del anti-join de sustituidos (``queries.EFECTIVO``) en los agregados.
+
+Sobre una base temporal (``CFDI_DATA_DIR``) importa ``--facturas`` CFDI de ingreso; uno
+de cada ``--cada`` sustituye (CfdiRelacionado 04) al anterior. Mide ``facturas_por_mes``
+y ``pagos_por_mes`` de todo el rango con el filtro de sustituidos y sin él (solo
+``VIGENTE``), y el resumen de un mes completo (``_compute_period_data``).
+
+Falla (código 1) si los ingresos del rango no descuentan a los sustituidos.
+
+Uso:
+    python -m scripts.bench_relacionados [--facturas 20000] [--cada 10]
+"""
+
+from __future__ import annotations
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from scripts.bench_importacion_concurrente import PLANTILLA
+
+RFC = "XAXX010101000"
+RELACION = (
+    '<cfdi:CfdiRelacionados TipoRelacion="04"><cfdi:CfdiRelacionado UUID="{uuid}"/></cfdi:CfdiRelacionados>\n'
+    "  <cfdi:Emisor "
+)
+
+
+def _uuid(i: int) -> str:
+    return f"0000CAFE-{i >> 16:04X}-4000-8000-{i:012X}"
+
+
+def _fecha(i: int) -> datetime:
+    return datetime(2024, 1, 1, 9) + timedelta(minutes=37 * i)
+
+
+def _medir(db, stmt, vueltas: int = 5) -> tuple[float, list]:
+    t0 = time.perf_counter()
+    for _ in range(vueltas):
+        filas = db.execute(stmt).all()
+    return (time.perf_counter() - t0) / vueltas * 1000, filas
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="Agregados con y sin el anti-join de CFDI sustituidos.")
+    ap.add_argument("--facturas", type=int, default=20000, help="CFDI importados (default 20000)")
+    ap.add_argument("--cada", type=int, default=10, help="Uno de cada N sustituye al anterior (default 10)")
+    args = ap.parse_args()
+
+    os.environ["CFDI_DATA_DIR"] = tempfile.mkdtemp(prefix="bench_relacionados_")
+    import main as app
+    import queries
+    from db import ReadSessionLocal, sync_schema, write_session
+    from importer import BulkWriter
+    from models import Base
+
+    sync_schema(Base.metadata)
+    t0 = time.perf_counter()
+    sustituidos = 0
+    with write_session(bulk=True) as db:
+        writer = BulkWriter(db, titular_rfc=RFC, batch_size=500)
+        for i in range(args.facturas):
+            xml = PLANTILLA.format(n=i, fecha=_fecha(i).strftime("%Y-%m-%dT%H:%M:%S"), rfc=RFC, uuid=_uuid(i))
+            if i % args.cada == args.cada - 1:
+                xml = xml.replace("<cfdi:Emisor ", RELACION.format(uuid=_uuid(i - 1)), 1)
+                sustituidos += 1
+            writer.add_xml(xml.encode("utf-8"))
+        writer.flush()
+    print(f"{args.facturas} CFDI importados ({sustituidos} sustituyen a otro) en {time.perf_counter() - t0:.1f} s")
+
+    desde = (_fecha(0).year, _fecha(0).month)
+    hasta = (_fecha(args.facturas - 1).year, _fecha(args.facturas - 1).month)
+    db = ReadSessionLocal()
+    try:
+        efectivo_ms, filas = _medir(db, queries.facturas_por_mes(RFC, desde, hasta))
+        ingresos = sum(float(r.ingresos_total) for r in filas)
+        efectivo = queries.EFECTIVO
+        try:
+            queries.EFECTIVO = queries.VIGENTE  # las funciones lo leen al armar la sentencia
+            vigente_ms, _ = _medir(db, queries.facturas_por_mes(RFC, desde, hasta))
+        finally:
+            queries.EFECTIVO = efectivo
+        pagos_ms, _ = _medir(db, queries.pagos_por_mes(RFC, desde, hasta))
+        print(
+            f"facturas_por_mes ({hasta[0] * 12 + hasta[1] - desde[0] * 12 - desde[1] + 1} meses): "
+            f"{efectivo_ms:.1f} ms sin sustituidos, {vigente_ms:.1f} ms solo vigentes; pagos_por_mes {pagos_ms:.1f} ms"
+        )
+        t0 = time.perf_counter()
+        data = app._compute_period_data(db, RFC, *desde)
+        print(
+            f"resumen de {desde[0]}-{desde[1]:02d}: {(time.perf_counter() - t0) * 1000:.1f} ms, "
+            f"{len(data['docs'])} CFDI, {len(data['sustituidos'])} sustituidos"
+        )
+    finally:
+        db.close()
+
+    esperado = (args.facturas - sustituidos) * 1160
+    print(f"ingresos del rango: {ingresos:.2f} (esperado {esperado:.2f})")
+    if abs(ingresos - esperado) > 0.01:
+        print("FALLA: los ingresos no descuentan a los CFDI sustituidos")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,172 @@
+"""Mide ``respaldo.py`` mientras la base recibe escrituras.
+
+Crea una base temporal (``CFDI_DATA_DIR``) con ``--filas`` CFDI y ``--pdfs`` PDF. Hace un
+respaldo completo mientras un hilo confirma inserciones pequeñas y otro lee (como una
+importación y una vista), y reporta la peor latencia de ambos. Luego agrega unos PDF,
+hace un respaldo incremental, restaura la cadena en otra carpeta y la verifica.
+
+Falla (código 1) si alguna escritura o lectura esperó más de ``--max-ms`` durante la
+copia, si el incremental no trae solo los PDF nuevos o si la verificación no pasa.
+
+Uso:
+    python -m scripts.bench_respaldo [--filas 200000] [--pdfs 500]
+"""
+
+from __future__ import annotations
+
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+
+RFC = "XAXX010101000"
+
+
+def _poblar(filas: int) -> None:
+    from sqlalchemy import insert
+
+    from db import write_session
+    from models import Factura
+
+    lote = 5000
+    for desde in range(0, filas, lote):
+        with write_session(bulk=True) as db:
+            db.execute(
+                insert(Factura),
+                [
+                    {
+                        "titular_rfc": RFC,
+                        "uuid": f"{i:08d}-0000-4000-8000-000000000000",
+                        "tipo_comprobante": "I",
+                        "fecha_emision": datetime(2025, 1 + i % 12, 1),
+                        "year_emision": 2025,
+                        "month_emision": 1 + i % 12,
+                        "naturaleza": "ingreso",
+                        "emisor_rfc": RFC,
+                        "receptor_rfc": "CLI010101AAA",
+                        "moneda": "MXN",
+                        "subtotal": 1000,
+                        "total": 1160,
+                        "xml_text": "<cfdi:Comprobante/>" + "x" * 1500,
+                    }
+                    for i in range(desde, min(desde + lote, filas))
+                ],
+            )
+            db.commit()
+
+
+def _pdfs(desde: int, n: int) -> None:
+    from db import PDF_DIR
+    from utils import safe_pdf_filename, sha256_bytes
+
+    for i in range(desde, desde + n):
+        contenido = b"%PDF-1.4\n" + os.urandom(64 * 1024) + str(i).encode()
+        (PDF_DIR / safe_pdf_filename(sha256_bytes(contenido))).write_bytes(contenido)
+
+
+def _carga(fin: threading.Event, latencias: dict[str, float]) -> list[threading.Thread]:
+    """Un hilo que escribe (commits pequeños) y otro que lee, midiendo su peor espera."""
+    from sqlalchemy import func, insert, select
+
+    from db import ReadSessionLocal, write_session
+    from models import Factura
+
+    def escribir() -> None:
+        i = 0
+        while not fin.is_set():
+            t = time.perf_counter()
+            with write_session() as db:
+                db.execute(
+                    insert(Factura),
+                    {"titular_rfc": RFC, "uuid": f"{i:08d}-9999-4000-8000-000000000000", "tipo_comprobante": "I",
+                     "fecha_emision": datetime(2025, 6, 1), "year_emision": 2025, "month_emision": 6,
+                     "naturaleza": "ingreso", "moneda": "MXN", "subtotal": 1, "total": 1, "xml_text": "<x/>"},
+                )
+                db.commit()
+            latencias["escritura"] = max(latencias["escritura"], time.perf_counter() - t)
+            i += 1
+            time.sleep(0.01)
+
+    def leer() -> None:
+        while not fin.is_set():
+            t = time.perf_counter()
+            db = ReadSessionLocal()
+            try:
+                db.scalar(select(func.count()).select_from(Factura).where(Factura.month_emision == 6))
+            finally:
+                db.close()
+            latencias["lectura"] = max(latencias["lectura"], time.perf_counter() - t)
+            time.sleep(0.01)
+
+    hilos = [threading.Thread(target=escribir), threading.Thread(target=leer)]
+    for h in hilos:
+        h.start()
+    return hilos
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="Respaldo en línea, incremental y restauración.")
+    ap.add_argument("--filas", type=int, default=200000, help="CFDI en la base (default 200000)")
+    ap.add_argument("--pdfs", type=int, default=500, help="PDF de 64 KiB (default 500)")
+    ap.add_argument("--max-ms", type=float, default=500.0, help="Espera máxima de escrituras/lecturas")
+    args = ap.parse_args()
+
+    os.environ["CFDI_DATA_DIR"] = tempfile.mkdtemp(prefix="bench_respaldo_")
+    import respaldo
+    from db import sync_schema
+    from models import Base
+
+    sync_schema(Base.metadata)
+    t0 = time.perf_counter()
+    _poblar(args.filas)
+    _pdfs(0, args.pdfs)
+    print(f"Base con {args.filas} CFDI y {args.pdfs} PDF en {time.perf_counter() - t0:.1f} s")
+
+    fin = threading.Event()
+    latencias = {"escritura": 0.0, "lectura": 0.0}
+    hilos = _carga(fin, latencias)
+    t0 = time.perf_counter()
+    completo = respaldo.crear_respaldo()
+    dt = time.perf_counter() - t0
+    fin.set()
+    for h in hilos:
+        h.join()
+    print(
+        f"completo: {dt:.2f} s; peor escritura {latencias['escritura'] * 1000:.0f} ms, "
+        f"peor lectura {latencias['lectura'] * 1000:.0f} ms durante la copia"
+    )
+
+    nuevos = 10
+    _pdfs(args.pdfs, nuevos)
+    time.sleep(1)  # el nombre del respaldo lleva segundos
+    t0 = time.perf_counter()
+    incremental = respaldo.crear_respaldo()
+    m = respaldo._leer_manifiesto(incremental)
+    print(f"incremental: {time.perf_counter() - t0:.2f} s, {len(m['pdfs'])} PDF (base {m['base']})")
+
+    destino = Path(tempfile.mkdtemp(prefix="bench_restaurar_"))
+    t0 = time.perf_counter()
+    res = respaldo.restaurar(incremental, destino)
+    print(
+        f"restaurar y verificar: {time.perf_counter() - t0:.2f} s; integridad {res.integridad}, "
+        f"{res.pdfs} PDF, {len(res.hash_incorrecto)} con hash incorrecto"
+    )
+
+    falla = (
+        max(latencias.values()) * 1000 > args.max_ms
+        or len(m["pdfs"]) != nuevos
+        or m["base"] != completo.name
+        or res.pdfs != args.pdfs + nuevos
+        or not res.ok
+    )
+    if falla:
+        print("FALLA: el respaldo bloqueó la base o la restauración no cuadra")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,165 @@
+"""Mide la verificación offline de sellos (``sellos.py``) y el efecto de la caché de certificados.
+
+Sobre una base temporal (``CFDI_DATA_DIR``) genera certificados de prueba (``--emisores``
+CSD y uno del SAT, RSA 2048 como los reales), sella y timbra ``--documentos`` CFDI con la
+cadena original de ``sellos.py`` y altera uno de cada 100 después de sellarlo. Mide:
+
+- ``verificar_xml`` en un proceso con la caché de certificados y sin ella (``maxsize=0``),
+- ``sellos.verificar`` sobre la base con 1 proceso y con ``--workers``.
+
+Falla (código 1) si los resultados no son los esperados (alterados inválidos y el resto
+válidos) o si la caché no ahorra al menos ``--min-ahorro`` µs por documento.
+
+Uso:
+    python -m scripts.bench_sellos [--documentos 5000] [--emisores 5] [--workers 4]
+"""
+
+from __future__ import annotations
+
+import argparse
+import base64
+import os
+import sys
+import tempfile
+import time
+import xml.etree.ElementTree as ET
+from datetime import datetime, timedelta
+
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import padding, rsa
+from cryptography.x509.oid import NameOID
+
+from scripts.bench_importacion_concurrente import PLANTILLA
+
+RFC = "XAXX010101000"
+NO_CERTIFICADO_SAT = "00001000000500000002"  # el de PLANTILLA
+ALTERAR_CADA = 100
+
+
+def _certificado(numero: str, rfc: str) -> tuple[rsa.RSAPrivateKey, str]:
+    """Llave y certificado autofirmado (base64 DER) con el número y el RFC como los del SAT."""
+    llave = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    nombre = x509.Name([
+        x509.NameAttribute(NameOID.COMMON_NAME, f"PRUEBA {rfc}"),
+        x509.NameAttribute(NameOID.X500_UNIQUE_IDENTIFIER, f"{rfc} / "),
+    ])
+    cert = (
+        x509.CertificateBuilder()
+        .subject_name(nombre)
+        .issuer_name(nombre)
+        .public_key(llave.public_key())
+        .serial_number(int(numero.encode("ascii").hex(), 16))
+        .not_valid_before(datetime(2020, 1, 1))
+        .not_valid_after(datetime(2030, 1, 1))
+        .sign(llave, hashes.SHA256())
+    )
+    return llave, base64.b64encode(cert.public_bytes(serialization.Encoding.DER)).decode("ascii")
+
+
+def _firmar(llave: rsa.RSAPrivateKey, cadena: str) -> str:
+    return base64.b64encode(llave.sign(cadena.encode("utf-8"), padding.PKCS1v15(), hashes.SHA256())).decode("ascii")
+
+
+def _documentos(n: int, emisores: list[tuple[str, str, rsa.RSAPrivateKey, str]], llave_sat) -> list[bytes]:
+    import sellos
+
+    ET.register_namespace("cfdi", "http://www.sat.gob.mx/cfd/4")
+    ET.register_namespace("tfd", "http://www.sat.gob.mx/TimbreFiscalDigital")
+    base = datetime(2024, 1, 1, 9)
+    out = []
+    for i in range(n):
+        rfc, numero, llave, certificado = emisores[i % len(emisores)]
+        xml = PLANTILLA.format(
+            n=i,
+            fecha=(base + timedelta(hours=7 * i)).strftime("%Y-%m-%dT%H:%M:%S"),
+            rfc=rfc,
+            uuid=f"5E110000-{i >> 16:04X}-4000-8000-{i:012X}",
+        )
+        root = ET.fromstring(xml)
+        root.set("NoCertificado", numero)
+        root.set("Certificado", certificado)
+        sello = _firmar(llave, sellos.cadena_original(root))
+        root.set("Sello", sello)
+        tfd = root.find(".//{http://www.sat.gob.mx/TimbreFiscalDigital}TimbreFiscalDigital")
+        tfd.set("SelloCFD", sello)
+        tfd.set("SelloSAT", _firmar(llave_sat, sellos.cadena_timbre(tfd)))
+        if i % ALTERAR_CADA == ALTERAR_CADA - 1:
+            root.set("Total", "1161.00")  # alterado después de sellar
+        out.append(ET.tostring(root, encoding="utf-8", xml_declaration=True))
+    return out
+
+
+def _medir(docs: list[bytes], certificados) -> float:
+    import sellos
+
+    t0 = time.perf_counter()
+    for d in docs:
+        sellos.verificar_xml(d, certificados)
+    return (time.perf_counter() - t0) / len(docs) * 1e6
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="Verificación de sello y timbre, con y sin caché de certificados.")
+    ap.add_argument("--documentos", type=int, default=5000, help="CFDI sellados (default 5000)")
+    ap.add_argument("--emisores", type=int, default=5, help="Certificados de emisor distintos (default 5)")
+    ap.add_argument("--workers", type=int, default=os.cpu_count() or 2, help="Procesos del pool (default: CPUs)")
+    ap.add_argument("--min-ahorro", type=float, default=50, help="µs/doc que debe ahorrar la caché (default 50)")
+    args = ap.parse_args()
+
+    tmp = tempfile.mkdtemp(prefix="bench_sellos_")
+    os.environ["CFDI_DATA_DIR"] = tmp
+    import sellos
+    from db import sync_schema, write_session
+    from importer import BulkWriter
+    from models import Base
+
+    t0 = time.perf_counter()
+    llave_sat, cert_sat = _certificado(NO_CERTIFICADO_SAT, "SAT970701NN3")
+    sellos.CERTIFICADOS_SAT_DIR.mkdir(parents=True, exist_ok=True)
+    (sellos.CERTIFICADOS_SAT_DIR / f"{NO_CERTIFICADO_SAT}.cer").write_bytes(base64.b64decode(cert_sat))
+    emisores = []
+    for k in range(args.emisores):
+        rfc, numero = f"EMI{k:06d}AA{k % 10}", f"3000100000050000{k:04d}"
+        emisores.append((rfc, numero, *_certificado(numero, rfc)))
+    docs = _documentos(args.documentos, emisores, llave_sat)
+    alterados = args.documentos // ALTERAR_CADA
+    print(f"{args.documentos} CFDI sellados con {args.emisores} certificados en {time.perf_counter() - t0:.1f} s")
+
+    sin_cache = _medir(docs, sellos.CacheCertificados(maxsize=0))
+    con = sellos.CacheCertificados()
+    con_cache = _medir(docs, con)
+    stats = con.stats()
+    print(
+        f"un proceso: {con_cache:.0f} µs/doc con caché (aciertos {stats['tasa_aciertos']:.1%}), "
+        f"{sin_cache:.0f} µs/doc sin caché"
+    )
+
+    sync_schema(Base.metadata)
+    with write_session(bulk=True) as db:
+        writer = BulkWriter(db, titular_rfc=RFC, batch_size=500)
+        for d in docs:
+            writer.add_xml(d)
+        writer.flush()
+
+    resultados = []
+    for workers in sorted({1, args.workers}):
+        sellos.reiniciar(todos=True)
+        t0 = time.perf_counter()
+        res = sellos.verificar(workers=workers)
+        dt = time.perf_counter() - t0
+        print(
+            f"sellos.verificar con {workers} proceso(s): {res['verificados'] / dt:.0f} CFDI/s ({dt:.1f} s); "
+            + ", ".join(f"{res[e]} {e}" for e in sellos.ESTATUS)
+        )
+        resultados.append(res)
+
+    esperado = {"valido": args.documentos - alterados, "invalido": alterados}
+    falla = any(r[e] != n for r in resultados for e, n in esperado.items()) or sin_cache - con_cache < args.min_ahorro
+    if falla:
+        print(f"FALLA: se esperaba {esperado} y un ahorro de {args.min_ahorro:.0f} µs/doc con la caché")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+"""Mide la normalización a MXN (``tipos_cambio.py``) y los agregados sobre las columnas ``*_mxn``.
+
+Sobre una base temporal (``CFDI_DATA_DIR``) importa ``--facturas`` CFDI de ingreso; uno de
+cada ``--cada`` está en USD sin ``TipoCambio``, así que queda pendiente. Mide:
+
+- la importación (incluye ``normalizar`` de cada lote),
+- la carga de un CSV de Banxico con un tipo de cambio por día hábil del rango, que
+  normaliza los pendientes (``normalizar_pendientes``),
+- ``normalizar --todos`` (recalcular todos los documentos en moneda extranjera),
+- ``facturas_por_mes`` de todo el rango, que sigue siendo un ``SUM`` por columna.
+
+Falla (código 1) si los ingresos del rango no son los esperados en MXN.
+
+Uso:
+    python -m scripts.bench_tipos_cambio [--facturas 20000] [--cada 10]
+"""
+
+from __future__ import annotations
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from scripts.bench_importacion_concurrente import PLANTILLA
+
+RFC = "XAXX010101000"
+TIPO_CAMBIO = 17.25
+
+
+def _fecha(i: int) -> datetime:
+    return datetime(2024, 1, 1, 9) + timedelta(minutes=37 * i)
+
+
+def _csv(ruta: str, desde: datetime, hasta: datetime) -> int:
+    """CSV como el del SIE de Banxico (serie FIX), sin fines de semana."""
+    dias = 0
+    with open(ruta, "w", encoding="utf-8") as f:
+        f.write('Banco de México\n\nSerie,"Tipo de cambio FIX"\n"Fecha","SF43718"\n')
+        dia = desde.date()
+        while dia <= hasta.date():
+            if dia.weekday() < 5:
+                f.write(f'"{dia:%d/%m/%Y}","{TIPO_CAMBIO:.4f}"\n')
+                dias += 1
+            dia += timedelta(days=1)
+    return dias
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="Normalización a MXN y agregados sobre columnas *_mxn.")
+    ap.add_argument("--facturas", type=int, default=20000, help="CFDI importados (default 20000)")
+    ap.add_argument("--cada", type=int, default=10, help="Uno de cada N en USD sin TipoCambio (default 10)")
+    args = ap.parse_args()
+
+    tmp = tempfile.mkdtemp(prefix="bench_tipos_cambio_")
+    os.environ["CFDI_DATA_DIR"] = tmp
+    import queries
+    import tipos_cambio
+    from db import ReadSessionLocal, sync_schema, write_session
+    from importer import BulkWriter
+    from models import Base
+
+    sync_schema(Base.metadata)
+    t0 = time.perf_counter()
+    en_usd = 0
+    with write_session(bulk=True) as db:
+        writer = BulkWriter(db, titular_rfc=RFC, batch_size=500)
+        for i in range(args.facturas):
+            xml = PLANTILLA.format(
+                n=i, fecha=_fecha(i).strftime("%Y-%m-%dT%H:%M:%S"), rfc=RFC, uuid=f"0000DA1A-{i >> 16:04X}-4000-8000-{i:012X}"
+            )
+            if i % args.cada == args.cada - 1:
+                xml = xml.replace('Moneda="MXN"', 'Moneda="USD"', 1)
+                en_usd += 1
+            writer.add_xml(xml.encode("utf-8"))
+        writer.flush()
+    print(f"{args.facturas} CFDI importados ({en_usd} en USD sin TipoCambio) en {time.perf_counter() - t0:.1f} s")
+
+    ruta = os.path.join(tmp, "tipos_cambio.csv")
+    dias = _csv(ruta, _fecha(0), _fecha(args.facturas - 1))
+    t0 = time.perf_counter()
+    with open(ruta, "rb") as f:
+        res = tipos_cambio.cargar([(ruta, f)])
+    print(
+        f"cargar: {res.cargados} tipos de cambio ({dias} días hábiles), {res.facturas_normalizadas} facturas "
+        f"normalizadas, {res.sin_tipo_cambio} sin tipo de cambio en {(time.perf_counter() - t0) * 1000:.0f} ms"
+    )
+    t0 = time.perf_counter()
+    tipos_cambio.reiniciar()
+    revisadas, sin_tc = tipos_cambio.normalizar_pendientes()
+    print(f"normalizar --todos: {revisadas} facturas en {(time.perf_counter() - t0) * 1000:.0f} ms")
+
+    desde = (_fecha(0).year, _fecha(0).month)
+    hasta = (_fecha(args.facturas - 1).year, _fecha(args.facturas - 1).month)
+    db = ReadSessionLocal()
+    try:
+        t0 = time.perf_counter()
+        for _ in range(5):
+            filas = db.execute(queries.facturas_por_mes(RFC, desde, hasta)).all()
+        print(f"facturas_por_mes ({len(filas)} meses): {(time.perf_counter() - t0) / 5 * 1000:.1f} ms")
+    finally:
+        db.close()
+
+    ingresos = sum(float(r.ingresos_total) for r in filas)
+    esperado = (args.facturas - en_usd) * 1160 + en_usd * 1160 * TIPO_CAMBIO
+    print(f"ingresos del rango: {ingresos:.2f} MXN (esperado {esperado:.2f})")
+    if sin_tc or abs(ingresos - esperado) > 0.01:
+        print("FALLA: los ingresos en USD no se convirtieron con el tipo de cambio cargado")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,185 @@
+"""Revisa el ``EXPLAIN QUERY PLAN`` de cada consulta de ruta (``queries.py``).
+
+Falla (código de salida 1) si alguna consulta recorre una tabla completa (``SCAN``),
+necesita un índice automático o un B-tree temporal para ordenar/agrupar. Así el
+tiempo del resumen y de los listados depende del tamaño del periodo, no del archivo.
+
+Por omisión se revisa un esquema vacío creado en memoria con los modelos actuales;
+con ``--db`` se revisa una base existente (solo lectura), útil tras ``ANALYZE``.
+
+Uso:
+    python -m scripts.check_query_plans [--db data/contabilidad.sqlite] [-v]
+"""
+
+from __future__ import annotations
+
+import argparse
+import sys
+from pathlib import Path
+from datetime import date
+from typing import Optional
+
+from sqlalchemy import create_engine, event, select
+from sqlalchemy.orm import Session
+
+import busqueda
+import complementos  # noqa: F401  registra Nómina, Comercio Exterior, ...
+import queries
+import tipos_cambio
+from models import Base
+from parser_xml import tablas_complemento
+
+
+RFC = "XAXX010101000"
+YEAR, MONTH = 2025, 3
+
+# Agregados cuya llave de agrupación combina columnas de dos tablas: SQLite siempre
+# agrupa con un B-tree temporal, pero la entrada ya viene acotada al periodo por índice.
+PERMITIDOS = {
+    "impuestos_por_tasa": ("USE TEMP B-TREE FOR GROUP BY",),
+    # Conceptos de las facturas del periodo (por índice) agrupados por su categoría
+    "gastos_por_categoria": ("USE TEMP B-TREE FOR GROUP BY",),
+    # Orden por la suma de cada contraparte: solo se puede ordenar después de agregar. Con
+    # periodo, el planificador puede preferir el índice de fecha y agrupar aparte.
+    "totales_por_contraparte": ("USE TEMP B-TREE FOR ORDER BY", "USE TEMP B-TREE FOR GROUP BY"),
+    # (año, mes) sale del índice; naturaleza y método se agrupan aparte, pocas filas por mes
+    "facturas_por_mes_metodo": ("USE TEMP B-TREE FOR GROUP BY",),
+    # Une gastos PUE y pagos PPD del mes (cada parte ya acotada por índice) y agrupa por RFC
+    "diot_por_proveedor": ("USE TEMP B-TREE FOR GROUP BY", "USE TEMP B-TREE FOR ORDER BY"),
+}
+
+
+def _consultas() -> list[tuple[str, object]]:
+    out: list[tuple[str, object]] = []
+    for year, month in [(None, None), (YEAR, None), (YEAR, MONTH), (None, MONTH)]:
+        for tipo, naturaleza in [(None, None), ("I", None), (None, "ingreso"), ("E", "gasto")]:
+            out.append(
+                (
+                    f"facturas_listado(year={year}, month={month}, tipo={tipo}, naturaleza={naturaleza})",
+                    queries.facturas_listado(RFC, year, month, tipo, naturaleza),
+                )
+            )
+        out.append((f"retenciones_listado(year={year}, month={month})", queries.retenciones_listado(RFC, year, month)))
+        out.append(
+            (f"declaraciones_listado(year={year}, month={month})", queries.declaraciones_listado(RFC, year, month))
+        )
+    for desde, hasta in [(None, None), (date(YEAR, 1, 1), date(YEAR, 12, 31))]:
+        for filtros in [{}, {"tipo": "I", "naturaleza": "ingreso"}, {"contraparte": "CLI010101AAA"}]:
+            nombre = f"(desde={desde}, hasta={hasta}, {filtros})"
+            out.append(("export_facturas" + nombre, queries.export_facturas(RFC, desde, hasta, **filtros)))
+            out.append(("export_conceptos" + nombre, queries.export_conceptos(RFC, desde, hasta, **filtros)))
+    out += [
+        ("facturas_periodo", queries.facturas_periodo(RFC, YEAR, MONTH)),
+        ("facturas_ultimo_periodo", queries.facturas_ultimo_periodo(RFC)),
+        ("facturas_periodos", queries.facturas_periodos(RFC)),
+        ("periodos_archivados", queries.periodos_archivados(RFC)),
+        ("periodos_archivados_tabla", queries.periodos_archivados(RFC, "retenciones_plataforma")),
+        ("facturas_pendientes", queries.facturas_pendientes(RFC)),
+        ("impuestos_por_tasa", queries.impuestos_por_tasa(RFC, YEAR, MONTH)),
+        ("gastos_por_categoria", queries.gastos_por_categoria(RFC, YEAR, MONTH)),
+        ("facturas_por_mes", queries.facturas_por_mes(RFC, (YEAR - 1, 7), (YEAR, 6))),
+        ("totales_por_contraparte(gasto, year)", queries.totales_por_contraparte(RFC, "gasto", YEAR)),
+        ("totales_por_contraparte(ingreso, year, month)", queries.totales_por_contraparte(RFC, "ingreso", YEAR, MONTH)),
+        ("totales_por_contraparte(gasto)", queries.totales_por_contraparte(RFC, "gasto")),
+        ("facturas_por_mes_metodo", queries.facturas_por_mes_metodo(RFC, (1, 1), (YEAR, 12))),
+        ("diot_por_proveedor", queries.diot_por_proveedor(RFC, YEAR, MONTH)),
+        ("pagos_periodo", queries.pagos_periodo(RFC, YEAR, MONTH)),
+        ("pagos_por_mes", queries.pagos_por_mes(RFC, (YEAR - 1, 7), (YEAR, 6))),
+        ("iva_flujo_por_mes", queries.iva_flujo_por_mes(RFC, (YEAR - 1, 7), (YEAR, 6))),
+        ("retenciones_por_rango", queries.retenciones_por_rango(RFC, YEAR - 1, YEAR)),
+        ("iva_flujo_periodo", queries.iva_flujo_periodo(RFC, YEAR, MONTH)),
+        ("abonos_factura", queries.abonos_factura(RFC, "11111111-1111-1111-1111-111111111111")),
+        ("relaciones_declaradas", queries.relaciones_declaradas(1)),
+        ("relaciones_recibidas", queries.relaciones_recibidas(RFC, "11111111-1111-1111-1111-111111111111")),
+        ("facturas_sustituidas_periodo", queries.facturas_sustituidas_periodo(RFC, YEAR, MONTH)),
+        ("tipos_cambio.pendientes", tipos_cambio.pendientes(0, tipos_cambio.LOTE)),
+        ("tipos_cambio.factor_mxn", select(tipos_cambio.factor_mxn("USD", None, f"{YEAR}-{MONTH:02d}-10T12:00:00"))),
+        ("metadata_sin_xml", queries.metadata_sin_xml(RFC)),
+        ("metadata_sin_xml(year, month)", queries.metadata_sin_xml(RFC, YEAR, MONTH)),
+        ("metadata_sin_xml_conteo(year, month)", queries.metadata_sin_xml_conteo(RFC, YEAR, MONTH)),
+        *(
+            (f"complemento_filas[{t}]", queries.complemento_filas(t, 1))
+            for t in tablas_complemento("cfdi") + tablas_complemento("retenciones")
+        ),
+        ("retenciones_periodo", queries.retenciones_periodo(RFC, YEAR, MONTH)),
+        ("retenciones_rangos", queries.retenciones_rangos(RFC)),
+        ("retenciones_ultimo_periodo", queries.retenciones_ultimo_periodo(RFC)),
+        ("retenciones_periodos", queries.retenciones_periodos(RFC)),
+        ("declaraciones_periodos", queries.declaraciones_periodos(RFC)),
+        ("declaracion_del_periodo", queries.declaracion_del_periodo(RFC, YEAR, MONTH)),
+        ("declaracion_por_sha", queries.declaracion_por_sha("0" * 64)),
+        ("importaciones_listado", queries.importaciones_listado(RFC)),
+        ("importacion_archivos", queries.importacion_archivos(1)),
+        ("importacion_archivos(status=error)", queries.importacion_archivos(1, "error")),
+        ("buscar_conceptos", queries.buscar_conceptos(RFC, busqueda.consulta_fts("uber viaje"), 20, 40)),
+        ("buscar_contrapartes", queries.buscar_contrapartes(RFC, busqueda.consulta_fts("uber"))),
+        ("buscar_acuses", queries.buscar_acuses(RFC, busqueda.consulta_fts("isr"))),
+        ("buscar_conceptos(desde_rowid)", queries.buscar_conceptos(RFC, busqueda.consulta_fts("servicio"), desde_rowid=1000)),
+        ("fts_corte", queries.fts_corte("conceptos", busqueda.consulta_fts("servicio"), busqueda.VENTANA_RANKING)),
+    ]
+    return out
+
+
+def _problemas(nombre: str, plan: list[str]) -> list[str]:
+    permitidos = PERMITIDOS.get(nombre.split("(")[0], ())
+    malos = []
+    for linea in plan:
+        # Un índice FTS5 consultado con MATCH aparece como "SCAN x VIRTUAL TABLE INDEX n:M..."
+        fts_match = "VIRTUAL TABLE INDEX" in linea and ":M" in linea
+        # "SCAN anon_n" lee el resultado de una subconsulta (co-rutina), no una tabla
+        subconsulta = linea.startswith("SCAN anon_")
+        if linea.startswith("SCAN ") and "CONSTANT ROW" not in linea and not fts_match and not subconsulta:
+            malos.append(linea)
+        elif ("TEMP B-TREE" in linea or "AUTOMATIC" in linea) and not any(p in linea for p in permitidos):
+            malos.append(linea)
+    return malos
+
+
+def revisar(db_path: Optional[Path] = None, verbose: bool = False) -> int:
+    """Imprime el plan de cada consulta y regresa cuántas fallaron."""
+    if db_path:
+        engine = create_engine(f"sqlite:///file:{db_path.as_posix()}?mode=ro&uri=true")
+    else:
+        engine = create_engine("sqlite://")
+        Base.metadata.create_all(engine)
+        busqueda.crear_indices_fts(engine)
+
+    planes: list[list[str]] = []
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _explain(conn, cursor, statement, parameters, context, executemany):
+        cursor.execute("EXPLAIN QUERY PLAN " + statement, parameters)
+        planes.append([row[3] for row in cursor.fetchall()])
+
+    fallas = 0
+    with Session(engine) as db:
+        for nombre, stmt in _consultas():
+            planes.clear()
+            db.execute(stmt).all()
+            # Con ORM puede haber consultas extra (selectinload); se revisa la principal
+            plan = planes[0] if planes else []
+            malos = _problemas(nombre, plan)
+            if malos:
+                fallas += 1
+            if malos or verbose:
+                print(f"{'FALLA' if malos else 'ok   '} {nombre}")
+                for linea in plan:
+                    print(f"        {'!!' if linea in malos else '  '} {linea}")
+    engine.dispose()
+    return fallas
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="Revisa que las consultas de ruta usen índices.")
+    ap.add_argument("--db", type=Path, default=None, help="Base SQLite a revisar (default: esquema vacío en memoria)")
+    ap.add_argument("-v", "--verbose", action="store_true", help="Muestra también los planes correctos")
+    args = ap.parse_args()
+
+    total = len(_consultas())
+    fallas = revisar(args.db, args.verbose)
+    print(f"{total - fallas}/{total} consultas sin SCAN ni B-tree temporal")
+    sys.exit(1 if fallas else 0)
+
+
+if __name__ == "__main__":
+    main()
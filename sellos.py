@@ -0,0 +1,525 @@
+"""Verificación offline del sello digital (emisor) y del timbre (SAT) de los CFDI importados.
+
+Para cada CFDI 4.0 guardado:
+
+1. Se arma la cadena original con una implementación nativa del XSLT del SAT
+   (``cadenaoriginal_4_0.xslt`` con Pagos 2.0 e Impuestos Locales): cada nodo tiene una
+   plantilla con sus atributos en el orden del XSLT. Los complementos sin plantilla dan
+   ``no_soportado`` en lugar de un falso inválido.
+2. ``Sello`` se verifica (RSA PKCS#1 v1.5 con SHA-256) contra el ``Certificado`` incluido,
+   que además debe corresponder a ``NoCertificado``, al RFC del emisor y estar vigente en
+   la ``Fecha`` del comprobante.
+3. ``SelloSAT`` se verifica contra la cadena del ``TimbreFiscalDigital`` 1.1 con el
+   certificado del SAT ``<NoCertificadoSAT>.cer`` de ``DATA_DIR/certificados_sat/``
+   (se descargan del portal del SAT). Si no está, el resultado es ``sin_cert_sat``.
+
+Los certificados se leen una vez por ``NoCertificado`` (``CacheCertificados``, LRU por
+proceso): miles de CFDI del mismo emisor no vuelven a parsear el mismo X.509.
+
+``verificar`` recorre los CFDI pendientes (``sello_estatus`` NULL, índice parcial) por
+bloques en un pool de procesos y guarda ``sello_estatus``/``sello_detalle`` por factura;
+es reanudable. Las importaciones en segundo plano (jobs.py) verifican lo que acaban de
+insertar; el checklist de la declaración muestra los inválidos y los pendientes.
+
+Uso:
+    python sellos.py verificar [--rfc RFC] [--chunk 1000] [--workers N] [--reintentar | --todos]
+"""
+
+from __future__ import annotations
+
+import argparse
+import base64
+import binascii
+import re
+import threading
+import time
+from bisect import bisect_right
+import xml.etree.ElementTree as ET
+from collections import Counter, OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, replace
+from datetime import datetime
+from pathlib import Path
+from typing import Optional, Sequence, Union
+
+from cryptography import x509
+from cryptography.exceptions import InvalidSignature
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.asymmetric import padding
+from cryptography.x509.oid import NameOID
+from sqlalchemy import bindparam, select, update
+
+from db import DATA_DIR, ReadSessionLocal, sync_schema, write_session
+from estado import bump_data_version
+from models import Base, Factura
+from parser_xml import CFDI_40_NS, PAGOS20_NS, TFD_NS
+from utils import parse_iso_datetime
+
+
+CERTIFICADOS_SAT_DIR = DATA_DIR / "certificados_sat"
+CACHE_CERTIFICADOS_MAX = 256  # certificados (emisores + SAT) por proceso
+CHUNK = 1000  # CFDI por bloque / transacción
+WORKERS = 2  # procesos del pool dentro de la app (la línea de comandos usa todos los CPU)
+
+IMPLOCAL_NS = "http://www.sat.gob.mx/implocal"
+
+# valido: sello y timbre verificados · sin_cert_sat: sello válido, falta el certificado del SAT
+# invalido: sello, certificado o timbre no corresponden · no_soportado: sin cadena original
+# nativa (versión o complemento) · error: XML sin sello/certificado/timbre o ilegible
+ESTATUS = ("valido", "sin_cert_sat", "invalido", "no_soportado", "error")
+
+
+# ---------------------------------------------------------------------------
+# Cadena original
+# ---------------------------------------------------------------------------
+
+# Una plantilla es la secuencia de pasos del XSLT para un nodo:
+#   "Atributo"          Requerido: "|valor" (solo "|" si falta)
+#   "Atributo?"         Opcional: "|valor" solo si el atributo existe
+#   ("Hijo/Nieto", p)   aplica la plantilla p a cada nodo de la ruta (mismo namespace)
+#   ("Hijo/*", None)    cada hijo con la plantilla registrada para su namespace (complementos)
+Plantilla = tuple[Union[str, tuple[str, Optional["Plantilla"]]], ...]
+
+_CONCEPTO_TRASLADO: Plantilla = ("Base", "Impuesto", "TipoFactor", "TasaOCuota?", "Importe?")
+_INFORMACION_ADUANERA: Plantilla = ("NumeroPedimento",)
+
+_CFDI_40: Plantilla = (
+    "Version", "Serie?", "Folio?", "Fecha", "FormaPago?", "NoCertificado", "CondicionesDePago?", "SubTotal",
+    "Descuento?", "Moneda", "TipoCambio?", "Total", "TipoDeComprobante", "Exportacion", "MetodoPago?",
+    "LugarExpedicion", "Confirmacion?",
+    ("InformacionGlobal", ("Periodicidad", "Meses", "Año")),
+    ("CfdiRelacionados", ("TipoRelacion", ("CfdiRelacionado", ("UUID",)))),
+    ("Emisor", ("Rfc", "Nombre", "RegimenFiscal", "FacAtrAdquirente?")),
+    ("Receptor", (
+        "Rfc", "Nombre", "DomicilioFiscalReceptor", "ResidenciaFiscal?", "NumRegIdTrib?", "RegimenFiscalReceptor",
+        "UsoCFDI",
+    )),
+    ("Conceptos/Concepto", (
+        "ClaveProdServ", "NoIdentificacion?", "Cantidad", "ClaveUnidad", "Unidad?", "Descripcion", "ValorUnitario",
+        "Importe", "Descuento?", "ObjetoImp",
+        ("Impuestos/Traslados/Traslado", _CONCEPTO_TRASLADO),
+        ("Impuestos/Retenciones/Retencion", ("Base", "Impuesto", "TipoFactor", "TasaOCuota", "Importe")),
+        ("ACuentaTerceros", (
+            "RfcACuentaTerceros", "NombreACuentaTerceros", "RegimenFiscalACuentaTerceros",
+            "DomicilioFiscalACuentaTerceros",
+        )),
+        ("InformacionAduanera", _INFORMACION_ADUANERA),
+        ("CuentaPredial", ("Numero",)),
+        ("ComplementoConcepto/*", None),
+        ("Parte", (
+            "ClaveProdServ", "NoIdentificacion?", "Cantidad", "Unidad?", "Descripcion", "ValorUnitario?", "Importe?",
+            ("InformacionAduanera", _INFORMACION_ADUANERA),
+        )),
+    )),
+    ("Impuestos", (
+        ("Retenciones/Retencion", ("Impuesto", "Importe")),
+        "TotalImpuestosRetenidos?",
+        ("Traslados/Traslado", _CONCEPTO_TRASLADO),
+        "TotalImpuestosTrasladados?",
+    )),
+    ("Complemento/*", None),
+)
+
+_PAGOS_20: Plantilla = (
+    "Version",
+    ("Totales", (
+        "TotalRetencionesIVA?", "TotalRetencionesISR?", "TotalRetencionesIEPS?", "TotalTrasladosBaseIVA16?",
+        "TotalTrasladosImpuestoIVA16?", "TotalTrasladosBaseIVA8?", "TotalTrasladosImpuestoIVA8?",
+        "TotalTrasladosBaseIVA0?", "TotalTrasladosImpuestoIVA0?", "TotalTrasladosBaseIVAExento?", "MontoTotalPagos",
+    )),
+    ("Pago", (
+        "FechaPago", "FormaDePagoP", "MonedaP", "TipoCambioP?", "Monto", "NumOperacion?", "RfcEmisorCtaOrd?",
+        "NomBancoOrdExt?", "CtaOrdenante?", "RfcEmisorCtaBen?", "CtaBeneficiario?", "TipoCadPago?", "CertPago?",
+        "CadPago?", "SelloPago?",
+        ("DoctoRelacionado", (
+            "IdDocumento", "Serie?", "Folio?", "MonedaDR", "EquivalenciaDR?", "NumParcialidad", "ImpSaldoAnt",
+            "ImpPagado", "ImpSaldoInsoluto", "ObjetoImpDR",
+            ("ImpuestosDR/RetencionesDR/RetencionDR", ("BaseDR", "ImpuestoDR", "TipoFactorDR", "TasaOCuotaDR", "ImporteDR")),
+            ("ImpuestosDR/TrasladosDR/TrasladoDR", ("BaseDR", "ImpuestoDR", "TipoFactorDR", "TasaOCuotaDR?", "ImporteDR?")),
+        )),
+        ("ImpuestosP/RetencionesP/RetencionP", ("ImpuestoP", "ImporteP")),
+        ("ImpuestosP/TrasladosP/TrasladoP", ("BaseP", "ImpuestoP", "TipoFactorP", "TasaOCuotaP?", "ImporteP?")),
+    )),
+)
+
+_IMPUESTOS_LOCALES: Plantilla = (
+    "version", "TotaldeRetenciones", "TotaldeTraslados",
+    ("RetencionesLocales", ("ImpLocRetenido", "TasadeRetencion", "Importe")),
+    ("TrasladosLocales", ("ImpLocTrasladado", "TasadeTraslado", "Importe")),
+)
+
+_TFD_11: Plantilla = ("Version", "UUID", "FechaTimbrado", "RfcProvCertif", "Leyenda?", "SelloCFD", "NoCertificadoSAT")
+
+
+def _compilar(ns: str, plantilla: Plantilla) -> tuple:
+    """Convierte las rutas de la plantilla a rutas de ElementTree con el namespace ``ns``."""
+    pasos = []
+    for paso in plantilla:
+        if isinstance(paso, str):
+            opcional = paso.endswith("?")
+            pasos.append((paso.rstrip("?"), opcional))
+            continue
+        ruta, sub = paso
+        partes = ruta.split("/")
+        if partes[-1] == "*":
+            pasos.append(("/".join(f"{{{ns}}}{p}" for p in partes[:-1]) + "/*", None))
+        else:
+            pasos.append(("/".join(f"{{{ns}}}{p}" for p in partes), _compilar(ns, sub)))
+    return tuple(pasos)
+
+
+# Plantilla por nodo raíz ("{namespace}Nodo"); los complementos sin plantilla no se pueden verificar.
+_PLANTILLAS = {
+    f"{{{CFDI_40_NS}}}Comprobante": _compilar(CFDI_40_NS, _CFDI_40),
+    f"{{{PAGOS20_NS}}}Pagos": _compilar(PAGOS20_NS, _PAGOS_20),
+    f"{{{IMPLOCAL_NS}}}ImpuestosLocales": _compilar(IMPLOCAL_NS, _IMPUESTOS_LOCALES),
+}
+# El timbre se agrega después de sellar: el XSLT del CFDI no lo incluye
+_OMITIDOS = {f"{{{TFD_NS}}}TimbreFiscalDigital"}
+_TFD = _compilar(TFD_NS, _TFD_11)
+
+# normalize-space de XPath: solo espacio, tab, CR y LF (no otros espacios Unicode)
+_ESPACIOS = re.compile(r"[ \t\r\n]+")
+
+
+class SinPlantilla(Exception):
+    """El CFDI trae un nodo (versión o complemento) sin plantilla de cadena original."""
+
+
+def _aplicar(nodo: ET.Element, pasos: tuple, salida: list[str]) -> None:
+    attrib = nodo.attrib
+    for paso, sub in pasos:
+        if sub is None:
+            for hijo in nodo.iterfind(paso):
+                if hijo.tag in _OMITIDOS:
+                    continue
+                plantilla = _PLANTILLAS.get(hijo.tag)
+                if plantilla is None:
+                    raise SinPlantilla(hijo.tag)
+                _aplicar(hijo, plantilla, salida)
+        elif sub is True or sub is False:
+            valor = attrib.get(paso)
+            if valor is None:
+                if sub:
+                    continue
+                valor = ""
+            salida.append(_ESPACIOS.sub(" ", valor).strip(" "))
+        else:
+            for hijo in nodo.iterfind(paso):
+                _aplicar(hijo, sub, salida)
+
+
+def _cadena(nodo: ET.Element, pasos: tuple) -> str:
+    salida: list[str] = []
+    _aplicar(nodo, pasos, salida)
+    return "||" + "|".join(salida) + "||"
+
+
+def cadena_original(comprobante: ET.Element) -> str:
+    """Cadena original del CFDI (equivalente a ``cadenaoriginal_4_0.xslt``). ``SinPlantilla`` si no se puede armar."""
+    plantilla = _PLANTILLAS.get(comprobante.tag)
+    if plantilla is None:
+        raise SinPlantilla(comprobante.tag)
+    return _cadena(comprobante, plantilla)
+
+
+def cadena_timbre(tfd: ET.Element) -> str:
+    """Cadena original del TimbreFiscalDigital 1.1 (la que firma ``SelloSAT``)."""
+    return _cadena(tfd, _TFD)
+
+
+# ---------------------------------------------------------------------------
+# Certificados
+# ---------------------------------------------------------------------------
+
+
+@dataclass(frozen=True)
+class Certificado:
+    numero: str  # NoCertificado (el número de serie del SAT son dígitos ASCII en hexadecimal)
+    rfc: Optional[str]
+    vigente_desde: datetime  # UTC sin zona
+    vigente_hasta: datetime
+    llave: object  # llave pública RSA
+    origen: str  # base64 del XML (o ruta del .cer): una entrada solo sirve para el mismo certificado
+
+
+def _numero_serie(serie: int) -> str:
+    hexa = format(serie, "x")
+    try:
+        texto = bytes.fromhex(hexa.zfill(len(hexa) + len(hexa) % 2)).decode("ascii")
+    except (ValueError, UnicodeDecodeError):
+        return hexa
+    return texto if texto.isdigit() else hexa
+
+
+def _leer_certificado(der: bytes, origen: str) -> Certificado:
+    """``ValueError`` si no es un certificado X.509."""
+    if der.lstrip().startswith(b"-----BEGIN"):
+        cert = x509.load_pem_x509_certificate(der)
+    else:
+        cert = x509.load_der_x509_certificate(der)
+    # x500UniqueIdentifier de los certificados del SAT: "RFC / CURP"
+    unicos = cert.subject.get_attributes_for_oid(NameOID.X500_UNIQUE_IDENTIFIER)
+    rfc = str(unicos[0].value).split("/")[0].strip().upper() if unicos else ""
+    return Certificado(
+        numero=_numero_serie(cert.serial_number),
+        rfc=rfc or None,
+        vigente_desde=cert.not_valid_before_utc.replace(tzinfo=None),
+        vigente_hasta=cert.not_valid_after_utc.replace(tzinfo=None),
+        llave=cert.public_key(),
+        origen=origen,
+    )
+
+
+class CacheCertificados:
+    """LRU de ``Certificado`` por ``NoCertificado``, acotado a ``maxsize`` entradas, seguro entre hilos.
+
+    Una entrada solo se usa si el certificado del XML es exactamente el mismo texto; un
+    XML con otro certificado bajo el mismo número se parsea aparte (y no se guarda).
+    """
+
+    def __init__(self, maxsize: int = CACHE_CERTIFICADOS_MAX, carpeta_sat: Path = CERTIFICADOS_SAT_DIR) -> None:
+        self.maxsize = maxsize
+        self.carpeta_sat = carpeta_sat
+        self._items: "OrderedDict[str, Certificado]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _buscar(self, numero: str, origen: str) -> Optional[Certificado]:
+        with self._lock:
+            cert = self._items.get(numero)
+            if cert is not None and cert.origen == origen:
+                self._items.move_to_end(numero)
+                self.hits += 1
+                return cert
+            self.misses += 1
+            return None
+
+    def _guardar(self, cert: Certificado) -> None:
+        with self._lock:
+            self._items[cert.numero] = cert
+            self._items.move_to_end(cert.numero)
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+
+    def emisor(self, numero: str, certificado_b64: str) -> Certificado:
+        """Certificado incluido en el CFDI. ``ValueError`` si no se puede leer."""
+        cert = self._buscar(numero, certificado_b64)
+        if cert is None:
+            try:
+                der = base64.b64decode(certificado_b64)
+            except binascii.Error as e:
+                raise ValueError(str(e)) from None
+            cert = _leer_certificado(der, certificado_b64)
+            if cert.numero == numero:
+                self._guardar(cert)
+        return cert
+
+    def sat(self, numero: str) -> Optional[Certificado]:
+        """Certificado del SAT ``<numero>.cer`` de la carpeta local; None si no está."""
+        ruta = self.carpeta_sat / f"{numero}.cer"
+        cert = self._buscar(numero, str(ruta))
+        if cert is None:
+            try:
+                cert = _leer_certificado(ruta.read_bytes(), str(ruta))
+            except (OSError, ValueError):
+                return None
+            cert = replace(cert, numero=numero)  # indexado por el nombre del archivo
+            self._guardar(cert)
+        return cert
+
+    def limpiar(self) -> None:
+        with self._lock:
+            self._items.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entradas": len(self._items),
+                "max": self.maxsize,
+                "aciertos": self.hits,
+                "fallos": self.misses,
+                "tasa_aciertos": round(self.hits / total, 3) if total else None,
+            }
+
+
+cache = CacheCertificados()
+
+
+def _firma_valida(cert: Certificado, sello_b64: str, cadena: str) -> bool:
+    try:
+        cert.llave.verify(base64.b64decode(sello_b64), cadena.encode("utf-8"), padding.PKCS1v15(), hashes.SHA256())
+    except (InvalidSignature, ValueError, TypeError, binascii.Error):
+        return False
+    return True
+
+
+# ---------------------------------------------------------------------------
+# Verificación
+# ---------------------------------------------------------------------------
+
+
+def verificar_xml(xml: Union[str, bytes], certificados: Optional[CacheCertificados] = None) -> tuple[str, Optional[str]]:
+    """Verifica sello y timbre de un CFDI. Regresa ``(estatus, detalle)``; ver ``ESTATUS``."""
+    certificados = certificados or cache
+    if isinstance(xml, str):
+        xml = xml.encode("utf-8")
+    try:
+        root = ET.fromstring(xml.lstrip(b"\xef\xbb\xbf"))
+    except ET.ParseError as e:
+        return "error", f"XML ilegible: {e}"
+
+    try:
+        cadena = cadena_original(root)
+    except SinPlantilla as e:
+        nodo = str(e)
+        if nodo == root.tag:
+            return "no_soportado", f"Versión {root.get('Version') or nodo} sin cadena original nativa"
+        return "no_soportado", f"Complemento {nodo} sin cadena original nativa"
+
+    sello, certificado_b64, numero = root.get("Sello"), root.get("Certificado"), root.get("NoCertificado")
+    if not sello or not certificado_b64 or not numero:
+        return "error", "Sin Sello, Certificado o NoCertificado"
+    try:
+        cert = certificados.emisor(numero, certificado_b64)
+    except ValueError:
+        return "invalido", "El Certificado incluido no es un certificado X.509"
+    if cert.numero != numero:
+        return "invalido", f"NoCertificado {numero} no es el del certificado incluido ({cert.numero})"
+    emisor = root.find(f"{{{CFDI_40_NS}}}Emisor")
+    rfc_emisor = (emisor.get("Rfc") if emisor is not None else "") or ""
+    if cert.rfc and cert.rfc != rfc_emisor.upper():
+        return "invalido", f"El certificado es de {cert.rfc}, no del emisor {rfc_emisor}"
+    fecha = parse_iso_datetime(root.get("Fecha"))
+    if fecha is not None and not cert.vigente_desde <= fecha.replace(tzinfo=None) <= cert.vigente_hasta:
+        return "invalido", f"Fecha fuera de la vigencia del certificado {numero}"
+    if not _firma_valida(cert, sello, cadena):
+        return "invalido", "El Sello no corresponde a la cadena original (XML alterado)"
+
+    tfd = root.find(f"{{{CFDI_40_NS}}}Complemento/{{{TFD_NS}}}TimbreFiscalDigital")
+    if tfd is None:
+        return "error", "Sin TimbreFiscalDigital"
+    if tfd.get("SelloCFD") != sello:
+        return "invalido", "El SelloCFD del timbre no es el Sello del comprobante"
+    numero_sat = tfd.get("NoCertificadoSAT") or ""
+    cert_sat = certificados.sat(numero_sat)
+    if cert_sat is None:
+        return "sin_cert_sat", f"Sello válido; falta certificados_sat/{numero_sat}.cer para verificar el timbre"
+    if not _firma_valida(cert_sat, tfd.get("SelloSAT") or "", cadena_timbre(tfd)):
+        return "invalido", "El SelloSAT no corresponde al timbre"
+    return "valido", None
+
+
+def _verificar(args: tuple[int, str]) -> tuple[int, str, Optional[str]]:
+    """Se ejecuta en el pool: (id, xml_text) -> (id, estatus, detalle)."""
+    row_id, xml_text = args
+    try:
+        estatus, detalle = verificar_xml(xml_text)
+    except Exception as e:  # un XML raro no detiene el bloque
+        estatus, detalle = "error", f"{e.__class__.__name__}: {e}"
+    return row_id, estatus, detalle[:200] if detalle else None
+
+
+def verificar(
+    titular_rfc: Optional[str] = None,
+    desde_id: int = 0,
+    chunk_size: int = CHUNK,
+    workers: Optional[int] = None,
+    pool: Optional[ProcessPoolExecutor] = None,
+    ids: Optional[Sequence[int]] = None,
+) -> dict:
+    """Verifica los CFDI pendientes (``sello_estatus`` NULL) con ``id > desde_id``. Regresa estadísticas.
+
+    Lee un bloque con la sesión de lectura, verifica en el pool y escribe los resultados
+    en una transacción corta por bloque, así que se puede interrumpir y retomar. Con
+    ``ids`` solo se revisan esos (p.ej. los que insertó un trabajo de importación).
+    """
+    stats: dict = {"verificados": 0, **{e: 0 for e in ESTATUS}, "ultimo_id": desde_id}
+    upd = (
+        update(Factura.__table__)
+        .where(Factura.__table__.c.id == bindparam("_id"))
+        .values(sello_estatus=bindparam("v_estatus"), sello_detalle=bindparam("v_detalle"))
+    )
+    own_pool = pool is None
+    pool = pool or ProcessPoolExecutor(max_workers=workers)
+    last_id = desde_id
+    ids = sorted(ids) if ids is not None else None
+    try:
+        while True:
+            stmt = select(Factura.id, Factura.xml_text).where(Factura.sello_estatus.is_(None), Factura.id > last_id)
+            if titular_rfc:
+                # "titular_rfc || ''" evita que SQLite cambie el índice parcial por el del titular (y ordene aparte)
+                stmt = stmt.where(Factura.titular_rfc + "" == titular_rfc)
+            if ids is not None:
+                bloque = ids[bisect_right(ids, last_id):][:chunk_size]
+                if not bloque:
+                    break
+                stmt = stmt.where(Factura.id.in_(bloque))
+            db = ReadSessionLocal()
+            try:
+                rows = [tuple(r) for r in db.execute(stmt.order_by(Factura.id).limit(chunk_size))]
+            finally:
+                db.close()
+            if ids is not None and not rows:
+                last_id = bloque[-1]  # ya verificados (p.ej. por ``python sellos.py verificar``)
+                continue
+            if not rows:
+                break
+
+            resultados = list(pool.map(_verificar, rows, chunksize=max(1, len(rows) // 32)))
+            with write_session(bulk=True) as db:
+                db.execute(upd, [{"_id": i, "v_estatus": e, "v_detalle": d} for i, e, d in resultados])
+                bump_data_version(db)
+                db.commit()
+
+            last_id = rows[-1][0] if ids is None else bloque[-1]
+            stats["verificados"] += len(rows)
+            for estatus, n in Counter(e for _, e, _ in resultados).items():
+                stats[estatus] += n
+            stats["ultimo_id"] = last_id
+    finally:
+        if own_pool:
+            pool.shutdown()
+    return stats
+
+
+def reiniciar(titular_rfc: Optional[str] = None, todos: bool = False) -> int:
+    """Vuelve a dejar pendientes los no válidos (o ``todos``), p.ej. tras agregar certificados del SAT."""
+    stmt = update(Factura).values(sello_estatus=None, sello_detalle=None).where(Factura.sello_estatus.is_not(None))
+    if not todos:
+        stmt = stmt.where(Factura.sello_estatus != "valido")
+    if titular_rfc:
+        stmt = stmt.where(Factura.titular_rfc == titular_rfc)
+    with write_session() as db:
+        n = db.execute(stmt.execution_options(synchronize_session=False)).rowcount
+        db.commit()
+    return n
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="Verifica sello y timbre de los CFDI importados (sin conexión).")
+    sub = ap.add_subparsers(dest="comando", required=True)
+    p = sub.add_parser("verificar", help="Verifica los CFDI pendientes")
+    p.add_argument("--rfc", default=None, help="Solo este titular (default: todos)")
+    p.add_argument("--chunk", type=int, default=CHUNK, help=f"CFDI por bloque (default {CHUNK})")
+    p.add_argument("--workers", type=int, default=None, help="Procesos del pool (default: CPUs)")
+    g = p.add_mutually_exclusive_group()
+    g.add_argument("--reintentar", action="store_true", help="Vuelve a verificar los que no salieron válidos")
+    g.add_argument("--todos", action="store_true", help="Vuelve a verificar todos")
+    args = ap.parse_args()
+
+    sync_schema(Base.metadata)
+    rfc = args.rfc.upper() if args.rfc else None
+    if args.reintentar or args.todos:
+        print(f"{reiniciar(rfc, todos=args.todos)} CFDI vuelven a quedar pendientes")
+    t0 = time.perf_counter()
+    stats = verificar(rfc, chunk_size=args.chunk, workers=args.workers)
+    dt = time.perf_counter() - t0
+    detalle = ", ".join(f"{stats[e]} {e}" for e in ESTATUS)
+    print(f"{stats['verificados']} CFDI verificados ({stats['verificados'] / max(dt, 1e-9):,.0f}/s): {detalle}")
+
+
+if __name__ == "__main__":
+    main()
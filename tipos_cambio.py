@@ -0,0 +1,362 @@
+"""Tipos de cambio y columnas en MXN.
+
+Los agregados (resumen, reportes de varios meses, DIOT, contabilidad electrónica) suman
+columnas ``*_mxn`` que se llenan al importar, así que siguen siendo un ``SUM`` de una
+columna aunque haya CFDI en dólares:
+
+- Factor por documento (``tipo_cambio_mxn``): 1 en MXN (o sin moneda, ``XXX``), el
+  ``TipoCambio`` del CFDI (``TipoCambioP`` en cada pago) o, si no lo trae, el último de
+  la tabla ``tipos_cambio`` publicado en o antes de la fecha, a lo más ``MAX_DIAS``
+  antes. La búsqueda es una subconsulta por la llave primaria (moneda, fecha).
+- ``normalizar`` lo calcula en SQL para un bloque de facturas con unos cuantos
+  ``UPDATE``: factura, sus impuestos, sus pagos y el IVA de cada DoctoRelacionado.
+- Sin tipo de cambio el factor queda NULL: el documento no suma y aparece en el
+  checklist de la declaración. Los índices parciales ``ix_*_mxn_pendiente`` guardan
+  solo esos, y ``normalizar_pendientes`` los vuelve a intentar (al cargar tipos de
+  cambio y al arrancar la app; la primera vez, con una base anterior, llena todo).
+
+La tabla se carga del CSV de Banxico (SIE: renglones de encabezado y luego
+``Fecha,SF43718,...`` con ``dd/mm/aaaa``; "N/E" en días sin dato) o de uno exportado del
+DOF (``Fecha,Valor``). Las series conocidas (``SERIES``) dan la moneda de su columna; las
+demás toman ``--moneda``. Recargar un archivo solo reescribe los valores que cambiaron.
+
+Uso:
+    python tipos_cambio.py cargar tipos_cambio.csv [--moneda USD]
+    python tipos_cambio.py normalizar [--todos]
+"""
+
+from __future__ import annotations
+
+import argparse
+import csv
+import io
+import sys
+import time
+from dataclasses import dataclass, field
+from datetime import date, datetime
+from pathlib import Path
+from typing import BinaryIO, Iterable, Iterator, Optional
+
+from sqlalchemy import case, func, select, union, update
+from sqlalchemy.orm import Session
+
+from db import sync_schema, write_session
+from estado import bump_data_version
+from models import Base, Factura, ImpuestoComprobante, Pago, PagoDocumento, TipoCambio
+
+
+MONEDAS_PESOS = ("MXN", "XXX")  # XXX: sin moneda (CFDI de pago)
+MAX_DIAS = 7  # antigüedad máxima del tipo de cambio de la tabla (fines de semana, días inhábiles)
+BLOQUE = 500  # ids por UPDATE ... WHERE id IN (...)
+LOTE = 5000  # facturas por transacción en normalizar_pendientes
+MAX_ERRORES = 20
+
+# Series del SIE de Banxico -> moneda
+SERIES = {
+    "SF43718": "USD",  # FIX
+    "SF60653": "USD",  # para solventar obligaciones (el publicado en el DOF)
+    "SF46410": "EUR",
+    "SF46406": "JPY",
+    "SF46407": "GBP",
+    "SF60632": "CAD",
+}
+_FORMATOS_FECHA = ("%d/%m/%Y", "%d-%m-%Y", "%Y-%m-%d", "%Y/%m/%d")
+
+
+class ArchivoInvalido(Exception):
+    """El CSV no tiene una columna ``Fecha`` seguida de valores."""
+
+
+@dataclass
+class Resumen:
+    renglones: int = 0
+    cargados: int = 0
+    sin_dato: int = 0  # "N/E" o vacío
+    facturas_normalizadas: int = 0
+    sin_tipo_cambio: int = 0
+    monedas: set[str] = field(default_factory=set)
+    errores: int = 0
+    detalle_errores: list[str] = field(default_factory=list)
+
+    def error(self, msg: str) -> None:
+        self.errores += 1
+        if len(self.detalle_errores) < MAX_ERRORES:
+            self.detalle_errores.append(msg)
+
+
+# ---------------------------------------------------------------------------
+# Normalización (SQL)
+# ---------------------------------------------------------------------------
+
+
+def _de_tabla(moneda, fecha):
+    """Último tipo de cambio de ``tipos_cambio`` para la moneda en o antes de la fecha (llave primaria)."""
+    dia = func.date(fecha)
+    return (
+        select(TipoCambio.tipo_cambio)
+        .where(
+            TipoCambio.moneda == moneda,
+            TipoCambio.fecha <= dia,
+            TipoCambio.fecha >= func.date(fecha, f"-{MAX_DIAS} days"),
+        )
+        .order_by(TipoCambio.fecha.desc())
+        .limit(1)
+        .scalar_subquery()
+    )
+
+
+def factor_mxn(moneda, tipo_cambio, fecha):
+    """Pesos por unidad de ``moneda``: 1 en MXN, el tipo de cambio del XML o el de la tabla (NULL si no hay)."""
+    moneda = func.upper(func.coalesce(moneda, "MXN"))
+    return case(
+        (moneda.in_(MONEDAS_PESOS), 1),
+        else_=func.coalesce(tipo_cambio, _de_tabla(moneda, fecha)),
+    )
+
+
+def normalizar(db: Session, factura_ids: list[int]) -> int:
+    """Llena ``tipo_cambio_mxn`` y las columnas ``*_mxn`` de las facturas indicadas y de sus hijos.
+
+    Regresa cuántas facturas quedaron sin tipo de cambio (ellas o alguno de sus pagos).
+    No hace commit.
+    """
+    sin_tc: set[int] = set()
+    for i in range(0, len(factura_ids), BLOQUE):
+        ids = factura_ids[i:i + BLOQUE]
+        factores = db.execute(
+            update(Factura)
+            .where(Factura.id.in_(ids))
+            .values(tipo_cambio_mxn=factor_mxn(Factura.moneda, Factura.tipo_cambio, Factura.fecha_emision))
+            .returning(Factura.id, Factura.tipo_cambio_mxn)
+            .execution_options(synchronize_session=False)
+        ).all()
+        sin_tc.update(fid for fid, factor in factores if factor is None)
+        # SQLite evalúa SET con los valores de antes de esta sentencia: el factor va en la anterior
+        tc = Factura.tipo_cambio_mxn
+        db.execute(
+            update(Factura)
+            .where(Factura.id.in_(ids))
+            .values(
+                base_mxn=(func.coalesce(Factura.subtotal, 0) - func.coalesce(Factura.descuento, 0)) * tc,
+                total_mxn=func.coalesce(Factura.total, 0) * tc,
+                trasladados_mxn=func.coalesce(Factura.total_trasladados, 0) * tc,
+                retenidos_mxn=func.coalesce(Factura.total_retenidos, 0) * tc,
+            )
+            .execution_options(synchronize_session=False)
+        )
+        tc_factura = select(Factura.tipo_cambio_mxn).where(Factura.id == ImpuestoComprobante.factura_id).scalar_subquery()
+        db.execute(
+            update(ImpuestoComprobante)
+            .where(ImpuestoComprobante.factura_id.in_(ids))
+            .values(base_mxn=ImpuestoComprobante.base * tc_factura, importe_mxn=ImpuestoComprobante.importe * tc_factura)
+            .execution_options(synchronize_session=False)
+        )
+        factores = db.execute(
+            update(Pago)
+            .where(Pago.factura_id.in_(ids))
+            .values(tipo_cambio_mxn=factor_mxn(Pago.moneda_p, Pago.tipo_cambio_p, Pago.fecha_pago))
+            .returning(Pago.factura_id, Pago.tipo_cambio_mxn)
+            .execution_options(synchronize_session=False)
+        ).all()
+        sin_tc.update(fid for fid, factor in factores if factor is None)
+        db.execute(
+            update(Pago)
+            .where(Pago.factura_id.in_(ids))
+            .values(monto_mxn=func.coalesce(Pago.monto, 0) * Pago.tipo_cambio_mxn)
+            .execution_options(synchronize_session=False)
+        )
+        # ImporteDR está en la moneda del documento: EquivalenciaDR lo pasa a la del pago
+        tc_pago = select(Pago.tipo_cambio_mxn).where(Pago.id == PagoDocumento.pago_id).scalar_subquery()
+        db.execute(
+            update(PagoDocumento)
+            .where(PagoDocumento.factura_id.in_(ids))
+            .values(iva_mxn=PagoDocumento.iva_dr / func.coalesce(PagoDocumento.equivalencia_dr, 1) * tc_pago)
+            .execution_options(synchronize_session=False)
+        )
+    return len(sin_tc)
+
+
+def pendientes(despues_de: int, limite: int):
+    """Ids de facturas (propias o de sus pagos) sin tipo de cambio, por los índices parciales."""
+    return (
+        union(
+            select(Factura.id).where(Factura.tipo_cambio_mxn.is_(None), Factura.id > despues_de),
+            select(Pago.factura_id).where(Pago.tipo_cambio_mxn.is_(None), Pago.factura_id > despues_de),
+        )
+        .order_by("id")
+        .limit(limite)
+    )
+
+
+def normalizar_pendientes(lote: int = LOTE) -> tuple[int, int]:
+    """Normaliza las facturas sin tipo de cambio, en transacciones de ``lote``.
+
+    Regresa (facturas revisadas, las que siguen sin tipo de cambio).
+    """
+    revisadas = sin_tc = 0
+    ultimo = 0
+    while True:
+        with write_session(bulk=True) as db:
+            ids = list(db.scalars(pendientes(ultimo, lote)))
+            if not ids:
+                return revisadas, sin_tc
+            faltan = normalizar(db, ids)
+            if faltan < len(ids):
+                bump_data_version(db)
+            db.commit()
+        revisadas += len(ids)
+        sin_tc += faltan
+        ultimo = ids[-1]
+
+
+def reiniciar() -> int:
+    """Vuelve a dejar pendientes los documentos en moneda extranjera (p.ej. tras corregir la tabla)."""
+    extranjera = func.upper(func.coalesce(Factura.moneda, "MXN")).not_in(MONEDAS_PESOS)
+    extranjera_p = func.upper(func.coalesce(Pago.moneda_p, "MXN")).not_in(MONEDAS_PESOS)
+    with write_session() as db:
+        n = db.execute(
+            update(Factura).where(extranjera).values(tipo_cambio_mxn=None).execution_options(synchronize_session=False)
+        ).rowcount
+        db.execute(update(Pago).where(extranjera_p).values(tipo_cambio_mxn=None).execution_options(synchronize_session=False))
+        db.commit()
+    return n
+
+
+# ---------------------------------------------------------------------------
+# Carga del CSV
+# ---------------------------------------------------------------------------
+
+
+def _fecha(texto: str) -> Optional[date]:
+    for formato in _FORMATOS_FECHA:
+        try:
+            return datetime.strptime(texto, formato).date()
+        except ValueError:
+            continue
+    return None
+
+
+def leer(nombre: str, archivo: BinaryIO, moneda: Optional[str], resumen: Resumen) -> Iterator[tuple[str, str, float]]:
+    """Renglones (moneda, fecha ISO, tipo de cambio) del CSV, por flujo.
+
+    Ignora todo hasta el encabezado (primer renglón que empieza con ``Fecha``); cada
+    columna de valores toma la moneda de su serie de Banxico, su nombre si es un código
+    de moneda o ``moneda``.
+    """
+    texto = io.TextIOWrapper(archivo, encoding="utf-8-sig", errors="replace", newline="")
+    try:
+        columnas: Optional[list[Optional[str]]] = None
+        for campos in csv.reader(texto):
+            campos = [c.strip() for c in campos]
+            if not campos or not campos[0]:
+                continue
+            if columnas is None:
+                if campos[0].lower() != "fecha":
+                    continue  # renglones de título de Banxico
+                columnas = []
+                for c in campos[1:]:
+                    serie = c.upper()
+                    if serie in SERIES:
+                        columnas.append(SERIES[serie])
+                    elif len(serie) == 3 and serie.isalpha():
+                        columnas.append(serie)
+                    else:
+                        columnas.append(moneda)
+                if not any(columnas):
+                    raise ArchivoInvalido(f"{nombre}: no se reconoce la moneda de las columnas {campos[1:]}; use --moneda")
+                continue
+
+            resumen.renglones += 1
+            dia = _fecha(campos[0])
+            if dia is None:
+                resumen.error(f"{nombre}: renglón {resumen.renglones}: fecha inválida {campos[0]!r}")
+                continue
+            for mon, valor in zip(columnas, campos[1:]):
+                if mon is None:
+                    continue
+                if not valor or valor.upper() in ("N/E", "N/D"):
+                    resumen.sin_dato += 1
+                    continue
+                try:
+                    tc = float(valor.replace(",", ""))
+                except ValueError:
+                    resumen.error(f"{nombre}: renglón {resumen.renglones}: valor inválido {valor!r}")
+                    continue
+                resumen.monedas.add(mon)
+                yield mon, dia.isoformat(), tc
+        if columnas is None:
+            raise ArchivoInvalido(f"{nombre}: no tiene el encabezado Fecha,<serie> de Banxico o del DOF")
+    finally:
+        texto.detach()  # el llamador cierra el archivo
+
+
+# Solo reescribe la fila si el valor cambió
+_UPSERT = (
+    "INSERT INTO tipos_cambio (moneda, fecha, tipo_cambio, fuente, cargado_en) VALUES (?, ?, ?, ?, ?) "
+    "ON CONFLICT (moneda, fecha) DO UPDATE SET "
+    "tipo_cambio = excluded.tipo_cambio, fuente = excluded.fuente, cargado_en = excluded.cargado_en "
+    "WHERE tipos_cambio.tipo_cambio IS NOT excluded.tipo_cambio"
+)
+
+
+def cargar(fuentes: Iterable[tuple[str, BinaryIO]], moneda: Optional[str] = None) -> Resumen:
+    """Carga CSV de tipos de cambio (nombre, archivo binario) y normaliza los CFDI que los esperaban.
+
+    Lanza ``ArchivoInvalido`` si un archivo no trae el encabezado esperado (lo ya cargado se conserva).
+    """
+    moneda = moneda.upper() if moneda else None
+    resumen = Resumen()
+    ahora = datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S.%f")
+    for nombre, archivo in fuentes:
+        fuente = Path(nombre).name[:60]
+        filas = [(m, f, tc, fuente, ahora) for m, f, tc in leer(nombre, archivo, moneda, resumen)]
+        if filas:
+            with write_session() as db:
+                db.connection().exec_driver_sql(_UPSERT, filas)
+                db.commit()
+        resumen.cargados += len(filas)
+
+    resumen.facturas_normalizadas, resumen.sin_tipo_cambio = normalizar_pendientes()
+    return resumen
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="Tipos de cambio (Banxico/DOF) e importes en MXN.")
+    sub = ap.add_subparsers(dest="comando", required=True)
+    p = sub.add_parser("cargar", help="Carga CSV de tipos de cambio y normaliza los CFDI que los esperaban")
+    p.add_argument("archivos", type=Path, nargs="+")
+    p.add_argument("--moneda", default=None, help="Moneda de las columnas que no son una serie conocida (p.ej. USD)")
+    p = sub.add_parser("normalizar", help="Llena los importes en MXN pendientes")
+    p.add_argument("--todos", action="store_true", help="Recalcula todos los documentos en moneda extranjera")
+    args = ap.parse_args()
+
+    sync_schema(Base.metadata)
+    t0 = time.perf_counter()
+    if args.comando == "cargar":
+        abiertos = [open(ruta, "rb") for ruta in args.archivos]
+        try:
+            res = cargar(((str(r), f) for r, f in zip(args.archivos, abiertos)), args.moneda)
+        except ArchivoInvalido as e:
+            print(f"error: {e}", file=sys.stderr)
+            sys.exit(2)
+        finally:
+            for f in abiertos:
+                f.close()
+        print(
+            f"{res.cargados} tipos de cambio ({', '.join(sorted(res.monedas)) or 'ninguna moneda'}) de "
+            f"{res.renglones} renglones, {res.sin_dato} sin dato, {res.errores} con error; "
+            f"{res.facturas_normalizadas} CFDI revisados, {res.sin_tipo_cambio} siguen sin tipo de cambio "
+            f"({time.perf_counter() - t0:.1f} s)"
+        )
+        for msg in res.detalle_errores:
+            print(f"  {msg}")
+        return
+
+    if args.todos:
+        print(f"{reiniciar()} CFDI en moneda extranjera vuelven a quedar pendientes")
+    revisadas, sin_tc = normalizar_pendientes()
+    print(f"{revisadas} CFDI revisados, {sin_tc} sin tipo de cambio ({time.perf_counter() - t0:.1f} s)")
+
+
+if __name__ == "__main__":
+    main()
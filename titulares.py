@@ -0,0 +1,85 @@
+"""Titulares (contribuyentes) cuya contabilidad se lleva en la base."""
+
+from __future__ import annotations
+
+from sqlalchemy import delete, select, update
+from sqlalchemy.orm import Session
+
+import archivo
+from config import MI_RFC
+from estado import bump_data_version, get_parametro, set_parametro
+from importer import actualizar_saldos_ppd
+from models import Base, Factura, Titular
+from reclasificar import reclasificar_naturaleza
+
+
+RFC_DEFAULT_KEY = "rfc_clasificacion"
+
+# Toda tabla con columna ``titular_rfc`` (facturas, pago_documento, cfdi_relacionados,
+# metadata_sat, ...): las que se agreguen después se mueven sin tocar esta lista.
+TABLAS_CON_TITULAR = tuple(t for t in Base.metadata.sorted_tables if "titular_rfc" in t.c)
+
+
+def listar_titulares(db: Session) -> list[Titular]:
+    return list(db.scalars(select(Titular).order_by(Titular.rfc)).all())
+
+
+def registrar_titular(db: Session, rfc: str, nombre: str | None = None) -> Titular:
+    rfc = rfc.strip().upper()
+    titular = db.get(Titular, rfc)
+    if titular is None:
+        titular = Titular(rfc=rfc, nombre=(nombre or "").strip() or None)
+        db.add(titular)
+    elif nombre:
+        titular.nombre = nombre.strip()
+    return titular
+
+
+def sincronizar_titular_default(db: Session) -> None:
+    """Asegura que ``config.MI_RFC`` exista como titular y que no haya filas sin titular.
+
+    - Filas importadas antes del modo multi-RFC se asignan a ``MI_RFC``.
+    - Si ``MI_RFC`` cambió y el RFC anterior era el único titular, sus filas pasan al
+      nuevo RFC (caso de un solo contribuyente que corrige su RFC), también en los años
+      archivados. Con varios titulares solo cambia el default.
+    - Si algo cambió, reclasifica ``naturaleza`` con un solo UPDATE y recalcula los saldos
+      PPD del titular (el cruce con ``pago_documento`` es por ``titular_rfc``).
+
+    No hace commit.
+    """
+    mi = (MI_RFC or "").upper()
+    anterior = get_parametro(db, RFC_DEFAULT_KEY)
+    cambios = 0
+
+    if anterior and anterior != mi:
+        registrados = set(db.scalars(select(Titular.rfc)).all())
+        if registrados <= {anterior}:
+            for tabla in TABLAS_CON_TITULAR:
+                mover = update(tabla).where(tabla.c.titular_rfc == anterior).values(titular_rfc=mi)
+                if tabla.c.titular_rfc.primary_key:
+                    # metadata_sat, uuids_archivados, periodos_archivados: si el nuevo RFC ya
+                    # tiene la fila se queda la suya y la del anterior sobra
+                    cambios += db.execute(mover.prefix_with("OR IGNORE")).rowcount or 0
+                    db.execute(delete(tabla).where(tabla.c.titular_rfc == anterior))
+                else:
+                    cambios += db.execute(mover).rowcount or 0
+            db.execute(delete(Titular).where(Titular.rfc == anterior))
+            cambios += archivo.mover_titular(archivo.anios_archivados(db), anterior, mi)
+
+    for tabla in TABLAS_CON_TITULAR:
+        if not tabla.c.titular_rfc.nullable:
+            continue
+        cambios += db.execute(
+            update(tabla).where(tabla.c.titular_rfc.is_(None)).values(titular_rfc=mi)
+        ).rowcount or 0
+
+    registrar_titular(db, mi)
+    set_parametro(db, RFC_DEFAULT_KEY, mi)
+
+    if cambios:
+        bump_data_version(db)
+    if cambios or anterior != mi:
+        reclasificar_naturaleza(db)
+    if cambios:
+        ppd = db.scalars(select(Factura.uuid).where(Factura.titular_rfc == mi, Factura.metodo_pago == "PPD"))
+        actualizar_saldos_ppd(db, mi, set(ppd))